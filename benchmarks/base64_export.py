@@ -0,0 +1,60 @@
+"""
+Benchmark base64 encoding content into an lxml xmlfile, as on export.
+
+Compares base64.encode() with dgi_repo.utilities.base64_encode(); run it
+from the repository root:
+
+    python3 benchmarks/base64_export.py [--size MiB]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+from functools import partial
+from tempfile import TemporaryFile
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__
+))))
+
+from dgi_repo import utilities as utils  # noqa: E402
+
+
+def encode(encoder, content):
+    """
+    Encode content into a binaryContent element, returning the time taken.
+    """
+    content.seek(0)
+    with TemporaryFile() as out_file:
+        started = time.perf_counter()
+        with etree.xmlfile(out_file, buffered=False, encoding='utf-8') as xf:
+            with xf.element('binaryContent'):
+                encoder(content, xf)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=256,
+                        help='MiB of content to encode.')
+    args = parser.parse_args()
+
+    with TemporaryFile() as content:
+        for _ in range(args.size):
+            content.write(os.urandom(2 ** 20))
+
+        for name, encoder in (
+                ('base64.encode', base64.encode),
+                ('utilities.base64_encode', utils.base64_encode),
+                ('utilities.base64_encode, unbroken',
+                 partial(utils.base64_encode, line_length=None))):
+            elapsed = encode(encoder, content)
+            print('{}: {:.2f}s; {:.1f} MiB/s'.format(name, elapsed,
+                                                     args.size / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark listing the members of deep, wide collection trees.
+
+Temporary tables shadow those of the configured database for the session, so
+nothing is written to the repository itself; run it from the repository
+root, against a database with the schema installed:
+
+    python3 benchmarks/collection_members.py [--width N] [--levels N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__
+))))
+
+from dgi_repo.database.read.object_relations import (  # noqa: E402
+    collection_members
+)
+from dgi_repo.database.utilities import get_connection  # noqa: E402
+
+# Created without the composite indexes, so they can be compared.
+TABLES = '''
+    CREATE TEMPORARY TABLE pid_namespaces (
+        id bigint PRIMARY KEY,
+        namespace character varying(255) NOT NULL
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE objects (
+        id bigint PRIMARY KEY,
+        pid_id character varying(1024) NOT NULL,
+        namespace bigint NOT NULL,
+        label character varying(1024)
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE is_member_of_collection (
+        id bigserial PRIMARY KEY,
+        rdf_subject bigint NOT NULL,
+        rdf_object bigint NOT NULL
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE is_member_of (
+        LIKE is_member_of_collection INCLUDING DEFAULTS
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE has_model (
+        LIKE is_member_of_collection INCLUDING DEFAULTS
+    ) ON COMMIT DROP;
+    CREATE INDEX ON is_member_of_collection (rdf_object);
+    CREATE INDEX ON is_member_of_collection (rdf_subject);
+    CREATE INDEX ON is_member_of (rdf_object);
+    CREATE INDEX ON is_member_of (rdf_subject);
+    CREATE INDEX ON has_model (rdf_subject);
+'''
+
+COMPOSITE_INDEXES = '''
+    CREATE INDEX ON is_member_of_collection (rdf_object, rdf_subject);
+    CREATE INDEX ON is_member_of (rdf_object, rdf_subject);
+    CREATE INDEX ON has_model (rdf_subject, rdf_object);
+'''
+
+
+def populate(cursor, width, levels):
+    """
+    Build a tree "levels" deep, with "width" members to each object.
+
+    Object 0 is the root; object n is a member of object (n - 1) / width.
+    Collections (with members) use isMemberOfCollection, and their leaves
+    isMemberOf. Returns the number of objects.
+    """
+    count = sum(width ** level for level in range(levels + 1))
+    leaves = width ** levels
+    cursor.execute(TABLES)
+    cursor.execute('''
+        INSERT INTO pid_namespaces VALUES (1, 'benchmark');
+        INSERT INTO objects
+        SELECT n, n::text, 1, 'Object ' || n
+        FROM generate_series(0, %(count)s) AS n;
+        INSERT INTO is_member_of_collection (rdf_subject, rdf_object)
+        SELECT n, (n - 1) / %(width)s
+        FROM generate_series(1, %(count)s - %(leaves)s - 1) AS n;
+        INSERT INTO is_member_of (rdf_subject, rdf_object)
+        SELECT n, (n - 1) / %(width)s
+        FROM generate_series(%(count)s - %(leaves)s, %(count)s - 1) AS n;
+        INSERT INTO has_model (rdf_subject, rdf_object)
+        SELECT n, %(count)s
+        FROM generate_series(0, %(count)s - 1) AS n;
+        ANALYZE pid_namespaces, objects, is_member_of_collection,
+            is_member_of, has_model;
+    ''', {'count': count, 'width': width, 'leaves': leaves})
+    return count
+
+
+def time_pages(cursor, depth, limit, repeat):
+    """
+    Time paging through every member of the root, to the given depth.
+
+    Returns the best time taken and the number of members.
+    """
+    best = None
+    for _ in range(repeat):
+        members = 0
+        after = None
+        started = time.perf_counter()
+        while True:
+            rows = collection_members(0, depth=depth, after=after,
+                                      limit=limit, cursor=cursor).fetchall()
+            members += len(rows)
+            if len(rows) < limit:
+                break
+            after = rows[-1]['id']
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, members
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=20,
+                        help='Members of each collection.')
+    parser.add_argument('--levels', type=int, default=4,
+                        help='Levels of collections beneath the root.')
+    parser.add_argument('--limit', type=int, default=1000,
+                        help='Members per page.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Times to page through, keeping the best.')
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            count = populate(cursor, args.width, args.levels)
+            print('{} objects, {} wide and {} deep.'.format(
+                count, args.width, args.levels
+            ))
+            for indexes in ('single column', 'composite'):
+                if indexes == 'composite':
+                    cursor.execute(COMPOSITE_INDEXES)
+                    cursor.execute('ANALYZE is_member_of_collection, '
+                                   'is_member_of, has_model')
+                for depth in range(1, args.levels + 1):
+                    best, members = time_pages(cursor, depth, args.limit,
+                                               args.repeat)
+                    print('{} indexes, depth {}: {} members in {:.3f}s; '
+                          '{:.0f} members/s'.format(indexes, depth, members,
+                                                    best, members / best))
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
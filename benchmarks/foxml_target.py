@@ -0,0 +1,108 @@
+"""
+Benchmark the throughput of FoxmlTarget parsing FOXML.
+
+The database and filestore are stubbed out, so this measures the parser
+target's own handling of events; run it from the repository root:
+
+    python3 benchmarks/foxml_target.py [--elements N] [--versions N]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__
+))))
+
+from dgi_repo.fcrepo3.foxml import FoxmlTarget  # noqa: E402
+
+
+class _NullStash(object):
+    """
+    Stand-in for a StashWriter, discarding what is written.
+    """
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        return None, 'null://'
+
+
+class BenchmarkTarget(FoxmlTarget):
+    """
+    FoxmlTarget with its database and filestore writes stubbed out.
+    """
+
+    def _stash_writer(self):
+        return _NullStash()
+
+    def _create_ds(self, ds, old=False):
+        return None
+
+
+def generate_foxml(elements, versions):
+    """
+    Generate FOXML with an inline XML datastream of many versions.
+    """
+    mods = ''.join(
+        '<mods:name type="personal"><mods:namePart>Name {0}</mods:namePart>'
+        '<mods:role><mods:roleTerm authority="marcrelator" type="text">'
+        'author</mods:roleTerm></mods:role></mods:name>'.format(i)
+        for i in range(elements)
+    )
+    version = '''
+    <foxml:datastreamVersion ID="MODS.{0}" LABEL="MODS Record"
+      CREATED="2016-01-01T00:00:00.{0:03d}Z" MIMETYPE="application/xml">
+      <foxml:xmlContent>
+        <mods:mods xmlns:mods="http://www.loc.gov/mods/v3">{1}</mods:mods>
+      </foxml:xmlContent>
+    </foxml:datastreamVersion>'''
+    return '''<?xml version="1.0" encoding="UTF-8"?>
+<foxml:digitalObject VERSION="1.1" PID="benchmark:1"
+  xmlns:foxml="info:fedora/fedora-system:def/foxml#">
+  <foxml:datastream ID="MODS" STATE="A" CONTROL_GROUP="X"
+    VERSIONABLE="true">{0}
+  </foxml:datastream>
+</foxml:digitalObject>
+'''.format(''.join(version.format(i, mods)
+                   for i in range(versions))).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--elements', type=int, default=2000,
+                        help='Names per inline MODS version.')
+    parser.add_argument('--versions', type=int, default=50,
+                        help='Versions of the MODS datastream.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Times to parse, keeping the best.')
+    args = parser.parse_args()
+
+    foxml = generate_foxml(args.elements, args.versions)
+    events = sum(1 for _ in etree.iterparse(
+        BytesIO(foxml), events=('start', 'end')
+    ))
+
+    best = None
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        etree.fromstring(foxml, etree.XMLParser(
+            target=BenchmarkTarget(None, cursor=object()),
+            huge_tree=True
+        ))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    print('{:.1f} MiB, {} start/end events: {:.3f}s; {:.1f} MiB/s, '
+          '{:.0f} events/s'.format(len(foxml) / 2 ** 20, events, best,
+                                   len(foxml) / 2 ** 20 / best,
+                                   events / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 """
 Helpers for determining authorization rules.
 
-@TODO: verify that there are restrictions before returning False.
+Rules are read from the access index, which is kept up to date by triggers on
+the permission relation tables. Anything without rules is viewable by anyone;
+managing always requires a rule.
 """
-import dgi_repo.fcrepo3.relations as relations
-import dgi_repo.database.read.datastream_relations as datastream_relations
-import dgi_repo.database.read.object_relations as object_relations
+import dgi_repo.database.read.access as access_reader
 from dgi_repo.database.utilities import check_cursor
 
 
@@ -13,143 +13,69 @@ def is_datastream_viewable(ds_db_id, user_id=None, roles=None, cursor=None):
     """
     Check if the datastream is viewable by the given user or roles.
     """
-    cursor = check_cursor(cursor)
-
-    if is_datastream_manageable(ds_db_id, user_id, roles, cursor):
-        return True
-
-    if user_id is not None:
-        datastream_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_VIEWABLE_BY_USER_PREDICATE,
-            ds_db_id,
-            user_id,
-            cursor=cursor
-        )
-        if cursor.fetchone():
-            return True
-
-    if roles:
-        datastream_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_VIEWABLE_BY_ROLE_PREDICATE,
-            ds_db_id,
-            cursor=cursor
-        )
-        db_role_info = cursor.fetchall()
-        db_roles = set()
-        for db_role in db_role_info:
-            db_roles.add(db_role['rdf_object'])
-
-        if db_roles.intersection(roles):
-            return True
-
-    return False
+    return ds_db_id in viewable_datastreams([ds_db_id], user_id, roles,
+                                            cursor)
 
 
 def is_datastream_manageable(ds_db_id, user_id=None, roles=None, cursor=None):
     """
     Check if the datastream is manageable by the given user or roles.
     """
-    cursor = check_cursor(cursor)
-
-    if user_id is not None:
-        datastream_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_MANAGEABLE_BY_USER_PREDICATE,
-            ds_db_id,
-            user_id,
-            cursor=cursor
-        )
-        if cursor.fetchone():
-            return True
-
-    if roles:
-        datastream_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_MANAGEABLE_BY_ROLE_PREDICATE,
-            ds_db_id,
-            cursor=cursor
-        )
-        db_role_info = cursor.fetchall()
-        db_roles = set()
-        for db_role in db_role_info:
-            db_roles.add(db_role['rdf_object'])
-
-        if db_roles.intersection(roles):
-            return True
-
-    return False
+    return ds_db_id in manageable_datastreams([ds_db_id], user_id, roles,
+                                              cursor)
 
 
 def is_object_viewable(object_db_id, user_id=None, roles=None, cursor=None):
     """
     Check if the object is viewable by the given user or roles.
     """
-    cursor = check_cursor(cursor)
-
-    if is_object_manageable(object_db_id, user_id, roles, cursor):
-        return True
-
-    if user_id is not None:
-        object_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_VIEWABLE_BY_USER_PREDICATE,
-            object_db_id,
-            user_id,
-            cursor=cursor
-        )
-        if cursor.fetchone():
-            return True
-
-    if roles:
-        object_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_VIEWABLE_BY_USER_PREDICATE,
-            object_db_id,
-            cursor=cursor
-        )
-        db_role_info = cursor.fetchall()
-        db_roles = set()
-        for db_role in db_role_info:
-            db_roles.add(db_role['rdf_object'])
-
-        if db_roles.intersection(roles):
-            return True
-
-    return False
+    return object_db_id in viewable_objects([object_db_id], user_id, roles,
+                                            cursor)
 
 
 def is_object_manageable(object_db_id, user_id=None, roles=None, cursor=None):
     """
     Check if the object is manageable by the given user or roles.
     """
+    return object_db_id in manageable_objects([object_db_id], user_id, roles,
+                                              cursor)
+
+
+def viewable_datastreams(ds_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Get the set of the given datastreams viewable by the user or roles.
+    """
+    cursor = check_cursor(cursor)
+    access_reader.viewable_datastreams(ds_db_ids, user_id, roles,
+                                       cursor=cursor)
+    return {row['id'] for row in cursor}
+
+
+def manageable_datastreams(ds_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Get the set of the given datastreams manageable by the user or roles.
+    """
+    cursor = check_cursor(cursor)
+    access_reader.manageable_datastreams(ds_db_ids, user_id, roles,
+                                         cursor=cursor)
+    return {row['id'] for row in cursor}
+
+
+def viewable_objects(object_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Get the set of the given objects viewable by the user or roles.
+    """
     cursor = check_cursor(cursor)
+    access_reader.viewable_objects(object_db_ids, user_id, roles,
+                                   cursor=cursor)
+    return {row['id'] for row in cursor}
+
 
-    if user_id is not None:
-        object_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_MANAGEABLE_BY_USER_PREDICATE,
-            object_db_id,
-            user_id,
-            cursor=cursor
-        )
-        if cursor.fetchone():
-            return True
-
-    if roles:
-        object_relations.read_relationship(
-            relations.ISLANDORA_RELS_EXT_NAMESPACE,
-            relations.IS_MANAGEABLE_BY_ROLE_PREDICATE,
-            object_db_id,
-            cursor=cursor
-        )
-        db_role_info = cursor.fetchall()
-        db_roles = set()
-        for db_role in db_role_info:
-            db_roles.add(db_role['rdf_object'])
-
-        if db_roles.intersection(roles):
-            return True
-
-    return False
+def manageable_objects(object_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Get the set of the given objects manageable by the user or roles.
+    """
+    cursor = check_cursor(cursor)
+    access_reader.manageable_objects(object_db_ids, user_id, roles,
+                                     cursor=cursor)
+    return {row['id'] for row in cursor}
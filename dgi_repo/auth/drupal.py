@@ -11,9 +11,7 @@ import logging
 
 import talons.auth.basicauth
 
-from dgi_repo.database.utilities import get_connection
-from dgi_repo.database.write import sources
-from dgi_repo.database.read import sources as source_reader
+from dgi_repo.database import cache
 from dgi_repo.configuration import configuration as _config
 
 """
@@ -53,11 +51,7 @@ def authenticate(identity):
         identity.drupal_user_id = 0
         identity.roles.add('anonymous user')
 
-        cursor = source_reader.source_id(identity.site)
-        if not cursor.rowcount:
-            sources.upsert_source(identity.site, cursor=cursor)
-        identity.source_id = cursor.fetchone()['id']
-        cursor.close()
+        identity.source_id = cache.source_id(identity.site)
 
         logger.debug('Anonymous user logged in from %s.', identity.site)
         return True
@@ -95,26 +89,9 @@ WHERE u.name=%s AND u.pass=%s'''
             identity.roles.add('authenticated user')
             logger.info('Authenticated %s:%s with roles: %s', identity.site,
                         identity.login, identity.roles)
-            with get_connection() as connection:
-                with connection.cursor() as cursor:
-                    # Most requests won't be from new users.
-                    user_info = source_reader.source_and_user_from_raw(
-                        identity.site,
-                        identity.login,
-                        cursor=cursor
-                    ).fetchone()
-                    if user_info is not None:
-                        identity.source_id = user_info['source_id']
-                        identity.user_id = user_info['user_id']
-                    else:
-                        sources.upsert_source(identity.site, cursor=cursor)
-                        identity.source_id = cursor.fetchone()['id']
-                        sources.upsert_user(
-                            {'name': identity.login,
-                             'source': identity.source_id},
-                            cursor=cursor
-                        )
-                        identity.user_id = cursor.fetchone()['id']
+            identity.source_id = cache.source_id(identity.site)
+            identity.user_id = cache.user_id(identity.login,
+                                             identity.source_id)
 
             return True
         else:
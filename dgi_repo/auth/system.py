@@ -2,14 +2,28 @@
 System/configured user auth functionality.
 """
 import ipaddress
-from ipaddress import IPv4Network, IPv4Address
+import os
+import hmac
+from bisect import bisect_right
+from hashlib import sha256
+from threading import Lock
+from ipaddress import IPv4Network
 from crypt import crypt
 from hmac import compare_digest as compare_hash
 
+from cachetools import TTLCache, LRUCache
 from talons.auth import interfaces
 
 from dgi_repo.configuration import configuration as _config
 
+# Credentials which have passed crypt, as HMACs under a per-process secret.
+_verified = TTLCache(
+    maxsize=_config['configured_users']['credential_cache']['size'] or 1,
+    ttl=_config['configured_users']['credential_cache']['ttl']
+)
+_verified_lock = Lock()
+_verified_secret = os.urandom(32)
+
 
 def authenticate(identity):
     """
@@ -23,13 +37,35 @@ def authenticate(identity):
     except KeyError:
         return None
     else:
-        if compare_hash(password, crypt(identity.key, password)):
+        if _check_password(identity.login, identity.key, password):
             # The site value will be used during authorization.
             identity.site = _config['configured_users']['source']
             return True
         return False
 
 
+def _check_password(login, key, password):
+    """
+    Check the key against the crypt'd password, avoiding repeated crypts.
+
+    Successfully verified keys are remembered (for a time) as an HMAC, so
+    repeated requests need not pay for the hashing again.
+    """
+    cache_key = (login, password)
+    digest = hmac.new(_verified_secret, key.encode(), sha256).digest()
+    with _verified_lock:
+        verified = _verified.get(cache_key)
+    if verified is not None and compare_hash(verified, digest):
+        return True
+
+    if not compare_hash(password, crypt(key, password)):
+        return False
+    if _config['configured_users']['credential_cache']['size']:
+        with _verified_lock:
+            _verified[cache_key] = digest
+    return True
+
+
 class Authorize(interfaces.Authorizes):
     """
     Callable authorization class.
@@ -46,8 +82,11 @@ class Authorize(interfaces.Authorizes):
 class IPNetworkSet(object):
     """
     Represent a set of IP networks, both v4 and v6.
+
+    Networks are held as sorted, disjoint ranges of integers so membership is
+    a binary search; recent decisions are also remembered per address.
     """
-    def __init__(self, ips):
+    def __init__(self, ips, cache_size=1024):
         """
         Constructor.
 
@@ -56,27 +95,57 @@ class IPNetworkSet(object):
                 or with the network and subnet masks separated by a slash, for
                 example: 127.0.0.0/8 and 127.0.0.0/255.0.0.0 would be
                 equivalent.
+            cache_size: The number of addresses for which to remember the
+                result of membership tests.
         """
-        self._ipv4 = []
-        self._ipv6 = []
+        ipv4 = []
+        ipv6 = []
 
         for ip in ips:
             network = ipaddress.ip_network(ip, False)
             if isinstance(network, IPv4Network):
-                self._ipv4.append(network)
+                ipv4.append(network)
             else:
-                self._ipv6.append(network)
+                ipv6.append(network)
+
+        self._ranges = {
+            4: self._to_ranges(ipv4),
+            6: self._to_ranges(ipv6),
+        }
+        self._decisions = LRUCache(maxsize=cache_size)
+        self._decisions_lock = Lock()
 
-        self._ipv4 = set(ipaddress.collapse_addresses(self._ipv4))
-        self._ipv6 = set(ipaddress.collapse_addresses(self._ipv6))
+    @staticmethod
+    def _to_ranges(networks):
+        """
+        Get sorted lists of the first and last addresses of the networks.
+        """
+        starts = []
+        ends = []
+        # Collapsed networks are disjoint and come out sorted.
+        for network in ipaddress.collapse_addresses(networks):
+            starts.append(int(network.network_address))
+            ends.append(int(network.broadcast_address))
+        return starts, ends
 
     def __contains__(self, addr):
         """
         Test if the given IP is contained in our set of networks.
         """
+        with self._decisions_lock:
+            decision = self._decisions.get(addr)
+        if decision is None:
+            decision = self._lookup(addr)
+            with self._decisions_lock:
+                self._decisions[addr] = decision
+        return decision
+
+    def _lookup(self, addr):
+        """
+        Search our ranges for the given IP.
+        """
         ip = ipaddress.ip_address(addr)
-        networks = self._ipv4 if isinstance(ip, IPv4Address) else self._ipv6
-        for net in networks:
-            if ip in net:
-                return True
-        return False
+        starts, ends = self._ranges[ip.version]
+        ip = int(ip)
+        index = bisect_right(starts, ip) - 1
+        return index >= 0 and ip <= ends[index]
@@ -0,0 +1,45 @@
+"""
+Tests authorization against the access index.
+"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+from dgi_repo.auth import authorization
+
+
+class AuthorizationTestCase(unittest.TestCase):
+    """
+    Tests checking access to batches of objects and datastreams.
+    """
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.cursor.__iter__.return_value = [{'id': 1}, {'id': 3}]
+
+    @patch('dgi_repo.database.read.access.viewable_objects')
+    def test_batch(self, viewable_objects):
+        """
+        Test the IDs allowed are given back as a set.
+        """
+        self.assertEqual(
+            authorization.viewable_objects([1, 2, 3], 5, [6],
+                                           cursor=self.cursor),
+            {1, 3}
+        )
+        viewable_objects.assert_called_once_with([1, 2, 3], 5, [6],
+                                                 cursor=self.cursor)
+
+    @patch('dgi_repo.database.read.access.manageable_datastreams')
+    def test_single(self, manageable_datastreams):
+        """
+        Test single checks are batches of one.
+        """
+        self.assertTrue(authorization.is_datastream_manageable(
+            3, cursor=self.cursor
+        ))
+        self.assertFalse(authorization.is_datastream_manageable(
+            2, cursor=self.cursor
+        ))
+        manageable_datastreams.assert_called_with([2], None, None,
+                                                  cursor=self.cursor)
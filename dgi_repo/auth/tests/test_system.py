@@ -0,0 +1,114 @@
+"""
+Tests system/configured user auth functionality.
+"""
+
+import unittest
+from unittest.mock import patch
+
+from cachetools import TTLCache
+
+from dgi_repo.auth import system
+from dgi_repo.auth.system import IPNetworkSet
+
+
+class IPNetworkSetTestCase(unittest.TestCase):
+    """
+    Tests IP network membership.
+    """
+
+    def setUp(self):
+        self.networks = IPNetworkSet([
+            '127.0.0.1/8',
+            '192.168.0.0/255.255.0.0',
+            '10.1.0.0/24',
+            '10.1.1.0/24',
+            '2001:db8::/32',
+        ])
+
+    def test_ipv4(self):
+        """
+        Test IPv4 addresses inside and outside of the networks.
+        """
+        self.assertIn('127.0.0.1', self.networks)
+        self.assertIn('127.255.255.255', self.networks)
+        self.assertIn('192.168.14.2', self.networks)
+        self.assertIn('10.1.1.255', self.networks)
+        self.assertNotIn('10.1.2.0', self.networks)
+        self.assertNotIn('126.255.255.255', self.networks)
+        self.assertNotIn('0.0.0.0', self.networks)
+
+    def test_ipv6(self):
+        """
+        Test IPv6 addresses inside and outside of the networks.
+        """
+        self.assertIn('2001:db8::1', self.networks)
+        self.assertIn('2001:db8:ffff:ffff:ffff:ffff:ffff:ffff', self.networks)
+        self.assertNotIn('2001:db9::', self.networks)
+        self.assertNotIn('::1', self.networks)
+
+    def test_repeated(self):
+        """
+        Test that remembered decisions match.
+        """
+        for _ in range(2):
+            self.assertIn('192.168.0.1', self.networks)
+            self.assertNotIn('192.169.0.1', self.networks)
+
+    def test_empty(self):
+        """
+        Test that an empty set contains nothing.
+        """
+        networks = IPNetworkSet([])
+        self.assertNotIn('127.0.0.1', networks)
+        self.assertNotIn('::1', networks)
+
+
+def _crypt(key, password):
+    """
+    Stand-in for crypt; only "secret" hashes to the password given.
+    """
+    return password if key == 'secret' else '*'
+
+
+@patch('dgi_repo.auth.system.crypt', side_effect=_crypt)
+class CheckPasswordTestCase(unittest.TestCase):
+    """
+    Tests remembering verified credentials.
+    """
+
+    def setUp(self):
+        for patcher in (
+                patch.object(system, '_verified',
+                             TTLCache(maxsize=10, ttl=60)),
+                patch.dict(system._config['configured_users'], {
+                    'credential_cache': {'size': 10, 'ttl': 60},
+                })):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_hit(self, crypt):
+        """
+        Test a verified key is not crypt'd again.
+        """
+        self.assertTrue(system._check_password('user', 'secret', 'hash'))
+        self.assertTrue(system._check_password('user', 'secret', 'hash'))
+        crypt.assert_called_once_with('secret', 'hash')
+
+    def test_changed_hash(self, crypt):
+        """
+        Test a change to the stored hash misses the cache.
+        """
+        self.assertTrue(system._check_password('user', 'secret', 'hash'))
+        self.assertTrue(system._check_password('user', 'secret', 'new hash'))
+        self.assertEqual(crypt.call_count, 2)
+        crypt.assert_called_with('secret', 'new hash')
+
+    def test_wrong_key(self, crypt):
+        """
+        Test a wrong key is always crypt'd, and never cached as valid.
+        """
+        self.assertTrue(system._check_password('user', 'secret', 'hash'))
+        for _ in range(2):
+            self.assertFalse(system._check_password('user', 'wrong', 'hash'))
+        self.assertEqual(crypt.call_count, 3)
+        self.assertEqual(len(system._verified), 1)
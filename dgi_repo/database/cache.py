@@ -9,6 +9,10 @@ import dgi_repo.database.write.repo_objects as object_writer
 import dgi_repo.database.read.repo_objects as object_reader
 import dgi_repo.database.read.relations as relations_reader
 import dgi_repo.database.write.relations as relations_writer
+import dgi_repo.database.read.sources as source_reader
+import dgi_repo.database.write.sources as source_writer
+import dgi_repo.database.write.datastreams as datastream_writer
+import dgi_repo.database.write.log as log_writer
 from dgi_repo.database.utilities import check_cursor
 from dgi_repo.configuration import configuration as _config
 
@@ -43,6 +47,20 @@ def clear_cache():
         cache.clear()
 
 
+def rollback(cursor, savepoint=None):
+    """
+    Roll back the cursor's transaction, or to a savepoint, clearing caches.
+
+    IDs cached since the transaction or savepoint began might be for rows
+    which the rollback removes.
+    """
+    clear_cache()
+    if savepoint is None:
+        cursor.connection.rollback()
+    else:
+        cursor.execute('ROLLBACK TO SAVEPOINT {}'.format(savepoint))
+
+
 @_cache(key=lambda namespace, cursor=None: hashkey(namespace))
 def repo_object_namespace_id(namespace, cursor=None):
     """
@@ -98,3 +116,57 @@ def predicate_id_from_raw(namespace, predicate, cursor=None):
     namespace_id = rdf_namespace_id(namespace, cursor=cursor)
 
     return predicate_id(namespace_id, predicate, cursor=cursor)
+
+
+@_cache(key=lambda source, cursor=None: hashkey(source))
+def source_id(source, cursor=None):
+    """
+    Get a source ID, creating it if necessary.
+    """
+    cursor = source_reader.source_id(source, cursor=cursor)
+
+    if not cursor.rowcount:
+        source_writer.upsert_source(source, cursor=cursor)
+
+    return cursor.fetchone()['id']
+
+
+@_cache(key=lambda name, source, cursor=None: hashkey(name, source))
+def user_id(name, source, cursor=None):
+    """
+    Get a user ID, creating it if necessary.
+    """
+    return source_writer.upsert_user(
+        {'name': name, 'source': source},
+        cursor=cursor
+    ).fetchone()['id']
+
+
+@_cache(key=lambda role, source, cursor=None: hashkey(role, source))
+def role_id(role, source, cursor=None):
+    """
+    Get a role ID, creating it if necessary.
+    """
+    return source_writer.upsert_role(
+        {'role': role, 'source': source},
+        cursor=cursor
+    ).fetchone()['id']
+
+
+@_cache(key=lambda mime, cursor=None: hashkey(mime))
+def mime_id(mime, cursor=None):
+    """
+    Get a MIME type ID, creating it if necessary.
+    """
+    return datastream_writer.upsert_mime(mime, cursor=cursor).fetchone()['id']
+
+
+@_cache(key=lambda log, cursor=None: hashkey(log))
+def log_id(log, cursor=None):
+    """
+    Get a log ID, creating it if necessary.
+
+    Only use this for the repository's own messages; caching arbitrary
+    messages from clients would just churn the cache.
+    """
+    return log_writer.upsert_log(log, cursor=cursor).fetchone()['id']
@@ -39,6 +39,14 @@ def delete_datastream_relations(ds_db_id, cursor=None):
     logger.debug(('Deleted any RDF relation about datastream: %s from the '
                   'general table.'), ds_db_id)
 
+    # Delete any yet to be resolved.
+    cursor.execute('''
+        DELETE FROM pending_references
+        WHERE datastream = %s
+    ''', (ds_db_id,))
+    logger.debug('Deleted any pending references from datastream: %s.',
+                 ds_db_id)
+
     return cursor
 
 
@@ -48,6 +48,14 @@ def delete_object_relations(object_id, cursor=None):
     logger.debug(('Deleted any RDF relation about object: %s from the sequence'
                   ' number of table.'), object_id)
 
+    # Delete any yet to be resolved.
+    cursor.execute('''
+        DELETE FROM pending_references
+        WHERE object = %s
+    ''', (object_id,))
+    logger.debug('Deleted any pending references from object: %s.',
+                 object_id)
+
     return cursor
 
 
@@ -59,3 +59,40 @@ def delete_from_standard_relation_table(table, log_message, db_id,
     logger.debug(log_message, db_id)
 
     return cursor
+
+
+def delete_relation_rows(table, ids, cursor=None):
+    """
+    Delete relations from a relation table by their IDs.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        DELETE FROM {}
+        WHERE id = ANY(%s)
+    '''.format(table), (list(ids),))
+
+    logger.debug('Deleted %s relations from %s.', cursor.rowcount, table)
+
+    return cursor
+
+
+def delete_pending_references(column, subjects, cursor=None):
+    """
+    Delete the pending references from some objects or datastreams.
+
+    Args:
+        column: Either "object" or "datastream", for what the subjects are.
+        subjects: The IDs of the subjects.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        DELETE FROM pending_references
+        WHERE {} = ANY(%s)
+    '''.format(column), (list(subjects),))
+
+    logger.debug('Deleted any pending references from %s %s.', column,
+                 subjects)
+
+    return cursor
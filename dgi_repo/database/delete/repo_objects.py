@@ -59,3 +59,19 @@ def delete_namespace(namespace_id, cursor=None):
     logger.debug('Deleted namespace with ID: %s', namespace_id)
 
     return cursor
+
+
+def delete_objects(object_ids, cursor=None):
+    """
+    Delete a set of objects from the repository.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        DELETE FROM objects
+        WHERE id = ANY(%s)
+    ''', (list(object_ids),))
+
+    logger.debug('Deleted %s objects.', cursor.rowcount)
+
+    return cursor
@@ -1,19 +1,24 @@
 """
 Handle file storage.
 """
+import fcntl
 import logging
 import os
+from functools import partial
 from io import BytesIO
 from shutil import copyfileobj
 from tempfile import NamedTemporaryFile
+from threading import Condition, Thread
 
 from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
 
 import dgi_repo.database.write.datastreams as datastream_writer
 import dgi_repo.database.read.datastreams as datastream_reader
 import dgi_repo.database.delete.datastreams as datastream_purger
+from dgi_repo.database import cache
 from dgi_repo.utilities import checksum_file
-from dgi_repo.database.utilities import get_connection, check_cursor
+from dgi_repo.database.utilities import (get_connection, check_cursor,
+                                         HookedConnection)
 from dgi_repo.configuration import configuration as _config
 from dgi_repo.database.delete.datastreams import delete_resource
 
@@ -35,6 +40,20 @@ _URI_MAP = {
     }
 }
 
+'''
+Fedora hash types mapped to the names that hashlib uses.
+'''
+HASH_TYPE_MAP = {
+    'MD5': 'md5',
+    'SHA-1': 'sha1',
+    'SHA-256': 'sha256',
+    'SHA-384': 'sha384',
+    'SHA-512': 'sha512'
+}
+
+# The FICLONE ioctl request number from linux/fs.h, to reflink a whole file.
+_FICLONE = 0x40049409
+
 
 for scheme, info in _URI_MAP.items():
     try:
@@ -54,7 +73,7 @@ for scheme, info in _URI_MAP.items():
 
 
 def stash(data, destination_scheme=UPLOAD_SCHEME,
-          mimetype='application/octet-stream'):
+          mimetype='application/octet-stream', cursor=None):
     """
     Persist data, likely in our data directory.
 
@@ -65,6 +84,9 @@ def stash(data, destination_scheme=UPLOAD_SCHEME,
             closed.
         destination_scheme: One of URI_MAP's keys. Defaults to UPLOADED_URI.
         mimetype: The MIME-type of the file.
+        cursor: The cursor of the transaction which will reference the
+            stashed file, if any; it will not commit before the file is
+            durable. Without one, we wait for the file to be durable.
 
     Returns:
         The resource_id and URI of the stashed resource.
@@ -86,42 +108,345 @@ def stash(data, destination_scheme=UPLOAD_SCHEME,
             logger.debug('Unknown data type: attempting to wrap in a BytesIO.')
             return BytesIO(data)
 
-    destination = _URI_MAP[destination_scheme]
-    connection = get_connection()
-    with NamedTemporaryFile(delete=False, **destination) as dest:
+    def write(dest):
+        with streamify() as src:
+            copyfileobj(src, dest)
+
+    return _stash(write, destination_scheme, mimetype, cursor)
+
+
+def adopt(path, destination_scheme=DATASTREAM_SCHEME,
+          mimetype='application/octet-stream', cursor=None):
+    """
+    Persist an existing file, avoiding copying its bytes where possible.
+
+    In order of preference the file is hard linked, cloned (reflinked),
+    copied in-kernel and finally copied.
+
+    Args:
+        path: The path of the file to persist; it should not be modified
+            afterwards, as it may share storage with the persisted copy.
+        destination_scheme: One of URI_MAP's keys. Defaults to
+            DATASTREAM_SCHEME.
+        mimetype: The MIME-type of the file.
+        cursor: As for stash().
+
+    Returns:
+        The resource_id and URI of the stashed resource.
+    """
+    def write(dest):
+        link_path = '{}.link'.format(dest.name)
         try:
-            name = os.path.relpath(dest.name, destination['dir'])
-            uri = '{}://{}'.format(destination_scheme, name)
-            with streamify() as src:
-                with connection:
-                    # XXX: This _must_ happen as a separate transaction, so we
-                    # know that the resource is tracked when it is present in
-                    # the relevant directory (and so might be garbage
-                    # collected).
-                    cursor = connection.cursor()
-                    cursor = datastream_writer.upsert_mime(mimetype, cursor)
-                    mime_id = cursor.fetchone()[0]
-
-                    datastream_writer.upsert_resource({
-                        'uri': uri,
-                        'mime': mime_id,
-                    }, cursor=cursor)
-
-                logger.debug('Stashing data as %s.', dest.name)
-                copyfileobj(src, dest)
-                # This is our Raison d'etre, make sure the file is out.
-                dest.flush()
-                os.fsync(dest.fileno())
+            os.link(path, link_path)
+        except OSError as e:
+            logger.debug('Could not link %s (%s); copying.', path, e)
+        else:
+            try:
+                os.replace(link_path, dest.name)
+            except:
+                os.remove(link_path)
+                raise
+            logger.debug('Linked %s to %s.', path, dest.name)
+            return
+
+        with open(path, 'rb') as src:
+            try:
+                fcntl.ioctl(dest.fileno(), _FICLONE, src.fileno())
+            except OSError as e:
+                logger.debug('Could not clone %s (%s).', path, e)
+            else:
+                logger.debug('Cloned %s to %s.', path, dest.name)
+                return
+
+            if hasattr(os, 'copy_file_range'):
+                remaining = os.fstat(src.fileno()).st_size
+                try:
+                    while remaining:
+                        copied = os.copy_file_range(src.fileno(),
+                                                    dest.fileno(), remaining)
+                        if not copied:
+                            break
+                        remaining -= copied
+                except OSError as e:
+                    logger.debug('Could not copy %s in-kernel (%s).', path, e)
+                    src.seek(0)
+                    dest.seek(0)
+                    dest.truncate()
+                else:
+                    if not remaining:
+                        logger.debug('Copied %s to %s in-kernel.', path,
+                                     dest.name)
+                        return
+
+            # Picks up from wherever the above left off.
+            copyfileobj(src, dest)
+
+    return _stash(write, destination_scheme, mimetype, cursor)
+
+
+def _stash(write, destination_scheme, mimetype, cursor):
+    """
+    Persist a file in our data directory.
+
+    Args:
+        write: A callable which will be passed the open destination file to
+            populate.
+        destination_scheme: One of URI_MAP's keys.
+        mimetype: The MIME-type of the file.
+        cursor: As for stash().
+
+    Returns:
+        The resource_id and URI of the stashed resource.
+    """
+    stash_writer = StashWriter(destination_scheme, mimetype, cursor=cursor)
+    try:
+        write(stash_writer.file)
+    except:
+        logger.exception('Attempting to delete %s (%s) due to exception.',
+                         stash_writer.uri, stash_writer.file.name)
+        stash_writer.discard()
+        raise
+    return stash_writer.close()
+
+
+class StashWriter(object):
+    """
+    A file being stashed a piece at a time, as for stash().
+
+    Write to it as to a (binary) file, then close() it to have it persisted,
+    or discard() it.
+    """
+
+    def __init__(self, destination_scheme=UPLOAD_SCHEME,
+                 mimetype='application/octet-stream', cursor=None,
+                 collectable=False):
+        """
+        Open and track the file.
+
+        Args:
+            destination_scheme: One of URI_MAP's keys. Defaults to
+                UPLOADED_URI.
+            mimetype: The MIME-type of the file.
+            cursor: As for stash().
+            collectable: Whether to have the resource garbage collected should
+                nothing come to reference it; for files whose transaction
+                may well fail after they are stashed.
+        """
+        self.cursor = cursor
+        self.directory = _URI_MAP[destination_scheme]['dir']
+        self.file, self.uri = reserve(destination_scheme)
+        connection = get_connection()
+        try:
+            with connection:
+                # XXX: This _must_ happen as a separate transaction, so we
+                # know that the resource is tracked when it is present in
+                # the relevant directory (and so might be garbage
+                # collected).
+                stash_cursor = connection.cursor()
+                mime_id = cache.mime_id(mimetype, cursor=stash_cursor)
+
+                datastream_writer.upsert_resource({
+                    'uri': self.uri,
+                    'mime': mime_id,
+                }, cursor=stash_cursor)
+                self.resource_id = stash_cursor.fetchone()[0]
+                if collectable:
+                    datastream_writer.upsert_unreferenced_resource(
+                        self.resource_id,
+                        cursor=stash_cursor
+                    )
         except:
             logger.exception('Attempting to delete %s (%s) due to exception.',
-                             uri, dest.name)
-            os.remove(dest.name)
+                             self.uri, self.file.name)
+            self.discard()
             raise
-        else:
-            resource_id = cursor.fetchone()[0]
-            logger.debug('%s got resource id %s', uri, resource_id)
-            return resource_id, uri
-    return
+        logger.debug('Stashing data as %s.', self.file.name)
+
+    def write(self, data):
+        """
+        Write to the file.
+        """
+        return self.file.write(data)
+
+    def close(self):
+        """
+        Persist the file.
+
+        Returns:
+            The resource_id and URI of the stashed resource.
+        """
+        try:
+            self.file.flush()
+            # This is our Raison d'etre, make sure the file is out.
+            if _config['filestore_durability'] == 'fsync':
+                _fsync_path(self.file.name)
+                _fsync_path(self.directory)
+            self.file.close()
+        except:
+            logger.exception('Attempting to delete %s (%s) due to exception.',
+                             self.uri, self.file.name)
+            self.discard()
+            raise
+        logger.debug('%s got resource id %s', self.uri, self.resource_id)
+        if _config['filestore_durability'] == 'group':
+            _flush_before_commit(self.file.name, self.cursor)
+        return self.resource_id, self.uri
+
+    def discard(self):
+        """
+        Remove the file.
+        """
+        logger.debug('Deleting %s (%s).', self.uri, self.file.name)
+        self.file.close()
+        os.remove(self.file.name)
+
+
+def reserve(destination_scheme=DATASTREAM_SCHEME):
+    """
+    Open a new, untracked file in our data directory.
+
+    It is up to the caller to track the file as a resource, to make it
+    durable and to remove it should either fail.
+
+    Args:
+        destination_scheme: One of URI_MAP's keys. Defaults to
+            DATASTREAM_SCHEME.
+
+    Returns:
+        A two-tuple of the open (binary, writable) file and its URI.
+    """
+    destination = _URI_MAP[destination_scheme]
+    dest = NamedTemporaryFile(delete=False, **destination)
+    name = os.path.relpath(dest.name, destination['dir'])
+    return dest, '{}://{}'.format(destination_scheme, name)
+
+
+def make_durable(paths):
+    """
+    Flush files, and the directories holding them, to disk.
+    """
+    paths = list(paths)
+    for path in paths:
+        _fsync_path(path)
+    for directory in {os.path.dirname(path) for path in paths}:
+        _fsync_path(directory)
+
+
+def _fsync_path(path):
+    """
+    Flush a file or directory to disk by its path.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _flush_before_commit(path, cursor=None):
+    """
+    Have the flusher make a file durable before the cursor commits.
+
+    Without a transaction to hold up we wait for the flusher here.
+    """
+    ticket = _flusher.queue(path)
+    connection = getattr(cursor, 'connection', None)
+    if isinstance(connection, HookedConnection) and not connection.autocommit:
+        connection.add_pre_commit_hook(partial(_flusher.wait, ticket))
+    else:
+        _flusher.wait(ticket)
+
+
+class _Flusher(object):
+    """
+    Background flushing of stashed files, in groups.
+
+    While one group is being flushed the next accumulates, so concurrent
+    stashes share the wait for the disk. Each queued file gets a ticket, to
+    wait on until it and everything queued before it has been flushed.
+    """
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        """
+        (Re)initialize state; also used in forked children.
+        """
+        self._pid = os.getpid()
+        self._condition = Condition()
+        self._pending = []
+        self._queued = 0
+        self._flushed = 0
+        self._failures = []
+        self._thread = None
+
+    def queue(self, path):
+        """
+        Queue a file to be flushed.
+
+        Returns:
+            A ticket to pass to wait().
+        """
+        if self._pid != os.getpid():
+            # Threads do not survive forks; start over.
+            self._reset()
+        with self._condition:
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name='filestore flusher', daemon=True)
+                self._thread.start()
+            self._pending.append(path)
+            self._queued += 1
+            self._condition.notify_all()
+            return self._queued
+
+    def wait(self, ticket):
+        """
+        Block until the ticket's file has been flushed.
+
+        Raises:
+            OSError: The file (or another in its group) failed to flush.
+        """
+        with self._condition:
+            while self._flushed < ticket:
+                self._condition.wait()
+            for first, last, error in self._failures:
+                if first <= ticket <= last:
+                    raise OSError('Failed to flush stashed file.') from error
+
+    def _run(self):
+        """
+        Flush groups of files as they are queued.
+        """
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                group, self._pending = self._pending, []
+                first = self._flushed + 1
+            last = first + len(group) - 1
+
+            error = None
+            try:
+                for directory in {os.path.dirname(path) for path in group}:
+                    # Entries will have been made for all our files.
+                    _fsync_path(directory)
+                for path in group:
+                    _fsync_path(path)
+            except OSError as e:
+                logger.exception('Failed to flush stashed files.')
+                error = e
+            else:
+                logger.debug('Flushed %s stashed files.', len(group))
+
+            with self._condition:
+                if error is not None:
+                    self._failures.append((first, last, error))
+                self._flushed = last
+                self._condition.notify_all()
+
+
+_flusher = _Flusher()
 
 
 def purge(*resource_ids):
@@ -198,7 +523,21 @@ def create_datastream_from_data(datastream_data, data, mime=None,
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
-    datastream_data['resource'] = stash(data, DATASTREAM_SCHEME, mime)[0]
+    resource_id = stash(data, DATASTREAM_SCHEME, mime, cursor=cursor)[0]
+
+    return create_datastream_from_resource(datastream_data, resource_id,
+                                           checksums=checksums, old=old,
+                                           cursor=cursor)
+
+
+def create_datastream_from_resource(datastream_data, resource_id,
+                                    checksums=None, old=False, cursor=None):
+    """
+    Create a datastream from a resource already stashed as a datastream.
+    """
+    cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
+
+    datastream_data['resource'] = resource_id
     update_checksums(datastream_data['resource'], checksums, cursor=cursor)
 
     _create_datastream_from_filestore(datastream_data, old, cursor=cursor)
@@ -213,11 +552,24 @@ def create_datastream_from_upload(datastream_data, upload_uri, mime=None,
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
-    datastream_reader.resource_from_uri(upload_uri, cursor=cursor)
+    upload = datastream_reader.resource_from_uri(upload_uri,
+                                                 cursor=cursor).fetchone()
+
+    datastream_data['resource'] = adopt(resolve_uri(upload_uri),
+                                        DATASTREAM_SCHEME, mime,
+                                        cursor=cursor)[0]
+    if upload is not None:
+        # The bytes are the same, so are any checksums we already have.
+        for checksum in datastream_reader.checksums(upload['id'],
+                                                    cursor=cursor).fetchall():
+            datastream_writer.upsert_checksum({
+                'checksum': checksum['checksum'],
+                'type': checksum['type'],
+                'resource': datastream_data['resource'],
+            }, cursor=cursor)
+    update_checksums(datastream_data['resource'], checksums, cursor=cursor)
 
-    with open(resolve_uri(upload_uri), 'rb') as data:
-        create_datastream_from_data(datastream_data, data, mime, checksums,
-                                    old, cursor=cursor)
+    _create_datastream_from_filestore(datastream_data, old, cursor=cursor)
 
     return cursor
 
@@ -249,15 +601,6 @@ def update_checksums(resource, checksums, cursor=None):
     Raises:
         ValueError: On checksum mismatch.
     """
-    # Fedora hash types mapped to the names that hashlib uses.
-    hash_type_map = {
-        'MD5': 'md5',
-        'SHA-1': 'sha1',
-        'SHA-256': 'sha256',
-        'SHA-384': 'sha384',
-        'SHA-512': 'sha512'
-    }
-
     if checksums is not None:
         old_checksums = datastream_reader.checksums(resource, cursor=cursor
                                                     ).fetchall()
@@ -290,7 +633,7 @@ def update_checksums(resource, checksums, cursor=None):
                     cursor=cursor).fetchone()['uri'])
                 checksum_value = checksum_file(
                     file_path,
-                    hash_type_map[checksum['type']]
+                    HASH_TYPE_MAP[checksum['type']]
                 )
 
                 if not checksum['checksum']:
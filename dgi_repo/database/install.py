@@ -6,6 +6,7 @@ import logging
 from os.path import join, dirname
 
 from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
+from psycopg2.extras import execute_values
 
 import dgi_repo.fcrepo3.relations as rels
 import dgi_repo.fcrepo3.foxml as foxml
@@ -13,7 +14,7 @@ import dgi_repo.database.write.repo_objects as object_writer
 import dgi_repo.database.write.relations as relations_writer
 import dgi_repo.database.write.sources as source_writer
 import dgi_repo.utilities as utils
-from dgi_repo.database.utilities import get_connection
+from dgi_repo.database.utilities import get_connection, log_hash
 from dgi_repo.configuration import configuration as _config
 
 logger = logging.getLogger(__name__)
@@ -41,6 +42,73 @@ def install_schema():
     logger.info('Installed schema.')
 
 
+def backfill_log_hashes(cursor):
+    """
+    Compute the digests of log entries that lack them.
+
+    The digest is computed here so it will match those made by the writers.
+    """
+    with cursor.connection.cursor(name='log_hash_backfill') as log_cursor:
+        log_cursor.itersize = 10000
+        log_cursor.execute('SELECT id, log FROM log WHERE log_hash IS NULL')
+        while True:
+            rows = log_cursor.fetchmany(log_cursor.itersize)
+            if not rows:
+                break
+            execute_values(
+                cursor,
+                '''
+                    UPDATE log
+                    SET log_hash = hashes.log_hash
+                    FROM (VALUES %s) AS hashes (id, log_hash)
+                    WHERE log.id = hashes.id
+                ''',
+                [(log_id, log_hash(log)) for log_id, log in rows]
+            )
+            logger.info('Backfilled %s log hashes.', len(rows))
+
+
+'''
+The schema updates, in the order to apply them: either the names of SQL files
+in "resources/updates" or callables accepting a cursor. Each must be safe to
+re-apply.
+'''
+UPDATES = [
+    '0001_access_index.sql',
+    '0002_log_hash.sql',
+    backfill_log_hashes,
+    '0003_log_hash_constraint.sql',
+    '0004_pending_references.sql',
+    '0005_reference_indexes.sql',
+    '0006_membership_indexes.sql',
+    '0007_page_indexes.sql',
+    '0008_fedora_uris.sql',
+    '0009_find_objects_indexes.sql',
+    '0010_changes.sql',
+]
+
+
+def install_updates():
+    """
+    Apply the schema updates to the database.
+
+    Updates are safe to re-apply, so this can be run against new and existing
+    installations alike.
+    """
+    updates_path = join(dirname(__file__), 'resources', 'updates')
+    db_connection = get_connection()
+    with db_connection, db_connection.cursor() as cursor:
+        for update in UPDATES:
+            if callable(update):
+                update(cursor)
+                update = update.__name__
+            else:
+                with open(join(updates_path, update), 'r') as update_file:
+                    cursor.execute(update_file.read())
+            logger.info('Applied schema update: %s.', update)
+    db_connection.close()
+
+
 def install_base_data():
     """
     Install the application's base data to the database.
@@ -2,15 +2,36 @@
 DB proxy.
 """
 
-from contextlib import closing
+import csv
+import io
+import logging
+import zlib
+from functools import partial
+from itertools import chain
+from threading import Lock
 
 import falcon
 import simplejson as json
-from psycopg2 import connect, DatabaseError, ProgrammingError
+from psycopg2 import DatabaseError, ProgrammingError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
 from dgi_repo.configuration import configuration as _config
-from dgi_repo.utilities import SpooledTemporaryFile
-from dgi_repo.fcrepo3.utilities import serialize_to_json
+from dgi_repo.fcrepo3.utilities import (serialize_to_json, format_date,
+                                        stream_response)
+
+logger = logging.getLogger(__name__)
+
+'''
+A mapping of the output formats we support to their content types.
+'''
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+_pool = None
+_pool_lock = Lock()
 
 
 class ProxyResource(object):
@@ -22,17 +43,21 @@ class ProxyResource(object):
         Respond to a particular POST'd JSON with JSON (or error).
 
         POST'd JSON is expected to have the "application/json" Content-Type
-        header set, and to be an object containing up to two properties:
-        - "query": A required string containing the query to perform, and
+        header set, and to be an object containing up to three properties:
+        - "query": A required string containing the query to perform,
         - "replacements": Depending on the replacement tokens used, either a
-            list or an object to combine into the query.
+            list or an object to combine into the query, and
+        - "format": One of "json" (the default), "ndjson" or "csv".
 
         "query" and "replacements" correspond to the two parameters of
         cursor.execute(). For particulars, see:
         http://initd.org/psycopg/docs/usage.html#query-parameters
 
-        On success, the response body will be a list of lists, representing
-        the rows returned from the query.
+        On success, the response body will be streamed as the rows are read
+        from the database. For "json" it is a list of lists, representing
+        the rows returned from the query; for "ndjson" each row is a list on
+        its own line; and "csv" has a header row of column names followed by
+        the rows. At most "max_rows" rows (as configured) will be sent.
         """
         if req.content_type != 'application/json':
             raise falcon.HTTPUnsupportedMediaType(
@@ -41,50 +66,240 @@ class ProxyResource(object):
         info = json.load(req.stream)
         if 'query' not in info:
             raise falcon.HTTPMissingParam('query')
-
-        # XXX: "mode" cannot be binary, as json.dump explicitly writes "str".
-        resp.stream = SpooledTemporaryFile(mode='w')
-
-        with closing(self._get_connection()) as conn:
-            # XXX: Named cursor must _not_ be closed... so no "with".
-            cursor = conn.cursor(name=__name__)
-            try:
-                if 'replacements' in info:
-                    try:
-                        cursor.execute(info['query'], info['replacements'])
-                    except (TypeError, IndexError):
-                        raise falcon.HTTPBadRequest(
-                            'Bad query',
-                            ('Query placeholders invalid for the given'
-                             ' "replacements"?')
-                        )
-                else:
-                    cursor.execute(info['query'])
-            except ProgrammingError as pe:
-                raise falcon.HTTPBadRequest(
-                    'Bad query',
-                    (pe.diag.message_primary if pe.diag.message_primary
-                     else str(pe))
-                )
-            except DatabaseError as de:
-                raise falcon.HTTPInternalServerError(
-                    'Query failed',
-                    (de.diag.message_primary if de.diag.message_primary
-                     else str(de))
+        output_format = info.get('format', 'json')
+        if output_format not in FORMATS:
+            raise falcon.HTTPBadRequest(
+                'Bad format',
+                'The "format" must be one of: {}.'.format(
+                    ', '.join(sorted(FORMATS))
                 )
+            )
+
+        connection = self._get_connection()
+        try:
+            description, batches = self._execute(connection, info)
+        except:
+            _release_connection(connection)
+            raise
+
+        chunks = (chunk.encode('utf-8') for chunk in
+                  _SERIALIZERS[output_format](description, batches))
+        if (_config['db_proxy']['compress'] and
+                'gzip' in (req.get_header('Accept-Encoding') or '')):
+            resp.set_header('Content-Encoding', 'gzip')
+            chunks = _gzip(chunks)
+        resp.append_header('Vary', 'Accept-Encoding')
+        resp.content_type = FORMATS[output_format]
+        resp.stream = stream_response(
+            chunks,
+            partial(_release_connection, connection),
+            'query proxy results'
+        )
+
+    def _execute(self, connection, info):
+        """
+        Run the query, fetching the first batch of rows.
+
+        The first batch is fetched here, before anything is sent, so that
+        most query errors can still be reported with a relevant status.
+
+        Returns:
+            A two-tuple of the cursor's description and an iterator of lists
+            of rows.
+
+        Raises:
+            falcon.HTTPBadRequest: The query or its replacements were invalid.
+            falcon.HTTPInternalServerError: The query otherwise failed.
+        """
+        with connection.cursor() as settings_cursor:
+            settings_cursor.execute(
+                'SET LOCAL statement_timeout = %s',
+                (_config['db_proxy']['statement_timeout'],)
+            )
+        # XXX: Named cursor must _not_ be closed... so no "with".
+        cursor = connection.cursor(name=__name__)
+        try:
+            if 'replacements' in info:
+                try:
+                    cursor.execute(info['query'], info['replacements'])
+                except (TypeError, IndexError):
+                    raise falcon.HTTPBadRequest(
+                        'Bad query',
+                        ('Query placeholders invalid for the given'
+                         ' "replacements"?')
+                    )
             else:
-                json.dump(cursor, resp.stream, iterable_as_array=True,
-                          default=serialize_to_json)
+                cursor.execute(info['query'])
+            batches = _batches(cursor, _config['db_proxy']['itersize'],
+                               _config['db_proxy']['max_rows'])
+            first = next(batches, None)
+        except ProgrammingError as pe:
+            raise falcon.HTTPBadRequest(
+                'Bad query',
+                (pe.diag.message_primary if pe.diag.message_primary
+                 else str(pe))
+            )
+        except DatabaseError as de:
+            raise falcon.HTTPInternalServerError(
+                'Query failed',
+                (de.diag.message_primary if de.diag.message_primary
+                 else str(de))
+            )
+
+        if first is None:
+            return cursor.description, iter([])
+        return cursor.description, chain([first], batches)
 
     def _get_connection(self):
         """
-        Helper to get a connection with reduced permissions.
+        Helper to check out a pooled connection with reduced permissions.
+
+        Raises:
+            falcon.HTTPServiceUnavailable: All pooled connections are in use.
         """
-        connection = connect(
-            host=_config['database']['host'],
-            database=_config['database']['name'],
-            user=_config['db_proxy']['username'],
-            password=_config['db_proxy']['password'],
-        )
+        pool = _get_pool()
+        try:
+            connection = pool.getconn()
+            while connection.closed:
+                # Dropped while pooled; throw it out and try another.
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+        except PoolError:
+            raise falcon.HTTPServiceUnavailable(
+                title='Query proxy busy',
+                description='All query proxy connections are in use.',
+                retry_after=1
+            )
         connection.set_session(readonly=True)
         return connection
+
+
+def _get_pool():
+    """
+    Get the proxy's connection pool, creating it on first use.
+
+    Creation is deferred so that forking servers get a pool per process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            proxy_config = _config['db_proxy']
+            _pool = ThreadedConnectionPool(
+                proxy_config['pool']['min'],
+                proxy_config['pool']['max'],
+                # Reads may be routed to a hot-standby.
+                host=(proxy_config['host'] if 'host' in proxy_config
+                      else _config['database']['host']),
+                port=proxy_config['port'] if 'port' in proxy_config else None,
+                database=_config['database']['name'],
+                user=proxy_config['username'],
+                password=proxy_config['password'],
+            )
+    return _pool
+
+
+def _release_connection(connection):
+    """
+    Reset the session of a checked out connection and return it to the pool.
+
+    Connections which fail to reset are closed instead of being reused.
+    """
+    pool = _get_pool()
+    try:
+        if not connection.closed:
+            connection.rollback()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('DISCARD ALL')
+            connection.autocommit = False
+    except DatabaseError:
+        logger.warning('Failed to reset query proxy connection; closing it.',
+                       exc_info=True)
+        pool.putconn(connection, close=True)
+    else:
+        pool.putconn(connection, close=bool(connection.closed))
+
+
+def _batches(cursor, itersize, max_rows=0):
+    """
+    Generate lists of rows from the cursor.
+
+    Args:
+        cursor: A cursor on which a query has been executed.
+        itersize: The number of rows to fetch from the server at a time.
+        max_rows: The maximum number of rows to generate in total; 0 (or
+            another false-y value) for no limit.
+    """
+    remaining = max_rows
+    while True:
+        size = min(itersize, remaining) if max_rows else itersize
+        if size <= 0:
+            logger.info('Query proxy results truncated at %s rows.', max_rows)
+            return
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+        if max_rows:
+            remaining -= len(rows)
+
+
+def _json_chunks(description, batches):
+    """
+    Serialize batches of rows into a JSON list of lists.
+    """
+    yield '['
+    separator = ''
+    for rows in batches:
+        yield separator + ','.join(
+            json.dumps(row, default=serialize_to_json) for row in rows
+        )
+        separator = ','
+    yield ']'
+
+
+def _ndjson_chunks(description, batches):
+    """
+    Serialize batches of rows as newline delimited JSON lists.
+    """
+    for rows in batches:
+        yield ''.join(
+            json.dumps(row, default=serialize_to_json) + '\n' for row in rows
+        )
+
+
+def _csv_chunks(description, batches):
+    """
+    Serialize batches of rows as CSV, with a header row.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if description is not None:
+        writer.writerow([column.name for column in description])
+    for rows in chain([[]], batches):
+        writer.writerows(
+            [format_date(value) if hasattr(value, 'astimezone') else value
+             for value in row] for row in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _gzip(chunks):
+    """
+    Compress the stream of chunks.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+_SERIALIZERS = {
+    'json': _json_chunks,
+    'ndjson': _ndjson_chunks,
+    'csv': _csv_chunks,
+}
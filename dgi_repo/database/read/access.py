@@ -0,0 +1,71 @@
+"""
+Database helpers relating to the access index.
+
+The object_access and datastream_access tables are maintained by triggers on
+the permission relation tables.
+"""
+
+from dgi_repo.database.utilities import check_cursor
+
+
+def viewable_objects(object_ids, user_id=None, roles=None, cursor=None):
+    """
+    Query for which of the given objects the user or roles can view.
+    """
+    return _filter_access('object_access', 'object', 'view', object_ids,
+                          user_id, roles, cursor)
+
+
+def manageable_objects(object_ids, user_id=None, roles=None, cursor=None):
+    """
+    Query for which of the given objects the user or roles can manage.
+    """
+    return _filter_access('object_access', 'object', 'manage', object_ids,
+                          user_id, roles, cursor)
+
+
+def viewable_datastreams(ds_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Query for which of the given datastreams the user or roles can view.
+    """
+    return _filter_access('datastream_access', 'datastream', 'view',
+                          ds_db_ids, user_id, roles, cursor)
+
+
+def manageable_datastreams(ds_db_ids, user_id=None, roles=None, cursor=None):
+    """
+    Query for which of the given datastreams the user or roles can manage.
+    """
+    return _filter_access('datastream_access', 'datastream', 'manage',
+                          ds_db_ids, user_id, roles, cursor)
+
+
+def _filter_access(table, column, access, ids, user_id, roles, cursor):
+    """
+    Query for the IDs of those entries the user or roles have access to.
+
+    Entries without any rules are viewable by everyone, but only manageable
+    with an explicit rule.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT {column} AS id
+        FROM {table}
+        WHERE {column} = ANY(%(ids)s) AND (
+            {unrestricted}
+            %(user)s = ANY({access}_users) OR
+            {access}_roles && %(roles)s::bigint[]
+        )
+    '''.format(
+        column=column,
+        table=table,
+        access=access,
+        unrestricted='unrestricted OR' if access == 'view' else '',
+    ), {
+        'ids': list(ids),
+        'user': user_id,
+        'roles': list(roles) if roles else [],
+    })
+
+    return cursor
@@ -0,0 +1,58 @@
+"""
+Database helpers relating to the change log.
+"""
+
+from dgi_repo.database.utilities import check_cursor
+
+
+def changes_since(transaction=0, change_id=0, limit=None, cursor=None):
+    """
+    Query for the changes logged after the given one.
+
+    Changes are read in order of the transactions which made them, and only
+    once no transaction which began before them is still running; so none
+    can later commit where they have already been read. Changes are only
+    delayed as long as the longest-running transaction.
+
+    Args:
+        transaction: The transaction of the last change read, if any.
+        change_id: The ID of the last change read, if any.
+        limit: The most changes to query for; None for all.
+
+    Returns:
+        The cursor, having queried for the "id", "transaction", "pid",
+        "dsid", "purged" and "changed" of each change, in order.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT id, transaction, pid, dsid, purged, changed
+        FROM changes
+        WHERE (transaction, id) > (%(transaction)s, %(id)s) AND
+            transaction < txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY transaction, id
+        LIMIT %(limit)s
+    ''', {'transaction': transaction, 'id': change_id, 'limit': limit})
+
+    return cursor
+
+
+def latest_change(cursor=None):
+    """
+    Query for the last change which may be read.
+
+    Returns:
+        The cursor, having queried for the "transaction" and "id" of the
+        change, if any.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT transaction, id
+        FROM changes
+        WHERE transaction < txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY transaction DESC, id DESC
+        LIMIT 1
+    ''')
+
+    return cursor
@@ -296,3 +296,41 @@ def mime_from_resource(resource_id, cursor=None):
     ''', (resource_id,))
 
     return cursor
+
+
+def object_resources(object_ids, cursor=None):
+    """
+    Query for the resources of every version of some objects' datastreams.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT resource
+        FROM datastreams
+        WHERE object = ANY(%(objects)s) AND resource IS NOT NULL
+        UNION
+        SELECT old_datastreams.resource
+        FROM old_datastreams
+            JOIN
+        datastreams
+            ON old_datastreams.datastream = datastreams.id
+        WHERE datastreams.object = ANY(%(objects)s) AND
+            old_datastreams.resource IS NOT NULL
+    ''', {'objects': list(object_ids)})
+
+    return cursor
+
+
+def unreferenced_resources(resource_ids, cursor=None):
+    """
+    Query for which of some resources no datastream version references.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT id
+        FROM resource_refcounts
+        WHERE id = ANY(%s) AND refcount = 0
+    ''', (list(resource_ids),))
+
+    return cursor
@@ -2,7 +2,7 @@
 Database helpers relating to the log.
 """
 
-from dgi_repo.database.utilities import check_cursor
+from dgi_repo.database.utilities import check_cursor, log_hash
 
 
 def log_id(log, cursor=None):
@@ -14,7 +14,7 @@ def log_id(log, cursor=None):
     cursor.execute('''
         SELECT id
         FROM log
-        WHERE log = %s
-    ''', (log,))
+        WHERE log_hash = %s
+    ''', (log_hash(log),))
 
     return cursor
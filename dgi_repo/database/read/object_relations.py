@@ -2,12 +2,19 @@
 Database helpers relating to the object relations.
 """
 
+from itertools import chain
+
 import dgi_repo.database.read.relations as relations_reader
 
 from dgi_repo.database.utilities import check_cursor
 from dgi_repo.database.utilities import OBJECT_RELATION_MAP
 from dgi_repo.database import cache
 
+GENERAL_RDF_OBJECT_TABLES = [
+    'object_relationships',
+    'datastream_relationships',
+]
+
 REPO_OBJECT_RDF_OBJECT_TABLES = [
     'is_member_of_collection',
     'is_member_of',
@@ -17,6 +24,11 @@ REPO_OBJECT_RDF_OBJECT_TABLES = [
     'is_sequence_number_of',
 ]
 
+MEMBERSHIP_TABLES = [
+    'is_member_of_collection',
+    'is_member_of',
+]
+
 
 def read_relationship(namespace, predicate, subject=None, rdf_object=None,
                       cursor=None):
@@ -92,10 +104,301 @@ def is_object_referenced(object_id, cursor):
     """
     Check if an object is referenced by relations.
     """
-    for table in REPO_OBJECT_RDF_OBJECT_TABLES:
-        cursor.execute('''
-            SELECT EXISTS(SELECT 1 from {} WHERE rdf_object=%s)
-        '''.format(table), (object_id,))
-        if cursor.fetchone()[0]:
-            return True
-    return False
+    return bool(referenced_objects([object_id], cursor=cursor).fetchall())
+
+
+def referenced_objects(object_ids, cursor=None):
+    """
+    Query for which of some objects are referenced by relations.
+
+    Both the tables linking to objects and the general relation tables, which
+    reference objects and their datastreams by URI, are checked, in one
+    statement. Relations from an object, or its datastreams, to itself don't
+    count; they go with it.
+    """
+    cursor = check_cursor(cursor)
+
+    linked = ('''
+        EXISTS (
+            SELECT 1 FROM {} WHERE rdf_object = candidates.id AND
+                {}
+        )
+    '''.format(table, _foreign_subject(table)) for table in
+              REPO_OBJECT_RDF_OBJECT_TABLES)
+    # URIs of the object, and of its datastreams (between "uri/" and "uri0").
+    general = ('''
+        EXISTS (
+            SELECT 1 FROM {0} WHERE rdf_object = candidates.uri AND
+                {1}
+            UNION ALL
+            SELECT 1 FROM {0}
+            WHERE rdf_object ~>=~ (candidates.uri || '/') AND
+                rdf_object ~<~ (candidates.uri || '0') AND
+                {1}
+        )
+    '''.format(table, _foreign_subject(table)) for table in
+               GENERAL_RDF_OBJECT_TABLES)
+
+    cursor.execute('''
+        WITH candidates AS (
+            SELECT objects.id,
+                   ('info:fedora/' || pid_namespaces.namespace || ':' ||
+                    objects.pid_id)::text AS uri
+            FROM objects
+                JOIN pid_namespaces ON pid_namespaces.id = objects.namespace
+            WHERE objects.id = ANY(%s)
+        )
+        SELECT id
+        FROM candidates
+        WHERE {}
+    '''.format(' OR '.join(chain(linked, general))), (list(object_ids),))
+
+    return cursor
+
+
+def _foreign_subject(table):
+    """
+    Get a condition that a relation in the table isn't about the candidate.
+    """
+    if table == 'datastream_relationships':
+        return '''rdf_subject NOT IN (
+                    SELECT id FROM datastreams WHERE object = candidates.id
+                )'''
+    return 'rdf_subject <> candidates.id'
+
+
+def selected_objects(namespaces=(), collections=(), models=(), pids=(),
+                     descendants=False, cursor=None):
+    """
+    Query for the objects matching any of the given criteria.
+
+    Args:
+        namespaces: PID namespaces, all objects in which are selected.
+        collections: PIDs of collections, the direct members of which are
+            selected.
+        models: PIDs of content models, the objects of which are selected.
+        pids: PIDs of objects to select.
+        descendants: Whether to also select, recursively, those objects
+            which are members, constituents or pages of the selected.
+
+    Returns:
+        The cursor, having queried for the "id" and "pid" of each object,
+        newest first.
+    """
+    cursor = check_cursor(cursor)
+
+    requested = [('collection', pid) for pid in collections]
+    requested.extend(('model', pid) for pid in models)
+    requested.extend(('pid', pid) for pid in pids)
+    kinds, requested_pids = zip(*requested) if requested else ((), ())
+
+    source = 'selected'
+    recursion = ''
+    if descendants:
+        source = 'descendants'
+        recursion = ''', descendants(id) AS (
+            SELECT id FROM selected
+            UNION
+            SELECT links.rdf_subject
+            FROM ({}) AS links
+                JOIN descendants ON links.rdf_object = descendants.id
+        )'''.format(' UNION ALL '.join(
+            'SELECT rdf_subject, rdf_object FROM {}'.format(table)
+            for table in REPO_OBJECT_RDF_OBJECT_TABLES
+            if table != 'has_model'
+        ))
+
+    cursor.execute('''
+        WITH RECURSIVE requested AS (
+            SELECT requested.kind, objects.id
+            FROM unnest(%(kinds)s::text[], %(pids)s::text[])
+                    AS requested(kind, pid)
+                JOIN pid_namespaces
+                    ON pid_namespaces.namespace =
+                        split_part(requested.pid, ':', 1)
+                JOIN objects
+                    ON objects.namespace = pid_namespaces.id AND
+                        objects.pid_id = split_part(requested.pid, ':', 2)
+        ), selected(id) AS (
+            SELECT objects.id
+            FROM objects
+                JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+            WHERE pid_namespaces.namespace = ANY(%(namespaces)s::text[])
+            UNION
+            SELECT id FROM requested WHERE kind = 'pid'
+            UNION
+            SELECT is_member_of_collection.rdf_subject
+            FROM is_member_of_collection
+                JOIN requested
+                    ON requested.kind = 'collection' AND
+                        is_member_of_collection.rdf_object = requested.id
+            UNION
+            SELECT has_model.rdf_subject
+            FROM has_model
+                JOIN requested
+                    ON requested.kind = 'model' AND
+                        has_model.rdf_object = requested.id
+        ){0}
+        SELECT objects.id,
+               pid_namespaces.namespace || ':' || objects.pid_id AS pid
+        FROM {1}
+            JOIN objects ON objects.id = {1}.id
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+        ORDER BY objects.id DESC
+    '''.format(recursion, source), {
+        'kinds': list(kinds),
+        'pids': list(requested_pids),
+        'namespaces': list(namespaces),
+    })
+
+    return cursor
+
+
+def collection_members(object_id, depth=1, after=None, limit=None,
+                       cursor=None):
+    """
+    Query for the members of an object, recursively, a page at a time.
+
+    Membership is by either of the MEMBERSHIP_TABLES; pages are keyed on the
+    database ID of the members, so are stable while members come and go.
+
+    Direct members are paged through the membership indexes. Deeper pages
+    must walk the whole membership tree below the object, as members before
+    the page may have members on it; so, depth should be kept in check.
+
+    Args:
+        object_id: The database ID of the collection (or other object).
+        depth: How many levels of membership to follow; 1 for direct
+            members only.
+        after: The database ID of the last member of the previous page, if
+            any.
+        limit: The most members to query for; None for all of them.
+
+    Returns:
+        The cursor, having queried for the "id", "pid", "label" and "models"
+        of each member, and the "depth" at which it was first found, ordered
+        by "id".
+    """
+    cursor = check_cursor(cursor)
+
+    if depth == 1:
+        # At most a page from each table.
+        members = 'members(id, depth) AS ({})'.format(' UNION '.join('''
+            (SELECT rdf_subject, 1
+             FROM {}
+             WHERE rdf_object = %(object)s AND
+                 rdf_subject <> %(object)s AND
+                 (%(after)s::bigint IS NULL OR
+                  rdf_subject > %(after)s::bigint)
+             ORDER BY rdf_subject
+             LIMIT %(limit)s)
+        '''.format(table) for table in MEMBERSHIP_TABLES))
+    else:
+        links = ' UNION ALL '.join(
+            'SELECT rdf_subject, rdf_object FROM {}'.format(table)
+            for table in MEMBERSHIP_TABLES
+        )
+        members = '''RECURSIVE members(id, depth) AS (
+            SELECT links.rdf_subject, 1
+            FROM ({0}) AS links
+            WHERE links.rdf_object = %(object)s
+            UNION
+            SELECT links.rdf_subject, members.depth + 1
+            FROM ({0}) AS links
+                JOIN members ON links.rdf_object = members.id
+            WHERE members.depth < %(depth)s
+        )'''.format(links)
+
+    cursor.execute('''
+        WITH {}, page AS (
+            SELECT id, min(depth) AS depth
+            FROM members
+            WHERE id <> %(object)s AND
+                (%(after)s::bigint IS NULL OR id > %(after)s::bigint)
+            GROUP BY id
+            ORDER BY id
+            LIMIT %(limit)s
+        )
+        SELECT objects.id,
+               pid_namespaces.namespace || ':' || objects.pid_id AS pid,
+               objects.label,
+               page.depth,
+               ARRAY(
+                   SELECT model_namespaces.namespace || ':' || models.pid_id
+                   FROM has_model
+                       JOIN objects AS models
+                           ON models.id = has_model.rdf_object
+                       JOIN pid_namespaces AS model_namespaces
+                           ON models.namespace = model_namespaces.id
+                   WHERE has_model.rdf_subject = objects.id
+                   ORDER BY 1
+               ) AS models
+        FROM page
+            JOIN objects ON objects.id = page.id
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+        ORDER BY objects.id
+    '''.format(members), {
+        'object': object_id,
+        'depth': depth,
+        'after': after,
+        'limit': limit,
+    })
+
+    return cursor
+
+
+def ordered_pages(object_id, dsids=None, cursor=None):
+    """
+    Query for the pages of a paged object, in sequence.
+
+    Pages are those objects which are isPageOf or isSequenceNumberOf the
+    paged object; their sequence is that relative to the object if given,
+    else their isSequenceNumber. Pages without either go last.
+
+    Args:
+        object_id: The database ID of the paged object.
+        dsids: The datastream IDs to list for each page, where present; None
+            for all of them.
+
+    Returns:
+        The cursor, having queried for the "id", "pid", "label",
+        "sequence_number" and "dsids" of each page.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        WITH pages AS (
+            SELECT rdf_subject AS id FROM is_page_of
+            WHERE rdf_object = %(object)s
+            UNION
+            SELECT rdf_subject FROM is_sequence_number_of
+            WHERE rdf_object = %(object)s
+        )
+        SELECT objects.id,
+               pid_namespaces.namespace || ':' || objects.pid_id AS pid,
+               objects.label,
+               COALESCE(
+                   (SELECT min(sequence_number) FROM is_sequence_number_of
+                    WHERE rdf_subject = pages.id AND
+                        rdf_object = %(object)s),
+                   (SELECT min(rdf_object) FROM is_sequence_number
+                    WHERE rdf_subject = pages.id)
+               ) AS sequence_number,
+               ARRAY(
+                   SELECT dsid
+                   FROM datastreams
+                   WHERE object = pages.id AND
+                       (%(dsids)s::text[] IS NULL OR
+                        dsid = ANY(%(dsids)s::text[]))
+                   ORDER BY dsid
+               ) AS dsids
+        FROM pages
+            JOIN objects ON objects.id = pages.id
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+        ORDER BY sequence_number NULLS LAST, objects.id
+    ''', {
+        'object': object_id,
+        'dsids': None if dsids is None else list(dsids),
+    })
+
+    return cursor
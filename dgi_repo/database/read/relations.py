@@ -2,7 +2,7 @@
 Database helpers relating to relations.
 """
 
-from dgi_repo.database.utilities import check_cursor
+from dgi_repo.database.utilities import check_cursor, relation_columns
 
 
 def namespace_id(namespace, cursor=None):
@@ -107,3 +107,43 @@ def predicate_id_from_raw(namespace, predicate, cursor=None):
     ''', (namespace, predicate))
 
     return cursor
+
+
+def pending_reference_pids(cursor=None):
+    """
+    Query for the PIDs referenced by pending references.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT DISTINCT namespace || ':' || pid_id AS pid
+        FROM pending_references
+        ORDER BY pid
+    ''')
+
+    return cursor
+
+
+def relation_rows(tables, subjects, cursor=None):
+    """
+    Query for the relations about some subjects, across relation tables.
+
+    Each row has the "relation_table" and "id" of a relation, and its
+    "relation_row": its values as text, in the order of relation_columns().
+    """
+    cursor = check_cursor(cursor)
+
+    queries = []
+    parameters = []
+    for table in tables:
+        columns = ', '.join('{}::text'.format(column)
+                            for column in relation_columns(table))
+        queries.append('''
+            SELECT %s AS relation_table, id, ARRAY[{}] AS relation_row
+            FROM {}
+            WHERE rdf_subject = ANY(%s)
+        '''.format(columns, table))
+        parameters.extend((table, list(subjects)))
+    cursor.execute(' UNION ALL '.join(queries), parameters)
+
+    return cursor
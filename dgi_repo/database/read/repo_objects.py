@@ -2,9 +2,32 @@
 Database helpers relating to repository objects.
 """
 
-from dgi_repo.database.utilities import check_cursor
+from dgi_repo.database.utilities import check_cursor, OBJECT_RELATION_MAP
+from dgi_repo.fcrepo3.relations import DC_NAMESPACE
 from dgi_repo import utilities
 
+'''
+The tables of the DC fields of objects, by field.
+'''
+DC_FIELD_TABLES = {
+    predicate: info['table']
+    for (namespace, predicate), info in OBJECT_RELATION_MAP.items()
+    if namespace == DC_NAMESPACE
+}
+
+'''
+SQL for the properties of objects which may be searched, by Fedora's field
+names; see find_objects().
+'''
+OBJECT_FIELDS = {
+    'pid': "pid_namespaces.namespace || ':' || objects.pid_id",
+    'label': 'objects.label',
+    'state': 'objects.state::text',
+    'ownerId': 'owners.name',
+    'cDate': 'objects.created',
+    'mDate': 'objects.modified',
+}
+
 
 def object_info(db_id, cursor=None):
     """
@@ -117,3 +140,156 @@ def object_id_from_raw(pid, cursor=None):
     ''', (pid_id, namespace))
 
     return cursor
+
+
+def object_pids(namespaces=None, cursor=None):
+    """
+    Query for the PIDs of all objects, or those in the given namespaces.
+
+    Returns:
+        The cursor, having queried for the "pid" of each object, in the order
+        they were created.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        SELECT pid_namespaces.namespace || ':' || objects.pid_id AS pid
+        FROM objects
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+        WHERE %(namespaces)s::text[] IS NULL OR
+            pid_namespaces.namespace = ANY(%(namespaces)s::text[])
+        ORDER BY objects.id
+    ''', {'namespaces': list(namespaces) if namespaces else None})
+
+    return cursor
+
+
+def find_objects(conditions=(), terms=None, dc_fields=(), after=None,
+                 limit=None, cursor=None):
+    """
+    Query for a page of the objects matching a search, as Fedora's
+    findObjects.
+
+    Args:
+        conditions: (field, operator, value) tuples, all of which must match:
+            - field: One of OBJECT_FIELDS or DC_FIELD_TABLES; DC fields match
+                if any of their values do.
+            - operator: One of "=", "<", ">", "<=", ">=" or "~"; the last
+                matches case-insensitively, with "*" and "?" wildcards.
+            - value: The value to compare.
+        terms: A pattern, with wildcards as for "~", which any field must
+            contain; None for no such pattern.
+        dc_fields: The DC fields to list the values of for each object.
+        after: The database ID of the last object of the previous page, if
+            any.
+        limit: The most objects to query for; None for all.
+
+    Returns:
+        The cursor, having queried for the "id", "pid", "label", "state",
+        "owner", "created" and "modified" of each object, and a list of the
+        values of each of the given DC fields under its name, ordered by
+        "id".
+    """
+    cursor = check_cursor(cursor)
+
+    clauses = []
+    params = []
+    for field, operator, value in conditions:
+        if field in DC_FIELD_TABLES:
+            table = DC_FIELD_TABLES[field]
+            clause, field_params = _compare(
+                '{}.rdf_object'.format(table), operator, value, folded=True
+            )
+            clause = '''EXISTS (
+                SELECT 1
+                FROM {0}
+                WHERE {0}.rdf_subject = objects.id AND {1}
+            )'''.format(table, clause)
+        elif field == 'pid' and operator == '=':
+            # Compare the parts, so the unique index may be used.
+            namespace, _, pid_id = value.partition(':')
+            clause = ('(pid_namespaces.namespace = %s AND '
+                      'objects.pid_id = %s)')
+            field_params = [namespace, pid_id]
+        else:
+            clause, field_params = _compare(OBJECT_FIELDS[field], operator,
+                                            value, folded=field == 'label')
+        clauses.append(clause)
+        params.extend(field_params)
+
+    if terms is not None:
+        pattern = '%{}%'.format(_like_pattern(terms))
+        matches = ['lower({}) LIKE lower(%s)'.format(OBJECT_FIELDS[field])
+                   for field in ('pid', 'label')]
+        matches.extend('''EXISTS (
+                SELECT 1
+                FROM {0}
+                WHERE {0}.rdf_subject = objects.id AND
+                    lower({0}.rdf_object) LIKE lower(%s)
+            )'''.format(table) for table in sorted(DC_FIELD_TABLES.values()))
+        clauses.append('({})'.format(' OR '.join(matches)))
+        params.extend([pattern] * len(matches))
+
+    if after is not None:
+        clauses.append('objects.id > %s')
+        params.append(after)
+
+    values = ''.join(''',
+               ARRAY(
+                   SELECT {0}.rdf_object
+                   FROM {0}
+                   WHERE {0}.rdf_subject = objects.id
+                   ORDER BY {0}.id
+               ) AS "{1}"'''.format(DC_FIELD_TABLES[field], field)
+                     for field in dc_fields)
+
+    cursor.execute('''
+        SELECT objects.id,
+               pid_namespaces.namespace || ':' || objects.pid_id AS pid,
+               objects.label,
+               objects.state,
+               owners.name AS owner,
+               objects.created,
+               objects.modified{}
+        FROM objects
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+            JOIN users AS owners ON objects.owner = owners.id
+        {}
+        ORDER BY objects.id
+        {}
+    '''.format(
+        values,
+        'WHERE ' + ' AND '.join(clauses) if clauses else '',
+        'LIMIT %s' if limit is not None else ''
+    ), params + ([limit] if limit is not None else []))
+
+    return cursor
+
+
+def _compare(expression, operator, value, folded=False):
+    """
+    Get SQL comparing an expression to a value, and its parameters.
+
+    Args:
+        folded: Whether the expression is indexed in lower case, so exact
+            matches should first be narrowed down by it.
+    """
+    if operator == '~':
+        return 'lower({}) LIKE lower(%s)'.format(expression), [
+            _like_pattern(value)
+        ]
+    if operator == '=' and folded:
+        return 'lower({0}) = lower(%s) AND {0} = %s'.format(expression), [
+            value,
+            value,
+        ]
+    return '{} {} %s'.format(expression, operator), [value]
+
+
+def _like_pattern(pattern):
+    """
+    Convert a pattern with "*" and "?" wildcards to one for LIKE.
+    """
+    for character in ('\\', '%', '_'):
+        pattern = pattern.replace(character, '\\' + character)
+    return pattern.replace('*', '%').replace('?', '_')
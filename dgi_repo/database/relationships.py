@@ -8,7 +8,7 @@ from lxml import etree
 import dgi_repo.fcrepo3.relations as relations
 import dgi_repo.database.read.repo_objects as object_reader
 import dgi_repo.database.read.datastreams as datastream_reader
-import dgi_repo.database.write.sources as source_writer
+from dgi_repo.database import cache
 from dgi_repo.exceptions import (ReferencedObjectDoesNotExistError,
                                  ReferencedDatastreamDoesNotExist)
 from dgi_repo.fcrepo3.utilities import (RDF_NAMESPACE, pid_from_fedora_uri,
@@ -22,6 +22,48 @@ from dgi_repo.database.utilities import (DATASTREAM_RELATION_MAP,
 
 logger = logging.getLogger(__name__)
 
+'''
+Predicates whose literal objects are user or role names, to be dereferenced.
+'''
+USER_PREDICATES = frozenset([
+    (relations.ISLANDORA_RELS_EXT_NAMESPACE,
+     relations.IS_VIEWABLE_BY_USER_PREDICATE),
+    (relations.ISLANDORA_RELS_INT_NAMESPACE,
+     relations.IS_VIEWABLE_BY_USER_PREDICATE),
+    (relations.ISLANDORA_RELS_EXT_NAMESPACE,
+     relations.IS_MANAGEABLE_BY_USER_PREDICATE),
+    (relations.ISLANDORA_RELS_INT_NAMESPACE,
+     relations.IS_MANAGEABLE_BY_USER_PREDICATE),
+])
+ROLE_PREDICATES = frozenset([
+    (relations.ISLANDORA_RELS_EXT_NAMESPACE,
+     relations.IS_VIEWABLE_BY_ROLE_PREDICATE),
+    (relations.ISLANDORA_RELS_INT_NAMESPACE,
+     relations.IS_VIEWABLE_BY_ROLE_PREDICATE),
+    (relations.ISLANDORA_RELS_EXT_NAMESPACE,
+     relations.IS_MANAGEABLE_BY_ROLE_PREDICATE),
+    (relations.ISLANDORA_RELS_INT_NAMESPACE,
+     relations.IS_MANAGEABLE_BY_ROLE_PREDICATE),
+])
+
+
+def relation_row(rel_map, general_table, namespace, predicate, subject,
+                 rdf_object, cursor=None):
+    """
+    Get the table and row for a relation, as the relation writers would.
+
+    Returns:
+        A two-tuple of the table and the row, its values in the order of
+        relation_columns().
+    """
+    try:
+        return (rel_map[(namespace, predicate)]['table'],
+                (subject, rdf_object))
+    except KeyError:
+        predicate_id = cache.predicate_id_from_raw(namespace, predicate,
+                                                   cursor=cursor)
+        return (general_table, (predicate_id, subject, rdf_object))
+
 
 def _element_predicate(relation):
     """
@@ -83,37 +125,13 @@ def _rdf_object_from_element(predicate, relation, source, cursor):
             reference a repo object, but it could not be found.
         ValueError: If the value could not be resolved in general.
     """
-    user_tags = frozenset([
-        (relations.ISLANDORA_RELS_EXT_NAMESPACE,
-         relations.IS_VIEWABLE_BY_USER_PREDICATE),
-        (relations.ISLANDORA_RELS_INT_NAMESPACE,
-         relations.IS_VIEWABLE_BY_USER_PREDICATE),
-        (relations.ISLANDORA_RELS_EXT_NAMESPACE,
-         relations.IS_MANAGEABLE_BY_USER_PREDICATE),
-        (relations.ISLANDORA_RELS_INT_NAMESPACE,
-         relations.IS_MANAGEABLE_BY_USER_PREDICATE),
-    ])
-    role_tags = frozenset([
-        (relations.ISLANDORA_RELS_EXT_NAMESPACE,
-         relations.IS_VIEWABLE_BY_ROLE_PREDICATE),
-        (relations.ISLANDORA_RELS_INT_NAMESPACE,
-         relations.IS_VIEWABLE_BY_ROLE_PREDICATE),
-        (relations.ISLANDORA_RELS_EXT_NAMESPACE,
-         relations.IS_MANAGEABLE_BY_ROLE_PREDICATE),
-        (relations.ISLANDORA_RELS_INT_NAMESPACE,
-         relations.IS_MANAGEABLE_BY_ROLE_PREDICATE),
-    ])
     if relation.text:
-        if predicate in user_tags:
-            cursor = source_writer.upsert_user({'name': relation.text,
-                                                'source': source},
-                                               cursor=cursor)
-            return (cursor.fetchone()['id'], USER_RDF_OBJECT)
-        elif predicate in role_tags:
-            cursor = source_writer.upsert_role({'role': relation.text,
-                                                'source': source},
-                                               cursor=cursor)
-            return (cursor.fetchone()['id'], ROLE_RDF_OBJECT)
+        if predicate in USER_PREDICATES:
+            return (cache.user_id(relation.text, source, cursor=cursor),
+                    USER_RDF_OBJECT)
+        elif predicate in ROLE_PREDICATES:
+            return (cache.role_id(relation.text, source, cursor=cursor),
+                    ROLE_RDF_OBJECT)
         else:
             logger.debug(('No dereferencing performed for relationship %s for '
                           'value %s.'), predicate, relation.text)
@@ -0,0 +1,274 @@
+--
+-- Trigger maintained index of who may view and manage objects and datastreams.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: object_access; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE IF NOT EXISTS object_access (
+    object bigint NOT NULL,
+    view_users bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    view_roles bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    manage_users bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    manage_roles bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    unrestricted boolean DEFAULT true NOT NULL,
+    CONSTRAINT object_access_pkey PRIMARY KEY (object),
+    CONSTRAINT object_access_object_link FOREIGN KEY (object) REFERENCES objects(id) ON DELETE CASCADE
+);
+
+COMMENT ON TABLE object_access IS 'Derived from the object permission tables by triggers; do not write to directly.';
+COMMENT ON COLUMN object_access.view_users IS 'Users that can view the object, including those that can manage it.';
+COMMENT ON COLUMN object_access.view_roles IS 'Roles that can view the object, including those that can manage it.';
+COMMENT ON COLUMN object_access.manage_users IS 'Users that can manage the object.';
+COMMENT ON COLUMN object_access.manage_roles IS 'Roles that can manage the object.';
+COMMENT ON COLUMN object_access.unrestricted IS 'Whether the object has no permission rules at all.';
+
+CREATE INDEX IF NOT EXISTS object_access_view_users_index ON object_access USING gin (view_users);
+CREATE INDEX IF NOT EXISTS object_access_view_roles_index ON object_access USING gin (view_roles);
+
+
+--
+-- Name: datastream_access; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE IF NOT EXISTS datastream_access (
+    datastream bigint NOT NULL,
+    view_users bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    view_roles bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    manage_users bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    manage_roles bigint[] DEFAULT '{}'::bigint[] NOT NULL,
+    unrestricted boolean DEFAULT true NOT NULL,
+    CONSTRAINT datastream_access_pkey PRIMARY KEY (datastream),
+    CONSTRAINT datastream_access_datastream_link FOREIGN KEY (datastream) REFERENCES datastreams(id) ON DELETE CASCADE
+);
+
+COMMENT ON TABLE datastream_access IS 'Derived from the datastream permission tables by triggers; do not write to directly.';
+COMMENT ON COLUMN datastream_access.view_users IS 'Users that can view the datastream, including those that can manage it.';
+COMMENT ON COLUMN datastream_access.view_roles IS 'Roles that can view the datastream, including those that can manage it.';
+COMMENT ON COLUMN datastream_access.manage_users IS 'Users that can manage the datastream.';
+COMMENT ON COLUMN datastream_access.manage_roles IS 'Roles that can manage the datastream.';
+COMMENT ON COLUMN datastream_access.unrestricted IS 'Whether the datastream has no permission rules at all.';
+
+CREATE INDEX IF NOT EXISTS datastream_access_view_users_index ON datastream_access USING gin (view_users);
+CREATE INDEX IF NOT EXISTS datastream_access_view_roles_index ON datastream_access USING gin (view_roles);
+
+
+--
+-- Name: refresh_object_access(bigint); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION refresh_object_access(object_id bigint) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+    DECLARE
+      new_view_users bigint[];
+      new_view_roles bigint[];
+      new_manage_users bigint[];
+      new_manage_roles bigint[];
+    BEGIN
+      -- Rules are deleted in cascade when the object itself is.
+      IF NOT EXISTS (SELECT 1 FROM objects WHERE id = object_id) THEN
+        RETURN;
+      END IF;
+
+      new_manage_users := ARRAY(SELECT DISTINCT rdf_object FROM object_is_manageable_by_user WHERE rdf_subject = object_id);
+      new_manage_roles := ARRAY(SELECT DISTINCT rdf_object FROM object_is_manageable_by_role WHERE rdf_subject = object_id);
+      new_view_users := ARRAY(
+        SELECT rdf_object FROM object_is_viewable_by_user WHERE rdf_subject = object_id
+        UNION
+        SELECT unnest(new_manage_users)
+      );
+      new_view_roles := ARRAY(
+        SELECT rdf_object FROM object_is_viewable_by_role WHERE rdf_subject = object_id
+        UNION
+        SELECT unnest(new_manage_roles)
+      );
+
+      INSERT INTO object_access (object, view_users, view_roles, manage_users, manage_roles, unrestricted)
+      VALUES (
+        object_id,
+        new_view_users,
+        new_view_roles,
+        new_manage_users,
+        new_manage_roles,
+        cardinality(new_view_users) = 0 AND cardinality(new_view_roles) = 0
+      )
+      ON CONFLICT (object)
+      DO UPDATE SET view_users = EXCLUDED.view_users,
+                    view_roles = EXCLUDED.view_roles,
+                    manage_users = EXCLUDED.manage_users,
+                    manage_roles = EXCLUDED.manage_roles,
+                    unrestricted = EXCLUDED.unrestricted;
+    END;
+  $$;
+
+
+--
+-- Name: refresh_datastream_access(bigint); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION refresh_datastream_access(datastream_id bigint) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+    DECLARE
+      new_view_users bigint[];
+      new_view_roles bigint[];
+      new_manage_users bigint[];
+      new_manage_roles bigint[];
+    BEGIN
+      -- Rules are deleted in cascade when the datastream itself is.
+      IF NOT EXISTS (SELECT 1 FROM datastreams WHERE id = datastream_id) THEN
+        RETURN;
+      END IF;
+
+      new_manage_users := ARRAY(SELECT DISTINCT rdf_object FROM datastream_is_manageable_by_user WHERE rdf_subject = datastream_id);
+      new_manage_roles := ARRAY(SELECT DISTINCT rdf_object FROM datastream_is_manageable_by_role WHERE rdf_subject = datastream_id);
+      new_view_users := ARRAY(
+        SELECT rdf_object FROM datastream_is_viewable_by_user WHERE rdf_subject = datastream_id
+        UNION
+        SELECT unnest(new_manage_users)
+      );
+      new_view_roles := ARRAY(
+        SELECT rdf_object FROM datastream_is_viewable_by_role WHERE rdf_subject = datastream_id
+        UNION
+        SELECT unnest(new_manage_roles)
+      );
+
+      INSERT INTO datastream_access (datastream, view_users, view_roles, manage_users, manage_roles, unrestricted)
+      VALUES (
+        datastream_id,
+        new_view_users,
+        new_view_roles,
+        new_manage_users,
+        new_manage_roles,
+        cardinality(new_view_users) = 0 AND cardinality(new_view_roles) = 0
+      )
+      ON CONFLICT (datastream)
+      DO UPDATE SET view_users = EXCLUDED.view_users,
+                    view_roles = EXCLUDED.view_roles,
+                    manage_users = EXCLUDED.manage_users,
+                    manage_roles = EXCLUDED.manage_roles,
+                    unrestricted = EXCLUDED.unrestricted;
+    END;
+  $$;
+
+
+--
+-- Name: object_access_rule(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION object_access_rule() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      IF (TG_OP = 'DELETE' OR TG_OP = 'UPDATE') THEN
+        PERFORM refresh_object_access(OLD.rdf_subject);
+      END IF;
+      IF (TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.rdf_subject <> OLD.rdf_subject)) THEN
+        PERFORM refresh_object_access(NEW.rdf_subject);
+      END IF;
+
+      RETURN NULL;
+    END;
+  $$;
+
+
+--
+-- Name: datastream_access_rule(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION datastream_access_rule() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      IF (TG_OP = 'DELETE' OR TG_OP = 'UPDATE') THEN
+        PERFORM refresh_datastream_access(OLD.rdf_subject);
+      END IF;
+      IF (TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.rdf_subject <> OLD.rdf_subject)) THEN
+        PERFORM refresh_datastream_access(NEW.rdf_subject);
+      END IF;
+
+      RETURN NULL;
+    END;
+  $$;
+
+
+--
+-- Name: object_access_entry(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION object_access_entry() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      INSERT INTO object_access (object) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+      RETURN NULL;
+    END;
+  $$;
+
+
+--
+-- Name: datastream_access_entry(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION datastream_access_entry() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      INSERT INTO datastream_access (datastream) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+      RETURN NULL;
+    END;
+  $$;
+
+
+--
+-- Name: access triggers; Type: TRIGGER; Schema: public; Owner: -
+--
+
+DROP TRIGGER IF EXISTS object_access_entry ON objects;
+CREATE TRIGGER object_access_entry AFTER INSERT ON objects FOR EACH ROW EXECUTE PROCEDURE object_access_entry();
+
+DROP TRIGGER IF EXISTS datastream_access_entry ON datastreams;
+CREATE TRIGGER datastream_access_entry AFTER INSERT ON datastreams FOR EACH ROW EXECUTE PROCEDURE datastream_access_entry();
+
+DROP TRIGGER IF EXISTS object_access_rule ON object_is_viewable_by_user;
+CREATE TRIGGER object_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON object_is_viewable_by_user FOR EACH ROW EXECUTE PROCEDURE object_access_rule();
+
+DROP TRIGGER IF EXISTS object_access_rule ON object_is_viewable_by_role;
+CREATE TRIGGER object_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON object_is_viewable_by_role FOR EACH ROW EXECUTE PROCEDURE object_access_rule();
+
+DROP TRIGGER IF EXISTS object_access_rule ON object_is_manageable_by_user;
+CREATE TRIGGER object_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON object_is_manageable_by_user FOR EACH ROW EXECUTE PROCEDURE object_access_rule();
+
+DROP TRIGGER IF EXISTS object_access_rule ON object_is_manageable_by_role;
+CREATE TRIGGER object_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON object_is_manageable_by_role FOR EACH ROW EXECUTE PROCEDURE object_access_rule();
+
+DROP TRIGGER IF EXISTS datastream_access_rule ON datastream_is_viewable_by_user;
+CREATE TRIGGER datastream_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON datastream_is_viewable_by_user FOR EACH ROW EXECUTE PROCEDURE datastream_access_rule();
+
+DROP TRIGGER IF EXISTS datastream_access_rule ON datastream_is_viewable_by_role;
+CREATE TRIGGER datastream_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON datastream_is_viewable_by_role FOR EACH ROW EXECUTE PROCEDURE datastream_access_rule();
+
+DROP TRIGGER IF EXISTS datastream_access_rule ON datastream_is_manageable_by_user;
+CREATE TRIGGER datastream_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON datastream_is_manageable_by_user FOR EACH ROW EXECUTE PROCEDURE datastream_access_rule();
+
+DROP TRIGGER IF EXISTS datastream_access_rule ON datastream_is_manageable_by_role;
+CREATE TRIGGER datastream_access_rule AFTER INSERT OR DELETE OR UPDATE OF rdf_subject, rdf_object ON datastream_is_manageable_by_role FOR EACH ROW EXECUTE PROCEDURE datastream_access_rule();
+
+
+--
+-- Build the index for anything already in the repository; the triggers keep
+-- it up to date from there, so re-applying only fills in what is missing.
+--
+
+SELECT refresh_object_access(id)
+FROM objects
+WHERE NOT EXISTS (SELECT 1 FROM object_access WHERE object = objects.id);
+SELECT refresh_datastream_access(id)
+FROM datastreams
+WHERE NOT EXISTS (SELECT 1 FROM datastream_access WHERE datastream = datastreams.id);
@@ -0,0 +1,22 @@
+--
+-- Add a digest of log entries, so they need not be unique on their full text.
+--
+-- Hashes are backfilled by dgi_repo.database.install.backfill_log_hashes()
+-- before 0003_log_hash_constraint.sql is applied. Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+DO $$
+  BEGIN
+    IF NOT EXISTS (
+      SELECT 1
+      FROM information_schema.columns
+      WHERE table_name = 'log' AND column_name = 'log_hash'
+    ) THEN
+      ALTER TABLE log ADD COLUMN log_hash bytea;
+    END IF;
+  END;
+$$;
+
+COMMENT ON COLUMN log.log_hash IS 'SHA-256 digest of the text of the log entry.';
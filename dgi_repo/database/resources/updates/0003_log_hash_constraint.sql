@@ -0,0 +1,26 @@
+--
+-- Deduplicate log entries on their digest instead of their full text.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+ALTER TABLE log ALTER COLUMN log_hash SET NOT NULL;
+
+DO $$
+  BEGIN
+    IF NOT EXISTS (
+      SELECT 1
+      FROM pg_constraint
+      WHERE conname = 'unique_log_hashes'
+    ) THEN
+      ALTER TABLE ONLY log
+          ADD CONSTRAINT unique_log_hashes UNIQUE (log_hash);
+    END IF;
+  END;
+$$;
+
+COMMENT ON CONSTRAINT unique_log_hashes ON log IS 'Log entries should be unique.';
+
+ALTER TABLE ONLY log DROP CONSTRAINT IF EXISTS unique_log_entries;
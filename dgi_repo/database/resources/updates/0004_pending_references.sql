@@ -0,0 +1,83 @@
+--
+-- Stage relations whose objects could not be found on ingest, to be resolved
+-- once they have been.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: pending_references; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE IF NOT EXISTS pending_references (
+    id bigserial PRIMARY KEY,
+    object bigint REFERENCES objects (id) ON DELETE CASCADE,
+    datastream bigint REFERENCES datastreams (id) ON DELETE CASCADE,
+    relation_table regclass NOT NULL,
+    namespace character varying(255) NOT NULL,
+    pid_id character varying(255) NOT NULL,
+    dsid character varying(255),
+    sequence_number smallint,
+    CONSTRAINT one_pending_subject CHECK ((object IS NULL) <> (datastream IS NULL))
+);
+
+COMMENT ON TABLE pending_references IS 'Relations from an object or datastream to one which did not yet exist.';
+COMMENT ON COLUMN pending_references.relation_table IS 'The standard relation table the relation belongs in.';
+COMMENT ON COLUMN pending_references.dsid IS 'The referenced datastream, if any, of the referenced object.';
+COMMENT ON COLUMN pending_references.sequence_number IS 'The sequence number of is_sequence_number_of relations, which reference the paged object.';
+
+CREATE INDEX IF NOT EXISTS pending_references_reference_index ON pending_references USING btree (namespace, pid_id);
+CREATE INDEX IF NOT EXISTS pending_references_object_index ON pending_references USING btree (object);
+CREATE INDEX IF NOT EXISTS pending_references_datastream_index ON pending_references USING btree (datastream);
+
+
+--
+-- Name: resolve_pending_references(); Type: FUNCTION; Schema: public; Owner: -
+--
+-- Moves every pending reference which now resolves into its relation table,
+-- one set-based statement per table, returning how many were resolved.
+-- References in is_sequence_number_of carry their sequence number along.
+--
+
+CREATE OR REPLACE FUNCTION resolve_pending_references() RETURNS bigint
+    LANGUAGE plpgsql
+    AS $$
+    DECLARE
+      pending_table regclass;
+      resolved_count bigint;
+      total bigint := 0;
+    BEGIN
+      FOR pending_table IN SELECT DISTINCT relation_table FROM pending_references LOOP
+        EXECUTE format('
+          WITH targets AS (
+            SELECT pending.id,
+                   COALESCE(pending.object, pending.datastream) AS subject,
+                   CASE WHEN pending.dsid IS NULL THEN objects.id ELSE datastreams.id END AS target,
+                   pending.sequence_number
+            FROM pending_references AS pending
+                JOIN pid_namespaces ON pid_namespaces.namespace = pending.namespace
+                JOIN objects ON objects.namespace = pid_namespaces.id AND objects.pid_id = pending.pid_id
+                LEFT JOIN datastreams ON datastreams.object = objects.id AND datastreams.dsid = pending.dsid
+            WHERE pending.relation_table = %1$L::regclass AND
+                (pending.dsid IS NULL OR datastreams.id IS NOT NULL)
+            FOR UPDATE OF pending
+          ), resolved AS (
+            DELETE FROM pending_references
+            USING targets
+            WHERE pending_references.id = targets.id
+            RETURNING targets.subject, targets.target, targets.sequence_number
+          )
+          INSERT INTO %1$s (rdf_subject, rdf_object%2$s)
+          SELECT subject, target%2$s FROM resolved
+        ', pending_table, CASE
+          WHEN pending_table = 'is_sequence_number_of'::regclass THEN ', sequence_number'
+          ELSE ''
+        END);
+        GET DIAGNOSTICS resolved_count = ROW_COUNT;
+        total := total + resolved_count;
+      END LOOP;
+      RETURN total;
+    END;
+    $$;
@@ -0,0 +1,23 @@
+--
+-- Index the general relation tables by their objects, so URIs referencing
+-- objects (and their datastreams) can be found when purging.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: object_relationships_object_index; Type: INDEX; Schema: public; Owner: -
+--
+-- text_pattern_ops, to support the prefix ranges of datastream URIs.
+--
+
+CREATE INDEX IF NOT EXISTS object_relationships_object_index ON object_relationships USING btree (rdf_object text_pattern_ops);
+
+
+--
+-- Name: datastream_relationships_object_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS datastream_relationships_object_index ON datastream_relationships USING btree (rdf_object text_pattern_ops);
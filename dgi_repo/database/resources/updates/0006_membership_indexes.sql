@@ -0,0 +1,30 @@
+--
+-- Index the membership relations by both their objects and subjects, so
+-- members may be walked (recursively) from the index alone.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: is_member_of_collection_members_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS is_member_of_collection_members_index ON is_member_of_collection USING btree (rdf_object, rdf_subject);
+
+
+--
+-- Name: is_member_of_members_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS is_member_of_members_index ON is_member_of USING btree (rdf_object, rdf_subject);
+
+
+--
+-- Name: has_model_models_index; Type: INDEX; Schema: public; Owner: -
+--
+-- To list the models of members.
+--
+
+CREATE INDEX IF NOT EXISTS has_model_models_index ON has_model USING btree (rdf_subject, rdf_object);
@@ -0,0 +1,28 @@
+--
+-- Index the page relations by the paged object, so the pages of an object
+-- may be listed in sequence from the indexes alone.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: is_page_of_pages_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS is_page_of_pages_index ON is_page_of USING btree (rdf_object, rdf_subject);
+
+
+--
+-- Name: is_sequence_number_of_pages_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS is_sequence_number_of_pages_index ON is_sequence_number_of USING btree (rdf_object, rdf_subject, sequence_number);
+
+
+--
+-- Name: is_sequence_number_sequence_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS is_sequence_number_sequence_index ON is_sequence_number USING btree (rdf_subject, rdf_object);
@@ -0,0 +1,69 @@
+--
+-- Convert between objects and datastreams and their Fedora URIs, for queries
+-- over the relation tables which must compare or report terms as URIs.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: fedora_object_uri(bigint); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION fedora_object_uri(object_id bigint) RETURNS text
+    LANGUAGE sql STABLE
+    AS $$
+      SELECT 'info:fedora/' || pid_namespaces.namespace || ':' || objects.pid_id
+      FROM objects
+          JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+      WHERE objects.id = object_id
+    $$;
+
+
+--
+-- Name: fedora_datastream_uri(bigint); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION fedora_datastream_uri(datastream_id bigint) RETURNS text
+    LANGUAGE sql STABLE
+    AS $$
+      SELECT fedora_object_uri(datastreams.object) || '/' || datastreams.dsid
+      FROM datastreams
+      WHERE datastreams.id = datastream_id
+    $$;
+
+
+--
+-- Name: fedora_object_id(text); Type: FUNCTION; Schema: public; Owner: -
+--
+-- NULL where the URI is not that of an existing object.
+--
+
+CREATE OR REPLACE FUNCTION fedora_object_id(uri text) RETURNS bigint
+    LANGUAGE sql STABLE
+    AS $$
+      SELECT objects.id
+      FROM objects
+          JOIN pid_namespaces ON objects.namespace = pid_namespaces.id
+      WHERE uri LIKE 'info:fedora/%:%' AND
+          strpos(substr(uri, 13), '/') = 0 AND
+          pid_namespaces.namespace = split_part(substr(uri, 13), ':', 1) AND
+          objects.pid_id = substr(uri, 14 + length(split_part(substr(uri, 13), ':', 1)))
+    $$;
+
+
+--
+-- Name: fedora_datastream_id(text); Type: FUNCTION; Schema: public; Owner: -
+--
+-- NULL where the URI is not that of an existing datastream.
+--
+
+CREATE OR REPLACE FUNCTION fedora_datastream_id(uri text) RETURNS bigint
+    LANGUAGE sql STABLE
+    AS $$
+      SELECT datastreams.id
+      FROM datastreams
+      WHERE datastreams.object = fedora_object_id(split_part(uri, '/', 1) || '/' || split_part(uri, '/', 2)) AND
+          datastreams.dsid = substr(uri, length(split_part(uri, '/', 1) || '/' || split_part(uri, '/', 2)) + 2)
+    $$;
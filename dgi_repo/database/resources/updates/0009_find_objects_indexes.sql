@@ -0,0 +1,134 @@
+--
+-- Index the searchable properties and DC fields of objects, for findObjects.
+-- Values are indexed in lower case with pattern operators, so that both
+-- exact and (prefix) wildcard matches may use them.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: object_label_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS object_label_search_index ON objects USING btree (lower((label)::text) text_pattern_ops);
+
+
+--
+-- Name: object_created_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS object_created_index ON objects USING btree (created);
+
+
+--
+-- Name: object_modified_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS object_modified_index ON objects USING btree (modified);
+
+
+--
+-- Name: dc_contributor_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_contributor_search_index ON dc_contributor USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_coverage_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_coverage_search_index ON dc_coverage USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_creator_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_creator_search_index ON dc_creator USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_date_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_date_search_index ON dc_date USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_description_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_description_search_index ON dc_description USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_format_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_format_search_index ON dc_format USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_identifier_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_identifier_search_index ON dc_identifier USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_language_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_language_search_index ON dc_language USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_publisher_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_publisher_search_index ON dc_publisher USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_relation_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_relation_search_index ON dc_relation USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_rights_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_rights_search_index ON dc_rights USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_source_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_source_search_index ON dc_source USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_subject_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_subject_search_index ON dc_subject USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_title_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_title_search_index ON dc_title USING btree (lower((rdf_object)::text) text_pattern_ops);
+
+
+--
+-- Name: dc_type_search_index; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX IF NOT EXISTS dc_type_search_index ON dc_type USING btree (lower((rdf_object)::text) text_pattern_ops);
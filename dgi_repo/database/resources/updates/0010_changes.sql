@@ -0,0 +1,110 @@
+--
+-- Log changes to objects and datastreams, including purges, as they are
+-- committed, for incremental indexing.
+--
+-- Triggers are per statement, over transition tables, so bulk writes log
+-- their changes in one insert. Requires PostgreSQL 10.
+--
+-- Safe to re-apply.
+--
+
+SET search_path = public, pg_catalog;
+
+--
+-- Name: changes; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE IF NOT EXISTS changes (
+    id bigserial PRIMARY KEY,
+    transaction bigint DEFAULT txid_current() NOT NULL,
+    pid character varying(1024) NOT NULL,
+    dsid character varying(255),
+    purged boolean DEFAULT false NOT NULL,
+    changed timestamp with time zone DEFAULT now() NOT NULL
+);
+
+COMMENT ON TABLE changes IS 'Append-only log of changes to objects and datastreams.';
+COMMENT ON COLUMN changes.transaction IS 'The ID of the transaction which made the change; changes are read in order of it, once no earlier transaction may still commit.';
+COMMENT ON COLUMN changes.pid IS 'The PID of the object changed, kept as it may since have been purged.';
+COMMENT ON COLUMN changes.dsid IS 'The datastream changed, if any; NULL for changes to the object itself.';
+
+CREATE INDEX IF NOT EXISTS changes_order_index ON changes USING btree (transaction, id);
+
+
+--
+-- Name: log_object_changes(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE OR REPLACE FUNCTION log_object_changes() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        INSERT INTO changes (pid, purged)
+        SELECT pid_namespaces.namespace || ':' || old_rows.pid_id, TRUE
+        FROM old_rows
+            JOIN pid_namespaces ON old_rows.namespace = pid_namespaces.id;
+      ELSE
+        INSERT INTO changes (pid)
+        SELECT pid_namespaces.namespace || ':' || new_rows.pid_id
+        FROM new_rows
+            JOIN pid_namespaces ON new_rows.namespace = pid_namespaces.id;
+      END IF;
+      IF FOUND THEN
+        PERFORM pg_notify('changes', '');
+      END IF;
+      RETURN NULL;
+    END;
+    $$;
+
+
+--
+-- Name: log_datastream_changes(); Type: FUNCTION; Schema: public; Owner: -
+--
+-- Datastreams purged with their objects are not logged; the object is.
+--
+
+CREATE OR REPLACE FUNCTION log_datastream_changes() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        INSERT INTO changes (pid, dsid, purged)
+        SELECT pid_namespaces.namespace || ':' || objects.pid_id, old_rows.dsid, TRUE
+        FROM old_rows
+            JOIN objects ON old_rows.object = objects.id
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id;
+      ELSE
+        INSERT INTO changes (pid, dsid)
+        SELECT pid_namespaces.namespace || ':' || objects.pid_id, new_rows.dsid
+        FROM new_rows
+            JOIN objects ON new_rows.object = objects.id
+            JOIN pid_namespaces ON objects.namespace = pid_namespaces.id;
+      END IF;
+      IF FOUND THEN
+        PERFORM pg_notify('changes', '');
+      END IF;
+      RETURN NULL;
+    END;
+    $$;
+
+
+--
+-- Name: log_*_changes; Type: TRIGGER; Schema: public; Owner: -
+--
+-- Transition tables may only be had for one event per trigger.
+--
+
+DROP TRIGGER IF EXISTS log_object_inserts ON objects;
+CREATE TRIGGER log_object_inserts AFTER INSERT ON objects REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_object_changes();
+DROP TRIGGER IF EXISTS log_object_updates ON objects;
+CREATE TRIGGER log_object_updates AFTER UPDATE ON objects REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_object_changes();
+DROP TRIGGER IF EXISTS log_object_deletes ON objects;
+CREATE TRIGGER log_object_deletes AFTER DELETE ON objects REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_object_changes();
+
+DROP TRIGGER IF EXISTS log_datastream_inserts ON datastreams;
+CREATE TRIGGER log_datastream_inserts AFTER INSERT ON datastreams REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_datastream_changes();
+DROP TRIGGER IF EXISTS log_datastream_updates ON datastreams;
+CREATE TRIGGER log_datastream_updates AFTER UPDATE ON datastreams REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_datastream_changes();
+DROP TRIGGER IF EXISTS log_datastream_deletes ON datastreams;
+CREATE TRIGGER log_datastream_deletes AFTER DELETE ON datastreams REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE log_datastream_changes();
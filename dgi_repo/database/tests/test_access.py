@@ -0,0 +1,68 @@
+"""
+Tests access index queries.
+"""
+
+import unittest
+from unittest.mock import MagicMock
+
+from dgi_repo.database.read import access
+
+
+class FilterAccessTestCase(unittest.TestCase):
+    """
+    Tests querying which objects and datastreams may be viewed or managed.
+    """
+
+    def _query(self, function, *args, **kwargs):
+        """
+        Call the function with a mock cursor; get the query and parameters.
+        """
+        cursor = MagicMock()
+        self.assertIs(function(*args, cursor=cursor, **kwargs), cursor)
+        return cursor.execute.call_args[0]
+
+    def test_tables(self):
+        """
+        Test each function filters its own index by its own access.
+        """
+        for function, table, column, access_type in (
+                (access.viewable_objects, 'object_access', 'object',
+                 'view'),
+                (access.manageable_objects, 'object_access', 'object',
+                 'manage'),
+                (access.viewable_datastreams, 'datastream_access',
+                 'datastream', 'view'),
+                (access.manageable_datastreams, 'datastream_access',
+                 'datastream', 'manage')):
+            with self.subTest(function=function.__name__):
+                query, _ = self._query(function, [1])
+                self.assertIn('FROM {}'.format(table), query)
+                self.assertIn('SELECT {} AS id'.format(column), query)
+                self.assertIn('ANY({}_users)'.format(access_type), query)
+                self.assertIn('{}_roles &&'.format(access_type), query)
+
+    def test_params(self):
+        """
+        Test the IDs, user and roles are passed as the query expects.
+        """
+        _, params = self._query(access.viewable_objects, (1, 2), user_id=5,
+                                roles={3})
+        self.assertEqual(params, {'ids': [1, 2], 'user': 5, 'roles': [3]})
+
+        _, params = self._query(access.viewable_objects, [1])
+        self.assertEqual(params, {'ids': [1], 'user': None, 'roles': []})
+
+    def test_unrestricted(self):
+        """
+        Test entries without rules are viewable, but not manageable.
+        """
+        for function in (access.viewable_objects,
+                         access.viewable_datastreams):
+            with self.subTest(function=function.__name__):
+                query, _ = self._query(function, [1])
+                self.assertIn('unrestricted OR', query)
+        for function in (access.manageable_objects,
+                         access.manageable_datastreams):
+            with self.subTest(function=function.__name__):
+                query, _ = self._query(function, [1])
+                self.assertNotIn('unrestricted', query)
@@ -0,0 +1,126 @@
+"""
+Tests cached database reads.
+"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+from dgi_repo.database import cache
+
+
+def _row_cursor(row_id):
+    """
+    Get a mock cursor which found the row with the given ID.
+    """
+    cursor = MagicMock()
+    cursor.rowcount = 1
+    cursor.fetchone.return_value = {'id': row_id}
+    return cursor
+
+
+class RollbackTestCase(unittest.TestCase):
+    """
+    Tests rolling back with the caches.
+    """
+
+    def setUp(self):
+        self.cursor = MagicMock()
+
+    @patch('dgi_repo.database.cache.clear_cache')
+    def test_savepoint(self, clear_cache):
+        """
+        Test rolling back to a savepoint clears the caches.
+        """
+        cache.rollback(self.cursor, 'ingest')
+        clear_cache.assert_called_once_with()
+        self.cursor.execute.assert_called_once_with(
+            'ROLLBACK TO SAVEPOINT ingest'
+        )
+        self.cursor.connection.rollback.assert_not_called()
+
+    @patch('dgi_repo.database.cache.clear_cache')
+    def test_transaction(self, clear_cache):
+        """
+        Test rolling back without a savepoint rolls back the connection.
+        """
+        cache.rollback(self.cursor)
+        clear_cache.assert_called_once_with()
+        self.cursor.connection.rollback.assert_called_once_with()
+        self.cursor.execute.assert_not_called()
+
+    def test_cleared(self):
+        """
+        Test IDs cached before a rollback are looked up again after it.
+        """
+        cache.clear_cache()
+        with patch('dgi_repo.database.write.datastreams.upsert_mime',
+                   return_value=_row_cursor(3)) as upsert_mime:
+            cache.mime_id('text/plain', cursor=self.cursor)
+            cache.rollback(self.cursor)
+            cache.mime_id('text/plain', cursor=self.cursor)
+        self.assertEqual(upsert_mime.call_count, 2)
+
+
+class CachedIdTestCase(unittest.TestCase):
+    """
+    Tests IDs are only looked up once.
+    """
+
+    def setUp(self):
+        cache.clear_cache()
+        self.addCleanup(cache.clear_cache)
+        self.cursor = MagicMock()
+
+    def _assert_cached(self, function, args, target):
+        """
+        Look up an ID twice, asserting the target is called only once.
+        """
+        with patch(target, return_value=_row_cursor(7)) as lookup:
+            for _ in range(2):
+                self.assertEqual(function(*args, cursor=self.cursor), 7)
+        lookup.assert_called_once()
+
+    def test_source_id(self):
+        """
+        Test source IDs are cached.
+        """
+        self._assert_cached(cache.source_id, ('system',),
+                            'dgi_repo.database.read.sources.source_id')
+
+    def test_user_id(self):
+        """
+        Test user IDs are cached.
+        """
+        self._assert_cached(cache.user_id, ('admin', 1),
+                            'dgi_repo.database.write.sources.upsert_user')
+
+    def test_role_id(self):
+        """
+        Test role IDs are cached.
+        """
+        self._assert_cached(cache.role_id, ('editor', 1),
+                            'dgi_repo.database.write.sources.upsert_role')
+
+    def test_mime_id(self):
+        """
+        Test MIME type IDs are cached.
+        """
+        self._assert_cached(cache.mime_id, ('text/plain',),
+                            'dgi_repo.database.write.datastreams.upsert_mime')
+
+    def test_log_id(self):
+        """
+        Test log IDs are cached.
+        """
+        self._assert_cached(cache.log_id, ('Ingested.',),
+                            'dgi_repo.database.write.log.upsert_log')
+
+    def test_keys(self):
+        """
+        Test users of the same name from different sources are kept apart.
+        """
+        with patch('dgi_repo.database.write.sources.upsert_user',
+                   return_value=_row_cursor(7)) as upsert_user:
+            cache.user_id('admin', 1, cursor=self.cursor)
+            cache.user_id('admin', 2, cursor=self.cursor)
+        self.assertEqual(upsert_user.call_count, 2)
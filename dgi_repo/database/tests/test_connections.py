@@ -0,0 +1,80 @@
+"""
+Tests database connections.
+"""
+
+import unittest
+
+from psycopg2.extensions import connection as _connection
+
+from dgi_repo.database.utilities import HookedConnection
+
+
+class _RecordingConnection(_connection):
+    """
+    Stands in for the database under a HookedConnection, recording calls.
+    """
+    autocommit = False
+
+    def __init__(self, *args, **kwargs):
+        # No database; nothing to connect to.
+        self.calls = []
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def rollback(self):
+        self.calls.append('rollback')
+
+
+class _TestConnection(HookedConnection, _RecordingConnection):
+    """
+    A HookedConnection over a recording connection.
+    """
+
+
+class HookedConnectionTestCase(unittest.TestCase):
+    """
+    Tests running callbacks before committing.
+    """
+
+    def setUp(self):
+        self.connection = _TestConnection()
+
+    def _hook(self, name):
+        """
+        Get a hook recording its name with the connection's calls.
+        """
+        return lambda: self.connection.calls.append(name)
+
+    def test_commit(self):
+        """
+        Test hooks run in order before the commit, and only the once.
+        """
+        self.connection.add_pre_commit_hook(self._hook('first'))
+        self.connection.add_pre_commit_hook(self._hook('second'))
+        self.connection.commit()
+        self.connection.commit()
+        self.assertEqual(self.connection.calls,
+                         ['first', 'second', 'commit', 'commit'])
+
+    def test_rollback(self):
+        """
+        Test rolling back discards hooks.
+        """
+        self.connection.add_pre_commit_hook(self._hook('hook'))
+        self.connection.rollback()
+        self.connection.commit()
+        self.assertEqual(self.connection.calls, ['rollback', 'commit'])
+
+    def test_failed_hook(self):
+        """
+        Test a hook which raises prevents the commit.
+        """
+        def fail():
+            raise OSError('Failed to flush stashed file.')
+
+        self.connection.add_pre_commit_hook(fail)
+        self.connection.add_pre_commit_hook(self._hook('hook'))
+        with self.assertRaises(OSError):
+            self.connection.commit()
+        self.assertEqual(self.connection.calls, [])
@@ -0,0 +1,471 @@
+"""
+Tests stashing and adopting files in the filestore.
+"""
+
+import errno
+import os
+import unittest
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest.mock import patch, MagicMock
+
+from dgi_repo.database import filestore
+from dgi_repo.database.utilities import HookedConnection
+
+
+@patch('dgi_repo.database.write.datastreams.upsert_unreferenced_resource')
+@patch('dgi_repo.database.write.datastreams.upsert_resource')
+@patch('dgi_repo.database.cache.mime_id', return_value=3)
+@patch('dgi_repo.database.filestore.get_connection')
+@patch('dgi_repo.database.filestore.reserve')
+class StashWriterTestCase(unittest.TestCase):
+    """
+    Tests writing files into the filestore a piece at a time.
+    """
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file = NamedTemporaryFile(dir=directory.name, delete=False)
+        self.addCleanup(self.file.close)
+
+    def _writer(self, reserve, get_connection, upsert_resource, **kwargs):
+        """
+        Open a StashWriter onto the test's file, as resource 7.
+        """
+        reserve.return_value = (self.file, 'datastream://test')
+        cursor = get_connection.return_value.cursor.return_value
+        cursor.fetchone.return_value = (7,)
+        return filestore.StashWriter(filestore.DATASTREAM_SCHEME,
+                                     'text/plain', **kwargs)
+
+    def test_discard(self, reserve, get_connection, mime_id,
+                     upsert_resource, upsert_unreferenced_resource):
+        """
+        Test discarding a stash removes its file.
+        """
+        writer = self._writer(reserve, get_connection, upsert_resource)
+        writer.write(b'content')
+        writer.discard()
+        self.assertTrue(self.file.closed)
+        self.assertFalse(os.path.exists(self.file.name))
+
+    def test_tracked(self, reserve, get_connection, mime_id, upsert_resource,
+                     upsert_unreferenced_resource):
+        """
+        Test a stash is tracked as a resource, but not as collectable.
+        """
+        writer = self._writer(reserve, get_connection, upsert_resource)
+        self.assertEqual(writer.resource_id, 7)
+        self.assertEqual(upsert_resource.call_args[0][0],
+                         {'uri': 'datastream://test', 'mime': 3})
+        upsert_unreferenced_resource.assert_not_called()
+        writer.discard()
+
+    def test_collectable(self, reserve, get_connection, mime_id,
+                         upsert_resource, upsert_unreferenced_resource):
+        """
+        Test collectable stashes are tracked as having no references.
+        """
+        writer = self._writer(reserve, get_connection, upsert_resource,
+                              collectable=True)
+        upsert_unreferenced_resource.assert_called_once_with(
+            7,
+            cursor=get_connection.return_value.cursor.return_value
+        )
+        writer.discard()
+
+    def test_failed_tracking(self, reserve, get_connection, mime_id,
+                             upsert_resource, upsert_unreferenced_resource):
+        """
+        Test the file is removed should tracking it fail.
+        """
+        upsert_unreferenced_resource.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self._writer(reserve, get_connection, upsert_resource,
+                         collectable=True)
+        self.assertFalse(os.path.exists(self.file.name))
+
+
+class AdoptTestCase(unittest.TestCase):
+    """
+    Tests adopting uploaded files as datastream content.
+    """
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        datastreams = os.path.join(directory.name, 'datastreams')
+        os.mkdir(datastreams)
+        self.upload = os.path.join(directory.name, 'upload')
+        # More than copyfileobj() takes in one pass.
+        self.content = os.urandom(3 * 1024 * 1024 + 5)
+        with open(self.upload, 'wb') as upload:
+            upload.write(self.content)
+
+        connection = patch('dgi_repo.database.filestore.get_connection')
+        for patcher in (
+                patch.dict(filestore._URI_MAP, {
+                    filestore.DATASTREAM_SCHEME: {'dir': datastreams},
+                }),
+                patch.dict(filestore._config,
+                           {'filestore_durability': 'none'}),
+                patch('dgi_repo.database.cache.mime_id', return_value=3),
+                patch('dgi_repo.database.write.datastreams.upsert_resource'),
+                connection):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cursor = filestore.get_connection.return_value.cursor.return_value
+        cursor.fetchone.return_value = (7,)
+
+    def _adopt(self):
+        """
+        Adopt the upload; get the path it was adopted to.
+        """
+        resource_id, uri = filestore.adopt(self.upload, cursor=MagicMock())
+        self.assertEqual(resource_id, 7)
+        path = filestore.resolve_uri(uri)
+        with open(path, 'rb') as adopted:
+            self.assertEqual(adopted.read(), self.content)
+        # The upload is left in place, for garbage collection to remove.
+        with open(self.upload, 'rb') as upload:
+            self.assertEqual(upload.read(), self.content)
+        return path
+
+    def test_link(self):
+        """
+        Test uploads on the same filesystem are linked.
+        """
+        path = self._adopt()
+        self.assertTrue(os.path.samefile(path, self.upload))
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device link'))
+    def test_clone(self, link):
+        """
+        Test uploads which can't be linked are cloned.
+        """
+        def clone(dest_fd, request, src_fd):
+            with open(src_fd, 'rb', closefd=False) as src, \
+                    open(dest_fd, 'wb', closefd=False) as dest:
+                copyfileobj(src, dest)
+
+        with patch('fcntl.ioctl', side_effect=clone) as ioctl, \
+                patch('os.copy_file_range') as copy_file_range:
+            path = self._adopt()
+        self.assertEqual(ioctl.call_args[0][1], filestore._FICLONE)
+        copy_file_range.assert_not_called()
+        self.assertFalse(os.path.samefile(path, self.upload))
+
+    @patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'No clone'))
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device link'))
+    def test_copy_file_range(self, link, ioctl):
+        """
+        Test uploads which can't be cloned are copied in-kernel.
+        """
+        with patch('os.copy_file_range',
+                   side_effect=os.copy_file_range) as copy_file_range, \
+                patch('dgi_repo.database.filestore.copyfileobj') as copy:
+            path = self._adopt()
+        copy_file_range.assert_called()
+        copy.assert_not_called()
+        self.assertFalse(os.path.samefile(path, self.upload))
+
+    @patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'No clone'))
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device link'))
+    def test_copy(self, link, ioctl):
+        """
+        Test a failed in-kernel copy starts over with a plain copy.
+        """
+        copy_file_range = os.copy_file_range
+
+        def partial_copy(src_fd, dest_fd, count):
+            if os.lseek(dest_fd, 0, os.SEEK_CUR):
+                raise OSError(errno.EXDEV, 'Cross-device link')
+            return copy_file_range(src_fd, dest_fd, 1024)
+
+        with patch('os.copy_file_range', side_effect=partial_copy):
+            self._adopt()
+
+    @patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'No clone'))
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'Cross-device link'))
+    def test_short_copy(self, link, ioctl):
+        """
+        Test a plain copy picks up where an in-kernel copy stopped short.
+        """
+        copy_file_range = os.copy_file_range
+        copied = []
+
+        def short_copy(src_fd, dest_fd, count):
+            copied.append(copy_file_range(src_fd, dest_fd, 1024) if not copied
+                          else 0)
+            return copied[-1]
+
+        with patch('os.copy_file_range', side_effect=short_copy):
+            self._adopt()
+        self.assertEqual(copied, [1024, 0])
+
+
+@patch('dgi_repo.database.filestore.checksum_file')
+@patch('dgi_repo.database.filestore._create_datastream_from_filestore')
+@patch('dgi_repo.database.write.datastreams.upsert_checksum')
+@patch('dgi_repo.database.read.datastreams.checksums')
+@patch('dgi_repo.database.read.datastreams.resource_from_uri')
+@patch('dgi_repo.database.filestore.adopt', return_value=(9, 'datastream://a'))
+class CreateDatastreamFromUploadTestCase(unittest.TestCase):
+    """
+    Tests creating datastreams from uploads.
+    """
+
+    def setUp(self):
+        self.stored = {4: [{'type': 'MD5', 'checksum': 'abc'}], 9: []}
+
+    def _checksums(self, resource, cursor=None):
+        """
+        Get a mock cursor on the checksums stored for a resource.
+        """
+        checksums = MagicMock()
+        checksums.fetchall.return_value = list(self.stored[resource])
+        return checksums
+
+    def _upsert_checksum(self, checksum, cursor=None):
+        """
+        Store a checksum for its resource.
+        """
+        self.stored[checksum['resource']].append(checksum)
+
+    def test_reuse(self, adopt, resource_from_uri, checksums, upsert_checksum,
+                   create_datastream, checksum_file):
+        """
+        Test the upload's known checksums are reused, not recomputed.
+        """
+        resource_from_uri.return_value.fetchone.return_value = {'id': 4}
+        checksums.side_effect = self._checksums
+        upsert_checksum.side_effect = self._upsert_checksum
+        datastream = {}
+
+        filestore.create_datastream_from_upload(
+            datastream,
+            'uploaded://a',
+            checksums=[{'type': 'MD5', 'checksum': 'abc'}],
+            cursor=MagicMock()
+        )
+        self.assertEqual(datastream['resource'], 9)
+        self.assertEqual(self.stored[9], [{
+            'type': 'MD5',
+            'checksum': 'abc',
+            'resource': 9,
+        }])
+        checksum_file.assert_not_called()
+        create_datastream.assert_called_once()
+
+    def test_untracked(self, adopt, resource_from_uri, checksums,
+                       upsert_checksum, create_datastream, checksum_file):
+        """
+        Test checksums are computed for uploads without a resource.
+        """
+        resource_from_uri.return_value.fetchone.return_value = None
+        checksums.side_effect = self._checksums
+        checksum_file.return_value = 'abc'
+        cursor = MagicMock()
+        cursor.fetchone.return_value = {'uri': 'datastream://a'}
+        with patch('dgi_repo.database.read.datastreams.resource',
+                   return_value=cursor):
+            filestore.create_datastream_from_upload(
+                {},
+                'uploaded://a',
+                checksums=[{'type': 'MD5', 'checksum': 'abc'}],
+                cursor=cursor
+            )
+        checksum_file.assert_called_once()
+        upsert_checksum.assert_called_once()
+
+
+class _FsyncRecorder(object):
+    """
+    Stand-in for os.fsync, recording the inodes synced and failing some.
+    """
+
+    def __init__(self, *failing):
+        self.failing = {os.stat(path).st_ino for path in failing}
+        self.synced = []
+
+    def __call__(self, fd):
+        inode = os.fstat(fd).st_ino
+        if inode in self.failing:
+            raise OSError(errno.EIO, 'Input/output error')
+        self.synced.append(inode)
+
+
+class FlusherTestCase(unittest.TestCase):
+    """
+    Tests flushing stashed files in groups, in the background.
+    """
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.paths = []
+        for name in 'abcd':
+            path = os.path.join(self.directory, name)
+            open(path, 'w').close()
+            self.paths.append(path)
+        self.flusher = filestore._Flusher()
+
+    def test_flush(self):
+        """
+        Test files and their directory are synced before tickets are done.
+        """
+        fsync = _FsyncRecorder()
+        with patch('os.fsync', side_effect=fsync):
+            self.flusher.wait(self.flusher.queue(self.paths[0]))
+        self.assertEqual(sorted(fsync.synced), sorted([
+            os.stat(self.directory).st_ino,
+            os.stat(self.paths[0]).st_ino,
+        ]))
+
+    def test_failed_group(self):
+        """
+        Test only the tickets in a group which failed to flush raise.
+        """
+        a, b, c, d = self.paths
+        with patch('os.fsync', side_effect=_FsyncRecorder(c)):
+            first = self.flusher.queue(a)
+            self.flusher.wait(first)
+            with self.assertLogs('dgi_repo.database.filestore', 'ERROR'):
+                # Holding the lock, both are taken up in the one group.
+                with self.flusher._condition:
+                    failed = [self.flusher.queue(b), self.flusher.queue(c)]
+                for ticket in failed:
+                    with self.subTest(ticket=ticket), \
+                            self.assertRaises(OSError):
+                        self.flusher.wait(ticket)
+            last = self.flusher.queue(d)
+            self.flusher.wait(last)
+            self.flusher.wait(first)
+        self.assertEqual((first, failed, last), (1, [2, 3], 4))
+
+    def test_fork(self):
+        """
+        Test a forked child starts over with its own thread.
+        """
+        with patch('os.fsync'):
+            self.flusher.wait(self.flusher.queue(self.paths[0]))
+            thread = self.flusher._thread
+            with patch('os.getpid', return_value=os.getpid() + 1):
+                ticket = self.flusher.queue(self.paths[1])
+                self.flusher.wait(ticket)
+        self.assertEqual(ticket, 1)
+        self.assertIsNot(self.flusher._thread, thread)
+
+
+@patch('dgi_repo.database.filestore._flusher')
+class FlushBeforeCommitTestCase(unittest.TestCase):
+    """
+    Tests holding up commits until their files are flushed.
+    """
+
+    def _connection(self, autocommit):
+        """
+        Get a mock cursor on a hooked connection.
+        """
+        cursor = MagicMock()
+        cursor.connection = MagicMock(spec=HookedConnection)
+        cursor.connection.autocommit = autocommit
+        return cursor
+
+    def test_transaction(self, flusher):
+        """
+        Test the wait is left to the transaction's commit.
+        """
+        flusher.queue.return_value = 5
+        cursor = self._connection(False)
+        filestore._flush_before_commit('path', cursor)
+        flusher.wait.assert_not_called()
+
+        hook = cursor.connection.add_pre_commit_hook.call_args[0][0]
+        hook()
+        flusher.wait.assert_called_once_with(5)
+
+    def test_synchronous(self, flusher):
+        """
+        Test autocommit connections, or no cursor at all, wait here.
+        """
+        flusher.queue.return_value = 5
+        for cursor in (None, MagicMock(), self._connection(True)):
+            with self.subTest(cursor=cursor):
+                flusher.wait.reset_mock()
+                filestore._flush_before_commit('path', cursor)
+                flusher.wait.assert_called_once_with(5)
+        flusher.queue.assert_called_with('path')
+
+
+class DurabilityTestCase(unittest.TestCase):
+    """
+    Tests making stashed files durable, as configured.
+    """
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        connection = patch('dgi_repo.database.filestore.get_connection')
+        for patcher in (
+                patch.dict(filestore._URI_MAP, {
+                    filestore.DATASTREAM_SCHEME: {'dir': self.directory},
+                }),
+                patch('dgi_repo.database.cache.mime_id', return_value=3),
+                patch('dgi_repo.database.write.datastreams.upsert_resource'),
+                connection):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cursor = filestore.get_connection.return_value.cursor.return_value
+        cursor.fetchone.return_value = (7,)
+
+    def _stash(self, durability, cursor=None):
+        """
+        Stash some content with the durability; get its path.
+        """
+        with patch.dict(filestore._config,
+                        {'filestore_durability': durability}):
+            _, uri = filestore.stash(b'content', filestore.DATASTREAM_SCHEME,
+                                     cursor=cursor)
+        return filestore.resolve_uri(uri)
+
+    def test_fsync(self):
+        """
+        Test the file and its directory are synced before returning.
+        """
+        fsync = _FsyncRecorder()
+        with patch('os.fsync', side_effect=fsync), \
+                patch('dgi_repo.database.filestore._flush_before_commit'
+                      ) as flush_before_commit:
+            path = self._stash('fsync')
+        self.assertEqual(fsync.synced, [os.stat(path).st_ino,
+                                        os.stat(self.directory).st_ino])
+        flush_before_commit.assert_not_called()
+
+    def test_group(self):
+        """
+        Test the file is left to the flusher, for the cursor's commit.
+        """
+        cursor = MagicMock()
+        with patch('os.fsync') as fsync, \
+                patch('dgi_repo.database.filestore._flush_before_commit'
+                      ) as flush_before_commit:
+            path = self._stash('group', cursor)
+        fsync.assert_not_called()
+        flush_before_commit.assert_called_once_with(path, cursor)
+
+    def test_none(self):
+        """
+        Test nothing is synced without durability.
+        """
+        with patch('os.fsync') as fsync, \
+                patch('dgi_repo.database.filestore._flush_before_commit'
+                      ) as flush_before_commit:
+            self._stash('none')
+        fsync.assert_not_called()
+        flush_before_commit.assert_not_called()
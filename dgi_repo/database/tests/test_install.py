@@ -0,0 +1,59 @@
+"""
+Tests schema installation and updates.
+"""
+
+import unittest
+from hashlib import sha256
+from unittest.mock import patch, MagicMock
+
+from dgi_repo.database import install
+
+
+class BackfillLogHashesTestCase(unittest.TestCase):
+    """
+    Tests computing the digests of existing log entries.
+    """
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        named_cursor = self.cursor.connection.cursor.return_value
+        self.log_cursor = named_cursor.__enter__.return_value
+
+    @patch('dgi_repo.database.install.execute_values')
+    def test_pages(self, execute_values):
+        """
+        Test each page of entries is updated with the writers' digests.
+        """
+        cursor, log_cursor = self.cursor, self.log_cursor
+        log_cursor.fetchmany.side_effect = [
+            [(1, 'Ingested.'), (2, 'Purged.')],
+            [(3, 'Modifi\xe9.')],
+            [],
+        ]
+        install.backfill_log_hashes(cursor)
+
+        cursor.connection.cursor.assert_called_once_with(
+            name='log_hash_backfill'
+        )
+        self.assertIn('log_hash IS NULL', log_cursor.execute.call_args[0][0])
+        log_cursor.fetchmany.assert_called_with(log_cursor.itersize)
+        self.assertEqual(
+            [call[0][2] for call in execute_values.call_args_list],
+            [
+                [(1, sha256(b'Ingested.').digest()),
+                 (2, sha256(b'Purged.').digest())],
+                [(3, sha256('Modifi\xe9.'.encode('utf-8')).digest())],
+            ]
+        )
+        for call in execute_values.call_args_list:
+            self.assertIs(call[0][0], cursor)
+            self.assertIn('UPDATE log', call[0][1])
+
+    @patch('dgi_repo.database.install.execute_values')
+    def test_nothing(self, execute_values):
+        """
+        Test nothing is updated when every entry has its digest.
+        """
+        self.log_cursor.fetchmany.return_value = []
+        install.backfill_log_hashes(self.cursor)
+        execute_values.assert_not_called()
@@ -0,0 +1,59 @@
+"""
+Tests log entry reads and writes.
+"""
+
+import unittest
+from unittest.mock import MagicMock
+
+from dgi_repo.database.read import log as log_reader
+from dgi_repo.database.utilities import log_hash
+from dgi_repo.database.write import log as log_writer
+
+
+class LogHashTestCase(unittest.TestCase):
+    """
+    Tests log entries are keyed on their digest.
+    """
+
+    def test_digest(self):
+        """
+        Test entries differing only in their text differ in their digest.
+        """
+        self.assertEqual(len(log_hash('Ingested.')), 32)
+        self.assertEqual(log_hash('Ingested.'), log_hash('Ingested.'))
+        self.assertNotEqual(log_hash('Ingested.'), log_hash('Ingested!'))
+
+    def test_upsert(self):
+        """
+        Test the writer inserts on, and the reader looks up by, one digest.
+        """
+        cursor = MagicMock()
+        cursor.rowcount = 0
+        log_writer.upsert_log('Ingested.', cursor=cursor)
+
+        (insert, insert_params), (select, select_params) = [
+            call[0] for call in cursor.execute.call_args_list
+        ]
+        self.assertIn('ON CONFLICT (log_hash)', insert)
+        self.assertEqual(insert_params, ('Ingested.', log_hash('Ingested.')))
+        self.assertIn('WHERE log_hash = %s', select)
+        self.assertEqual(select_params, (log_hash('Ingested.'),))
+
+    def test_inserted(self):
+        """
+        Test new entries are not looked up again.
+        """
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        self.assertIs(log_writer.upsert_log('Ingested.', cursor=cursor),
+                      cursor)
+        cursor.execute.assert_called_once()
+
+    def test_log_id(self):
+        """
+        Test the reader keys on the digest alone.
+        """
+        cursor = MagicMock()
+        log_reader.log_id('Purged.', cursor=cursor)
+        self.assertEqual(cursor.execute.call_args[0][1],
+                         (log_hash('Purged.'),))
@@ -0,0 +1,102 @@
+"""
+Tests object relation queries.
+"""
+
+import re
+import unittest
+from unittest.mock import MagicMock
+
+from dgi_repo.database.read import object_relations
+
+
+class ReferencedObjectsTestCase(unittest.TestCase):
+    """
+    Tests finding which objects are referenced by others.
+    """
+
+    def setUp(self):
+        self.cursor = MagicMock()
+        object_relations.referenced_objects({7, 8}, cursor=self.cursor)
+        self.query, self.params = self.cursor.execute.call_args[0]
+
+    def _checks(self, table):
+        """
+        Get each check of the table in the query.
+        """
+        pattern = r'FROM {}\s+WHERE (.*?)(?:UNION ALL|\n\s*\)\n)'.format(table)
+        return re.findall(pattern, self.query, re.DOTALL)
+
+    def test_params(self):
+        """
+        Test the candidates are passed as a list.
+        """
+        self.assertEqual(sorted(self.params[0]), [7, 8])
+
+    def test_linked_self_references(self):
+        """
+        Test relations from a candidate to itself are excluded.
+        """
+        for table in object_relations.REPO_OBJECT_RDF_OBJECT_TABLES:
+            with self.subTest(table=table):
+                checks = self._checks(table)
+                self.assertEqual(len(checks), 1)
+                self.assertIn('rdf_subject <> candidates.id', checks[0])
+
+    def test_general_self_references(self):
+        """
+        Test relations from a candidate, or its datastreams, are excluded.
+        """
+        exclusions = {
+            'object_relationships': 'rdf_subject <> candidates.id',
+            'datastream_relationships': ('SELECT id FROM datastreams WHERE '
+                                         'object = candidates.id'),
+        }
+        for table, exclusion in exclusions.items():
+            with self.subTest(table=table):
+                checks = self._checks(table)
+                # The object's URI, then those of its datastreams.
+                self.assertEqual(len(checks), 2)
+                for check in checks:
+                    self.assertIn(exclusion, check)
+
+
+class CollectionMembersTestCase(unittest.TestCase):
+    """
+    Tests paging through the members of a collection.
+    """
+
+    def _query(self, depth):
+        """
+        Get the query and parameters for a page of members at the depth.
+        """
+        cursor = MagicMock()
+        object_relations.collection_members(7, depth=depth, after=20,
+                                            limit=10, cursor=cursor)
+        return cursor.execute.call_args[0]
+
+    def test_direct(self):
+        """
+        Test direct members are paged within each membership table.
+        """
+        query, params = self._query(1)
+        self.assertNotIn('RECURSIVE', query)
+        for table in object_relations.MEMBERSHIP_TABLES:
+            with self.subTest(table=table):
+                arm = re.search(
+                    r'FROM {}\s+WHERE (.*?LIMIT %\(limit\)s)\)'.format(table),
+                    query,
+                    re.DOTALL
+                ).group(1)
+                self.assertIn('rdf_subject > %(after)s', arm)
+                self.assertIn('rdf_subject <> %(object)s', arm)
+                self.assertIn('LIMIT %(limit)s', arm)
+        self.assertEqual((params['object'], params['after'], params['limit']),
+                         (7, 20, 10))
+
+    def test_recursive(self):
+        """
+        Test deeper members are found by walking the membership tree.
+        """
+        query, params = self._query(3)
+        self.assertIn('WITH RECURSIVE members', query)
+        self.assertEqual(params['depth'], 3)
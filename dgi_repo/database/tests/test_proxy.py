@@ -0,0 +1,229 @@
+"""
+Tests the DB proxy's connection pooling and serialization of results.
+"""
+
+import gzip
+import unittest
+from collections import namedtuple
+from datetime import datetime
+from unittest.mock import patch, MagicMock, call
+
+import falcon
+import pytz
+import simplejson as json
+
+from dgi_repo.database import proxy
+
+Column = namedtuple('Column', ['name'])
+
+DESCRIPTION = [Column('id'), Column('label'), Column('modified')]
+BATCHES = [
+    [[1, 'One', datetime(2016, 1, 2, 3, 4, 5, tzinfo=pytz.utc)]],
+    [[2, 'Two, "quoted"', None], [3, None, None]],
+]
+
+
+class SerializersTestCase(unittest.TestCase):
+    """
+    Tests serializing batches of rows.
+    """
+
+    def test_json(self):
+        """
+        Test rows are given as one JSON list of lists.
+        """
+        self.assertEqual(
+            json.loads(''.join(proxy._json_chunks(DESCRIPTION,
+                                                  iter(BATCHES[1:])))),
+            [[2, 'Two, "quoted"', None], [3, None, None]]
+        )
+        self.assertEqual(''.join(proxy._json_chunks(DESCRIPTION, iter([]))),
+                         '[]')
+
+    def test_ndjson(self):
+        """
+        Test each row is given as a JSON list on its own line.
+        """
+        chunks = list(proxy._ndjson_chunks(DESCRIPTION, iter(BATCHES[1:])))
+        self.assertEqual(len(chunks), 1)
+        lines = chunks[0].split('\n')
+        self.assertEqual(lines.pop(), '')
+        self.assertEqual([json.loads(line) for line in lines],
+                         [[2, 'Two, "quoted"', None], [3, None, None]])
+        self.assertEqual(list(proxy._ndjson_chunks(DESCRIPTION, iter([]))),
+                         [])
+
+    def test_csv(self):
+        """
+        Test rows are given as CSV after a header, dates as Fedora's.
+        """
+        self.assertEqual(
+            ''.join(proxy._csv_chunks(DESCRIPTION, iter(BATCHES))),
+            'id,label,modified\r\n'
+            '1,One,2016-01-02T03:04:05.000000Z\r\n'
+            '2,"Two, ""quoted""",\r\n'
+            '3,,\r\n'
+        )
+
+    def test_csv_header_first(self):
+        """
+        Test the header is sent before any rows are read.
+        """
+        chunks = proxy._csv_chunks(DESCRIPTION, iter(BATCHES))
+        self.assertEqual(next(chunks), 'id,label,modified\r\n')
+
+    def test_gzip(self):
+        """
+        Test the compressed stream decompresses to what was given.
+        """
+        chunks = [b'[', b'[1,2]' * 1000, b']']
+        self.assertEqual(gzip.decompress(b''.join(proxy._gzip(iter(chunks)))),
+                         b''.join(chunks))
+
+
+class BatchesTestCase(unittest.TestCase):
+    """
+    Tests fetching batches of rows, up to the most allowed.
+    """
+
+    def setUp(self):
+        self.rows = list(range(25))
+        self.cursor = MagicMock()
+        self.cursor.fetchmany.side_effect = self._fetchmany
+
+    def _fetchmany(self, size):
+        """
+        Stand in for fetchmany() over the rows.
+        """
+        fetched, self.rows = self.rows[:size], self.rows[size:]
+        return fetched
+
+    def test_unlimited(self):
+        """
+        Test every row is fetched without a limit.
+        """
+        batches = list(proxy._batches(self.cursor, 10))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    def test_truncated(self):
+        """
+        Test no more than the most rows are fetched.
+        """
+        with self.assertLogs('dgi_repo.database.proxy') as logs:
+            batches = list(proxy._batches(self.cursor, 10, 15))
+        self.assertEqual(batches, [list(range(10)), list(range(10, 15))])
+        self.assertEqual(
+            [call[0][0] for call in self.cursor.fetchmany.call_args_list],
+            [10, 5]
+        )
+        self.assertIn('truncated at 15 rows', logs.output[0])
+
+
+def _connection(closed=0):
+    """
+    Get a mock connection, open unless told otherwise.
+    """
+    connection = MagicMock()
+    connection.closed = closed
+    return connection
+
+
+@patch('dgi_repo.database.proxy._get_pool')
+class ConnectionTestCase(unittest.TestCase):
+    """
+    Tests checking connections out of, and back into, the pool.
+    """
+
+    def test_closed(self, get_pool):
+        """
+        Test connections dropped while pooled are thrown out and replaced.
+        """
+        dropped, connection = _connection(closed=2), _connection()
+        pool = get_pool.return_value
+        pool.getconn.side_effect = [dropped, connection]
+        self.assertIs(proxy.ProxyResource()._get_connection(), connection)
+        pool.putconn.assert_called_once_with(dropped, close=True)
+        connection.set_session.assert_called_once_with(readonly=True)
+
+    def test_busy(self, get_pool):
+        """
+        Test an exhausted pool makes for a 503, asking to retry.
+        """
+        get_pool.return_value.getconn.side_effect = proxy.PoolError
+        with self.assertRaises(falcon.HTTPServiceUnavailable) as context:
+            proxy.ProxyResource()._get_connection()
+        self.assertEqual(context.exception.headers['Retry-After'], '1')
+
+    def test_release(self, get_pool):
+        """
+        Test sessions are rolled back, then discarded outside a transaction.
+        """
+        connection = _connection()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lambda query: self.assertTrue(
+            connection.autocommit
+        )
+        proxy._release_connection(connection)
+
+        self.assertEqual(connection.mock_calls[:2], [
+            call.rollback(),
+            call.cursor(),
+        ])
+        cursor.execute.assert_called_once_with('DISCARD ALL')
+        self.assertFalse(connection.autocommit)
+        get_pool.return_value.putconn.assert_called_once_with(connection,
+                                                              close=False)
+
+    def test_failed_release(self, get_pool):
+        """
+        Test connections which fail to reset are closed.
+        """
+        connection = _connection()
+        connection.rollback.side_effect = proxy.DatabaseError
+        with self.assertLogs('dgi_repo.database.proxy', 'WARNING'):
+            proxy._release_connection(connection)
+        get_pool.return_value.putconn.assert_called_once_with(connection,
+                                                              close=True)
+
+
+@patch('dgi_repo.database.proxy.ThreadedConnectionPool')
+class PoolTestCase(unittest.TestCase):
+    """
+    Tests creating the connection pool.
+    """
+
+    def setUp(self):
+        for patcher in (
+                patch.object(proxy, '_pool', None),
+                patch.dict(proxy._config['db_proxy'], {
+                    'pool': {'min': 1, 'max': 5},
+                    'username': 'proxy',
+                    'password': 'secret',
+                })):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        proxy._config['db_proxy'].pop('host', None)
+        proxy._config['db_proxy'].pop('port', None)
+
+    def test_once(self, pool):
+        """
+        Test the pool is created on first use, and only then.
+        """
+        self.assertIs(proxy._get_pool(), pool.return_value)
+        self.assertIs(proxy._get_pool(), pool.return_value)
+        pool.assert_called_once()
+        args, kwargs = pool.call_args
+        self.assertEqual(args, (1, 5))
+        self.assertEqual(kwargs['host'], proxy._config['database']['host'])
+        self.assertIsNone(kwargs['port'])
+        self.assertEqual((kwargs['user'], kwargs['password']),
+                         ('proxy', 'secret'))
+
+    def test_standby(self, pool):
+        """
+        Test the proxy's own host and port are used when configured.
+        """
+        proxy._config['db_proxy'].update(host='standby', port=5433)
+        proxy._get_pool()
+        self.assertEqual((pool.call_args[1]['host'],
+                          pool.call_args[1]['port']), ('standby', 5433))
@@ -12,7 +12,7 @@ from dgi_repo.database.utilities import (LITERAL_RDF_OBJECT, URI_RDF_OBJECT,
                                          USER_RDF_OBJECT, ROLE_RDF_OBJECT,
                                          OBJECT_RDF_OBJECT,
                                          DATASTREAM_RDF_OBJECT)
-from dgi_repo.database import relationships
+from dgi_repo.database import relationships, cache
 
 
 class DatabaseRelationshipTestCase(unittest.TestCase):
@@ -26,6 +26,7 @@ class DatabaseRelationshipTestCase(unittest.TestCase):
         self.element = etree.Element('{{{}}}{}'.format(self.namespace,
                                                        self.name))
         self.pred_map = dict()
+        cache.clear_cache()
 
     def test_parse_tuple(self):
         self.assertEqual(relationships._element_predicate(self.element),
@@ -1,9 +1,12 @@
 """
 Database utility functions.
 """
+from hashlib import sha256
+
 from psycopg2 import connect
 from psycopg2.extras import DictCursor
-from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+from psycopg2.extensions import (ISOLATION_LEVEL_REPEATABLE_READ,
+                                 connection as _connection)
 
 from dgi_repo.configuration import configuration as _config
 import dgi_repo.fcrepo3.relations as rels
@@ -223,6 +226,16 @@ OBJECT_RELATION_MAP = {
     },
 }
 
+'''
+Columns of the relation tables which do not use the standard design.
+'''
+RELATION_TABLE_COLUMNS = {
+    'object_relationships': ('predicate', 'rdf_subject', 'rdf_object'),
+    'datastream_relationships': ('predicate', 'rdf_subject', 'rdf_object'),
+    'is_sequence_number_of': ('rdf_subject', 'rdf_object', 'sequence_number'),
+}
+STANDARD_RELATION_COLUMNS = ('rdf_subject', 'rdf_object')
+
 LITERAL_RDF_OBJECT = 'literal'
 URI_RDF_OBJECT = 'uri'
 RAW_RDF_OBJECT = 'raw'
@@ -234,6 +247,36 @@ LINKED_RDF_OBJECT_TYPES = set([OBJECT_RDF_OBJECT, DATASTREAM_RDF_OBJECT,
                                USER_RDF_OBJECT, ROLE_RDF_OBJECT])
 
 
+class HookedConnection(_connection):
+    """
+    A connection which can run callbacks before committing.
+
+    Hooks are discarded on commit and rollback; they are never run for
+    autocommit connections.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pre_commit_hooks = []
+
+    def add_pre_commit_hook(self, hook):
+        """
+        Register a callable to run before the transaction is next committed.
+
+        Should the hook raise, the commit does not happen.
+        """
+        self._pre_commit_hooks.append(hook)
+
+    def commit(self):
+        hooks, self._pre_commit_hooks = self._pre_commit_hooks, []
+        for hook in hooks:
+            hook()
+        super().commit()
+
+    def rollback(self):
+        self._pre_commit_hooks = []
+        super().rollback()
+
+
 def get_connection(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ):
     """
     Get a connection to the application database.
@@ -251,7 +294,9 @@ def get_connection(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ):
         _config['database']['host']
     )
 
-    connection = connect(connection_string, cursor_factory=DictCursor)
+    connection = connect(connection_string,
+                         connection_factory=HookedConnection,
+                         cursor_factory=DictCursor)
 
     connection.set_isolation_level(isolation_level)
 
@@ -268,3 +313,17 @@ def check_cursor(cursor=None, isolation_level=None):
         return db_connection.cursor()
     else:
         return cursor
+
+
+def relation_columns(table):
+    """
+    Get the columns of a relation table, as its rows are given in.
+    """
+    return RELATION_TABLE_COLUMNS.get(table, STANDARD_RELATION_COLUMNS)
+
+
+def log_hash(log):
+    """
+    Get the digest by which a log entry is deduplicated.
+    """
+    return sha256(log.encode()).digest()
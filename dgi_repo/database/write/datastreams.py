@@ -107,6 +107,25 @@ def upsert_resource(data, cursor=None):
     return cursor
 
 
+def upsert_unreferenced_resource(resource_id, cursor=None):
+    """
+    Track a resource as having no references, so it can be collected.
+
+    It will no longer be counted as unreferenced once it is referenced.
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('''
+        INSERT INTO resource_refcounts (id, refcount)
+        VALUES (%s, 0)
+        ON CONFLICT (id) DO NOTHING
+    ''', (resource_id,))
+
+    logger.debug('Tracked resource %s as unreferenced.', resource_id)
+
+    return cursor
+
+
 def upsert_mime(mime, cursor=None):
     """
     Upsert a mime in the repository.
@@ -7,7 +7,7 @@ control.
 
 import logging
 
-from dgi_repo.database.utilities import check_cursor
+from dgi_repo.database.utilities import check_cursor, log_hash
 from dgi_repo.database.read.log import log_id
 
 logger = logging.getLogger(__name__)
@@ -20,11 +20,11 @@ def upsert_log(log, cursor=None):
     cursor = check_cursor(cursor)
 
     cursor.execute('''
-        INSERT INTO log (log)
-        VALUES (%s)
-        ON CONFLICT (log) DO NOTHING
+        INSERT INTO log (log, log_hash)
+        VALUES (%s, %s)
+        ON CONFLICT (log_hash) DO NOTHING
         RETURNING id
-    ''', (log,))
+    ''', (log, log_hash(log)))
 
     if not cursor.rowcount:
         cursor = log_id(log, cursor)
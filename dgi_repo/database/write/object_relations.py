@@ -13,6 +13,7 @@ from dgi_repo.database.utilities import (check_cursor, OBJECT_RELATION_MAP,
 from dgi_repo.fcrepo3.relations import ISLANDORA_RELS_EXT_NAMESPACE
 from dgi_repo.database.read.repo_objects import object_id_from_raw
 from dgi_repo.database.write.relations import write_to_standard_relation_table
+from dgi_repo.exceptions import ReferencedObjectDoesNotExistError
 from dgi_repo.utilities import rreplace
 
 logger = logging.getLogger(__name__)
@@ -39,8 +40,10 @@ def write_relationship(namespace, predicate, subject, rdf_object, rdf_type,
             almost_pid = predicate.split('isSequenceNumberOf', 1)[1]
             paged_pid = rreplace(almost_pid, '_', ':', 1)
             paged_object = object_id_from_raw(paged_pid, cursor=cursor
-                                              ).fetchone()['id']
-            write_sequence_number(subject, paged_object, rdf_object,
+                                              ).fetchone()
+            if paged_object is None:
+                raise ReferencedObjectDoesNotExistError(paged_pid)
+            write_sequence_number(subject, paged_object['id'], rdf_object,
                                   cursor=cursor)
         else:
             predicate_id = cache.predicate_id_from_raw(namespace, predicate,
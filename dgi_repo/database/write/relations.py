@@ -7,7 +7,10 @@ control.
 
 import logging
 
-from dgi_repo.database.utilities import check_cursor
+from psycopg2.extras import execute_values
+
+from dgi_repo.database.utilities import check_cursor, relation_columns
+from dgi_repo.utilities import break_pid
 from dgi_repo.database.read.relations import namespace_id
 from dgi_repo.database.read.relations import predicate_id
 
@@ -75,3 +78,65 @@ def write_to_standard_relation_table(table, log_message, subject, rdf_object,
     logger.debug(log_message, subject, rdf_object)
 
     return cursor
+
+
+def write_relation_rows(table, rows, cursor=None):
+    """
+    Write relations to a relation table in bulk.
+
+    Args:
+        rows: The relations' values, in the order of relation_columns().
+    """
+    cursor = check_cursor(cursor)
+
+    execute_values(cursor, '''
+        INSERT INTO {} ({})
+        VALUES %s
+    '''.format(table, ', '.join(relation_columns(table))), rows)
+
+    logger.debug('Added %s relations to %s.', len(rows), table)
+
+    return cursor
+
+
+def write_pending_reference(data, cursor=None):
+    """
+    Stage a relation to an object which does not (yet) exist.
+
+    Args:
+        data: A dictionary with the "relation_table" the relation belongs in,
+            the referenced "pid" and "dsid" (None if referencing the object
+            itself) and either the subject "object" or "datastream" ID; and
+            the "sequence_number" of "is_sequence_number_of" relations.
+    """
+    cursor = check_cursor(cursor)
+    namespace, pid_id = break_pid(data['pid'])
+
+    cursor.execute('''
+        INSERT INTO pending_references (object, datastream, relation_table,
+                                        namespace, pid_id, dsid,
+                                        sequence_number)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    ''', (data.get('object'), data.get('datastream'), data['relation_table'],
+          namespace, pid_id, data.get('dsid'), data.get('sequence_number')))
+
+    logger.debug('Staged a pending reference in %s to %s.',
+                 data['relation_table'], data['pid'])
+
+    return cursor
+
+
+def resolve_pending_references(cursor=None):
+    """
+    Move pending references which now resolve into their relation tables.
+
+    The count of references resolved is selected as "resolved".
+    """
+    cursor = check_cursor(cursor)
+
+    cursor.execute('SELECT resolve_pending_references() AS resolved')
+
+    logger.debug('Resolved pending references.')
+
+    return cursor
@@ -105,3 +105,15 @@ class ExternalDatastreamsNotSupported(ValueError):
     """
     Raised when one tries to create an external datastream.
     """
+
+
+class MalformedInlineXmlError(ValueError):
+    """
+    Raised when content for an inline XML datastream isn't well-formed.
+    """
+
+
+class MalformedQueryError(ValueError):
+    """
+    Raised when a search query can't be parsed, or isn't supported.
+    """
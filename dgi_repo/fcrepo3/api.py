@@ -13,7 +13,8 @@ from dgi_repo.utilities import SpooledTemporaryFile
 from dgi_repo.exceptions import (ObjectDoesNotExistError, ObjectConflictsError,
                                  DatastreamExistsError, ObjectExistsError,
                                  DatastreamDoesNotExistError,
-                                 DatastreamConflictsError)
+                                 DatastreamConflictsError,
+                                 MalformedInlineXmlError)
 from dgi_repo.fcrepo3.utilities import format_date
 
 logger = logging.getLogger(__name__)
@@ -449,6 +450,10 @@ class DatastreamResource(ABC):
                          'exists.'), dsid, pid)
             raise falcon.HTTPMethodNotAllowed(['PUT', 'HEAD',
                                                'GET', 'DELETE']) from e
+        except MalformedInlineXmlError as e:
+            logger.info(('Did not create datastream %s on %s as its inline '
+                         'XML was malformed: %s'), dsid, pid, e)
+            raise falcon.HTTPBadRequest('Malformed XML', str(e)) from e
         resp.status = falcon.HTTP_201
         self._datastream_to_response(pid, dsid, resp)
 
@@ -511,6 +516,10 @@ class DatastreamResource(ABC):
             # @XXX Raising HTTPError over HTTPConflict because we
             # don't have  a title and description for HTTPConflict.
             raise falcon.HTTPError('409 Conflict') from e
+        except MalformedInlineXmlError as e:
+            logger.info(('Did not update datastream %s on %s as its inline '
+                         'XML was malformed: %s'), dsid, pid, e)
+            raise falcon.HTTPBadRequest('Malformed XML', str(e)) from e
         self._datastream_to_response(pid, dsid, resp)
 
     @abstractmethod
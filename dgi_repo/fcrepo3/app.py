@@ -9,6 +9,11 @@ from dgi_repo.utilities import bootstrap
 from dgi_repo.fcrepo3 import resources
 from dgi_repo.fcrepo3.object_resource import ObjectResource
 from dgi_repo.fcrepo3.datastream_resource import DatastreamResource
+from dgi_repo.fcrepo3.changes import ChangesResource
+from dgi_repo.fcrepo3.members import MembersResource, PagesResource
+from dgi_repo.fcrepo3.purge import PurgeResource
+from dgi_repo.fcrepo3.risearch import RISearchResource
+from dgi_repo.fcrepo3.search import FindObjectsResource
 from dgi_repo.fcrepo3.authorize import AuthMiddleware
 from dgi_repo.fcrepo3.exceptions import handle_exception
 
@@ -27,8 +32,14 @@ for route, resource_class in resources.route_map.items():
     app.add_route(route, resource_class())
 
 app.add_route('/query_proxy', ProxyResource())
+app.add_route('/changes', ChangesResource())
+app.add_route('/purge', PurgeResource())
+app.add_route('/risearch', RISearchResource())
+app.add_route('/objects', FindObjectsResource())
 app.add_route('/objects/{pid}', ObjectResource())
 app.add_route('/objects/{pid}/datastreams/{dsid}', DatastreamResource())
+app.add_route('/objects/{pid}/members', MembersResource())
+app.add_route('/objects/{pid}/pages', PagesResource())
 
 # Custom error handler to ensure 500s on any error.
 app.add_error_handler(Exception, handle_exception)
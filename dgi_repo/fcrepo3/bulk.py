@@ -0,0 +1,1047 @@
+"""
+Offline bulk loading of FOXML.
+
+Intended for migrations into an otherwise idle repository: FOXML is parsed in
+parallel, database IDs are allocated in bulk from their sequences and rows are
+written with COPY instead of row by row.
+"""
+import base64
+import hashlib
+import logging
+import os
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from itertools import chain, islice
+from multiprocessing import Pool
+from shutil import copyfileobj
+
+import click
+import requests
+from lxml import etree
+from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
+
+import dgi_repo.database.filestore as filestore
+import dgi_repo.database.write.repo_objects as object_writer
+from dgi_repo import utilities as utils
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database import cache
+from dgi_repo.database.relationships import (USER_PREDICATES,
+                                             ROLE_PREDICATES, relation_row)
+from dgi_repo.database.utilities import (get_connection,
+                                         DATASTREAM_RELATION_MAP,
+                                         OBJECT_RELATION_MAP,
+                                         RELATION_TABLE_COLUMNS,
+                                         relation_columns)
+from dgi_repo.database.write.sources import upsert_source
+from dgi_repo.exceptions import (ExternalDatastreamsNotSupported,
+                                 ReferencedObjectDoesNotExistError,
+                                 ReferencedDatastreamDoesNotExist)
+from dgi_repo.fcrepo3 import relations
+from dgi_repo.fcrepo3.foxml import (OBJECT_STATE_LABEL_MAP, OBJECT_LOG,
+                                    DEFAULT_DC_LABEL, DEFAULT_DC_LOG,
+                                    DIGITAL_OBJECT_TAG, PROPERTY_TAG,
+                                    DATASTREAM_TAG, DATASTREAM_VERSION_TAG,
+                                    CONTENT_DIGEST_TAG, CONTENT_LOCATION_TAG,
+                                    XML_CONTENT_TAG, BINARY_CONTENT_TAG,
+                                    default_dc, schedule_ingest)
+from dgi_repo.fcrepo3.utilities import (RDF_NAMESPACE, pid_from_fedora_uri,
+                                        dsid_from_fedora_uri)
+
+logger = logging.getLogger(__name__)
+
+RELATION_DSIDS = frozenset(['DC', 'RELS-EXT', 'RELS-INT'])
+
+'''
+Every table the loader writes to, excepting the vocabulary tables.
+'''
+_TABLES = sorted(set(chain(
+    ['resources', 'checksums', 'objects', 'datastreams', 'old_datastreams'],
+    RELATION_TABLE_COLUMNS,
+    (info['table'] for info in OBJECT_RELATION_MAP.values()),
+    (info['table'] for info in DATASTREAM_RELATION_MAP.values()),
+)))
+
+'''
+A LIKE pattern matching the names of the change log triggers.
+'''
+CHANGE_LOG_TRIGGERS = r'log\_%'
+
+
+class BulkFoxmlTarget(object):
+    """
+    Parser target reading FOXML into a record for the bulk loader.
+
+    Datastream content is written straight into the filestore, hashed as it
+    is written; nothing touches the database.
+    """
+
+    def __init__(self):
+        """
+        Prep for use.
+        """
+        self.object_info = {'PID': None}
+        self.datastreams = OrderedDict()
+        self.relations = {'DC': [], 'RELS-EXT': [], 'RELS-INT': []}
+        self.files = []
+        self.dsid = None
+        self.version = None
+        self.content = None
+        self.base64 = None
+        self.tree_builder = None
+
+    def start(self, tag, attributes, nsmap):
+        """
+        Grab data from the start of tags.
+        """
+        if self.tree_builder is not None:
+            self.tree_builder.start(tag, attributes, nsmap)
+        elif self.dsid == 'AUDIT':
+            return
+        elif tag == XML_CONTENT_TAG:
+            self.tree_builder = etree.TreeBuilder()
+        elif tag == BINARY_CONTENT_TAG:
+            self.content = self._open_content()
+            self.base64 = ''
+        elif tag == CONTENT_LOCATION_TAG:
+            self._write_reference(attributes['REF'])
+        elif tag == CONTENT_DIGEST_TAG:
+            self.version['checksums'].append({
+                'type': attributes['TYPE'],
+                'checksum': attributes['DIGEST'],
+            })
+        elif tag == DATASTREAM_VERSION_TAG:
+            self.version = {
+                'label': attributes.get('LABEL'),
+                'mimetype': attributes.get('MIMETYPE',
+                                           'application/octet-stream'),
+                'created': attributes.get('CREATED'),
+                'uri': None,
+                'checksums': [],
+            }
+            self.datastreams[self.dsid]['versions'].append(self.version)
+        elif tag == DATASTREAM_TAG:
+            self.dsid = attributes['ID']
+            if self.dsid == 'AUDIT':
+                return
+            if attributes['CONTROL_GROUP'] == 'E':
+                raise ExternalDatastreamsNotSupported
+            self.datastreams[self.dsid] = {
+                'dsid': self.dsid,
+                'control_group': attributes['CONTROL_GROUP'],
+                'state': attributes['STATE'],
+                'versioned': attributes.get('VERSIONABLE',
+                                            'true').upper() == 'TRUE',
+                'log': None,
+                'versions': [],
+            }
+        elif tag == PROPERTY_TAG:
+            self.object_info[attributes['NAME']] = attributes['VALUE']
+        elif tag == DIGITAL_OBJECT_TAG:
+            self.object_info['PID'] = attributes['PID']
+
+    def end(self, tag):
+        """
+        Write out content at the end of tags.
+        """
+        if tag == XML_CONTENT_TAG:
+            if self.tree_builder is None:
+                return
+            content = self._open_content()
+            content.write(etree.tostring(self.tree_builder.close()))
+            self.tree_builder = None
+            self._close_content(content)
+        elif self.tree_builder is not None:
+            self.tree_builder.end(tag)
+        elif (tag == BINARY_CONTENT_TAG and
+                self.content is not None):
+            self.content.write(base64.b64decode(self.base64))
+            self.base64 = None
+            self._close_content(self.content)
+            self.content = None
+        elif tag == DATASTREAM_TAG:
+            if self.dsid == 'AUDIT':
+                pass
+            elif not self.datastreams[self.dsid]['versions']:
+                logger.warning('Skipping %s of %s as it has no versions.',
+                               self.dsid, self.object_info['PID'])
+                del self.datastreams[self.dsid]
+            elif self.dsid in RELATION_DSIDS:
+                self._read_relations(self.datastreams[self.dsid])
+            self.dsid = None
+
+    def data(self, data):
+        """
+        Handle character data (datastream content).
+        """
+        if self.base64 is not None:
+            # Decode as we go, in whole quanta of four characters.
+            self.base64 += ''.join(data.split())
+            whole = len(self.base64) - len(self.base64) % 4
+            if whole:
+                self.content.write(base64.b64decode(self.base64[:whole]))
+                self.base64 = self.base64[whole:]
+        elif self.tree_builder is not None:
+            self.tree_builder.data(data)
+
+    def comment(self, data):
+        """
+        Maintain comments from Inline XML.
+        """
+        if self.tree_builder is not None:
+            self.tree_builder.comment(data)
+
+    def close(self):
+        """
+        Finish up the object's record.
+
+        Returns:
+            A dictionary describing the object; see _parse().
+        """
+        pid = self.object_info['PID']
+        if pid is None:
+            raise ValueError('No PID found; is this FOXML?')
+
+        if 'DC' not in self.datastreams:
+            self.dsid = 'DC'
+            self.datastreams['DC'] = {
+                'dsid': 'DC',
+                'control_group': 'X',
+                'state': 'A',
+                'versioned': False,
+                'log': DEFAULT_DC_LOG,
+                'versions': [],
+            }
+            self.start(DATASTREAM_VERSION_TAG, {
+                'LABEL': DEFAULT_DC_LABEL,
+                'MIMETYPE': 'application/xml',
+            }, {})
+            content = self._open_content()
+            content.write(default_dc(pid))
+            self._close_content(content)
+            self.end(DATASTREAM_TAG)
+
+        if _config['filestore_durability'] != 'none':
+            filestore.make_durable(self.files)
+
+        model = relations.FEDORA_MODEL_NAMESPACE
+        state = self.object_info.get('{}{}'.format(
+            model,
+            relations.STATE_PREDICATE
+        ), 'A')
+        return {
+            'pid': pid,
+            'label': self.object_info.get('{}{}'.format(
+                model,
+                relations.LABEL_PREDICATE
+            )),
+            'owner': self.object_info.get('{}{}'.format(
+                model,
+                relations.OWNER_PREDICATE
+            )),
+            'state': OBJECT_STATE_LABEL_MAP.get(state, state),
+            'created': self.object_info.get('{}{}'.format(
+                model,
+                relations.CREATED_DATE_PREDICATE
+            ), 'now'),
+            'modified': self.object_info.get('{}{}'.format(
+                relations.FEDORA_VIEW_NAMESPACE,
+                relations.LAST_MODIFIED_DATE_PREDICATE
+            ), 'now'),
+            'datastreams': list(self.datastreams.values()),
+            'relations': self.relations,
+            'files': self.files,
+        }
+
+    def _open_content(self):
+        """
+        Start writing the current version's content into the filestore.
+        """
+        content = _Content(self.version['checksums'])
+        self.files.append(content.file.name)
+        self.version['uri'] = content.uri
+        return content
+
+    def _close_content(self, content):
+        """
+        Finish writing the current version's content.
+        """
+        self.version['checksums'] = content.close()
+
+    def _write_reference(self, ref):
+        """
+        Resolve a datastream version's contentLocation.
+        """
+        if self.datastreams[self.dsid]['control_group'] == 'R':
+            # Data will remain external.
+            self.version['uri'] = ref
+            self.version['external'] = True
+            return
+
+        content = self._open_content()
+        if ref.startswith(filestore.UPLOAD_SCHEME):
+            with open(filestore.resolve_uri(ref), 'rb') as upload:
+                copyfileobj(upload, content)
+        else:
+            with requests.get(ref, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(
+                        _config['download_chunk_size']):
+                    content.write(chunk)
+        self._close_content(content)
+
+    def _read_relations(self, datastream):
+        """
+        Gather relations from the latest version of a DC or RELS datastream.
+
+        The relations are recorded as tuples of their namespace, localname,
+        text and resource, prefixed with the DSID for RELS-INT.
+        """
+        uri = datastream['versions'][-1]['uri']
+        if datastream['versions'][-1].get('external') or uri is None:
+            return
+        tree = etree.parse(filestore.resolve_uri(uri))
+
+        if datastream['dsid'] == 'DC':
+            for relation in tree.getroot():
+                qname = etree.QName(relation)
+                self.relations['DC'].append(
+                    (relations.DC_NAMESPACE, qname.localname,
+                     relation.text if relation.text is not None else '', None)
+                )
+        elif datastream['dsid'] == 'RELS-EXT':
+            self.relations['RELS-EXT'].extend(
+                _relation_tuple(relation) for relation in tree.getroot()[0]
+            )
+        else:
+            for description in tree.getroot():
+                dsid = dsid_from_fedora_uri(description.attrib[
+                    '{{{}}}about'.format(RDF_NAMESPACE)
+                ])
+                self.relations['RELS-INT'].extend(
+                    (dsid,) + _relation_tuple(relation)
+                    for relation in description
+                )
+
+
+class _Content(object):
+    """
+    A datastream version's content on its way into the filestore.
+    """
+
+    def __init__(self, checksums):
+        """
+        Open a new file in the filestore, and hashers for the checksums.
+        """
+        self.checksums = {}
+        for checksum in checksums:
+            checksum_type = checksum['type']
+            if checksum_type == 'DEFAULT':
+                checksum_type = _config['default_hash_algorithm']
+            if checksum_type == 'DISABLED':
+                continue
+            self.checksums[checksum_type] = (
+                checksum['checksum'],
+                hashlib.new(filestore.HASH_TYPE_MAP[checksum_type])
+            )
+        self.file, self.uri = filestore.reserve()
+
+    def write(self, data):
+        """
+        Write and hash a chunk of content.
+        """
+        self.file.write(data)
+        for _, hasher in self.checksums.values():
+            hasher.update(data)
+
+    def close(self):
+        """
+        Close the file, verifying checksums.
+
+        Returns:
+            A list of the resulting checksum dictionaries.
+
+        Raises:
+            ValueError: On checksum mismatch.
+        """
+        self.file.close()
+        checksums = []
+        for checksum_type, (expected, hasher) in self.checksums.items():
+            checksum = hasher.hexdigest()
+            if expected and expected != checksum:
+                raise ValueError('Checksum mismatch.')
+            checksums.append({'type': checksum_type, 'checksum': checksum})
+        return checksums
+
+
+def _relation_tuple(relation):
+    """
+    Helper; get the namespace, localname, text and resource of a relation.
+    """
+    qname = etree.QName(relation)
+    return (qname.namespace, qname.localname, relation.text,
+            relation.get('{{{}}}resource'.format(RDF_NAMESPACE)))
+
+
+def _parse(path):
+    """
+    Read a FOXML file, in a worker process.
+
+    Returns:
+        A dictionary of the object's "pid", "label", "owner", "state",
+        "created" and "modified" values, its "datastreams" (each with its
+        "versions", oldest first), its "relations" by DSID and the "files" its
+        content was written to; or, should the file fail to load, a
+        dictionary of the "path" and the "error".
+    """
+    target = BulkFoxmlTarget()
+    try:
+        record = etree.parse(path, etree.XMLParser(target=target,
+                                                   huge_tree=True))
+    except Exception as e:
+        _remove_files(target.files)
+        return {'path': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+    record['path'] = path
+    return record
+
+
+def _remove_files(paths):
+    """
+    Remove files written for a record which will not be loaded.
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            logger.warning('Failed to remove %s.', path)
+
+
+@click.command(help=('Bulk load FOXML, passed as "F", into an otherwise idle '
+                     'repository. "F" can indicate either a directory '
+                     'structure containing FOXML files, or a single FOXML '
+                     'file. Objects which already exist are skipped.'))
+@click.argument('info', metavar='f', type=click.Path(exists=True))
+@click.option('--source', default=None, type=int,
+              help=('The ID of the source as which to ingest the files. '
+                    'Defaults to the "system" source.'))
+@click.option('--jobs', default=os.cpu_count(), type=int, show_default=True,
+              help='The number of processes parsing FOXML.')
+@click.option('--batch-size', default=500, type=int, show_default=True,
+              help=('The number of objects to load per transaction. Objects '
+                    'may only reference those in the same or earlier '
+                    'batches.'))
+@click.option('--async-commit', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=("Don't wait for each batch to be flushed to the database's"
+                    ' write-ahead log. A database crash may then lose the last'
+                    ' few batches, which would have to be loaded again.'))
+@click.option('--defer-triggers', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Disable triggers on the tables being loaded until the '
+                    'end, then recompute resource reference counts and the '
+                    'access index in bulk. The change log is still written. '
+                    'Nothing else should be writing to the repository '
+                    'meanwhile.'))
+@click.option('--defer-indexes', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Drop non-unique indexes on the tables being loaded until '
+                    'the end, then recreate them. Their definitions are '
+                    'logged should they need recreating by hand.'))
+def bulk_import(info, source, jobs, batch_size, async_commit, defer_triggers,
+                defer_indexes):
+    utils.bootstrap()
+
+    # Fork the workers before connecting, so they share no connection.
+    pool = Pool(jobs)
+    # Objects are loaded after those they reference.
+    records = pool.imap(_parse, chain.from_iterable(schedule_ingest(info)[0]))
+
+    connection = get_connection(isolation_level=ISOLATION_LEVEL_READ_COMMITTED)
+    with connection, connection.cursor() as cursor:
+        if source is None:
+            source = upsert_source(
+                _config['self']['source'],
+                cursor=cursor
+            ).fetchone()['id']
+
+    loaded = failed = 0
+    with pool, _deferred(connection, defer_triggers, defer_indexes):
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            for record in batch:
+                if 'error' in record:
+                    logger.error('Failed to read %s: %s', record['path'],
+                                 record['error'])
+                    failed += 1
+            batch = [record for record in batch if 'error' not in record]
+
+            with connection, connection.cursor() as cursor:
+                if async_commit:
+                    cursor.execute('SET LOCAL synchronous_commit = off')
+                try:
+                    loaded += _load(batch, source, cursor)
+                except:
+                    # IDs cached during the batch are being rolled back.
+                    cache.clear_cache()
+                    for record in batch:
+                        _remove_files(record['files'])
+                    raise
+            logger.info('Loaded %s objects so far.', loaded)
+
+    logger.info('Loaded %s objects; %s files failed to read.', loaded, failed)
+
+
+@contextmanager
+def _deferred(connection, defer_triggers, defer_indexes):
+    """
+    Defer trigger and index maintenance on the loaded tables, as requested.
+    """
+    indexes = []
+    triggers = []
+    with connection, connection.cursor() as cursor:
+        if defer_indexes:
+            cursor.execute('''
+                SELECT indexrelid::regclass::text AS name,
+                       pg_get_indexdef(indexrelid) AS definition
+                FROM pg_index
+                WHERE indrelid = ANY(%s::regclass[]) AND
+                    NOT indisunique AND
+                    NOT indisprimary
+            ''', (_TABLES,))
+            indexes = cursor.fetchall()
+            for name, definition in indexes:
+                logger.info('Dropping index %s; its definition is: %s',
+                            name, definition)
+                cursor.execute('DROP INDEX {}'.format(name))
+        if defer_triggers:
+            # The change log triggers are left be, being per statement; so,
+            # loaded objects still reach the change feed.
+            cursor.execute('''
+                SELECT tgrelid::regclass::text AS relation, tgname AS name
+                FROM pg_trigger
+                WHERE tgrelid = ANY(%s::regclass[]) AND
+                    NOT tgisinternal AND
+                    tgname NOT LIKE %s
+            ''', (_TABLES, CHANGE_LOG_TRIGGERS))
+            triggers = cursor.fetchall()
+            for table, name in triggers:
+                cursor.execute('ALTER TABLE {} DISABLE TRIGGER {}'.format(
+                    table, name
+                ))
+            logger.info('Disabled triggers: %s.', ', '.join(
+                '{} on {}'.format(name, table) for table, name in triggers
+            ))
+    try:
+        yield
+    finally:
+        with connection, connection.cursor() as cursor:
+            for name, definition in indexes:
+                logger.info('Recreating index %s.', name)
+                cursor.execute(definition)
+            if defer_triggers:
+                for table, name in triggers:
+                    cursor.execute('ALTER TABLE {} ENABLE TRIGGER {}'.format(
+                        table, name
+                    ))
+                logger.info('Recomputing resource reference counts.')
+                _refresh_refcounts(cursor)
+                logger.info('Refreshing the access index.')
+                _refresh_access(cursor)
+
+
+def _refresh_refcounts(cursor):
+    """
+    Recompute resource reference counts, as the triggers would have.
+    """
+    cursor.execute('''
+        INSERT INTO resource_refcounts (id, refcount)
+        SELECT resources.id, count(refs.resource)
+        FROM resources
+            LEFT JOIN (
+                SELECT resource FROM datastreams
+                UNION ALL
+                SELECT resource FROM old_datastreams
+            ) AS refs
+            ON refs.resource = resources.id
+        GROUP BY resources.id
+        HAVING count(refs.resource) > 0 OR
+            resources.id IN (SELECT id FROM resource_refcounts)
+        ON CONFLICT (id) DO UPDATE
+        SET (refcount, touched) = (EXCLUDED.refcount, now())
+        WHERE resource_refcounts.refcount IS DISTINCT FROM EXCLUDED.refcount
+    ''')
+    logger.info('Updated %s resource reference counts.', cursor.rowcount)
+
+
+def _refresh_access(cursor):
+    """
+    Index access for those objects and datastreams missing from the index.
+    """
+    cursor.execute('''
+        SELECT refresh_object_access(id)
+        FROM objects
+        WHERE NOT EXISTS (
+            SELECT 1 FROM object_access WHERE object = objects.id
+        )
+    ''')
+    cursor.execute('''
+        SELECT refresh_datastream_access(id)
+        FROM datastreams
+        WHERE NOT EXISTS (
+            SELECT 1 FROM datastream_access WHERE datastream = datastreams.id
+        )
+    ''')
+
+
+def _load(records, source, cursor):
+    """
+    Write a batch of records to the database.
+
+    Returns:
+        The number of objects loaded.
+    """
+    records = _new_records(records, cursor)
+    if not records:
+        return 0
+
+    for record, object_id in zip(records, _allocate('objects_id_seq',
+                                                    len(records), cursor)):
+        record['id'] = object_id
+    datastreams = [datastream for record in records
+                   for datastream in record['datastreams']]
+    for datastream, datastream_id in zip(datastreams, _allocate(
+            'datastreams_id_seq', len(datastreams), cursor)):
+        datastream['id'] = datastream_id
+
+    relation_rows = _resolve_relations(records, source, cursor)
+
+    # Now that the batch has settled, the PIDs it uses.
+    highest = {}
+    for record in records:
+        if record['pid_id'].isdecimal():
+            highest[record['namespace']] = max(
+                highest.get(record['namespace'], 0),
+                int(record['pid_id'])
+            )
+    for namespace, pid_id in highest.items():
+        object_writer.jump_pids(namespace, str(pid_id), cursor=cursor)
+
+    resources = _resources(records, cursor)
+    _copy(cursor, 'checksums', ('checksum', 'resource', 'type'), (
+        (checksum['checksum'], resources[version['uri']], checksum['type'])
+        for record in records
+        for datastream in record['datastreams']
+        for version in datastream['versions']
+        if not version.get('external')
+        for checksum in version['checksums']
+    ))
+
+    default_owner = cache.user_id(
+        _config['self']['username'],
+        cache.source_id(_config['self']['source'], cursor=cursor),
+        cursor=cursor
+    )
+    object_log = cache.log_id(OBJECT_LOG, cursor=cursor)
+    _copy(cursor, 'objects', ('id', 'namespace', 'pid_id', 'state', 'owner',
+                              'label', 'log', 'created', 'modified'), (
+        (record['id'], record['namespace'], record['pid_id'],
+         record['state'],
+         (cache.user_id(record['owner'], source, cursor=cursor)
+          if record['owner'] is not None else default_owner),
+         record['label'], object_log, record['created'], record['modified'])
+        for record in records
+    ))
+
+    _copy(cursor, 'datastreams', ('id', 'object', 'label', 'dsid', 'resource',
+                                  'versioned', 'control_group', 'state',
+                                  'log', 'modified', 'created'), (
+        (datastream['id'], record['id'], datastream['versions'][-1]['label'],
+         datastream['dsid'], resources.get(datastream['versions'][-1]['uri']),
+         datastream['versioned'], datastream['control_group'],
+         datastream['state'],
+         (cache.log_id(datastream['log'], cursor=cursor)
+          if datastream['log'] is not None else None),
+         datastream['versions'][-1]['created'] or 'now',
+         datastream['versions'][0]['created'] or 'now')
+        for record in records
+        for datastream in record['datastreams']
+        if datastream['versions']
+    ))
+    _copy(cursor, 'old_datastreams', ('datastream', 'state', 'label',
+                                      'resource', 'committed'), (
+        (datastream['id'], datastream['state'], version['label'],
+         resources.get(version['uri']), committed)
+        for record in records
+        for datastream in record['datastreams']
+        for committed, version in _old_versions(datastream)
+    ))
+
+    for table, rows in relation_rows.items():
+        _copy(cursor, table, relation_columns(table), rows)
+
+    for record in records:
+        logger.info('Loaded %s from %s.', record['pid'], record['path'])
+    return len(records)
+
+
+def _new_records(records, cursor):
+    """
+    Filter out records for objects which exist, or repeat within the batch.
+    """
+    new_records = []
+    pids = set()
+    for record in records:
+        try:
+            raw_namespace, record['pid_id'] = utils.break_pid(record['pid'])
+        except ValueError as e:
+            logger.error('Skipping %s: %s', record['path'], e)
+            _remove_files(record['files'])
+            continue
+        if record['pid'] in pids:
+            logger.warning('Skipping %s: %s appears more than once.',
+                           record['path'], record['pid'])
+            _remove_files(record['files'])
+            continue
+        record['namespace'] = cache.repo_object_namespace_id(raw_namespace,
+                                                             cursor=cursor)
+        pids.add(record['pid'])
+        new_records.append(record)
+
+    existing = _object_ids(pids, cursor)
+    for record in new_records:
+        if record['pid'] in existing:
+            logger.warning('Object already exists "%s".', record['pid'])
+            _remove_files(record['files'])
+    return [record for record in new_records if record['pid'] not in existing]
+
+
+def _object_ids(pids, cursor):
+    """
+    Look up the database IDs of existing objects.
+
+    Returns:
+        A dictionary mapping the PIDs found to their IDs.
+    """
+    wanted = []
+    for pid in pids:
+        try:
+            wanted.append(utils.break_pid(pid))
+        except ValueError:
+            logger.debug('Not looking up malformed PID %s.', pid)
+    if not wanted:
+        return {}
+    namespaces, pid_ids = zip(*wanted)
+    cursor.execute('''
+        SELECT objects.id, pid_namespaces.namespace, objects.pid_id
+        FROM objects
+            JOIN
+        pid_namespaces
+            ON objects.namespace = pid_namespaces.id
+            JOIN
+        unnest(%s::text[], %s::text[]) AS wanted(namespace, pid_id)
+            ON pid_namespaces.namespace = wanted.namespace AND
+                objects.pid_id = wanted.pid_id
+    ''', (list(namespaces), list(pid_ids)))
+    return {'{}{}{}'.format(namespace, utils.PID_SEPARATOR, pid_id): object_id
+            for object_id, namespace, pid_id in cursor}
+
+
+def _datastream_ids(references, cursor):
+    """
+    Look up the database IDs of existing datastreams.
+
+    Args:
+        references: An iterable of (object ID, DSID) tuples.
+
+    Returns:
+        A dictionary mapping the references found to their IDs.
+    """
+    references = list(references)
+    if not references:
+        return {}
+    object_ids, dsids = zip(*references)
+    cursor.execute('''
+        SELECT datastreams.id, datastreams.object, datastreams.dsid
+        FROM datastreams
+            JOIN
+        unnest(%s::bigint[], %s::text[]) AS wanted(object, dsid)
+            ON datastreams.object = wanted.object AND
+                datastreams.dsid = wanted.dsid
+    ''', (list(object_ids), list(dsids)))
+    return {(object_id, dsid): datastream_id
+            for datastream_id, object_id, dsid in cursor}
+
+
+def _allocate(sequence, count, cursor):
+    """
+    Take a number of IDs from a sequence in one go.
+    """
+    if not count:
+        return []
+    cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+                   (sequence, count))
+    return [row[0] for row in cursor]
+
+
+def _old_versions(datastream):
+    """
+    Generate the commit time and version of each of a datastream's old ones.
+
+    As when ingesting a version per commit time is kept, the first seen.
+    """
+    committed = set()
+    for version in datastream['versions'][:-1]:
+        version_committed = version['created'] or 'now'
+        if version_committed not in committed:
+            committed.add(version_committed)
+            yield version_committed, version
+
+
+def _resources(records, cursor):
+    """
+    Write the resources for a batch of records.
+
+    Returns:
+        A dictionary mapping the resources' URIs to their IDs.
+    """
+    resources = {}
+    external = {}
+    for record in records:
+        for datastream in record['datastreams']:
+            for version in datastream['versions']:
+                if version.get('external'):
+                    external.setdefault(version['uri'], version['mimetype'])
+                elif version['uri'] is not None:
+                    resources[version['uri']] = version['mimetype']
+
+    # External resources may well be shared with existing datastreams.
+    known = {}
+    if external:
+        cursor.execute('SELECT id, uri FROM resources WHERE uri = ANY(%s)',
+                       (list(external),))
+        known = {uri: resource_id for resource_id, uri in cursor}
+    resources.update((uri, mimetype) for uri, mimetype in external.items()
+                     if uri not in known)
+
+    ids = dict(zip(resources, _allocate('resources_id_seq', len(resources),
+                                        cursor)))
+    _copy(cursor, 'resources', ('id', 'uri', 'mime'), (
+        (ids[uri], uri, cache.mime_id(mimetype, cursor=cursor))
+        for uri, mimetype in resources.items()
+    ))
+    ids.update(known)
+    return ids
+
+
+def _resolve_relations(records, source, cursor):
+    """
+    Resolve the relations of a batch of records to rows for their tables.
+
+    Objects with relations which fail to resolve are dropped from the batch,
+    and the remaining objects resolved again without them.
+
+    Returns:
+        A dictionary mapping relation tables to lists of rows.
+    """
+    # References outside the batch must already exist.
+    referenced = set()
+    for record in records:
+        for namespace, predicate, text, resource in _rdf_relations(record):
+            if (namespace == relations.ISLANDORA_RELS_EXT_NAMESPACE and
+                    predicate.startswith('isSequenceNumberOf')):
+                referenced.add(_paged_pid(predicate))
+            elif resource is not None and not text:
+                pid = pid_from_fedora_uri(resource)
+                if pid:
+                    referenced.add(pid)
+    existing_objects = _object_ids(referenced, cursor)
+    existing_datastreams = _datastream_ids(
+        ((existing_objects[pid_from_fedora_uri(resource)],
+          dsid_from_fedora_uri(resource))
+         for record in records
+         for _, _, text, resource in _rdf_relations(record)
+         if resource is not None and not text and
+         pid_from_fedora_uri(resource) in existing_objects and
+         dsid_from_fedora_uri(resource)),
+        cursor
+    )
+
+    while True:
+        objects = dict(existing_objects)
+        objects.update((record['pid'], record['id']) for record in records)
+        datastreams = dict(existing_datastreams)
+        datastreams.update(
+            ((record['id'], datastream['dsid']), datastream['id'])
+            for record in records for datastream in record['datastreams']
+        )
+
+        relation_rows = defaultdict(list)
+        failed = []
+        for record in records:
+            try:
+                for table, row in _relation_rows(record, source, objects,
+                                                 datastreams, cursor):
+                    relation_rows[table].append(row)
+            except (ValueError, ReferencedObjectDoesNotExistError,
+                    ReferencedDatastreamDoesNotExist) as e:
+                logger.error('Skipping %s: unresolvable relation (%s).',
+                             record['path'], e)
+                _remove_files(record['files'])
+                failed.append(record)
+        if not failed:
+            return relation_rows
+        records[:] = [record for record in records if record not in failed]
+
+
+def _rdf_relations(record):
+    """
+    Chain a record's RELS-EXT and RELS-INT relations, without their DSIDs.
+    """
+    return chain(
+        record['relations']['RELS-EXT'],
+        (relation[1:] for relation in record['relations']['RELS-INT'])
+    )
+
+
+def _relation_rows(record, source, objects, datastreams, cursor):
+    """
+    Generate the table and row for each of a record's relations.
+    """
+    for namespace, predicate, text, _ in record['relations']['DC']:
+        yield relation_row(OBJECT_RELATION_MAP, 'object_relationships',
+                           namespace, predicate, record['id'], text, cursor)
+
+    for namespace, predicate, text, resource in record['relations'][
+            'RELS-EXT']:
+        if (namespace == relations.ISLANDORA_RELS_EXT_NAMESPACE and
+                predicate.startswith('isSequenceNumberOf')):
+            paged_pid = _paged_pid(predicate)
+            try:
+                paged_object = objects[paged_pid]
+            except KeyError:
+                raise ReferencedObjectDoesNotExistError(paged_pid)
+            yield ('is_sequence_number_of',
+                   (record['id'], paged_object, text))
+            continue
+        rdf_object = _rdf_object(OBJECT_RELATION_MAP, namespace, predicate,
+                                 text, resource, source, objects, datastreams,
+                                 cursor)
+        yield relation_row(OBJECT_RELATION_MAP, 'object_relationships',
+                           namespace, predicate, record['id'], rdf_object,
+                           cursor)
+
+    datastream_ids = {datastream['dsid']: datastream['id']
+                      for datastream in record['datastreams']}
+    for dsid, namespace, predicate, text, resource in record['relations'][
+            'RELS-INT']:
+        try:
+            subject = datastream_ids[dsid]
+        except KeyError:
+            raise ReferencedDatastreamDoesNotExist(record['pid'], dsid)
+        rdf_object = _rdf_object(DATASTREAM_RELATION_MAP, namespace,
+                                 predicate, text, resource, source, objects,
+                                 datastreams, cursor)
+        yield relation_row(DATASTREAM_RELATION_MAP,
+                           'datastream_relationships', namespace, predicate,
+                           subject, rdf_object, cursor)
+
+
+def _rdf_object(rel_map, namespace, predicate, text, resource, source,
+                objects, datastreams, cursor):
+    """
+    Resolve a relation's object, as the relationship resolution does.
+
+    Raises:
+        ReferencedObjectDoesNotExistError: A referenced object is in neither
+            the batch nor the repository.
+        ReferencedDatastreamDoesNotExist: As above, for a datastream.
+        ValueError: The value could not be resolved in general.
+    """
+    if (namespace, predicate) not in rel_map:
+        if resource is not None:
+            return resource
+        elif text:
+            return text
+        raise ValueError(('Empty relationship node; we require either a '
+                          'populated text node or resource reference for '
+                          '{}.').format((namespace, predicate)))
+
+    if text:
+        if (namespace, predicate) in USER_PREDICATES:
+            return cache.user_id(text, source, cursor=cursor)
+        elif (namespace, predicate) in ROLE_PREDICATES:
+            return cache.role_id(text, source, cursor=cursor)
+        return text
+
+    pid = pid_from_fedora_uri(resource) if resource is not None else None
+    if not pid:
+        raise ValueError('Failed to resolve relationship {} with value {}.'
+                         .format((namespace, predicate), resource))
+    try:
+        object_id = objects[pid]
+    except KeyError:
+        raise ReferencedObjectDoesNotExistError(pid)
+    dsid = dsid_from_fedora_uri(resource)
+    if not dsid:
+        return object_id
+    try:
+        return datastreams[(object_id, dsid)]
+    except KeyError:
+        raise ReferencedDatastreamDoesNotExist(pid, dsid)
+
+
+def _paged_pid(predicate):
+    """
+    Get the PID from an "isSequenceNumberOf" predicate.
+    """
+    almost_pid = predicate.split('isSequenceNumberOf', 1)[1]
+    return utils.rreplace(almost_pid, '_', ':', 1)
+
+
+def _copy(cursor, table, columns, rows):
+    """
+    COPY rows into a table.
+    """
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns)),
+        _CopyFile(rows)
+    )
+    logger.debug('Copied %s rows into %s.', cursor.rowcount, table)
+
+
+class _CopyFile(object):
+    """
+    Minimal file-like object feeding rows to COPY in its text format.
+    """
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_copy_value(value) for value in row) + '\n'
+                       for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _copy_value(value):
+    """
+    Escape a value for COPY's text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
@@ -0,0 +1,146 @@
+"""
+A feed of the changes to objects and datastreams, for incremental indexing.
+"""
+import logging
+import select
+import time
+
+import falcon
+import simplejson as json
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+import dgi_repo.database.read.changes as change_reader
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database.utilities import get_connection
+from dgi_repo.fcrepo3.utilities import (serialize_to_json,
+                                        bounded_int_param)
+
+logger = logging.getLogger(__name__)
+
+'''
+The channel on which the change log triggers notify.
+'''
+CHANGES_CHANNEL = 'changes'
+
+
+class ChangesResource(object):
+    """
+    Falcon resource for the change feed.
+    """
+    def on_get(self, req, resp):
+        """
+        Respond with the changes after the given token, as JSON.
+
+        Query parameters:
+        - "since": The "next" token from the previous response; "now" to
+            start after the latest change, or absent to start from the
+            beginning of the log.
+        - "limit": The most changes to respond with, up to the configured
+            "max_page_size".
+        - "wait": Seconds to wait for changes if there are none yet, up to
+            the configured "max_wait"; 0 (the default) to respond at once.
+
+        The response is an object with the "changes", each with the "pid"
+        and "dsid" (null for the object itself) changed, whether it was
+        "purged", and when it was "changed"; and the "next" token, to be
+        given as "since" for the following changes.
+        """
+        changes_config = _config['changes']
+        limit = bounded_int_param(req, 'limit', changes_config['page_size'],
+                                  changes_config['max_page_size'])
+        wait = bounded_int_param(req, 'wait', 0, changes_config['max_wait'],
+                                 minimum=0)
+        since = req.get_param('since')
+
+        connection = get_connection(ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            with connection.cursor() as cursor:
+                if since == 'now':
+                    latest = change_reader.latest_change(
+                        cursor=cursor
+                    ).fetchone()
+                    position = ((latest['transaction'], latest['id'])
+                                if latest else (0, 0))
+                else:
+                    position = parse_token(since) if since else (0, 0)
+                changes = read_changes(connection, cursor, position, limit,
+                                       wait, changes_config['poll_interval'])
+        finally:
+            connection.close()
+
+        if changes:
+            position = (changes[-1]['transaction'], changes[-1]['id'])
+        resp.content_type = 'application/json'
+        resp.body = json.dumps({
+            'changes': [
+                {
+                    'pid': change['pid'],
+                    'dsid': change['dsid'],
+                    'purged': change['purged'],
+                    'changed': change['changed'],
+                }
+                for change in changes
+            ],
+            'next': make_token(*position),
+        }, default=serialize_to_json)
+
+
+def read_changes(connection, cursor, position, limit, wait, poll_interval):
+    """
+    Read the changes after the position, waiting for some if need be.
+
+    Changes may be notified before they can be read, while earlier
+    transactions are still running; so, the log is checked again every
+    "poll_interval" seconds, as well as when notified.
+
+    Args:
+        connection: An autocommitting connection, on which to listen.
+        cursor: A cursor on the connection.
+        position: The transaction and ID of the last change read.
+        limit: The most changes to read.
+        wait: The most seconds to wait for changes.
+        poll_interval: The most seconds to wait between checks.
+
+    Returns:
+        A list of the changes; empty if there were none in time.
+    """
+    deadline = time.monotonic() + wait
+    if wait:
+        cursor.execute('LISTEN {}'.format(CHANGES_CHANNEL))
+    while True:
+        changes = change_reader.changes_since(*position, limit=limit,
+                                              cursor=cursor).fetchall()
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        _wait_for_notification(connection, min(remaining, poll_interval))
+
+
+def _wait_for_notification(connection, timeout):
+    """
+    Wait for a notification on the connection, up to the timeout.
+    """
+    if select.select([connection], [], [], timeout) != ([], [], []):
+        connection.poll()
+        del connection.notifies[:]
+
+
+def make_token(transaction, change_id):
+    """
+    Make the token to read the changes after the given one.
+    """
+    return '{}.{}'.format(transaction, change_id)
+
+
+def parse_token(token):
+    """
+    Read a token made by make_token().
+
+    Raises:
+        falcon.HTTPInvalidParam: The token is malformed.
+    """
+    try:
+        transaction, change_id = (int(part) for part in token.split('.'))
+    except ValueError as e:
+        raise falcon.HTTPInvalidParam('Malformed token.', 'since') from e
+    return transaction, change_id
@@ -3,8 +3,14 @@ Functions to help with FOXML.
 """
 import logging
 import base64
-from io import BytesIO
 import os
+import re
+import sys
+from collections import defaultdict
+from functools import partial
+from itertools import chain
+from multiprocessing import Pool
+from shutil import copyfileobj
 try:
     from os import scandir as scandir
 except ImportError:
@@ -20,6 +26,9 @@ import dgi_repo.database.delete.datastream_relations as ds_relations_purger
 import dgi_repo.database.write.datastream_relations as ds_relations_writer
 import dgi_repo.database.delete.object_relations as object_relations_purger
 import dgi_repo.database.write.object_relations as object_relations_writer
+import dgi_repo.database.write.relations as relations_writer
+import dgi_repo.database.read.relations as relations_reader
+import dgi_repo.database.delete.relations as relations_purger
 import dgi_repo.database.read.datastreams as datastream_reader
 import dgi_repo.database.write.repo_objects as object_writer
 import dgi_repo.database.read.repo_objects as object_reader
@@ -29,19 +38,23 @@ from dgi_repo.database.read.repo_objects import (object_info_from_raw,
                                                  object_id_from_raw)
 from dgi_repo.exceptions import (ObjectExistsError,
                                  ExternalDatastreamsNotSupported,
-                                 ObjectDoesNotExistError)
+                                 ObjectDoesNotExistError,
+                                 ReferencedObjectDoesNotExistError,
+                                 ReferencedDatastreamDoesNotExist)
 from dgi_repo.fcrepo3.utilities import (write_ds, format_date, RDF_NAMESPACE,
-                                        dsid_from_fedora_uri)
+                                        dsid_from_fedora_uri,
+                                        pid_from_fedora_uri)
 from dgi_repo.database.write.sources import upsert_user, upsert_source
 from dgi_repo.database.utilities import (check_cursor, LITERAL_RDF_OBJECT,
-                                         get_connection)
-from dgi_repo.database.write.log import upsert_log
+                                         get_connection, OBJECT_RELATION_MAP,
+                                         DATASTREAM_RELATION_MAP)
 from dgi_repo.database.read.sources import user
 from dgi_repo import utilities as utils
 from dgi_repo.fcrepo3 import relations
 from dgi_repo.database.relationships import (
     repo_object_rdf_object_from_element,
-    datastream_rdf_object_from_element
+    datastream_rdf_object_from_element,
+    relation_row
 )
 from dgi_repo.configuration import configuration as _config
 from dgi_repo.database.delete.repo_objects import delete_object
@@ -53,16 +66,73 @@ SCHEMA_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
 SCHEMA_LOCATION = ('info:fedora/fedora-system:def/foxml# '
                    'http://www.fedora.info/definitions/1/0/foxml1-1.xsd')
 
+
+def _foxml_tag(localname):
+    """
+    Get the interned, qualified name of a FOXML element.
+    """
+    return sys.intern('{{{0}}}{1}'.format(FOXML_NAMESPACE, localname))
+
+
+DIGITAL_OBJECT_TAG = _foxml_tag('digitalObject')
+OBJECT_PROPERTIES_TAG = _foxml_tag('objectProperties')
+PROPERTY_TAG = _foxml_tag('property')
+DATASTREAM_TAG = _foxml_tag('datastream')
+DATASTREAM_VERSION_TAG = _foxml_tag('datastreamVersion')
+CONTENT_DIGEST_TAG = _foxml_tag('contentDigest')
+CONTENT_LOCATION_TAG = _foxml_tag('contentLocation')
+XML_CONTENT_TAG = _foxml_tag('xmlContent')
+BINARY_CONTENT_TAG = _foxml_tag('binaryContent')
+
+# Enough of stored inline XML to find the start of its document element.
+_INLINE_XML_HEAD_SIZE = 2 ** 16
+# The XML declaration, comments and processing instructions that may lead a
+# document; "rest" starts after the declaration, and a "doctype" or anything
+# but the document element after it prevents copying.
+_XML_PROLOG = re.compile(
+    br'''\A(?:\xef\xbb\xbf)?
+    (?:<\?xml(?:[^>]*?\sencoding\s*=\s*["']?(?P<encoding>[\w.:-]+))?[^>]*\?>)?
+    (?P<rest>(?:\s+|<!--.*?-->|<\?.*?\?>)*)
+    (?P<doctype><!DOCTYPE)?''',
+    re.DOTALL | re.VERBOSE
+)
+# Stored inline XML in these may be copied into UTF-8 FOXML as it is.
+_SPLICEABLE_ENCODINGS = {b'utf-8', b'utf8', b'us-ascii', b'ascii'}
+
+'''
+The tables the relations from each relation datastream are kept in.
+'''
+DC_RELATION_TABLES = sorted(
+    info['table'] for (namespace, _), info in OBJECT_RELATION_MAP.items()
+    if namespace == relations.DC_NAMESPACE
+)
+RELS_EXT_RELATION_TABLES = sorted(
+    info['table'] for (namespace, _), info in OBJECT_RELATION_MAP.items()
+    if namespace != relations.DC_NAMESPACE
+) + ['object_relationships', 'is_sequence_number_of']
+RELS_INT_RELATION_TABLES = sorted(
+    info['table'] for info in DATASTREAM_RELATION_MAP.values()
+) + ['datastream_relationships']
+
 OBJECT_STATE_MAP = {'A': 'Active', 'I': 'Inactive', 'D': 'Deleted'}
 OBJECT_STATE_LABEL_MAP = {'Active': 'A', 'Inactive': 'I', 'Deleted': 'D'}
 
+OBJECT_LOG = 'Object created through FOXML import.'
+DEFAULT_DC_LABEL = 'DC Record'
+DEFAULT_DC_LOG = 'Automatically generated DC.'
+
 
-def import_foxml(xml, source, pid=None, cursor=None):
+def import_foxml(xml, source, pid=None, cursor=None, defer_references=False):
     """
     Create a repo object out of a FOXML file.
+
+    Args:
+        defer_references: Whether to stage relations to objects which do not
+            exist yet, rather than failing; see internalize_rels_ext().
     """
     foxml_importer = etree.XMLParser(
-        target=FoxmlTarget(source, pid=pid, cursor=cursor),
+        target=FoxmlTarget(source, pid=pid, cursor=cursor,
+                           defer_references=defer_references),
         huge_tree=True
     )
     return etree.parse(xml, foxml_importer)
@@ -74,33 +144,40 @@ def create_default_dc_ds(object_id, pid, cursor=None):
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
-    dc_tree = etree.fromstring('''
-        <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
-         xmlns:dc="http://purl.org/dc/elements/1.1/"
-         xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-         xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/oai_dc/
-         http://www.openarchives.org/OAI/2.0/oai_dc.xsd">
-          <dc:identifier></dc:identifier>
-        </oai_dc:dc>
-    ''')
-    dc_tree[0].text = pid
-
-    log = upsert_log('Automatically generated DC.').fetchone()[0]
+    log = cache.log_id(DEFAULT_DC_LOG, cursor=cursor)
 
     filestore.create_datastream_from_data(
         {
             'object': object_id,
             'dsid': 'DC',
-            'label': 'DC Record',
+            'label': DEFAULT_DC_LABEL,
             'log': log,
             'control_group': 'X'
         },
-        etree.tostring(dc_tree),
+        default_dc(pid),
         'application/xml',
         cursor=cursor
     )
 
 
+def default_dc(pid):
+    """
+    Generate the content of a minimal DC DS, as Fedora does.
+    """
+    dc_tree = etree.fromstring('''
+        <oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+         xmlns:dc="http://purl.org/dc/elements/1.1/"
+         xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+         xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/oai_dc/
+         http://www.openarchives.org/OAI/2.0/oai_dc.xsd">
+          <dc:identifier></dc:identifier>
+        </oai_dc:dc>
+    ''')
+    dc_tree[0].text = pid
+
+    return etree.tostring(dc_tree)
+
+
 def generate_foxml(pid, base_url='http://localhost:8080/fedora',
                    archival=False, inline_to_managed=False, cursor=None):
     """
@@ -112,17 +189,22 @@ def generate_foxml(pid, base_url='http://localhost:8080/fedora',
         foxml.write_declaration(version='1.0')
         populate_foxml_etree(foxml, pid, base_url=base_url, archival=archival,
                              inline_to_managed=inline_to_managed,
-                             cursor=cursor)
+                             cursor=cursor, foxml_file=foxml_file)
         foxml_file.seek(0)
         return foxml_file
     return None
 
 
 def populate_foxml_etree(foxml, pid, base_url='http://localhost:8080/fedora',
-                         archival=False, inline_to_managed=False, cursor=None):
+                         archival=False, inline_to_managed=False, cursor=None,
+                         foxml_file=None):
     """
     Add FOXML from a PID into an lxml etree.
 
+    Args:
+        foxml_file: The binary file the lxml xmlfile writes to, if inline XML
+            may be copied straight into it.
+
     Raises:
         ObjectDoesNotExistError: The object doesn't exist.
     """
@@ -140,7 +222,38 @@ def populate_foxml_etree(foxml, pid, base_url='http://localhost:8080/fedora',
             raise ObjectDoesNotExistError(pid)
         populate_foxml_properties(foxml, object_info, cursor=cursor)
         populate_foxml_datastreams(foxml, pid, object_info, base_url, archival,
-                                   inline_to_managed, cursor)
+                                   inline_to_managed, cursor, foxml_file)
+
+
+def write_inline_xml(foxml, path, foxml_file=None):
+    """
+    Write stored inline XML content into FOXML.
+
+    The stored bytes are copied straight into the FOXML file less their XML
+    declaration, unless they can't be: there's no file to write to, content
+    isn't in UTF-8 or has a DOCTYPE, or validate_inline_xml_on_export is set.
+    Then the content is parsed and re-serialized.
+
+    Args:
+        foxml: The lxml xmlfile writer, in the xmlContent element.
+        path: The path of the stored content.
+        foxml_file: The binary file the writer writes to.
+    """
+    if foxml_file is not None and not _config['validate_inline_xml_on_export']:
+        with open(path, 'rb') as content:
+            head = content.read(_INLINE_XML_HEAD_SIZE)
+            prolog = _XML_PROLOG.match(head)
+            encoding = prolog.group('encoding')
+            if (prolog.group('doctype') is None and
+                    head[prolog.end():prolog.end() + 1] == b'<' and
+                    (encoding is None or
+                     encoding.lower() in _SPLICEABLE_ENCODINGS)):
+                foxml.flush()
+                foxml_file.write(head[prolog.start('rest'):])
+                copyfileobj(content, foxml_file)
+                return
+
+    foxml.write(etree.parse(path).getroot())
 
 
 def populate_foxml_properties(foxml, object_info, cursor=None):
@@ -193,7 +306,7 @@ def populate_foxml_properties(foxml, object_info, cursor=None):
 def populate_foxml_datastreams(foxml, pid, object_info,
                                base_url='http://localhost:8080/fedora',
                                archival=False, inline_to_managed=False,
-                               cursor=None):
+                               cursor=None, foxml_file=None):
     """
     Add FOXML datastreams into an lxml etree.
     """
@@ -204,13 +317,13 @@ def populate_foxml_datastreams(foxml, pid, object_info,
         populate_foxml_datastream(foxml, pid, datastream, base_url=base_url,
                                   archival=archival,
                                   inline_to_managed=inline_to_managed,
-                                  cursor=cursor)
+                                  cursor=cursor, foxml_file=foxml_file)
 
 
 def populate_foxml_datastream(foxml, pid, datastream,
                               base_url='http://localhost:8080/fedora',
                               archival=False, inline_to_managed=False,
-                              cursor=None):
+                              cursor=None, foxml_file=None):
     """
     Add a FOXML datastream into an lxml etree.
     """
@@ -262,19 +375,15 @@ def populate_foxml_datastream(foxml, pid, datastream,
 
                 if datastream['control_group'] == 'X' and (not
                                                            inline_to_managed):
-                    content_element = etree.Element(
-                        '{{{0}}}xmlContent'.format(FOXML_NAMESPACE)
-                    )
                     uri = filestore.resolve_uri(resource_info['uri'])
-                    xml_etree = etree.parse(uri)
-                    content_element.append(xml_etree.getroot())
-                    foxml.write(content_element)
+                    with foxml.element(XML_CONTENT_TAG):
+                        write_inline_xml(foxml, uri, foxml_file)
                 elif datastream['control_group'] in ['M', 'X'] and archival:
                     uri = filestore.resolve_uri(resource_info['uri'])
                     with open(uri, 'rb') as ds_file:
                         with foxml.element('{{{0}}}binaryContent'.format(
                                            FOXML_NAMESPACE)):
-                            base64.encode(ds_file, foxml)
+                            utils.base64_encode(ds_file, foxml)
                 else:
                     if datastream['control_group'] == 'R':
                         content_attributes = {
@@ -302,6 +411,8 @@ def populate_foxml_datastream(foxml, pid, datastream,
 def internalize_rels(pid, dsid, source, cursor=None):
     """
     Internalize rels given a ds_db_id.
+
+    Only the relations which changed are written.
     """
     cursor = check_cursor(cursor)
     if dsid not in ['DC', 'RELS-EXT', 'RELS-INT']:
@@ -313,13 +424,14 @@ def internalize_rels(pid, dsid, source, cursor=None):
     ds_info = cursor.fetchone()
     if ds_info is None or ds_info['resource'] is None:
         if dsid == 'DC':
-            internalize_rels_dc(None, object_id, cursor=cursor)
+            internalize_rels_dc(None, object_id, cursor=cursor,
+                                incremental=True)
         elif dsid == 'RELS-INT':
-            internalize_rels_int(etree.parse(None), object_id,
-                                 source, cursor=cursor)
+            internalize_rels_int(None, object_id, source, cursor=cursor,
+                                 incremental=True)
         elif dsid == 'RELS-EXT':
-            internalize_rels_ext(None, object_id, source,
-                                 cursor=cursor)
+            internalize_rels_ext(None, object_id, source, cursor=cursor,
+                                 incremental=True)
         return cursor
     else:
         datastream_reader.resource(ds_info['resource'], cursor=cursor)
@@ -328,27 +440,49 @@ def internalize_rels(pid, dsid, source, cursor=None):
 
     with open(resource_path, 'rb') as relations_file:
         if dsid == 'DC':
-            internalize_rels_dc(relations_file, object_id, cursor=cursor)
+            internalize_rels_dc(relations_file, object_id, cursor=cursor,
+                                incremental=True)
         elif dsid == 'RELS-INT':
             internalize_rels_int(etree.parse(relations_file), object_id,
-                                 source, cursor=cursor)
+                                 source, cursor=cursor, incremental=True)
         elif dsid == 'RELS-EXT':
             internalize_rels_ext(relations_file, object_id, source,
-                                 cursor=cursor)
+                                 cursor=cursor, incremental=True)
 
     return cursor
 
 
 def internalize_rels_int(relation_tree, object_id, source, purge=True,
-                         cursor=None):
+                         cursor=None, defer_references=False,
+                         incremental=False):
     """
     Update the RELS_INT information in the DB.
+
+    Args:
+        defer_references: As for internalize_rels_ext().
+        incremental: As for internalize_rels_ext().
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
     datastream_reader.datastreams(object_id, cursor=cursor)
     ds_db_ids = {row['dsid']: row['id'] for row in cursor}
 
+    if incremental:
+        relations_purger.delete_pending_references(
+            'datastream',
+            ds_db_ids.values(),
+            cursor=cursor
+        )
+        rows = [] if relation_tree is None else list(_rels_int_rows(
+            relation_tree,
+            ds_db_ids,
+            source,
+            cursor,
+            defer_references
+        ))
+        return _sync_relations(RELS_INT_RELATION_TABLES, ds_db_ids.values(),
+                               rows, cursor)
+
     if purge:
         for ds_db_id in ds_db_ids.values():
             # Purge existing relations.
@@ -364,9 +498,20 @@ def internalize_rels_int(relation_tree, object_id, source, purge=True,
             RDF_NAMESPACE
         )])
         for relation in description:
-            rdf_object, rdf_type = datastream_rdf_object_from_element(relation,
-                                                                      source,
-                                                                      cursor)
+            try:
+                rdf_object, rdf_type = datastream_rdf_object_from_element(
+                    relation,
+                    source,
+                    cursor
+                )
+            except (ReferencedObjectDoesNotExistError,
+                    ReferencedDatastreamDoesNotExist):
+                if not defer_references:
+                    raise
+                _defer_reference(relation, DATASTREAM_RELATION_MAP,
+                                 {'datastream': ds_db_ids[dsid]}, cursor)
+                cursor.fetchone()
+                continue
             relation_qname = etree.QName(relation)
             ds_relations_writer.write_relationship(
                 relation_qname.namespace,
@@ -381,12 +526,24 @@ def internalize_rels_int(relation_tree, object_id, source, purge=True,
     return cursor
 
 
-def internalize_rels_dc(relations_file, object_id, purge=True, cursor=None):
+def internalize_rels_dc(relations_file, object_id, purge=True, cursor=None,
+                        incremental=False):
     """
     Update the DC relation information in the DB.
+
+    Args:
+        incremental: As for internalize_rels_ext().
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
+    if incremental:
+        rows = [] if relations_file is None else list(_dc_rows(
+            relations_file,
+            object_id,
+            cursor
+        ))
+        return _sync_relations(DC_RELATION_TABLES, [object_id], rows, cursor)
+
     if purge:
         # Purge existing relations.
         object_relations_purger.delete_dc_relations(object_id, cursor=cursor)
@@ -412,12 +569,34 @@ def internalize_rels_dc(relations_file, object_id, purge=True, cursor=None):
 
 
 def internalize_rels_ext(relations_file, object_id, source, purge=True,
-                         cursor=None):
+                         cursor=None, defer_references=False,
+                         incremental=False):
     """
     Update the RELS_EXT information in the DB.
+
+    Args:
+        defer_references: Whether to stage relations to objects (or their
+            datastreams) which do not exist yet, instead of raising; they are
+            resolved by resolve_pending_references() once they do exist.
+        incremental: Whether to compare the relations against those in the
+            DB, deleting and adding only those which differ, instead of
+            purging (or keeping) all existing relations; purge is ignored.
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
 
+    if incremental:
+        relations_purger.delete_pending_references('object', [object_id],
+                                                   cursor=cursor)
+        rows = [] if relations_file is None else list(_rels_ext_rows(
+            relations_file,
+            object_id,
+            source,
+            cursor,
+            defer_references
+        ))
+        return _sync_relations(RELS_EXT_RELATION_TABLES, [object_id], rows,
+                               cursor)
+
     if purge:
         # Purge existing relations.
         object_relations_purger.delete_object_relations(
@@ -428,235 +607,494 @@ def internalize_rels_ext(relations_file, object_id, source, purge=True,
             return cursor
     # Ingest new relations.
     for relation in etree.parse(relations_file).getroot()[0]:
-        rdf_object, rdf_type = repo_object_rdf_object_from_element(
-            relation,
-            source,
-            cursor
-        )
         relation_qname = etree.QName(relation)
-        object_relations_writer.write_relationship(
-            relation_qname.namespace,
-            relation_qname.localname,
+        try:
+            rdf_object, rdf_type = repo_object_rdf_object_from_element(
+                relation,
+                source,
+                cursor
+            )
+            object_relations_writer.write_relationship(
+                relation_qname.namespace,
+                relation_qname.localname,
+                object_id,
+                rdf_object,
+                rdf_type=rdf_type,
+                cursor=cursor
+            )
+        except (ReferencedObjectDoesNotExistError,
+                ReferencedDatastreamDoesNotExist):
+            if not defer_references:
+                raise
+            _defer_reference(relation, OBJECT_RELATION_MAP,
+                             {'object': object_id}, cursor)
+        cursor.fetchone()
+
+    return cursor
+
+
+def _dc_rows(relations_file, object_id, cursor):
+    """
+    Generate the table and row for each relation in a DC document.
+    """
+    for relation in etree.parse(relations_file).getroot():
+        yield relation_row(
+            OBJECT_RELATION_MAP,
+            'object_relationships',
+            relations.DC_NAMESPACE,
+            etree.QName(relation).localname,
             object_id,
-            rdf_object,
-            rdf_type=rdf_type,
-            cursor=cursor
+            '' if relation.text is None else relation.text,
+            cursor
         )
-        cursor.fetchone()
 
+
+def _rels_ext_rows(relations_file, object_id, source, cursor,
+                   defer_references):
+    """
+    Generate the table and row for each relation in a RELS-EXT document.
+    """
+    for relation in etree.parse(relations_file).getroot()[0]:
+        try:
+            rdf_object, _ = repo_object_rdf_object_from_element(
+                relation,
+                source,
+                cursor
+            )
+        except (ReferencedObjectDoesNotExistError,
+                ReferencedDatastreamDoesNotExist):
+            if not defer_references:
+                raise
+            _defer_reference(relation, OBJECT_RELATION_MAP,
+                             {'object': object_id}, cursor)
+            continue
+        relation_qname = etree.QName(relation)
+        if (relation_qname.namespace ==
+                relations.ISLANDORA_RELS_EXT_NAMESPACE and
+                relation_qname.localname.startswith('isSequenceNumberOf')):
+            almost_pid = relation_qname.localname.split('isSequenceNumberOf',
+                                                        1)[1]
+            paged_pid = utils.rreplace(almost_pid, '_', ':', 1)
+            paged_object = object_reader.object_id_from_raw(
+                paged_pid,
+                cursor=cursor
+            ).fetchone()
+            if paged_object is None:
+                if not defer_references:
+                    raise ReferencedObjectDoesNotExistError(paged_pid)
+                _defer_reference(relation, OBJECT_RELATION_MAP,
+                                 {'object': object_id}, cursor)
+                continue
+            yield ('is_sequence_number_of',
+                   (object_id, paged_object['id'], rdf_object))
+        else:
+            yield relation_row(OBJECT_RELATION_MAP, 'object_relationships',
+                               relation_qname.namespace,
+                               relation_qname.localname, object_id,
+                               rdf_object, cursor)
+
+
+def _rels_int_rows(relation_tree, ds_db_ids, source, cursor,
+                   defer_references):
+    """
+    Generate the table and row for each relation in a RELS-INT document.
+    """
+    for description in relation_tree.getroot():
+        dsid = dsid_from_fedora_uri(description.attrib['{{{}}}about'.format(
+            RDF_NAMESPACE
+        )])
+        for relation in description:
+            try:
+                rdf_object, _ = datastream_rdf_object_from_element(
+                    relation,
+                    source,
+                    cursor
+                )
+            except (ReferencedObjectDoesNotExistError,
+                    ReferencedDatastreamDoesNotExist):
+                if not defer_references:
+                    raise
+                _defer_reference(relation, DATASTREAM_RELATION_MAP,
+                                 {'datastream': ds_db_ids[dsid]}, cursor)
+                continue
+            relation_qname = etree.QName(relation)
+            yield relation_row(DATASTREAM_RELATION_MAP,
+                               'datastream_relationships',
+                               relation_qname.namespace,
+                               relation_qname.localname, ds_db_ids[dsid],
+                               rdf_object, cursor)
+
+
+def _sync_relations(tables, subjects, rows, cursor):
+    """
+    Bring the relations about some subjects in line with those given.
+
+    Rows are compared by their values as text, as the DB gives them.
+
+    Args:
+        tables: The tables the subjects' relations are kept in.
+        subjects: The IDs of the subjects.
+        rows: An iterable of two-tuples of the table and row of each relation
+            wanted, as from relation_row().
+    """
+    wanted = defaultdict(list)
+    for table, row in rows:
+        key = tuple(None if value is None else str(value) for value in row)
+        wanted[(table, key)].append(row)
+
+    stale = defaultdict(list)
+    relations_reader.relation_rows(tables, subjects, cursor=cursor)
+    for current in cursor.fetchall():
+        key = (current['relation_table'], tuple(current['relation_row']))
+        if wanted.get(key):
+            # Already present; no need to write it.
+            wanted[key].pop()
+        else:
+            stale[current['relation_table']].append(current['id'])
+
+    added = defaultdict(list)
+    for (table, _), table_rows in wanted.items():
+        added[table].extend(table_rows)
+
+    for table, ids in stale.items():
+        relations_purger.delete_relation_rows(table, ids, cursor=cursor)
+    for table, table_rows in added.items():
+        if table_rows:
+            relations_writer.write_relation_rows(table, table_rows,
+                                                 cursor=cursor)
+
+    logger.debug('Synced relations about %s: %s deleted, %s added.',
+                 subjects, sum(len(ids) for ids in stale.values()),
+                 sum(len(table_rows) for table_rows in added.values()))
     return cursor
 
 
+def _defer_reference(relation, rel_map, subject, cursor):
+    """
+    Stage a relation whose object could not be found, to resolve later.
+
+    Args:
+        relation: The relation's element.
+        rel_map: The map of relations the relation's predicate is in;
+            "isSequenceNumberOf" relations reference the paged object named
+            by their predicate instead.
+        subject: A dictionary of either the subject "object" or "datastream"
+            ID.
+    """
+    qname = etree.QName(relation)
+    if (qname.namespace == relations.ISLANDORA_RELS_EXT_NAMESPACE and
+            qname.localname.startswith('isSequenceNumberOf')):
+        almost_pid = qname.localname.split('isSequenceNumberOf', 1)[1]
+        reference = {
+            'relation_table': 'is_sequence_number_of',
+            'pid': utils.rreplace(almost_pid, '_', ':', 1),
+            'dsid': None,
+            'sequence_number': relation.text,
+        }
+    else:
+        resource = relation.attrib['{{{}}}resource'.format(RDF_NAMESPACE)]
+        reference = {
+            'relation_table': rel_map[(qname.namespace,
+                                       qname.localname)]['table'],
+            'pid': pid_from_fedora_uri(resource),
+            'dsid': dsid_from_fedora_uri(resource) or None,
+        }
+    reference.update(subject)
+    logger.info('Deferring reference to %s.', reference['pid'])
+    return relations_writer.write_pending_reference(reference, cursor=cursor)
+
+
 class FoxmlTarget(object):
     """
     Parser target for incremental reading/ingest of FOXML.
+
+    Content is written out to the filestore as it is read, and each version
+    stashed as soon as it closes, so only the versions' details are held
+    until their datastream closes.
     """
 
-    def __init__(self, source, pid=None, cursor=None):
+    def __init__(self, source, pid=None, cursor=None, defer_references=False):
         """
         Prep for use.
         """
         self.cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
         self.source = source
+        self.defer_references = defer_references
         self.object_info = {'PID': pid}
         self.ds_info = {}
         self.object_id = None
         self.rels_int = None
         self.ds_file = None
-        self.tree_builder = None
+        self.base64 = None
+        self.xml_file = None
+        self.xml_writer = None
+        self.xml_elements = []
         self.dsid = None
 
     def start(self, tag, attributes, nsmap):
         """
         Grab data from the start of tags.
         """
-        # Start up a file for content.
-        if (tag == '{{{0}}}xmlContent'.format(FOXML_NAMESPACE) and
-                self.dsid != 'AUDIT'):
-            self.tree_builder = etree.TreeBuilder()
-        elif self.tree_builder is not None:
-            self.tree_builder.start(tag, attributes, nsmap)
+        if self.xml_writer is not None:
+            # Serialize inline XML as we go, rather than building up a tree.
+            element = self.xml_writer.element(
+                tag,
+                attributes,
+                # The default namespace is keyed by None when writing.
+                {prefix or None: uri for prefix, uri in nsmap.items()}
+            )
+            element.__enter__()
+            self.xml_elements.append(element)
+            return
+
+        handler = self._START_HANDLERS.get(tag)
+        if handler is not None:
+            handler(self, attributes)
+
+    def end(self, tag):
+        """
+        Internalize data at the end of tags.
 
-        if tag == '{{{0}}}binaryContent'.format(FOXML_NAMESPACE):
-            self.ds_file = utils.SpooledTemporaryFile()
+        Raises:
+            ObjectExistsError: The object already exists.
+        """
+        if self.xml_elements:
+            self.xml_elements.pop().__exit__(None, None, None)
+            return
 
-        if tag == '{{{0}}}contentLocation'.format(FOXML_NAMESPACE):
-            self.ds_info[self.dsid]['versions'][-1]['data_ref'] = attributes
+        handler = self._END_HANDLERS.get(tag)
+        if handler is not None:
+            handler(self)
 
-        # Record current DSID.
-        if tag == '{{{0}}}datastream'.format(FOXML_NAMESPACE):
-            self.dsid = attributes['ID']
-            self.ds_info[attributes['ID']] = {'versions': []}
+    def _start_digital_object(self, attributes):
+        """
+        Note the PID of the object.
+        """
+        if self.object_info['PID'] is None:
+            self.object_info['PID'] = attributes['PID']
+        logger.info('Attempting import of %s.', self.object_info['PID'])
 
-        # Store DS info.
-        if (tag == '{{{0}}}datastream'.format(FOXML_NAMESPACE) and
-                self.dsid != 'AUDIT'):
+    def _start_property(self, attributes):
+        """
+        Store object info.
+        """
+        self.object_info[attributes['NAME']] = attributes['VALUE']
+
+    def _start_datastream(self, attributes):
+        """
+        Record the current DSID, and store DS info.
+        """
+        self.dsid = attributes['ID']
+        self.ds_info[self.dsid] = {'versions': []}
+        if self.dsid != 'AUDIT':
             self.ds_info[self.dsid].update(attributes)
-        if (tag == '{{{0}}}datastreamVersion'.format(FOXML_NAMESPACE) and
-                self.dsid != 'AUDIT'):
+
+    def _start_datastream_version(self, attributes):
+        """
+        Store DS version info.
+        """
+        if self.dsid != 'AUDIT':
             attributes['data'] = None
             attributes['data_ref'] = None
             attributes['checksums'] = []
             self.ds_info[self.dsid]['versions'].append(attributes)
 
-        # Store checksum info.
-        if tag == '{{{0}}}contentDigest'.format(FOXML_NAMESPACE):
-            checksum = {
-                'type': attributes['TYPE'],
-                'checksum': attributes['DIGEST'],
-            }
-            self.ds_info[self.dsid]['versions'][-1]['checksums'].append(
-                checksum
-            )
+    def _start_content_digest(self, attributes):
+        """
+        Store checksum info.
+        """
+        checksum = {
+            'type': attributes['TYPE'],
+            'checksum': attributes['DIGEST'],
+        }
+        self.ds_info[self.dsid]['versions'][-1]['checksums'].append(checksum)
 
-        # Store object info.
-        if tag == '{{{0}}}property'.format(FOXML_NAMESPACE):
-            self.object_info[attributes['NAME']] = attributes['VALUE']
-        if tag == '{{{0}}}digitalObject'.format(FOXML_NAMESPACE):
-            if self.object_info['PID'] is None:
-                self.object_info['PID'] = attributes['PID']
-            logger.info('Attempting import of %s.', self.object_info['PID'])
+    def _start_content_location(self, attributes):
+        """
+        Store where content is to be had from.
+        """
+        self.ds_info[self.dsid]['versions'][-1]['data_ref'] = attributes
 
-    def end(self, tag):
+    def _start_xml_content(self, attributes):
         """
-        Internalize data at the end of tags.
+        Start up a file for inline XML content.
+        """
+        if self.dsid != 'AUDIT':
+            self.ds_file = self._stash_writer()
+            self.xml_file = etree.xmlfile(self.ds_file, encoding='utf-8')
+            self.xml_writer = self.xml_file.__enter__()
+
+    def _start_binary_content(self, attributes):
+        """
+        Start up a file for base64 encoded content.
+        """
+        self.ds_file = self._stash_writer()
+        self.base64 = ''
+
+    def _end_object_properties(self):
+        """
+        Create the object.
 
         Raises:
             ObjectExistsError: The object already exists.
         """
-        # Create the object.
-        if tag == '{{{0}}}objectProperties'.format(FOXML_NAMESPACE):
-            object_db_info = {}
+        object_db_info = {}
 
-            raw_namespace, object_db_info['pid_id'] = utils.break_pid(
-                self.object_info['PID']
-            )
-            object_db_info['namespace'] = cache.repo_object_namespace_id(
-                raw_namespace,
-                cursor=self.cursor
-            )
+        raw_namespace, object_db_info['pid_id'] = utils.break_pid(
+            self.object_info['PID']
+        )
+        object_db_info['namespace'] = cache.repo_object_namespace_id(
+            raw_namespace,
+            cursor=self.cursor
+        )
 
-            raw_log = 'Object created through FOXML import.'
-            upsert_log(raw_log, cursor=self.cursor)
-            object_db_info['log'] = self.cursor.fetchone()[0]
+        object_db_info['log'] = cache.log_id(OBJECT_LOG,
+                                             cursor=self.cursor)
 
-            try:
-                raw_owner = self.object_info['{}{}'.format(
-                    relations.FEDORA_MODEL_NAMESPACE,
-                    relations.OWNER_PREDICATE
-                )]
-            except KeyError:
-                pass
-            else:
-                upsert_user({'name': raw_owner, 'source': self.source},
-                            cursor=self.cursor)
-                object_db_info['owner'] = self.cursor.fetchone()[0]
+        try:
+            raw_owner = self.object_info['{}{}'.format(
+                relations.FEDORA_MODEL_NAMESPACE,
+                relations.OWNER_PREDICATE
+            )]
+        except KeyError:
+            pass
+        else:
+            upsert_user({'name': raw_owner, 'source': self.source},
+                        cursor=self.cursor)
+            object_db_info['owner'] = self.cursor.fetchone()[0]
+
+        try:
+            object_db_info['created'] = self.object_info['{}{}'.format(
+                relations.FEDORA_MODEL_NAMESPACE,
+                relations.CREATED_DATE_PREDICATE
+            )]
+        except KeyError:
+            pass
+
+        try:
+            object_db_info['modified'] = self.object_info['{}{}'.format(
+                relations.FEDORA_VIEW_NAMESPACE,
+                relations.LAST_MODIFIED_DATE_PREDICATE
+            )]
+        except KeyError:
+            pass
 
+        try:
+            object_db_info['state'] = OBJECT_STATE_LABEL_MAP[
+                self.object_info['{}{}'.format(
+                    relations.FEDORA_MODEL_NAMESPACE,
+                    relations.STATE_PREDICATE
+                )]]
+        except KeyError:
             try:
-                object_db_info['created'] = self.object_info['{}{}'.format(
+                object_db_info['state'] = self.object_info['{}{}'.format(
                     relations.FEDORA_MODEL_NAMESPACE,
-                    relations.CREATED_DATE_PREDICATE
+                    relations.STATE_PREDICATE
                 )]
             except KeyError:
                 pass
 
-            try:
-                object_db_info['modified'] = self.object_info['{}{}'.format(
-                    relations.FEDORA_VIEW_NAMESPACE,
-                    relations.LAST_MODIFIED_DATE_PREDICATE
-                )]
-            except KeyError:
-                pass
+        object_db_info['label'] = self.object_info['{}{}'.format(
+            relations.FEDORA_MODEL_NAMESPACE,
+            relations.LABEL_PREDICATE
+        )]
+
+        object_writer.jump_pids(object_db_info['namespace'],
+                                object_db_info['pid_id'],
+                                cursor=self.cursor)
+        try:
+            object_writer.write_object(object_db_info, cursor=self.cursor)
+        except IntegrityError:
+            raise ObjectExistsError(self.object_info['PID'])
+        self.object_id = self.cursor.fetchone()[0]
+
+    def _end_xml_content(self):
+        """
+        Stash inline XML content.
+        """
+        if self.dsid != 'AUDIT':
+            self.xml_file.__exit__(None, None, None)
+            self.xml_file = None
+            self.xml_writer = None
+            self._stash_version()
+
+    def _end_binary_content(self):
+        """
+        Stash base64 encoded content.
+        """
+        self.ds_file.write(base64.b64decode(self.base64))
+        self.base64 = None
+        self._stash_version()
 
+    def _end_datastream(self):
+        """
+        Store old and current DSs, passing off RELS/DC.
+        """
+        if self.dsid == 'AUDIT':
+            return
+        last_ds = self.ds_info[self.dsid]['versions'].pop()
+        last_ds.update(self.ds_info[self.dsid])
+        try:
+            last_ds['actually_created'] = (self.ds_info[self.dsid]
+                                           ['versions'][0]['CREATED'])
+        except IndexError:
             try:
-                object_db_info['state'] = OBJECT_STATE_LABEL_MAP[
-                    self.object_info['{}{}'.format(
-                        relations.FEDORA_MODEL_NAMESPACE,
-                        relations.STATE_PREDICATE
-                    )]]
+                last_ds['actually_created'] = last_ds['CREATED']
             except KeyError:
-                try:
-                    object_db_info['state'] = self.object_info['{}{}'.format(
-                        relations.FEDORA_MODEL_NAMESPACE,
-                        relations.STATE_PREDICATE
-                    )]
-                except KeyError:
-                    pass
-
-            object_db_info['label'] = self.object_info['{}{}'.format(
-                relations.FEDORA_MODEL_NAMESPACE,
-                relations.LABEL_PREDICATE
-            )]
+                last_ds['actually_created'] = None
+                last_ds['CREATED'] = None
 
-            object_writer.jump_pids(object_db_info['namespace'],
-                                    object_db_info['pid_id'],
-                                    cursor=self.cursor)
-            try:
-                object_writer.write_object(object_db_info, cursor=self.cursor)
-            except IntegrityError:
-                raise ObjectExistsError(self.object_info['PID'])
-            self.object_id = self.cursor.fetchone()[0]
-
-        # Stash content.
-        if (tag == '{{{0}}}xmlContent'.format(FOXML_NAMESPACE) and
-                self.dsid != 'AUDIT'):
-            base_element = self.tree_builder.close()
-            xml_ds = BytesIO(etree.tostring(base_element))
-            self.ds_info[self.dsid]['versions'][-1]['data'] = xml_ds
-            self.tree_builder = None
-        elif self.tree_builder is not None:
-            self.tree_builder.end(tag)
-
-        if tag == '{{{0}}}binaryContent'.format(FOXML_NAMESPACE):
-            self.ds_file.seek(0)
-            decoded_file = utils.SpooledTemporaryFile()
-            base64.decode(self.ds_file, decoded_file)
-            self.ds_file.close()
-            self.ds_file = None
-            decoded_file.seek(0)
-            self.ds_info[self.dsid]['versions'][-1]['data'] = decoded_file
-
-        # Store old and current DSs, passing off RELS/DC.
-        if (tag == '{{{0}}}datastream'.format(FOXML_NAMESPACE) and
-                self.dsid != 'AUDIT'):
-            last_ds = self.ds_info[self.dsid]['versions'].pop()
-            last_ds.update(self.ds_info[self.dsid])
-            try:
-                last_ds['actually_created'] = (self.ds_info[self.dsid]
-                                               ['versions'][0]['CREATED'])
-            except IndexError:
-                try:
-                    last_ds['actually_created'] = last_ds['CREATED']
-                except KeyError:
-                    last_ds['actually_created'] = None
-                    last_ds['CREATED'] = None
-
-            # Populate relations.
+        # Populate relations.
+        if self.dsid in ('DC', 'RELS-EXT', 'RELS-INT'):
+            path = (filestore.resolve_uri(last_ds['uri'])
+                    if 'uri' in last_ds else None)
             if self.dsid == 'DC':
-                internalize_rels_dc(last_ds['data'], self.object_id,
+                internalize_rels_dc(path, self.object_id,
                                     purge=False, cursor=self.cursor)
                 self.cursor.fetchall()
             elif self.dsid == 'RELS-EXT':
-                internalize_rels_ext(last_ds['data'], self.object_id,
-                                     self.source, purge=False,
-                                     cursor=self.cursor)
+                internalize_rels_ext(
+                    path,
+                    self.object_id,
+                    self.source,
+                    purge=False,
+                    cursor=self.cursor,
+                    defer_references=self.defer_references
+                )
                 self.cursor.fetchall()
-            elif self.dsid == 'RELS-INT':
-                self.rels_int = etree.parse(last_ds['data'])
-                last_ds['data'].seek(0)
+            else:
+                self.rels_int = etree.parse(path)
 
-            # Write DS.
-            ds_db_id = self._create_ds(last_ds)
+        # Write DS.
+        ds_db_id = self._create_ds(last_ds)
 
-            # Write old DSs.
-            for ds_version in self.ds_info[self.dsid]['versions']:
-                ds_version.update(self.ds_info[self.dsid])
-                ds_version['datastream'] = ds_db_id
-                ds_version['actually_created'] = None
-                self._create_ds(ds_version, old=True)
+        # Write old DSs.
+        for ds_version in self.ds_info[self.dsid]['versions']:
+            ds_version.update(self.ds_info[self.dsid])
+            ds_version['datastream'] = ds_db_id
+            ds_version['actually_created'] = None
+            self._create_ds(ds_version, old=True)
 
-            # Reset current datastream.
-            self.dsid = None
+        # Reset current datastream.
+        self.dsid = None
+
+    # Handlers by tag; anything else outside of inline XML is ignored.
+    _START_HANDLERS = {
+        DIGITAL_OBJECT_TAG: _start_digital_object,
+        PROPERTY_TAG: _start_property,
+        DATASTREAM_TAG: _start_datastream,
+        DATASTREAM_VERSION_TAG: _start_datastream_version,
+        CONTENT_DIGEST_TAG: _start_content_digest,
+        CONTENT_LOCATION_TAG: _start_content_location,
+        XML_CONTENT_TAG: _start_xml_content,
+        BINARY_CONTENT_TAG: _start_binary_content,
+    }
+    _END_HANDLERS = {
+        OBJECT_PROPERTIES_TAG: _end_object_properties,
+        XML_CONTENT_TAG: _end_xml_content,
+        BINARY_CONTENT_TAG: _end_binary_content,
+        DATASTREAM_TAG: _end_datastream,
+    }
 
     def _create_ds(self, ds, old=False):
         """
@@ -680,28 +1118,60 @@ class FoxmlTarget(object):
             prepared_ds['committed'] = ds['CREATED']
         if ds['actually_created'] is not None:
             prepared_ds['created'] = ds['actually_created']
-        write_ds(prepared_ds, old=old, cursor=self.cursor)
+        if 'uri' in ds:
+            # Content has already been stashed.
+            filestore.create_datastream_from_resource(
+                prepared_ds,
+                ds['resource'],
+                checksums=ds['checksums'],
+                old=old,
+                cursor=self.cursor
+            )
+        else:
+            write_ds(prepared_ds, old=old, cursor=self.cursor)
 
         return self.cursor.fetchone()['id']
 
     def data(self, data):
         """
         Handle character data (datastream content).
-
-        @XXX Documentation on buffer size doesn't exist; this may be an issue.
         """
-        # ds_file is None unless we are writing to a file.
-        if self.ds_file is not None:
-            self.ds_file.write(data.encode())
-        elif self.tree_builder is not None:
-            self.tree_builder.data(data)
+        if self.base64 is not None:
+            # Decode as we go, in whole quanta of four characters.
+            self.base64 += ''.join(data.split())
+            whole = len(self.base64) - len(self.base64) % 4
+            if whole:
+                self.ds_file.write(base64.b64decode(self.base64[:whole]))
+                self.base64 = self.base64[whole:]
+        elif self.xml_elements:
+            self.xml_writer.write(data)
 
     def comment(self, data):
         """
         Maintain comments from Inline XML.
         """
-        if self.tree_builder is not None:
-            self.tree_builder.comment(data)
+        if self.xml_elements:
+            self.xml_writer.write(etree.Comment(data))
+
+    def _stash_writer(self):
+        """
+        Start stashing the current datastream version's content.
+        """
+        return filestore.StashWriter(
+            filestore.DATASTREAM_SCHEME,
+            self.ds_info[self.dsid]['versions'][-1]['MIMETYPE'],
+            cursor=self.cursor,
+            # Should the object fail, nothing will reference it.
+            collectable=True
+        )
+
+    def _stash_version(self):
+        """
+        Finish stashing the current datastream version's content.
+        """
+        version = self.ds_info[self.dsid]['versions'][-1]
+        version['resource'], version['uri'] = self.ds_file.close()
+        self.ds_file = None
 
     def close(self):
         """
@@ -720,21 +1190,257 @@ class FoxmlTarget(object):
         # Create RELS-INT relations once all DSs are made.
         if self.rels_int is not None:
             internalize_rels_int(self.rels_int, self.object_id, self.source,
-                                 purge=False, cursor=self.cursor)
+                                 purge=False, cursor=self.cursor,
+                                 defer_references=self.defer_references)
             self.cursor.fetchall()
         # Reset for next use.
         try:
             pid = self.object_info['PID']
         except KeyError as e:
             raise ValueError from e
-        self.__init__(self.cursor, self.source)
+        self.__init__(self.source, cursor=self.cursor,
+                      defer_references=self.defer_references)
 
         return pid
 
 
+def foxml_paths(info):
+    """
+    Get the paths of the FOXML files to ingest, in order.
+
+    Args:
+        info: The path of either a FOXML file or a directory structure
+            containing FOXML files.
+    """
+    def scan(directory):
+        for entry in scandir(directory):
+            if entry.is_dir():
+                yield from scan(entry.path)
+            else:
+                yield entry
+
+    if os.path.isdir(info):
+        return sorted(ent.path for ent in scan(info) if ent.is_file())
+    else:
+        return [info]
+
+
+def foxml_header(path):
+    """
+    Cheaply read the PID of a FOXML file and those it references.
+
+    Only RELS-EXT references which must resolve to an existing object on
+    ingest are considered; the rest of the document is parsed but not kept.
+
+    Returns:
+        A two-tuple of the PID (None if it could not be found) and a set of
+        the PIDs referenced.
+    """
+    pid = None
+    references = set()
+    dsid = None
+    resource = '{{{}}}resource'.format(RDF_NAMESPACE)
+
+    for event, element in etree.iterparse(path, events=('start', 'end'),
+                                          huge_tree=True):
+        if event == 'end':
+            if element.tag == DATASTREAM_TAG and dsid == 'RELS-EXT':
+                break
+            # Content can be large; don't hold onto it.
+            element.clear()
+        elif element.tag == DIGITAL_OBJECT_TAG:
+            pid = element.get('PID')
+        elif element.tag == DATASTREAM_TAG:
+            dsid = element.get('ID')
+        elif dsid == 'RELS-EXT':
+            qname = etree.QName(element)
+            if (qname.namespace == relations.ISLANDORA_RELS_EXT_NAMESPACE and
+                    qname.localname.startswith('isSequenceNumberOf')):
+                almost_pid = qname.localname.split('isSequenceNumberOf', 1)[1]
+                references.add(utils.rreplace(almost_pid, '_', ':', 1))
+            elif ((qname.namespace, qname.localname) in OBJECT_RELATION_MAP and
+                    element.get(resource) is not None):
+                referenced_pid = pid_from_fedora_uri(element.get(resource))
+                if referenced_pid:
+                    references.add(referenced_pid)
+
+    references.discard(pid)
+    return pid, references
+
+
+def foxml_dependencies(paths):
+    """
+    Pre-scan FOXML files for which of them reference which others.
+
+    Returns:
+        A dictionary mapping each path to the set of paths it depends on.
+    """
+    headers = {}
+    for path in paths:
+        try:
+            headers[path] = foxml_header(path)
+        except etree.XMLSyntaxError as e:
+            logger.warning('Failed to pre-scan %s: %s', path, e)
+            headers[path] = (None, set())
+
+    paths_by_pid = {pid: path for path, (pid, _) in headers.items()
+                    if pid is not None}
+    return {
+        path: {paths_by_pid[reference] for reference in references
+               if reference in paths_by_pid} - {path}
+        for path, (_, references) in headers.items()
+    }
+
+
+def ingest_waves(dependencies):
+    """
+    Order paths into waves, each depending only on those before it.
+
+    The paths within a wave are independent of each other, so may be
+    ingested in parallel.
+
+    Args:
+        dependencies: A dictionary mapping each path to the set of paths it
+            depends on, as from foxml_dependencies().
+
+    Returns:
+        A two-tuple of the list of waves (each a sorted list of paths) and a
+        list of cycles amongst the paths left over (each a list of paths,
+        ending as it began). Paths left over are either in a cycle or depend
+        on one.
+    """
+    dependents = {path: set() for path in dependencies}
+    for path, path_dependencies in dependencies.items():
+        for dependency in path_dependencies:
+            dependents[dependency].add(path)
+
+    remaining = {path: len(path_dependencies)
+                 for path, path_dependencies in dependencies.items()}
+    waves = []
+    wave = sorted(path for path, count in remaining.items() if not count)
+    while wave:
+        waves.append(wave)
+        next_wave = []
+        for path in wave:
+            del remaining[path]
+            for dependent in dependents[path]:
+                remaining[dependent] -= 1
+                if not remaining[dependent]:
+                    next_wave.append(dependent)
+        wave = sorted(next_wave)
+
+    # Everything left has a dependency left, so following them must loop.
+    cycles = []
+    in_cycles = set()
+    for path in sorted(remaining):
+        walk = [path]
+        seen = {path: 0}
+        while True:
+            path = min(dependency for dependency in dependencies[walk[-1]]
+                       if dependency in remaining)
+            if path in seen:
+                cycle = walk[seen[path]:] + [path]
+                break
+            seen[path] = len(walk)
+            walk.append(path)
+        if not in_cycles.intersection(cycle):
+            in_cycles.update(cycle)
+            cycles.append(cycle)
+
+    return waves, cycles
+
+
+def schedule_ingest(info):
+    """
+    Get the waves in which to ingest FOXML, reporting any cycles.
+
+    Paths involved with cycles are left to a final wave, in which they can
+    be expected to fail on their references.
+
+    Returns:
+        A two-tuple of the list of waves and the dependencies they came from.
+    """
+    dependencies = foxml_dependencies(foxml_paths(info))
+    waves, cycles = ingest_waves(dependencies)
+    for cycle in cycles:
+        logger.error('FOXML references form a cycle: %s.', ' -> '.join(cycle))
+    leftover = sorted(set(dependencies) - set(chain.from_iterable(waves)))
+    if leftover:
+        logger.warning('%s files are in or depend on cycles: %s.',
+                       len(leftover), ', '.join(leftover))
+        waves.append(leftover)
+    logger.info('Scheduled %s files to ingest in %s waves.',
+                len(dependencies), len(waves))
+    return waves, dependencies
+
+
+def _import_path(path, source, force, cursor, defer_references=False,
+                 savepoint='subtransaction'):
+    """
+    Ingest a FOXML file within a savepoint, handling existing objects.
+
+    Returns:
+        The PID ingested; or None if the object already existed and was
+        left be.
+    """
+    try:
+        cursor.execute('SAVEPOINT {}'.format(savepoint))
+        pid = import_foxml(path, source, cursor=cursor,
+                           defer_references=defer_references)
+    except ObjectExistsError as e:
+        logger.warning('Object already exists "%s".', e.pid)
+        cache.rollback(cursor, savepoint)
+        if not force:
+            return None
+        logger.debug('Purging and reingesting %s.', e.pid)
+
+        object_id_from_raw(e.pid, cursor=cursor)
+        object_id = cursor.fetchone()[0]
+
+        # Out with the old.
+        delete_object(object_id, cursor=cursor)
+
+        # In with the new.
+        pid = import_foxml(path, source, cursor=cursor,
+                           defer_references=defer_references)
+    finally:
+        cursor.execute('RELEASE SAVEPOINT {}'.format(savepoint))
+
+    logger.info('Ingested %s.', pid)
+    return pid
+
+
+_worker_connection = None
+
+
+def _import_in_worker(path, source, force, defer_references):
+    """
+    Ingest a FOXML file in its own transaction, in a worker process.
+
+    Returns:
+        A three-tuple of the path, the PID ingested (None if the object was
+        left be) and the error on failure (otherwise None).
+    """
+    global _worker_connection
+    if _worker_connection is None or _worker_connection.closed:
+        _worker_connection = get_connection(
+            isolation_level=ISOLATION_LEVEL_READ_COMMITTED
+        )
+    try:
+        with _worker_connection, _worker_connection.cursor() as cursor:
+            return path, _import_path(path, source, force, cursor,
+                                      defer_references), None
+    except Exception as e:
+        # IDs cached during the transaction are being rolled back.
+        cache.clear_cache()
+        logger.exception('Failed to ingest %s.', path)
+        return path, None, '{}: {}'.format(type(e).__name__, e)
+
+
 @click.command(help=('Ingest FOXML, passed as "F". "F" can indicate either a '
                      'directory structure containing FOXML files, or a single'
-                     ' FOXML file to ingest.'))
+                     ' FOXML file to ingest. Objects are ingested after those '
+                     'they reference.'))
 @click.argument('info', metavar='f', type=click.Path(exists=True))
 @click.option('--source', default=None, type=int,
               help=('The ID of the source as which to ingest the files. '
@@ -742,6 +1448,17 @@ class FoxmlTarget(object):
 @click.option('--force', is_flag=True, default=False, type=bool,
               help=('Force the ingest of the object, purging first if need '
                     'be.'), show_default=True)
+@click.option('--defer-references', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Instead of ordering objects after those they reference, '
+                    'stage references to objects which do not exist yet and '
+                    'resolve them once all the files have been ingested.'))
+@click.option('--jobs', default=1, type=int, show_default=True,
+              help=('The number of objects to ingest at a time. With more '
+                    'than one, each object is committed on its own and '
+                    'failures are skipped over (along with anything '
+                    'referencing them); otherwise, everything is committed '
+                    'together, or not at all.'))
 @click.option('--index', is_flag=True, default=False, type=bool,
               help=('Index objects after ingest.'), show_default=True)
 @click.option('--gsearch-url', show_default=True,
@@ -753,37 +1470,21 @@ class FoxmlTarget(object):
 @click.option('--gsearch-password', default='islandora', show_default=True,
               envvar='GSEARCH_PASSWORD',
               help='Password to hit the GSearch endpoint.')
-def import_file(info, source, force, index, gsearch_url, gsearch_user,
-                gsearch_password):
+def import_file(info, source, force, defer_references, jobs, index,
+                gsearch_url, gsearch_user, gsearch_password):
     utils.bootstrap()
 
-    if index:
-        pids = list()
-
-        def _import_foxml(*args, **kwargs):
-            pid = import_foxml(*args, **kwargs)
-            logger.info('Ingested %s.', pid)
-            pids.append(pid)
+    if defer_references:
+        paths = foxml_paths(info)
+        waves, dependencies = [paths], {path: set() for path in paths}
     else:
-        def _import_foxml(*args, **kwargs):
-            pid = import_foxml(*args, **kwargs)
-            logger.info('Ingested %s.', pid)
-
-    def scan(directory):
-        for entry in scandir(directory):
-            if entry.is_dir():
-                yield from scan(entry.path)
-            else:
-                yield entry
-
-    def get_paths():
-        if os.path.isdir(info):
-            return sorted(ent.path for ent in scan(info) if ent.is_file())
-        else:
-            return [info]
+        waves, dependencies = schedule_ingest(info)
+    pids = list()
 
+    if jobs > 1:
+        # Fork the workers before connecting, so they share no connection.
+        pool = Pool(jobs)
     conn = get_connection(isolation_level=ISOLATION_LEVEL_READ_COMMITTED)
-    savepoint = 'subtransaction'
     with conn, conn.cursor() as cursor:
         if source is None:
             source = upsert_source(
@@ -791,27 +1492,49 @@ def import_file(info, source, force, index, gsearch_url, gsearch_user,
                 cursor=cursor
             ).fetchone()['id']
 
-        for path in get_paths():
-            try:
-                cursor.execute('SAVEPOINT {}'.format(savepoint))
-                _import_foxml(path, source, cursor=cursor)
-            except ObjectExistsError as e:
-                logger.warning('Object already exists "%s".', e.pid)
-                cache.clear_cache()
-                cursor.execute('ROLLBACK TO SAVEPOINT {}'.format(savepoint))
-                if force:
-                    logger.debug('Purging and reingesting %s.', e.pid)
-
-                    object_id_from_raw(e.pid, cursor=cursor)
-                    object_id = cursor.fetchone()[0]
-
-                    # Out with the old.
-                    delete_object(object_id, cursor=cursor)
-
-                    # In with the new.
-                    _import_foxml(path, source, cursor=cursor)
-            finally:
-                cursor.execute('RELEASE SAVEPOINT {}'.format(savepoint))
+        if jobs <= 1:
+            for path in chain.from_iterable(waves):
+                pid = _import_path(path, source, force, cursor,
+                                   defer_references)
+                if pid is not None:
+                    pids.append(pid)
+
+    if jobs > 1:
+        failed = set()
+        with pool:
+            for wave in waves:
+                ready = []
+                for path in wave:
+                    if dependencies[path] & failed:
+                        logger.error('Skipping %s as it references objects '
+                                     'which failed to ingest.', path)
+                        failed.add(path)
+                    else:
+                        ready.append(path)
+                for path, pid, error in pool.imap_unordered(
+                        partial(_import_in_worker, source=source,
+                                force=force,
+                                defer_references=defer_references),
+                        ready):
+                    if error is not None:
+                        failed.add(path)
+                    elif pid is not None:
+                        pids.append(pid)
+        if failed:
+            logger.error('%s files failed to ingest: %s.', len(failed),
+                         ', '.join(sorted(failed)))
+
+    if defer_references:
+        with conn, conn.cursor() as cursor:
+            resolved = relations_writer.resolve_pending_references(
+                cursor=cursor
+            ).fetchone()['resolved']
+            logger.info('Resolved %s deferred references.', resolved)
+            unresolved = [row['pid'] for row in
+                          relations_reader.pending_reference_pids(cursor)]
+            if unresolved:
+                logger.warning('References to %s objects remain pending: %s.',
+                               len(unresolved), ', '.join(unresolved))
 
     if index:
         s = requests.Session()
@@ -0,0 +1,308 @@
+"""
+Listing of the members of collections (and other objects), and of the pages
+of paged objects.
+"""
+import logging
+from io import BytesIO
+
+import falcon
+import simplejson as json
+from lxml import etree
+
+import dgi_repo.database.read.object_relations as object_relation_reader
+import dgi_repo.database.read.repo_objects as object_reader
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database.utilities import get_connection
+from dgi_repo.fcrepo3.utilities import bounded_int_param, stream_response
+
+logger = logging.getLogger(__name__)
+
+'''
+A mapping of the output formats we support to their content types.
+'''
+FORMATS = {
+    'json': 'application/json',
+    'xml': 'application/xml',
+}
+
+
+class MembersResource(object):
+    """
+    Falcon resource for listing the members of an object.
+    """
+    def on_get(self, req, resp, pid):
+        """
+        Respond with a page of the members of the object.
+
+        Query parameters:
+        - "depth": How many levels of membership to follow (by either
+            isMemberOfCollection or isMemberOf); 1 (the default) for direct
+            members only, up to the configured "max_depth".
+        - "limit": The number of members per page, up to the configured
+            "max_page_size".
+        - "after": The "next" token from the previous page, if any.
+        - "format": One of "json" (the default) or "xml".
+
+        Each member has its PID, label, models and the depth at which it was
+        found. The response ends with the token for the "next" page, which
+        is empty on the last page. The body is streamed as the members are
+        read from the database.
+        """
+        members_config = _config['collection_members']
+        output_format = _output_format(req)
+        depth = bounded_int_param(req, 'depth', 1,
+                                  members_config['max_depth'])
+        limit = bounded_int_param(req, 'limit', members_config['page_size'],
+                                  members_config['max_page_size'])
+        after = bounded_int_param(req, 'after', None)
+
+        connection, object_id = _connect(pid)
+        try:
+            # XXX: Named cursor must _not_ be closed... so no "with".
+            cursor = connection.cursor(name=__name__)
+            object_relation_reader.collection_members(
+                object_id,
+                depth=depth,
+                after=after,
+                limit=limit,
+                cursor=cursor
+            )
+        except:
+            connection.close()
+            raise
+
+        batches = iter(
+            lambda: cursor.fetchmany(members_config['itersize']),
+            []
+        )
+        resp.content_type = FORMATS[output_format]
+        resp.stream = stream_response(
+            _MEMBER_SERIALIZERS[output_format](batches, limit),
+            connection.close,
+            'a listing of members'
+        )
+
+
+class PagesResource(object):
+    """
+    Falcon resource for listing the pages of an object.
+    """
+    def on_get(self, req, resp, pid):
+        """
+        Respond with the pages of the object, in sequence.
+
+        Query parameters:
+        - "dsid": Datastream IDs to list for each page, where present; may be
+            repeated or comma-separated. All are listed if none are given.
+        - "format": One of "json" (the default) or "xml".
+
+        Each page has its PID, label, sequence number and datastream IDs. The
+        body is streamed as the pages are read from the database.
+        """
+        itersize = _config['collection_members']['itersize']
+        output_format = _output_format(req)
+        dsids = req.get_param_as_list('dsid')
+
+        connection, object_id = _connect(pid)
+        try:
+            # XXX: Named cursor must _not_ be closed... so no "with".
+            cursor = connection.cursor(name=__name__)
+            object_relation_reader.ordered_pages(object_id, dsids,
+                                                 cursor=cursor)
+        except:
+            connection.close()
+            raise
+
+        batches = iter(lambda: cursor.fetchmany(itersize), [])
+        resp.content_type = FORMATS[output_format]
+        resp.stream = stream_response(
+            _PAGE_SERIALIZERS[output_format](batches),
+            connection.close,
+            'a listing of pages'
+        )
+
+
+def _output_format(req):
+    """
+    Get the requested output format.
+
+    Raises:
+        falcon.HTTPInvalidParam: The format is not one of our FORMATS.
+    """
+    output_format = req.get_param('format') or 'json'
+    if output_format not in FORMATS:
+        raise falcon.HTTPInvalidParam(
+            'Must be one of: {}.'.format(', '.join(sorted(FORMATS))),
+            'format'
+        )
+    return output_format
+
+
+def _connect(pid):
+    """
+    Get a read-only connection, and the database ID of the object.
+
+    Raises:
+        falcon.HTTPNotFound: The object does not exist.
+    """
+    connection = get_connection()
+    try:
+        connection.set_session(readonly=True)
+        with connection.cursor() as cursor:
+            try:
+                object_info = object_reader.object_id_from_raw(
+                    pid,
+                    cursor=cursor
+                ).fetchone()
+            except ValueError as e:
+                raise falcon.HTTPNotFound() from e
+        if object_info is None:
+            raise falcon.HTTPNotFound()
+    except:
+        connection.close()
+        raise
+    return connection, object_info['id']
+
+
+class _Page(object):
+    """
+    Track the members of a page, to give the token of the next one.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.last = None
+
+    def members(self, batches):
+        """
+        Generate the batches of members, while tracking them.
+        """
+        for members in batches:
+            self.count += len(members)
+            self.last = members[-1]['id']
+            yield members
+
+    @property
+    def next(self):
+        """
+        The token of the next page; None if this is the last.
+        """
+        return str(self.last) if self.count >= self.limit else None
+
+
+def _member(row):
+    """
+    Get the details of a member from its row.
+    """
+    return {
+        'pid': row['pid'],
+        'label': row['label'],
+        'models': row['models'],
+        'depth': row['depth'],
+    }
+
+
+def _json_members(batches, limit):
+    """
+    Serialize batches of members into a JSON object.
+    """
+    page = _Page(limit)
+    yield '{"members":['
+    separator = ''
+    for members in page.members(batches):
+        yield separator + ','.join(
+            json.dumps(_member(member)) for member in members
+        )
+        separator = ','
+    yield '],"next":{}}}'.format(json.dumps(page.next))
+
+
+def _xml_members(batches, limit):
+    """
+    Serialize batches of members into an XML document.
+    """
+    page = _Page(limit)
+    buffer = BytesIO()
+    with etree.xmlfile(buffer, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('members'):
+            for members in page.members(batches):
+                for member in members:
+                    with xf.element('member', pid=member['pid'],
+                                    depth=str(member['depth'])):
+                        if member['label'] is not None:
+                            with xf.element('label'):
+                                xf.write(member['label'])
+                        for model in member['models']:
+                            with xf.element('model'):
+                                xf.write(model)
+                xf.flush()
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            with xf.element('next'):
+                if page.next is not None:
+                    xf.write(page.next)
+    yield buffer.getvalue()
+
+
+def _page(row):
+    """
+    Get the details of a page from its row.
+    """
+    return {
+        'pid': row['pid'],
+        'label': row['label'],
+        'sequence_number': row['sequence_number'],
+        'dsids': row['dsids'],
+    }
+
+
+def _json_pages(batches):
+    """
+    Serialize batches of pages into a JSON object.
+    """
+    yield '{"pages":['
+    separator = ''
+    for pages in batches:
+        yield separator + ','.join(json.dumps(_page(page)) for page in pages)
+        separator = ','
+    yield ']}'
+
+
+def _xml_pages(batches):
+    """
+    Serialize batches of pages into an XML document.
+    """
+    buffer = BytesIO()
+    with etree.xmlfile(buffer, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('pages'):
+            for pages in batches:
+                for page in pages:
+                    attributes = {'pid': page['pid']}
+                    if page['sequence_number'] is not None:
+                        attributes['sequence'] = str(page['sequence_number'])
+                    with xf.element('page', attributes):
+                        if page['label'] is not None:
+                            with xf.element('label'):
+                                xf.write(page['label'])
+                        for dsid in page['dsids']:
+                            with xf.element('datastream', dsid=dsid):
+                                pass
+                xf.flush()
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
+
+
+_MEMBER_SERIALIZERS = {
+    'json': _json_members,
+    'xml': _xml_members,
+}
+
+_PAGE_SERIALIZERS = {
+    'json': _json_pages,
+    'xml': _xml_pages,
+}
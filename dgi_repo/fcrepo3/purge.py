@@ -0,0 +1,260 @@
+"""
+Bulk purging of objects.
+
+Objects are selected by namespace, collection, content model or PID, and
+deleted in set-based batches; objects still referenced by others are held
+back until those others are gone.
+"""
+import logging
+
+import click
+import falcon
+import simplejson as json
+
+import dgi_repo.database.delete.repo_objects as object_purger
+import dgi_repo.database.read.datastreams as ds_reader
+import dgi_repo.database.read.object_relations as object_relation_reader
+from dgi_repo import utilities as utils
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database.filestore import purge_all
+from dgi_repo.database.utilities import get_connection
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 500
+
+FEDORA_URI_PREFIX = 'info:fedora/'
+
+
+def read_pid_file(pid_file):
+    """
+    Read PIDs from a file, one to a line.
+
+    Blank lines and those starting with "#" are ignored, and PIDs may be
+    given as "info:fedora/" URIs.
+
+    Raises:
+        ValueError: A line is not a PID.
+    """
+    pids = []
+    for line in pid_file:
+        pid = line.strip()
+        if not pid or pid.startswith('#'):
+            continue
+        if pid.startswith(FEDORA_URI_PREFIX):
+            pid = pid[len(FEDORA_URI_PREFIX):]
+        utils.break_pid(pid)
+        pids.append(pid)
+    return pids
+
+
+def select_objects(namespaces=(), collections=(), models=(), pids=(),
+                   descendants=False):
+    """
+    Get the objects matching any of the given criteria.
+
+    Returns:
+        A dict mapping the database IDs of the objects to their PIDs, newest
+        first.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        rows = object_relation_reader.selected_objects(
+            namespaces,
+            collections,
+            models,
+            pids,
+            descendants=descendants,
+            cursor=cursor
+        ).fetchall()
+    return {row['id']: row['pid'] for row in rows}
+
+
+def purge_objects(object_ids, batch_size=PURGE_BATCH_SIZE, collect=False,
+                  connection=None):
+    """
+    Purge objects in batches, those referenced by others after them.
+
+    Each pass deletes, a batch to a transaction, those of the remaining
+    objects which nothing references; deleting them may free others to go in
+    the next pass. Once a pass deletes nothing, those left are referenced
+    from outside of the selection (or only by each other) and are skipped.
+
+    Args:
+        object_ids: The database IDs of the objects to purge, in the order to
+            try them.
+        batch_size: The number of objects to delete per transaction.
+        collect: Whether to immediately delete the resources left
+            unreferenced by the purged objects, instead of leaving them to
+            garbage collection.
+        connection: The database connection to use, if not a new one.
+
+    Returns:
+        A two-tuple of the number of objects purged and a list of the IDs of
+        those skipped.
+    """
+    if connection is None:
+        connection = get_connection()
+    remaining = list(object_ids)
+    total = len(remaining)
+    purged = 0
+    skipped = []
+
+    while remaining:
+        deferred = []
+        for index in range(0, len(remaining), batch_size):
+            batch = remaining[index:index + batch_size]
+            released = []
+            with connection, connection.cursor() as cursor:
+                referenced = {
+                    row['id'] for row in
+                    object_relation_reader.referenced_objects(batch,
+                                                              cursor=cursor)
+                }
+                deletable = [object_id for object_id in batch
+                             if object_id not in referenced]
+                if deletable:
+                    if collect:
+                        released = [row['resource'] for row in
+                                    ds_reader.object_resources(deletable,
+                                                               cursor=cursor)]
+                    object_purger.delete_objects(deletable, cursor=cursor)
+            deferred.extend(object_id for object_id in batch
+                            if object_id in referenced)
+            purged += len(deletable)
+            logger.info('Purged %s of %s objects.', purged, total)
+
+            if released:
+                _collect(released, connection)
+
+        if len(deferred) == len(remaining):
+            skipped = deferred
+            break
+        remaining = deferred
+
+    return purged, skipped
+
+
+def _collect(resource_ids, connection):
+    """
+    Delete those of the given resources which are no longer referenced.
+    """
+    with connection, connection.cursor() as cursor:
+        garbage = [row['id'] for row in
+                   ds_reader.unreferenced_resources(resource_ids,
+                                                    cursor=cursor)]
+    purge_all(garbage)
+    logger.info('Deleted %s released resources.', len(garbage))
+
+
+class PurgeResource(object):
+    """
+    Falcon resource for our bulk purge endpoint.
+    """
+    def on_post(self, req, resp):
+        """
+        Purge the objects selected by the POST'd JSON, responding with JSON.
+
+        POST'd JSON is expected to have the "application/json" Content-Type
+        header set, and to be an object with any of the properties:
+        - "namespaces", "collections", "models" and "pids": Lists, as for the
+            "dgi_repo_purge" command's options of the same (singular) names,
+        - "descendants" and "gc": Booleans, as for the options of the same
+            names, and
+        - "batch_size": The number of objects to delete per transaction.
+
+        The response is an object with the number "purged", and a list of the
+        PIDs "skipped" as they are still referenced.
+
+        Only configured users may purge in bulk.
+        """
+        identity = req.env['wsgi.identity']
+        if identity.site != _config['configured_users']['source']:
+            raise falcon.HTTPForbidden(
+                'Forbidden',
+                'Only configured users may purge in bulk.'
+            )
+        if req.content_type != 'application/json':
+            raise falcon.HTTPUnsupportedMediaType(
+                'Only "application/json" is supported on this endpoint.'
+            )
+        info = json.load(req.stream)
+        selectors = {key: info.get(key, []) for key in
+                     ('namespaces', 'collections', 'models', 'pids')}
+        if not any(selectors.values()):
+            raise falcon.HTTPBadRequest(
+                'Nothing selected',
+                'At least one of "namespaces", "collections", "models" or '
+                '"pids" is required.'
+            )
+        try:
+            batch_size = int(info.get('batch_size', PURGE_BATCH_SIZE))
+            if batch_size < 1:
+                raise ValueError(batch_size)
+            for pid in selectors['pids']:
+                utils.break_pid(pid)
+        except (TypeError, ValueError) as e:
+            raise falcon.HTTPBadRequest('Bad request', str(e)) from e
+
+        objects = select_objects(descendants=info.get('descendants', False),
+                                 **selectors)
+        purged, skipped = purge_objects(objects, batch_size,
+                                        collect=info.get('gc', False))
+
+        resp.content_type = 'application/json'
+        resp.body = json.dumps({
+            'purged': purged,
+            'skipped': [objects[object_id] for object_id in skipped],
+        })
+
+
+@click.command(help=('Purge objects in bulk. Objects are selected by any of '
+                     'the given criteria; those still referenced from '
+                     'outside of the selection are skipped.'))
+@click.option('--namespace', multiple=True,
+              help='Select all objects in the namespace. May be repeated.')
+@click.option('--collection', multiple=True,
+              help=('Select the members of the collection with the given '
+                    'PID. May be repeated.'))
+@click.option('--model', multiple=True,
+              help=('Select the objects of the content model with the given '
+                    'PID. May be repeated.'))
+@click.option('--pid-file', type=click.File('r'),
+              help=('Select the objects listed in the file, one PID to a '
+                    'line; "-" reads from standard input.'))
+@click.option('--descendants', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Also select, recursively, the members, constituents and '
+                    'pages of those selected.'))
+@click.option('--batch-size', default=PURGE_BATCH_SIZE,
+              type=click.IntRange(min=1), show_default=True,
+              help='The number of objects to delete per transaction.')
+@click.option('--gc', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Delete the resources released by the purged objects '
+                    'immediately, instead of leaving them for '
+                    'dgi_repo_gc.'))
+@click.option('--dry-run', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help='List the selected PIDs without purging them.')
+def purge(namespace, collection, model, pid_file, descendants, batch_size, gc,
+          dry_run):
+    utils.bootstrap()
+    pids = read_pid_file(pid_file) if pid_file else []
+    if not (namespace or collection or model or pids):
+        raise click.UsageError('Nothing selected.')
+
+    objects = select_objects(namespace, collection, model, pids, descendants)
+    logger.info('Selected %s objects.', len(objects))
+    if dry_run:
+        for pid in objects.values():
+            click.echo(pid)
+        return
+
+    purged, skipped = purge_objects(objects, batch_size, collect=gc)
+    for object_id in skipped:
+        logger.warning('Skipped %s as it is referenced.', objects[object_id])
+    logger.info('Purged %s objects; skipped %s.', purged, len(skipped))
+
+
+if __name__ == '__main__':
+    purge()
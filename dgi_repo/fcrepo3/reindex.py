@@ -0,0 +1,309 @@
+"""
+Reindexing objects in GSearch, in parallel.
+
+Objects are enumerated from the database (all of them, some namespaces, a
+list of PIDs, or those changed since a checkpoint in the change log) and
+dispatched to GSearch's updateIndex operation by a pool of threads, with
+retries.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+import click
+import requests
+import simplejson as json
+
+import dgi_repo.database.read.changes as change_reader
+import dgi_repo.database.read.repo_objects as object_reader
+from dgi_repo import utilities as utils
+from dgi_repo.database.utilities import get_connection
+from dgi_repo.fcrepo3.purge import read_pid_file
+
+logger = logging.getLogger(__name__)
+
+REINDEX_BATCH_SIZE = 1000
+
+'''
+The GSearch updateIndex actions, by whether the object is to be deleted from
+the index.
+'''
+GSEARCH_ACTIONS = {
+    False: 'fromPid',
+    True: 'deletePid',
+}
+
+
+class GSearchIndexer(object):
+    """
+    Dispatch updateIndex requests to GSearch concurrently.
+    """
+    def __init__(self, url, auth=None, jobs=4, retries=3, backoff=1.0):
+        """
+        Args:
+            url: The URL of GSearch's REST endpoint.
+            auth: A (username, password) tuple, if needed.
+            jobs: The number of requests to make at a time.
+            retries: The number of times to retry a failed request.
+            backoff: The seconds to wait before the first retry, doubling for
+                each after.
+        """
+        self.url = url
+        self.auth = auth
+        self.jobs = jobs
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+
+    def _session(self):
+        """
+        Get the requests session of the current thread.
+        """
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def index(self, task):
+        """
+        (Re)index or delete one object, retrying on failure.
+
+        Args:
+            task: A two-tuple of the PID of the object and whether to delete
+                it from the index.
+
+        Returns:
+            A two-tuple of the PID and the error of the last attempt; None if
+            it succeeded.
+        """
+        pid, delete = task
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self._session().get(
+                    self.url,
+                    auth=self.auth,
+                    params={
+                        'operation': 'updateIndex',
+                        'action': GSEARCH_ACTIONS[delete],
+                        'value': pid,
+                    }
+                )
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if (response.status_code == requests.codes.okay and
+                        'exception' not in response.text):
+                    return pid, None
+                error = 'HTTP {}'.format(response.status_code)
+            logger.debug('Attempt %s to index %s failed: %s', attempt + 1,
+                         pid, error)
+        return pid, error
+
+    def index_all(self, batches, checkpoint=None):
+        """
+        Index the objects of each batch, one batch at a time.
+
+        Args:
+            batches: An iterable of two-tuples: a list of tasks, as taken by
+                index(), and the position in the change log to checkpoint
+                once they are done (or None).
+            checkpoint: The path of the file to save positions to, if any.
+                Positions stop being saved once any object fails, so a later
+                run picks up from before the first failure.
+
+        Returns:
+            A two-tuple of the number of objects indexed, and a list of the
+            PIDs of those which failed.
+        """
+        indexed = 0
+        failed = []
+        started = time.monotonic()
+        with ThreadPool(self.jobs) as pool:
+            for tasks, position in batches:
+                for pid, error in pool.imap_unordered(self.index, tasks):
+                    if error is None:
+                        indexed += 1
+                    else:
+                        logger.error('Failed to index %s: %s', pid, error)
+                        failed.append(pid)
+                if (checkpoint is not None and position is not None and
+                        not failed):
+                    save_checkpoint(checkpoint, position)
+                elapsed = time.monotonic() - started
+                logger.info('Indexed %s objects (%.1f/s); %s failed.',
+                            indexed, indexed / elapsed if elapsed else 0,
+                            len(failed))
+        return indexed, failed
+
+
+def load_checkpoint(path):
+    """
+    Read a position in the change log from a checkpoint file.
+
+    Returns:
+        The position, as taken by changes_since(); that of the start of the
+        log if the file doesn't exist.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return 0, 0
+    return checkpoint['transaction'], checkpoint['id']
+
+
+def save_checkpoint(path, position):
+    """
+    Write a position in the change log to a checkpoint file.
+
+    The file is replaced, rather than rewritten, so it is never left partly
+    written.
+    """
+    transaction, change_id = position
+    temporary_path = '{}.tmp'.format(path)
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump({'transaction': transaction, 'id': change_id},
+                  checkpoint_file)
+    os.replace(temporary_path, path)
+
+
+def _batched(iterable, batch_size):
+    """
+    Generate lists of up to batch_size items of the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def pid_batches(namespaces=None, batch_size=REINDEX_BATCH_SIZE,
+                connection=None):
+    """
+    Generate batches of tasks to index all objects, or those in namespaces.
+    """
+    if connection is None:
+        connection = get_connection()
+    with connection:
+        # XXX: Named cursor must _not_ be closed... so no "with".
+        cursor = connection.cursor(name='reindex_pids')
+        object_reader.object_pids(namespaces, cursor=cursor)
+        for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+            yield [(row['pid'], False) for row in rows], None
+
+
+def change_batches(position, batch_size=REINDEX_BATCH_SIZE, connection=None):
+    """
+    Generate batches of tasks for the changes after the position.
+
+    Each object changed within a batch is indexed once, or deleted from the
+    index if it was last purged.
+    """
+    if connection is None:
+        connection = get_connection()
+    with connection:
+        # XXX: Named cursor must _not_ be closed... so no "with".
+        cursor = connection.cursor(name='reindex_changes')
+        change_reader.changes_since(*position, cursor=cursor)
+        for changes in iter(lambda: cursor.fetchmany(batch_size), []):
+            purged = {}
+            for change in changes:
+                # Purging a datastream is a change to its object.
+                purged[change['pid']] = (change['purged'] and
+                                         change['dsid'] is None)
+            last = changes[-1]
+            yield list(purged.items()), (last['transaction'], last['id'])
+
+
+def latest_position():
+    """
+    Get the position of the latest change, or the start of the log.
+    """
+    with get_connection() as conn, conn.cursor() as cursor:
+        latest = change_reader.latest_change(cursor=cursor).fetchone()
+    return (latest['transaction'], latest['id']) if latest else (0, 0)
+
+
+@click.command(help=('Reindex objects in GSearch, in parallel. Indexes all '
+                     'objects unless some are selected.'))
+@click.option('--namespace', multiple=True,
+              help='Index the objects in the namespace. May be repeated.')
+@click.option('--pid-file', type=click.File('r'),
+              help=('Index the objects listed in the file, one PID to a '
+                    'line; "-" reads from standard input.'))
+@click.option('--changes', is_flag=True, default=False, type=bool,
+              show_default=True,
+              help=('Index the objects changed since the checkpoint, or '
+                    'since the start of the change log without one; deleting '
+                    'those purged.'))
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help=('The file in which to keep the position in the change '
+                    'log, so later runs with --changes start from it. It is '
+                    'saved after each batch of changes, or at the end of a '
+                    'run without --changes; but not past any object which '
+                    'failed to index.'))
+@click.option('--jobs', default=4, type=click.IntRange(min=1),
+              show_default=True,
+              help='The number of objects to index at a time.')
+@click.option('--retries', default=3, type=click.IntRange(min=0),
+              show_default=True,
+              help='The number of times to retry indexing an object.')
+@click.option('--batch-size', default=REINDEX_BATCH_SIZE,
+              type=click.IntRange(min=1), show_default=True,
+              help=('The number of objects to read from the database at a '
+                    'time.'))
+@click.option('--gsearch-url', show_default=True,
+              default='http://localhost:8080/fedoragsearch/rest',
+              help='The URL to the GSearch endpoint.')
+@click.option('--gsearch-user', default='fedoraAdmin', show_default=True,
+              help='Username to hit the GSearch endpoint.')
+@click.option('--gsearch-password', default='islandora', show_default=True,
+              envvar='GSEARCH_PASSWORD',
+              help='Password to hit the GSearch endpoint.')
+def reindex(namespace, pid_file, changes, checkpoint, jobs, retries,
+            batch_size, gsearch_url, gsearch_user, gsearch_password):
+    utils.bootstrap()
+    if changes and (namespace or pid_file):
+        raise click.UsageError(
+            '--changes may not be combined with other selections.'
+        )
+
+    final_position = None
+    if changes:
+        position = load_checkpoint(checkpoint) if checkpoint else (0, 0)
+        logger.info('Indexing changes after position %s.', position)
+        batches = change_batches(position, batch_size)
+    else:
+        if checkpoint:
+            # Anything changed from here on is picked up by --changes.
+            final_position = latest_position()
+        if pid_file:
+            batches = ((tasks, None) for tasks in _batched(
+                ((pid, False) for pid in read_pid_file(pid_file)),
+                batch_size
+            ))
+        else:
+            batches = pid_batches(namespace or None, batch_size)
+
+    indexer = GSearchIndexer(gsearch_url, (gsearch_user, gsearch_password),
+                             jobs=jobs, retries=retries)
+    indexed, failed = indexer.index_all(batches, checkpoint)
+    if final_position is not None and not failed:
+        save_checkpoint(checkpoint, final_position)
+
+    logger.info('Indexed %s objects; %s failed.', indexed, len(failed))
+    if failed:
+        logger.error('Failed to index: %s', ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    reindex()
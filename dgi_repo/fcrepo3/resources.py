@@ -53,7 +53,7 @@ class SoapAccessResource(api.FakeSoapResource):
                         xf.write(base64.encodebytes(uri.encode()))
                     else:
                         with open(filestore.resolve_uri(uri), 'rb') as ds_file:
-                            base64.encode(ds_file, xf)
+                            utils.base64_encode(ds_file, xf)
                 with xf.element('header'):
                     # Element doesn't appear to be necessary, nor appear to
                     # contain anything necessary here... Unclear as to what
@@ -110,7 +110,8 @@ class SoapManagementResource(api.FakeSoapResource):
             with xf.element('{{{0}}}exportResponse'.format(
                     api.FEDORA_TYPES_URI)):
                 with xf.element('objectXML'):
-                    base64.encode(foxml.generate_foxml(kwargs['pid']), xf)
+                    utils.base64_encode(foxml.generate_foxml(kwargs['pid']),
+                                        xf)
 
 
 @route('/upload')
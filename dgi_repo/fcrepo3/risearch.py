@@ -0,0 +1,297 @@
+"""
+A resource index endpoint, after Fedora's "/risearch".
+
+Queries are compiled to SQL over the relation tables (see
+dgi_repo.fcrepo3.sparql), so results reflect the repository as soon as
+changes are committed.
+"""
+import csv
+import io
+import logging
+import re
+from itertools import chain
+from urllib.parse import parse_qs
+
+import falcon
+from lxml import etree
+from psycopg2 import DatabaseError, ProgrammingError
+
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database.utilities import (get_connection, LITERAL_RDF_OBJECT,
+                                         RAW_RDF_OBJECT)
+from dgi_repo.exceptions import MalformedQueryError
+from dgi_repo.fcrepo3.sparql import compile_query, XSD_NAMESPACE
+from dgi_repo.fcrepo3.utilities import format_date, stream_response
+
+logger = logging.getLogger(__name__)
+
+'''
+A mapping of the output formats we support to their content types.
+'''
+FORMATS = {
+    'Sparql': 'application/sparql-results+xml; charset=UTF-8',
+    'CSV': 'text/csv; charset=UTF-8',
+    'count': 'text/plain; charset=UTF-8',
+}
+
+SPARQL_RESULT_NAMESPACE = 'http://www.w3.org/2001/sw/DataAccess/rf1/result'
+
+_URI = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:\S*$')
+
+
+class RISearchResource(object):
+    """
+    Falcon resource for our resource index endpoint.
+    """
+    def on_get(self, req, resp):
+        """
+        Respond to a query given in the query string.
+        """
+        self._respond(req.params, resp)
+
+    def on_post(self, req, resp):
+        """
+        Respond to a query given in the query string or a POST'd form.
+        """
+        params = dict(req.params)
+        if (req.content_type or '').startswith(
+                'application/x-www-form-urlencoded'):
+            form = parse_qs(req.stream.read().decode('utf-8'))
+            params.update((key, values[-1]) for key, values in form.items())
+        self._respond(params, resp)
+
+    def _respond(self, params, resp):
+        """
+        Respond to the query in the parameters.
+
+        Parameters are as Fedora's:
+        - "type": "tuples"; triples are not supported,
+        - "lang": "sparql"; iTQL is not supported,
+        - "format": One of "Sparql" (the default), "CSV" or "count",
+        - "query": The query,
+        - "limit": The most results to respond with, and
+        - "distinct": "on" to drop duplicate results.
+
+        Results are streamed as they are read from the database.
+        """
+        if _param(params, 'type', 'tuples') != 'tuples':
+            raise falcon.HTTPInvalidParam('Only "tuples" is supported.',
+                                          'type')
+        if _param(params, 'lang', 'sparql').lower() != 'sparql':
+            raise falcon.HTTPInvalidParam('Only "sparql" is supported.',
+                                          'lang')
+        output_format = _param(params, 'format', 'Sparql')
+        formats = {name.lower(): name for name in FORMATS}
+        if output_format.lower() not in formats:
+            raise falcon.HTTPInvalidParam(
+                'Must be one of: {}.'.format(', '.join(sorted(FORMATS))),
+                'format'
+            )
+        output_format = formats[output_format.lower()]
+        query = _param(params, 'query')
+        if not query:
+            raise falcon.HTTPMissingParam('query')
+        limit = _param(params, 'limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError(limit)
+            except ValueError:
+                raise falcon.HTTPInvalidParam('Must be a positive integer.',
+                                              'limit')
+        distinct = _param(params, 'distinct', 'off').lower() in ('on', 'true')
+
+        try:
+            compiled = compile_query(query, limit=limit, distinct=distinct)
+            if output_format == 'Sparql':
+                _check_result_names(compiled.variables)
+        except MalformedQueryError as e:
+            raise falcon.HTTPBadRequest('Malformed query', str(e)) from e
+
+        sql = compiled.sql
+        if output_format == 'count':
+            sql = 'SELECT count(*) FROM ({}) AS results'.format(sql)
+
+        connection = get_connection()
+        try:
+            batches = _execute(connection, sql, compiled.params)
+        except:
+            connection.close()
+            raise
+
+        resp.content_type = FORMATS[output_format]
+        resp.stream = stream_response(
+            _SERIALIZERS[output_format](compiled.variables, batches),
+            connection.close,
+            'resource index results'
+        )
+
+
+def _param(params, name, default=None):
+    """
+    Get the last value of a parameter.
+    """
+    value = params.get(name, default)
+    if isinstance(value, list):
+        return value[-1]
+    return value
+
+
+def _execute(connection, sql, params):
+    """
+    Run the compiled query, fetching the first batch of rows.
+
+    The first batch is fetched here, before anything is sent, so that most
+    query errors can still be reported with a relevant status.
+
+    Returns:
+        An iterator of lists of rows.
+
+    Raises:
+        falcon.HTTPBadRequest: The query was invalid; for example, comparing
+            literals which can't be.
+        falcon.HTTPInternalServerError: The query otherwise failed.
+    """
+    connection.set_session(readonly=True)
+    with connection.cursor() as settings_cursor:
+        settings_cursor.execute('SET LOCAL statement_timeout = %s',
+                                (_config['risearch']['statement_timeout'],))
+    itersize = _config['risearch']['itersize']
+    # XXX: Named cursor must _not_ be closed... so no "with".
+    cursor = connection.cursor(name=__name__)
+    try:
+        cursor.execute(sql, params)
+        first = cursor.fetchmany(itersize)
+    except ProgrammingError as pe:
+        raise falcon.HTTPBadRequest(
+            'Bad query',
+            (pe.diag.message_primary if pe.diag.message_primary
+             else str(pe))
+        )
+    except DatabaseError as de:
+        raise falcon.HTTPInternalServerError(
+            'Query failed',
+            (de.diag.message_primary if de.diag.message_primary
+             else str(de))
+        )
+    return chain([first], iter(lambda: cursor.fetchmany(itersize), []))
+
+
+def _term(value, kind):
+    """
+    Get an RDF term from a value of a result.
+
+    Returns:
+        A three-tuple of the term's text, whether it is a URI and its
+        datatype, if any; or None if the value is unbound.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return ('true' if value else 'false', False, XSD_NAMESPACE + 'boolean')
+    if isinstance(value, int):
+        return str(value), False, XSD_NAMESPACE + 'int'
+    if hasattr(value, 'astimezone'):
+        return format_date(value), False, XSD_NAMESPACE + 'dateTime'
+    if kind == LITERAL_RDF_OBJECT:
+        return str(value), False, None
+    if kind == RAW_RDF_OBJECT:
+        # The general relation tables don't record which values were URIs.
+        return str(value), bool(_URI.match(str(value))), None
+    return str(value), True, None
+
+
+def _sparql_chunks(variables, batches):
+    """
+    Serialize batches of results as SPARQL results XML, as Fedora does.
+    """
+    buffer = io.BytesIO()
+    with etree.xmlfile(buffer, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('sparql', nsmap={None: SPARQL_RESULT_NAMESPACE}):
+            with xf.element('head'):
+                for name, _ in variables:
+                    xf.write(etree.Element('variable', name=name))
+            with xf.element('results'):
+                for rows in batches:
+                    for row in rows:
+                        xf.write(_sparql_result(variables, row))
+                    xf.flush()
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _check_result_names(variables):
+    """
+    Check the variables can name the elements of Sparql results.
+
+    Raises:
+        MalformedQueryError: A variable's name isn't a valid XML name, as
+            SPARQL allows; e.g., "?1st".
+    """
+    for name, _ in variables:
+        try:
+            etree.Element(name)
+        except ValueError as e:
+            raise MalformedQueryError(
+                'Variable "?{}" is not a valid XML name, so can\'t be given '
+                'in the "Sparql" format.'.format(name)
+            ) from e
+
+
+def _sparql_result(variables, row):
+    """
+    Build the element for a result.
+    """
+    result = etree.Element('result')
+    for (name, kind), value in zip(variables, row):
+        term = _term(value, kind)
+        binding = etree.SubElement(result, name)
+        if term is None:
+            binding.set('bound', 'false')
+            continue
+        text, is_uri, datatype = term
+        if is_uri:
+            binding.set('uri', text)
+        else:
+            binding.text = text
+            if datatype is not None:
+                binding.set('datatype', datatype)
+    return result
+
+
+def _csv_chunks(variables, batches):
+    """
+    Serialize batches of results as CSV, with a header row.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in variables])
+    for rows in chain([[]], batches):
+        for row in rows:
+            terms = (_term(value, kind) for (_, kind), value in
+                     zip(variables, row))
+            writer.writerow(['' if term is None else term[0]
+                             for term in terms])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _count_chunks(variables, batches):
+    """
+    Serialize the count of results.
+    """
+    for rows in batches:
+        for row in rows:
+            yield '{}\n'.format(row[0])
+
+
+_SERIALIZERS = {
+    'Sparql': _sparql_chunks,
+    'CSV': _csv_chunks,
+    'count': _count_chunks,
+}
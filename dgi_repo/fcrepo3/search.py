@@ -0,0 +1,281 @@
+"""
+Searching for objects, after Fedora's findObjects.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import re
+from io import BytesIO
+
+import falcon
+import simplejson as json
+from lxml import etree
+from psycopg2 import DataError
+
+import dgi_repo.database.read.repo_objects as object_reader
+from dgi_repo.configuration import configuration as _config
+from dgi_repo.database.utilities import get_connection
+from dgi_repo.exceptions import MalformedQueryError
+from dgi_repo.fcrepo3.api import FEDORA_TYPES_URI
+from dgi_repo.fcrepo3.utilities import format_date, stream_response
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = frozenset(['cDate', 'mDate'])
+
+'''
+All the fields, in the order Fedora lists them.
+'''
+FIELDS = list(object_reader.OBJECT_FIELDS) + [
+    'title', 'creator', 'subject', 'description', 'publisher', 'contributor',
+    'date', 'type', 'format', 'identifier', 'source', 'language', 'relation',
+    'coverage', 'rights',
+]
+
+_CONDITION = re.compile(r"""
+    (?P<field>\w+)
+    (?P<operator>>=|<=|=|~|>|<)
+    (?:'(?P<quoted>(?:[^']|'')*)'|(?P<value>[^'\s]\S*))
+    (?:\s+|$)
+""", re.VERBOSE)
+
+
+class FindObjectsResource(object):
+    """
+    Falcon resource for searching objects.
+    """
+    def on_get(self, req, resp):
+        """
+        Respond with a page of the objects matching a search.
+
+        Query parameters are as Fedora's:
+        - "query": Conditions separated by spaces; see parse_query(),
+        - "terms": A phrase (with "*" and "?" wildcards) any field must
+            contain; used if there is no "query",
+        - "maxResults": The number of objects per page, up to the configured
+            "max_page_size",
+        - "sessionToken": The token from the previous page, if any; the
+            search must be the same,
+        - "resultFormat": "xml"; HTML is not supported, and
+        - "pid", "label", "title", etc.: "true" for each of the fields to
+            list for each object; only "pid" is listed if none are given.
+
+        Pages are found by their last object, rather than by offset, so each
+        is as quick as the first. The body is streamed as the objects are
+        read from the database; so, the "listSession" follows the
+        "resultList", rather than preceding it as in Fedora's responses.
+        """
+        find_config = _config['find_objects']
+        if (req.get_param('resultFormat') or 'xml') != 'xml':
+            raise falcon.HTTPInvalidParam('Only "xml" is supported.',
+                                          'resultFormat')
+        try:
+            conditions = parse_query(req.get_param('query') or '')
+        except MalformedQueryError as e:
+            raise falcon.HTTPInvalidParam(str(e), 'query') from e
+        terms = None if conditions else req.get_param('terms')
+        if terms in ('', '*'):
+            terms = None
+
+        limit = req.get_param_as_int('maxResults')
+        if limit is None:
+            limit = find_config['page_size']
+        if limit < 1:
+            raise falcon.HTTPInvalidParam('Must be at least 1.', 'maxResults')
+        limit = min(limit, find_config['max_page_size'])
+
+        search = _fingerprint(conditions, terms)
+        after, position = None, 0
+        if req.get_param('sessionToken'):
+            after, position = decode_token(req.get_param('sessionToken'),
+                                           search)
+
+        fields = [field for field in FIELDS
+                  if req.get_param_as_bool(field)] or ['pid']
+        dc_fields = [field for field in fields
+                     if field in object_reader.DC_FIELD_TABLES]
+
+        connection = get_connection()
+        try:
+            connection.set_session(readonly=True)
+            # XXX: Named cursor must _not_ be closed... so no "with".
+            cursor = connection.cursor(name=__name__)
+            object_reader.find_objects(conditions, terms, dc_fields,
+                                       after=after, limit=limit, cursor=cursor)
+            first = cursor.fetchmany(find_config['itersize'])
+        except DataError as e:
+            connection.close()
+            # Such as malformed dates.
+            raise falcon.HTTPInvalidParam(
+                e.diag.message_primary or str(e), 'query'
+            ) from e
+        except:
+            connection.close()
+            raise
+
+        batches = iter(
+            lambda: cursor.fetchmany(find_config['itersize']),
+            []
+        )
+        resp.content_type = 'text/xml'
+        resp.stream = stream_response(
+            _xml_results(_chain(first, batches), fields, limit, position,
+                         search),
+            connection.close,
+            'search results'
+        )
+
+
+def parse_query(query):
+    """
+    Parse the conditions of a findObjects query.
+
+    Conditions are separated by spaces, each of a field, an operator and a
+    value: for example, "pid~islandora:* cDate>=2016-01-01 title~'a b'".
+    Values with spaces are quoted with single quotes; quotes in them are
+    doubled. Operators are "=", "~" (wildcard match, with "*" and "?"), and
+    "<", ">", "<=" or ">=".
+
+    Returns:
+        A list of (field, operator, value) tuples.
+
+    Raises:
+        MalformedQueryError: The query is malformed, or its fields or
+            operators unsupported.
+    """
+    conditions = []
+    query = query.strip()
+    position = 0
+    while position < len(query):
+        match = _CONDITION.match(query, position)
+        if match is None:
+            raise MalformedQueryError(
+                'Malformed condition: {!r}.'.format(query[position:])
+            )
+        position = match.end()
+        field, operator = match.group('field', 'operator')
+        if match.group('quoted') is not None:
+            value = match.group('quoted').replace("''", "'")
+        else:
+            value = match.group('value')
+        if field not in FIELDS:
+            raise MalformedQueryError('Unknown field: {}.'.format(field))
+        if operator == '~' and field in DATE_FIELDS:
+            raise MalformedQueryError(
+                'Dates may not be matched with "~": {}.'.format(field)
+            )
+        conditions.append((field, operator, value))
+    return conditions
+
+
+def encode_token(after, position, search):
+    """
+    Make the session token of the page after the given object.
+
+    Args:
+        after: The database ID of the last object of the page.
+        position: The number of objects before the next page.
+        search: The fingerprint of the search.
+    """
+    token = json.dumps([after, position, search]).encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii')
+
+
+def decode_token(token, search):
+    """
+    Read a session token.
+
+    Returns:
+        A two-tuple of the database ID of the object after which the page
+        starts, and the number of objects before it.
+
+    Raises:
+        falcon.HTTPInvalidParam: The token is malformed, or from another
+            search.
+    """
+    try:
+        after, position, token_search = json.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+        )
+        if not (isinstance(after, int) and isinstance(position, int)):
+            raise ValueError(token)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise falcon.HTTPInvalidParam('Malformed token.',
+                                      'sessionToken') from e
+    if token_search != search:
+        raise falcon.HTTPInvalidParam('Token is from another search.',
+                                      'sessionToken')
+    return after, position
+
+
+def _fingerprint(conditions, terms):
+    """
+    Identify a search, so its tokens aren't used for another.
+    """
+    search = json.dumps([conditions, terms]).encode('utf-8')
+    return hashlib.sha1(search).hexdigest()[:16]
+
+
+def _chain(first, batches):
+    """
+    Generate the first batch of objects, if any, then the rest.
+    """
+    if first:
+        yield first
+        yield from batches
+
+
+def _values(row, field):
+    """
+    Get the values of a field of an object.
+    """
+    if field == 'pid':
+        values = [row['pid']]
+    elif field == 'label':
+        values = [row['label']]
+    elif field == 'state':
+        values = [row['state']]
+    elif field == 'ownerId':
+        values = [row['owner']]
+    elif field == 'cDate':
+        values = [row['created']]
+    elif field == 'mDate':
+        values = [row['modified']]
+    else:
+        values = row[field]
+    return [format_date(value) if hasattr(value, 'astimezone') else value
+            for value in values if value is not None]
+
+
+def _xml_results(batches, fields, limit, position, search):
+    """
+    Serialize batches of objects into a findObjects result.
+    """
+    count = 0
+    last = None
+    buffer = BytesIO()
+    with etree.xmlfile(buffer, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('result', nsmap={None: FEDORA_TYPES_URI}):
+            with xf.element('resultList'):
+                for rows in batches:
+                    for row in rows:
+                        with xf.element('objectFields'):
+                            for field in fields:
+                                for value in _values(row, field):
+                                    with xf.element(field):
+                                        xf.write(value)
+                    count += len(rows)
+                    last = rows[-1]['id']
+                    xf.flush()
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            if count >= limit:
+                with xf.element('listSession'):
+                    with xf.element('token'):
+                        xf.write(encode_token(last, position + count, search))
+                    with xf.element('cursor'):
+                        xf.write(str(position))
+    yield buffer.getvalue()
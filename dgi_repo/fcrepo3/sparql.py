@@ -0,0 +1,1048 @@
+"""
+Compilation of resource index queries to SQL.
+
+Covers the subset of SPARQL Islandora sends to Fedora's resource index:
+SELECT queries of basic graph patterns, with UNION, OPTIONAL and FILTER,
+ordered and limited. Rather than a separate triplestore, triples are read
+where they already are: predicates with tables of their own from those
+tables, others from the general relation tables, and the properties Fedora
+indexes of objects (label, state, owner, dates) and their datastreams from
+the objects and datastreams tables.
+"""
+import re
+from collections import namedtuple, OrderedDict
+
+from dgi_repo import utilities as utils
+from dgi_repo.database.read.object_relations import (
+    REPO_OBJECT_RDF_OBJECT_TABLES
+)
+from dgi_repo.database.relationships import USER_PREDICATES, ROLE_PREDICATES
+from dgi_repo.database.utilities import (OBJECT_RELATION_MAP,
+                                         DATASTREAM_RELATION_MAP,
+                                         LITERAL_RDF_OBJECT, URI_RDF_OBJECT,
+                                         RAW_RDF_OBJECT, OBJECT_RDF_OBJECT,
+                                         DATASTREAM_RDF_OBJECT)
+from dgi_repo.exceptions import MalformedQueryError
+from dgi_repo.fcrepo3 import relations
+from dgi_repo.fcrepo3.utilities import (RDF_NAMESPACE, FEDORA_URI_PREFIX,
+                                        dsid_from_fedora_uri)
+
+XSD_NAMESPACE = 'http://www.w3.org/2001/XMLSchema#'
+
+'''
+Prefixes Fedora's resource index expands, even without declaration and in
+angle brackets; for example: <fedora-model:hasModel>.
+'''
+BUILTIN_PREFIXES = {
+    'fedora': FEDORA_URI_PREFIX,
+    'fedora-model': relations.FEDORA_MODEL_NAMESPACE,
+    'fedora-rels-ext': relations.FEDORA_RELS_EXT_NAMESPACE,
+    'fedora-view': relations.FEDORA_VIEW_NAMESPACE,
+    'dc': relations.DC_NAMESPACE,
+    'rdf': RDF_NAMESPACE,
+    'xml-schema': XSD_NAMESPACE,
+    'xsd': XSD_NAMESPACE,
+}
+
+'''
+SQL types of the literals in the relation tables, where not text.
+'''
+LITERAL_TYPES = {
+    'date_issued': 'timestamp with time zone',
+    'defer_derivatives': 'boolean',
+    'generate_ocr': 'boolean',
+    'is_page_number': 'integer',
+    'is_section': 'integer',
+    'is_sequence_number': 'integer',
+    'image_height': 'integer',
+    'image_width': 'integer',
+}
+
+'''
+SQL types of typed literals in queries, by their datatype.
+'''
+DATATYPES = {
+    XSD_NAMESPACE + 'int': 'integer',
+    XSD_NAMESPACE + 'integer': 'integer',
+    XSD_NAMESPACE + 'long': 'bigint',
+    XSD_NAMESPACE + 'decimal': 'numeric',
+    XSD_NAMESPACE + 'boolean': 'boolean',
+    XSD_NAMESPACE + 'dateTime': 'timestamp with time zone',
+}
+
+SEQUENCE_NUMBER_OF_PREDICATE = 'isSequenceNumberOf'
+
+OBJECT_STATE_URIS = {
+    'A': relations.FEDORA_MODEL_NAMESPACE + 'Active',
+    'I': relations.FEDORA_MODEL_NAMESPACE + 'Inactive',
+    'D': relations.FEDORA_MODEL_NAMESPACE + 'Deleted',
+}
+
+'''
+Matches values of the general relation tables which are URIs, rather than
+literals; the tables do not record which they were.
+'''
+URI_PATTERN = '^[A-Za-z][A-Za-z0-9+.-]*:[^[:space:]]*$'
+
+Var = namedtuple('Var', 'name')
+Iri = namedtuple('Iri', 'value')
+Literal = namedtuple('Literal', 'value datatype')
+Triple = namedtuple('Triple', 'subject predicate object')
+Group = namedtuple('Group', 'elements')
+Union = namedtuple('Union', 'groups')
+Optional = namedtuple('Optional', 'group')
+Filter = namedtuple('Filter', 'expression')
+Call = namedtuple('Call', 'function arguments')
+Query = namedtuple('Query', 'variables distinct where order limit offset')
+
+'''
+The SQL of a compiled query, its parameters, and its variables as a list of
+(name, kind) tuples; the kind being one of OBJECT_RDF_OBJECT,
+DATASTREAM_RDF_OBJECT, URI_RDF_OBJECT, LITERAL_RDF_OBJECT or RAW_RDF_OBJECT
+(either of the last two).
+'''
+CompiledQuery = namedtuple('CompiledQuery', 'sql params variables')
+
+_Binding = namedtuple('_Binding', 'expression kind type')
+_Property = namedtuple('_Property', 'source subject object subject_kind '
+                                    'object_kind object_type conditions')
+
+_TOKENS = re.compile(r'''
+    (?P<space>\s+|\#[^\n]*) |
+    (?P<iri><[^<>"{}|^`\\\s]*>) |
+    (?P<var>[?$]\w+) |
+    (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*') |
+    (?P<language>@[A-Za-z]+(?:-[A-Za-z0-9]+)*) |
+    (?P<number>[+-]?\d+(?:\.\d+)?) |
+    (?P<pname>(?:[A-Za-z][\w.-]*)?:(?:[\w-](?:[\w.-]*[\w-])?)?) |
+    (?P<name>[A-Za-z_]\w*) |
+    (?P<punctuation>\^\^|&&|\|\||!=|<=|>=|[{}().;,*=<>!])
+''', re.VERBOSE)
+
+_ESCAPES = re.compile(r'\\(.)')
+_ESCAPED = {'t': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+_COMPARISONS = frozenset(['=', '!=', '<', '>', '<=', '>='])
+
+
+def parse_query(query):
+    """
+    Parse a SPARQL SELECT query.
+
+    Returns:
+        A Query.
+
+    Raises:
+        MalformedQueryError: The query is malformed, or uses SPARQL beyond the
+            supported subset.
+    """
+    return _Parser(query).query()
+
+
+def compile_query(query, limit=None, distinct=False):
+    """
+    Compile a SPARQL SELECT query to SQL.
+
+    Args:
+        query: The query, as a string.
+        limit: The most results to give, if fewer than the query's own
+            limit.
+        distinct: Whether to give only distinct results, regardless of the
+            query.
+
+    Returns:
+        A CompiledQuery.
+
+    Raises:
+        MalformedQueryError: The query is malformed, or uses SPARQL beyond the
+            supported subset.
+    """
+    parsed = parse_query(query)
+    if limit is not None:
+        limit = limit if parsed.limit is None else min(limit, parsed.limit)
+        parsed = parsed._replace(limit=limit)
+    if distinct:
+        parsed = parsed._replace(distinct=True)
+    return _Compiler().query(parsed)
+
+
+class _Parser(object):
+    """
+    Recursive descent parser for our subset of SPARQL.
+    """
+    def __init__(self, query):
+        self.tokens = list(self._tokenize(query))
+        self.position = 0
+        self.prefixes = dict(BUILTIN_PREFIXES)
+
+    @staticmethod
+    def _tokenize(query):
+        """
+        Generate (kind, value) tuples for the tokens of the query.
+        """
+        position = 0
+        while position < len(query):
+            match = _TOKENS.match(query, position)
+            if match is None:
+                raise MalformedQueryError(
+                    'Unexpected character at {}: {!r}.'.format(
+                        position, query[position]
+                    )
+                )
+            position = match.end()
+            if match.lastgroup != 'space':
+                yield match.lastgroup, match.group()
+
+    def _peek(self, offset=0):
+        """
+        Get the token at the offset from the current one, if any.
+        """
+        try:
+            return self.tokens[self.position + offset]
+        except IndexError:
+            return (None, None)
+
+    def _next(self):
+        """
+        Consume the current token.
+        """
+        token = self._peek()
+        if token[0] is None:
+            raise MalformedQueryError('Unexpected end of query.')
+        self.position += 1
+        return token
+
+    def _is(self, *values):
+        """
+        Check if the current token is punctuation or a keyword of those given.
+        """
+        kind, value = self._peek()
+        if kind == 'punctuation':
+            return value in values
+        if kind == 'name':
+            return value.upper() in values
+        return False
+
+    def _accept(self, *values):
+        """
+        Consume the current token if it is one of those given.
+        """
+        if self._is(*values):
+            return self._next()[1]
+        return None
+
+    def _expect(self, *values):
+        """
+        Consume the current token, which must be one of those given.
+        """
+        if not self._is(*values):
+            raise MalformedQueryError('Expected {}, found {!r}.'.format(
+                ' or '.join(values), self._peek()[1]
+            ))
+        return self._next()[1]
+
+    def query(self):
+        """
+        Parse the whole query.
+        """
+        while self._is('PREFIX', 'BASE'):
+            if self._next()[1].upper() == 'PREFIX':
+                kind, prefix = self._next()
+                if kind != 'pname' or not prefix.endswith(':'):
+                    raise MalformedQueryError(
+                        'Malformed prefix: {!r}.'.format(prefix)
+                    )
+                self.prefixes[prefix[:-1]] = self._iri_token().value
+            else:
+                self._iri_token()
+
+        self._expect('SELECT')
+        distinct = bool(self._accept('DISTINCT'))
+        self._accept('REDUCED')
+        variables = []
+        if not self._accept('*'):
+            while self._peek()[0] == 'var':
+                variables.append(self._next()[1][1:])
+            if not variables:
+                raise MalformedQueryError('No variables selected.')
+        while self._accept('FROM'):
+            self._accept('NAMED')
+            self._iri_token()
+        self._accept('WHERE')
+        where = self.group()
+
+        order = []
+        limit = offset = None
+        if self._accept('ORDER'):
+            self._expect('BY')
+            while True:
+                direction = self._accept('ASC', 'DESC')
+                if direction:
+                    self._expect('(')
+                    expression = self.expression()
+                    self._expect(')')
+                elif self._peek()[0] == 'var':
+                    expression = Var(self._next()[1][1:])
+                elif self._is('('):
+                    expression = self.primary()
+                else:
+                    break
+                order.append((expression, direction == 'DESC'))
+            if not order:
+                raise MalformedQueryError('Nothing to order by.')
+        while self._is('LIMIT', 'OFFSET'):
+            keyword = self._next()[1].upper()
+            kind, value = self._next()
+            if kind != 'number' or not value.isdigit():
+                raise MalformedQueryError(
+                    'Malformed {}: {!r}.'.format(keyword, value)
+                )
+            if keyword == 'LIMIT':
+                limit = int(value)
+            else:
+                offset = int(value)
+
+        if self._peek()[0] is not None:
+            raise MalformedQueryError(
+                'Unexpected {!r}.'.format(self._peek()[1])
+            )
+        return Query(variables, distinct, where, order, limit, offset)
+
+    def group(self):
+        """
+        Parse a group graph pattern.
+        """
+        self._expect('{')
+        elements = []
+        while not self._accept('}'):
+            if self._is('{'):
+                groups = [self.group()]
+                while self._accept('UNION'):
+                    groups.append(self.group())
+                elements.append(Union(groups))
+            elif self._accept('OPTIONAL'):
+                elements.append(Optional(self.group()))
+            elif self._accept('FILTER'):
+                if self._is('('):
+                    self._next()
+                    expression = self.expression()
+                    self._expect(')')
+                else:
+                    expression = self.primary()
+                elements.append(Filter(expression))
+            elif not self._accept('.'):
+                elements.extend(self.triples())
+        return Group(elements)
+
+    def triples(self):
+        """
+        Parse the triples sharing a subject.
+        """
+        subject = self.term()
+        triples = []
+        while True:
+            if self._peek() == ('name', 'a'):
+                self._next()
+                predicate = Iri(RDF_NAMESPACE + 'type')
+            else:
+                predicate = self.term()
+                if isinstance(predicate, Literal):
+                    raise MalformedQueryError(
+                        'Literal predicate: {!r}.'.format(predicate.value)
+                    )
+            triples.append(Triple(subject, predicate, self.term()))
+            while self._accept(','):
+                triples.append(Triple(subject, predicate, self.term()))
+            if not self._accept(';'):
+                return triples
+            while self._accept(';'):
+                pass
+            if self._is('.', '}'):
+                return triples
+
+    def term(self):
+        """
+        Parse a variable, IRI or literal.
+        """
+        kind, value = self._peek()
+        if kind == 'var':
+            self._next()
+            return Var(value[1:])
+        if kind in ('iri', 'pname'):
+            return self._iri_token()
+        if kind == 'string':
+            self._next()
+            value = _ESCAPES.sub(
+                lambda match: _ESCAPED.get(match.group(1), match.group(1)),
+                value[1:-1]
+            )
+            datatype = None
+            if self._peek()[0] == 'language':
+                self._next()
+            elif self._accept('^^'):
+                datatype = self._iri_token().value
+            return Literal(value, datatype)
+        if kind == 'number':
+            self._next()
+            return Literal(value, XSD_NAMESPACE +
+                           ('decimal' if '.' in value else 'integer'))
+        if kind == 'name' and value in ('true', 'false'):
+            self._next()
+            return Literal(value, XSD_NAMESPACE + 'boolean')
+        raise MalformedQueryError('Unsupported term: {!r}.'.format(value))
+
+    def _iri_token(self):
+        """
+        Parse an IRI, expanding prefixes.
+        """
+        kind, value = self._next()
+        if kind == 'iri':
+            value = value[1:-1]
+            prefix, separator, local = value.partition(':')
+            if separator and prefix in BUILTIN_PREFIXES:
+                return Iri(BUILTIN_PREFIXES[prefix] + local)
+            return Iri(value)
+        if kind == 'pname':
+            prefix, _, local = value.partition(':')
+            try:
+                return Iri(self.prefixes[prefix] + local)
+            except KeyError:
+                raise MalformedQueryError(
+                    'Undeclared prefix: {!r}.'.format(prefix)
+                )
+        raise MalformedQueryError('Expected an IRI, found {!r}.'.format(value))
+
+    def expression(self):
+        """
+        Parse a disjunction.
+        """
+        expression = self._conjunction()
+        while self._accept('||'):
+            expression = Call('||', [expression, self._conjunction()])
+        return expression
+
+    def _conjunction(self):
+        """
+        Parse a conjunction.
+        """
+        expression = self._comparison()
+        while self._accept('&&'):
+            expression = Call('&&', [expression, self._comparison()])
+        return expression
+
+    def _comparison(self):
+        """
+        Parse a comparison, or just its operand.
+        """
+        expression = self._unary()
+        operator = self._accept(*_COMPARISONS)
+        if operator:
+            expression = Call(operator, [expression, self._unary()])
+        return expression
+
+    def _unary(self):
+        """
+        Parse a negation, or just its operand.
+        """
+        if self._accept('!'):
+            return Call('!', [self._unary()])
+        return self.primary()
+
+    def primary(self):
+        """
+        Parse a bracketed expression, function call or term.
+        """
+        if self._accept('('):
+            expression = self.expression()
+            self._expect(')')
+            return expression
+        kind, value = self._peek()
+        if kind == 'name' and self._peek(1) == ('punctuation', '('):
+            self._next()
+            self._next()
+            arguments = []
+            if not self._accept(')'):
+                arguments.append(self.expression())
+                while self._accept(','):
+                    arguments.append(self.expression())
+                self._expect(')')
+            return Call(value.upper(), arguments)
+        return self.term()
+
+
+class _Select(object):
+    """
+    The SQL being built for a group graph pattern.
+    """
+    def __init__(self, bindings):
+        # Bindings visible in the group, including those of enclosing groups.
+        self.bindings = OrderedDict(bindings)
+        self.new = []
+        self.joins = []
+        self.conditions = []
+
+    def bind(self, name, binding):
+        """
+        Bind a variable first seen in this group.
+        """
+        self.bindings[name] = binding
+        self.new.append(name)
+
+    def from_clause(self):
+        """
+        Render the FROM clause, if any.
+        """
+        if not self.joins:
+            return ''
+        joins = list(self.joins)
+        if joins[0][0].startswith('LEFT'):
+            # Left joins need something to join to.
+            joins.insert(0, ('CROSS JOIN', '(SELECT 1) AS unit', ''))
+        clauses = [joins[0][1]]
+        clauses.extend(' '.join(part for part in join if part)
+                       for join in joins[1:])
+        return ' FROM ' + ' '.join(clauses)
+
+    def where_clause(self):
+        """
+        Render the WHERE clause, if any.
+        """
+        if not self.conditions:
+            return ''
+        return ' WHERE ' + ' AND '.join(self.conditions)
+
+
+class _Compiler(object):
+    """
+    Compiles parsed queries to SQL.
+    """
+    def __init__(self):
+        self.params = {}
+        self.aliases = 0
+
+    def _param(self, value):
+        """
+        Add a parameter, getting its placeholder.
+        """
+        name = 'p{}'.format(len(self.params))
+        self.params[name] = value
+        return '%({})s'.format(name)
+
+    def _alias(self, prefix='t'):
+        """
+        Get a new table alias.
+        """
+        self.aliases += 1
+        return '{}{}'.format(prefix, self.aliases)
+
+    def query(self, query):
+        """
+        Compile the query.
+        """
+        select = self._group(query.where, {})
+        names = query.variables or list(select.bindings)
+
+        variables = []
+        columns = []
+        for name in names:
+            binding = select.bindings.get(name)
+            if binding is None:
+                columns.append('NULL AS "{}"'.format(name))
+                variables.append((name, LITERAL_RDF_OBJECT))
+                continue
+            if binding.kind in (OBJECT_RDF_OBJECT, DATASTREAM_RDF_OBJECT):
+                expression = self._term(binding)
+            else:
+                expression = binding.expression
+            columns.append('{} AS "{}"'.format(expression, name))
+            variables.append((name, binding.kind))
+
+        order = []
+        for expression, descending in query.order:
+            if isinstance(expression, Var) and expression.name in names:
+                binding = select.bindings.get(expression.name)
+                key = '"{}"'.format(expression.name)
+            elif query.distinct:
+                raise MalformedQueryError(
+                    'With DISTINCT, only selected variables may be ordered by.'
+                )
+            else:
+                binding = self._operand(expression, select)
+                key = binding.expression
+                if binding.kind in (OBJECT_RDF_OBJECT, DATASTREAM_RDF_OBJECT):
+                    key = self._term(binding)
+            order.append('{} {}'.format(
+                key, 'DESC NULLS LAST' if descending else 'ASC NULLS FIRST'
+            ))
+
+        sql = 'SELECT {}{}{}{}'.format(
+            'DISTINCT ' if query.distinct else '',
+            ', '.join(columns),
+            select.from_clause(),
+            select.where_clause(),
+        )
+        if order:
+            sql += ' ORDER BY ' + ', '.join(order)
+        if query.limit is not None:
+            sql += ' LIMIT {:d}'.format(query.limit)
+        if query.offset is not None:
+            sql += ' OFFSET {:d}'.format(query.offset)
+        return CompiledQuery(sql, self.params, variables)
+
+    def _group(self, group, bindings):
+        """
+        Compile a group graph pattern, in the scope of the given bindings.
+        """
+        select = _Select(bindings)
+        filters = []
+        for element in group.elements:
+            if isinstance(element, Triple):
+                self._triple(element, select)
+            elif isinstance(element, Optional):
+                self._lateral(element.group, select)
+            elif isinstance(element, Union):
+                self._union(element.groups, select)
+            elif isinstance(element, Filter):
+                filters.append(element.expression)
+        # Filters apply to the whole group, wherever they are in it.
+        for expression in filters:
+            select.conditions.append(self._condition(expression, select))
+        return select
+
+    def _triple(self, triple, select):
+        """
+        Join to the source of a triple pattern, and match its terms.
+        """
+        if not isinstance(triple.predicate, Iri):
+            raise MalformedQueryError(
+                'Only fixed predicates are supported; not ?{}.'.format(
+                    triple.predicate.name
+                )
+            )
+        subject_kind = None
+        if isinstance(triple.subject, Var):
+            if triple.subject.name in select.bindings:
+                subject_kind = select.bindings[triple.subject.name].kind
+        elif dsid_from_fedora_uri(triple.subject.value):
+            subject_kind = DATASTREAM_RDF_OBJECT
+        rdf_property = self._property(triple.predicate.value, subject_kind)
+
+        alias = self._alias()
+        select.joins.append(('CROSS JOIN',
+                             rdf_property.source.format(t=alias), ''))
+        select.conditions.extend(condition.format(t=alias) for condition in
+                                 rdf_property.conditions)
+        self._match(triple.subject, _Binding(
+            rdf_property.subject.format(t=alias),
+            rdf_property.subject_kind,
+            'bigint'
+        ), select)
+        self._match(triple.object, _Binding(
+            rdf_property.object.format(t=alias),
+            rdf_property.object_kind,
+            rdf_property.object_type
+        ), select)
+
+    def _property(self, uri, subject_kind=None):
+        """
+        Get where a predicate's triples are, and what their terms are.
+        """
+        if uri.startswith(relations.FEDORA_MODEL_NAMESPACE):
+            rdf_property = self._model_property(
+                uri[len(relations.FEDORA_MODEL_NAMESPACE):]
+            )
+            if rdf_property is not None:
+                return rdf_property
+        elif uri.startswith(relations.FEDORA_VIEW_NAMESPACE):
+            rdf_property = self._view_property(
+                uri[len(relations.FEDORA_VIEW_NAMESPACE):]
+            )
+            if rdf_property is not None:
+                return rdf_property
+
+        match = re.match('^(.*[#/])([^#/]+)$', uri)
+        if match is None:
+            raise MalformedQueryError('Unsupported predicate: {}.'.format(uri))
+        predicate = match.groups()
+
+        for rel_map, kind in ((OBJECT_RELATION_MAP, OBJECT_RDF_OBJECT),
+                              (DATASTREAM_RELATION_MAP,
+                               DATASTREAM_RDF_OBJECT)):
+            if predicate in rel_map:
+                return self._table_property(rel_map[predicate]['table'],
+                                            predicate, kind)
+
+        namespace, localname = predicate
+        if (namespace == relations.ISLANDORA_RELS_EXT_NAMESPACE and
+                localname.startswith(SEQUENCE_NUMBER_OF_PREDICATE) and
+                localname != SEQUENCE_NUMBER_OF_PREDICATE):
+            paged_pid = utils.rreplace(
+                localname[len(SEQUENCE_NUMBER_OF_PREDICATE):], '_', ':', 1
+            )
+            return _Property(
+                'is_sequence_number_of {t}',
+                '{t}.rdf_subject',
+                '{t}.sequence_number',
+                OBJECT_RDF_OBJECT,
+                LITERAL_RDF_OBJECT,
+                'smallint',
+                ['{{t}}.rdf_object = fedora_object_id({})'.format(
+                    self._param(FEDORA_URI_PREFIX + paged_pid)
+                )]
+            )
+
+        if subject_kind == DATASTREAM_RDF_OBJECT:
+            table, kind = 'datastream_relationships', DATASTREAM_RDF_OBJECT
+        else:
+            table, kind = 'object_relationships', OBJECT_RDF_OBJECT
+        return _Property(
+            '{} {{t}}'.format(table),
+            '{t}.rdf_subject',
+            '{t}.rdf_object',
+            kind,
+            RAW_RDF_OBJECT,
+            'text',
+            ['''{{t}}.predicate = (
+                SELECT predicates.id
+                FROM predicates
+                    JOIN rdf_namespaces
+                        ON rdf_namespaces.id = predicates.rdf_namespace
+                WHERE rdf_namespaces.rdf_namespace = {} AND
+                    predicates.predicate = {}
+            )'''.format(self._param(namespace), self._param(localname))]
+        )
+
+    @staticmethod
+    def _table_property(table, predicate, subject_kind):
+        """
+        Describe a predicate with a table of its own.
+        """
+        source = '{} {{t}}'.format(table)
+        rdf_object = '{t}.rdf_object'
+        if table in REPO_OBJECT_RDF_OBJECT_TABLES:
+            kind, sql_type = OBJECT_RDF_OBJECT, 'bigint'
+        elif predicate in USER_PREDICATES:
+            source += ' JOIN users {t}_user ON {t}_user.id = {t}.rdf_object'
+            rdf_object = '{t}_user.name'
+            kind, sql_type = LITERAL_RDF_OBJECT, 'text'
+        elif predicate in ROLE_PREDICATES:
+            source += (' JOIN user_roles {t}_role'
+                       ' ON {t}_role.id = {t}.rdf_object')
+            rdf_object = '{t}_role.role'
+            kind, sql_type = LITERAL_RDF_OBJECT, 'text'
+        else:
+            kind = LITERAL_RDF_OBJECT
+            sql_type = LITERAL_TYPES.get(table, 'text')
+        return _Property(source, '{t}.rdf_subject', rdf_object, subject_kind,
+                         kind, sql_type, [])
+
+    @staticmethod
+    def _model_property(localname):
+        """
+        Describe one of the object properties Fedora indexes, if it is one.
+        """
+        if localname == relations.LABEL_PREDICATE:
+            return _Property('objects {t}', '{t}.id', '{t}.label',
+                             OBJECT_RDF_OBJECT, LITERAL_RDF_OBJECT, 'text',
+                             [])
+        if localname == relations.STATE_PREDICATE:
+            states = ' '.join("WHEN '{}' THEN '{}'".format(state, uri)
+                              for state, uri in
+                              sorted(OBJECT_STATE_URIS.items()))
+            return _Property('objects {t}', '{t}.id',
+                             'CASE {{t}}.state {} END'.format(states),
+                             OBJECT_RDF_OBJECT, URI_RDF_OBJECT, 'text', [])
+        if localname == relations.OWNER_PREDICATE:
+            return _Property(
+                'objects {t} JOIN users {t}_owner ON {t}_owner.id = {t}.owner',
+                '{t}.id', '{t}_owner.name', OBJECT_RDF_OBJECT,
+                LITERAL_RDF_OBJECT, 'text', []
+            )
+        if localname == relations.CREATED_DATE_PREDICATE:
+            return _Property('objects {t}', '{t}.id', '{t}.created',
+                             OBJECT_RDF_OBJECT, LITERAL_RDF_OBJECT,
+                             'timestamp with time zone', [])
+        return None
+
+    @staticmethod
+    def _view_property(localname):
+        """
+        Describe one of the properties Fedora indexes as views, if it is one.
+        """
+        if localname == relations.LAST_MODIFIED_DATE_PREDICATE:
+            return _Property('objects {t}', '{t}.id', '{t}.modified',
+                             OBJECT_RDF_OBJECT, LITERAL_RDF_OBJECT,
+                             'timestamp with time zone', [])
+        if localname == 'disseminates':
+            return _Property('datastreams {t}', '{t}.object', '{t}.id',
+                             OBJECT_RDF_OBJECT, DATASTREAM_RDF_OBJECT,
+                             'bigint', [])
+        if localname == 'disseminationType':
+            return _Property('datastreams {t}', '{t}.id',
+                             "'{}*/' || {{t}}.dsid".format(FEDORA_URI_PREFIX),
+                             DATASTREAM_RDF_OBJECT, URI_RDF_OBJECT, 'text',
+                             [])
+        if localname == 'mimeType':
+            return _Property(
+                'datastreams {t}'
+                ' JOIN resources {t}_resource'
+                ' ON {t}_resource.id = {t}.resource'
+                ' JOIN mimes {t}_mime ON {t}_mime.id = {t}_resource.mime',
+                '{t}.id', '{t}_mime.mime', DATASTREAM_RDF_OBJECT,
+                LITERAL_RDF_OBJECT, 'text', []
+            )
+        return None
+
+    def _lateral(self, group, select):
+        """
+        Left join an OPTIONAL group, which may refer to what precedes it.
+        """
+        inner = self._group(group, select.bindings)
+        alias = self._alias('o')
+        columns = ['{} AS "{}"'.format(inner.bindings[name].expression, name)
+                   for name in inner.new]
+        select.joins.append((
+            'LEFT JOIN LATERAL',
+            '(SELECT {}{}{}) AS {}'.format(', '.join(columns) or '1',
+                                           inner.from_clause(),
+                                           inner.where_clause(), alias),
+            'ON TRUE'
+        ))
+        for name in inner.new:
+            binding = inner.bindings[name]
+            select.bind(name, binding._replace(
+                expression='{}."{}"'.format(alias, name)
+            ))
+
+    def _union(self, groups, select):
+        """
+        Join the UNION of groups, which may refer to what precedes them.
+        """
+        branches = [self._group(group, select.bindings) for group in groups]
+        names = []
+        for branch in branches:
+            names.extend(name for name in branch.new if name not in names)
+
+        # Where the branches differ, the variable is compared as text.
+        unified = {}
+        for name in names:
+            bindings = set((branch.bindings[name].kind,
+                            branch.bindings[name].type)
+                           for branch in branches if name in branch.new)
+            if len(bindings) == 1:
+                unified[name] = bindings.pop()
+            else:
+                unified[name] = (RAW_RDF_OBJECT, 'text')
+
+        queries = []
+        for branch in branches:
+            columns = []
+            for name in names:
+                kind, sql_type = unified[name]
+                if name not in branch.new:
+                    expression = 'NULL::{}'.format(sql_type)
+                elif branch.bindings[name].kind == kind:
+                    expression = branch.bindings[name].expression
+                else:
+                    expression = self._term(branch.bindings[name])
+                columns.append('{} AS "{}"'.format(expression, name))
+            queries.append('(SELECT {}{}{})'.format(', '.join(columns) or '1',
+                                                    branch.from_clause(),
+                                                    branch.where_clause()))
+
+        alias = self._alias('u')
+        select.joins.append((
+            'CROSS JOIN LATERAL',
+            '({}) AS {}'.format(' UNION ALL '.join(queries), alias),
+            ''
+        ))
+        for name in names:
+            kind, sql_type = unified[name]
+            select.bind(name, _Binding('{}."{}"'.format(alias, name), kind,
+                                       sql_type))
+
+    def _match(self, term, binding, select):
+        """
+        Match a term of a triple pattern to where it is in the source.
+        """
+        if isinstance(term, Var):
+            if term.name in select.bindings:
+                select.conditions.append(
+                    self._equal(select.bindings[term.name], binding)
+                )
+            else:
+                select.bind(term.name, binding)
+        else:
+            select.conditions.append(self._equal(binding,
+                                                 self._constant(term)))
+
+    def _constant(self, term):
+        """
+        Get a binding for an IRI or literal.
+        """
+        if isinstance(term, Iri):
+            return _Binding(self._param(term.value), URI_RDF_OBJECT, 'text')
+        return _Binding(self._param(term.value), LITERAL_RDF_OBJECT,
+                        DATATYPES.get(term.datatype, 'text'))
+
+    def _equal(self, left, right):
+        """
+        Get the SQL comparing two bindings for equality, as RDF terms.
+
+        Comparisons are of the values as they are stored wherever possible,
+        so indexes may be used.
+        """
+        linked = (OBJECT_RDF_OBJECT, DATASTREAM_RDF_OBJECT)
+        if left.kind in linked and right.kind == URI_RDF_OBJECT:
+            left, right = right, left
+        if left.kind == URI_RDF_OBJECT and right.kind in linked:
+            function = ('fedora_object_id' if right.kind == OBJECT_RDF_OBJECT
+                        else 'fedora_datastream_id')
+            return '{} = {}({})'.format(right.expression, function,
+                                        left.expression)
+        if left.kind == right.kind and left.kind != LITERAL_RDF_OBJECT:
+            return '{} = {}'.format(left.expression, right.expression)
+        if left.kind == LITERAL_RDF_OBJECT == right.kind:
+            if (left.type == right.type or
+                    'text' not in (left.type, right.type)):
+                return '{} = {}'.format(left.expression, right.expression)
+            # Literal parameters take on the type of what they're compared to.
+            if right.expression.startswith('%('):
+                return '{} = {}'.format(left.expression, right.expression)
+            if left.expression.startswith('%('):
+                return '{} = {}'.format(left.expression, right.expression)
+        if {left.kind, right.kind} & set(linked) and LITERAL_RDF_OBJECT in (
+                left.kind, right.kind):
+            return 'FALSE'
+        return '{} = {}'.format(self._term(left), self._term(right))
+
+    @staticmethod
+    def _term(binding):
+        """
+        Get SQL for the text of the RDF term of a binding.
+        """
+        if binding.kind == OBJECT_RDF_OBJECT:
+            return 'fedora_object_uri({})'.format(binding.expression)
+        if binding.kind == DATASTREAM_RDF_OBJECT:
+            return 'fedora_datastream_uri({})'.format(binding.expression)
+        if binding.type != 'text':
+            return '({})::text'.format(binding.expression)
+        return binding.expression
+
+    def _operand(self, expression, select):
+        """
+        Get a binding for an expression used as a value.
+        """
+        if isinstance(expression, Var):
+            try:
+                return select.bindings[expression.name]
+            except KeyError:
+                return _Binding('NULL::text', LITERAL_RDF_OBJECT, 'text')
+        if isinstance(expression, (Iri, Literal)):
+            return self._constant(expression)
+        if isinstance(expression, Call) and expression.function == 'STR':
+            self._arity(expression, 1)
+            return _Binding(
+                self._term(self._operand(expression.arguments[0], select)),
+                LITERAL_RDF_OBJECT,
+                'text'
+            )
+        raise MalformedQueryError('Unsupported value: {}.'.format(
+            getattr(expression, 'function', expression)
+        ))
+
+    @staticmethod
+    def _arity(call, *counts):
+        """
+        Check the number of arguments of a function call.
+        """
+        if len(call.arguments) not in counts:
+            raise MalformedQueryError(
+                'Wrong number of arguments to {}.'.format(call.function)
+            )
+
+    def _condition(self, expression, select):
+        """
+        Compile a FILTER expression to a SQL condition.
+
+        Comparisons with unbound variables (or URIs of objects which do not
+        exist) are false, rather than errors.
+        """
+        if isinstance(expression, Var):
+            binding = self._operand(expression, select)
+            if binding.type != 'boolean':
+                raise MalformedQueryError(
+                    'Only boolean variables may be filtered on directly.'
+                )
+            return '({} IS TRUE)'.format(binding.expression)
+        if not isinstance(expression, Call):
+            raise MalformedQueryError('Unsupported filter.')
+
+        function, arguments = expression
+        if function == '||':
+            return '({} OR {})'.format(
+                *(self._condition(argument, select) for argument in arguments)
+            )
+        if function == '&&':
+            return '({} AND {})'.format(
+                *(self._condition(argument, select) for argument in arguments)
+            )
+        if function == '!':
+            return '(NOT {})'.format(self._condition(arguments[0], select))
+        if function in ('=', 'SAMETERM'):
+            self._arity(expression, 2)
+            left, right = (self._operand(argument, select)
+                           for argument in arguments)
+            return 'COALESCE({}, FALSE)'.format(self._equal(left, right))
+        if function == '!=':
+            return '(NOT {})'.format(self._condition(
+                Call('=', arguments), select
+            ))
+        if function in _COMPARISONS:
+            left, right = (self._operand(argument, select)
+                           for argument in arguments)
+            if (LITERAL_RDF_OBJECT == left.kind == right.kind and
+                    (left.type == right.type or
+                     left.expression.startswith('%(') or
+                     right.expression.startswith('%('))):
+                left, right = left.expression, right.expression
+            else:
+                left, right = self._term(left), self._term(right)
+            return 'COALESCE({} {} {}, FALSE)'.format(left, function, right)
+        if function == 'BOUND':
+            self._arity(expression, 1)
+            if not isinstance(arguments[0], Var):
+                raise MalformedQueryError('BOUND takes a variable.')
+            return '({} IS NOT NULL)'.format(
+                self._operand(arguments[0], select).expression
+            )
+        if function == 'REGEX':
+            self._arity(expression, 2, 3)
+            text = self._term(self._operand(arguments[0], select))
+            pattern, flags = (list(arguments[1:]) + [Literal('', None)])[:2]
+            if not (isinstance(pattern, Literal) and
+                    isinstance(flags, Literal)):
+                raise MalformedQueryError(
+                    'REGEX takes a literal pattern and flags.'
+                )
+            return 'COALESCE({} {} {}, FALSE)'.format(
+                text, '~*' if 'i' in flags.value else '~',
+                self._param(pattern.value)
+            )
+        if function in ('ISURI', 'ISIRI', 'ISLITERAL'):
+            self._arity(expression, 1)
+            binding = self._operand(arguments[0], select)
+            if binding.kind == RAW_RDF_OBJECT:
+                is_uri = 'COALESCE({} ~ {}, FALSE)'.format(
+                    binding.expression, self._param(URI_PATTERN)
+                )
+            elif binding.kind == LITERAL_RDF_OBJECT:
+                is_uri = 'FALSE'
+            else:
+                is_uri = '({} IS NOT NULL)'.format(binding.expression)
+            if function == 'ISLITERAL':
+                return '({} IS NOT NULL AND NOT {})'.format(
+                    binding.expression, is_uri
+                )
+            return is_uri
+        raise MalformedQueryError('Unsupported function: {}.'.format(function))
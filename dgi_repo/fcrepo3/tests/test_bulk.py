@@ -0,0 +1,287 @@
+"""
+Tests bulk FOXML loading functionality.
+"""
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, MagicMock
+
+from dgi_repo.database import filestore
+from dgi_repo.fcrepo3 import bulk, relations
+
+FOXML = '''<?xml version="1.0" encoding="UTF-8"?>
+<foxml:digitalObject VERSION="1.1" PID="a:1"
+  xmlns:foxml="info:fedora/fedora-system:def/foxml#">
+  <foxml:objectProperties>
+    <foxml:property NAME="info:fedora/fedora-system:def/model#state"
+      VALUE="I"/>
+    <foxml:property NAME="info:fedora/fedora-system:def/model#label"
+      VALUE="An object"/>
+  </foxml:objectProperties>
+  <foxml:datastream ID="AUDIT" STATE="A" CONTROL_GROUP="X">
+    <foxml:datastreamVersion ID="AUDIT.0" MIMETYPE="text/xml">
+      <foxml:xmlContent><audit/></foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+  <foxml:datastream ID="OBJ" STATE="A" CONTROL_GROUP="M">
+    <foxml:datastreamVersion ID="OBJ.0" MIMETYPE="text/plain"
+      CREATED="2016-01-01T00:00:00.000Z">
+      <foxml:contentDigest TYPE="MD5"
+        DIGEST="5d41402abc4b2a76b9719d911017c592"/>
+      <foxml:binaryContent>aGVs
+        bG8=</foxml:binaryContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+  <foxml:datastream ID="RELS-EXT" STATE="A" CONTROL_GROUP="X">
+    <foxml:datastreamVersion ID="RELS-EXT.0" MIMETYPE="application/rdf+xml">
+      <foxml:xmlContent>
+        <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+          xmlns:fedora="info:fedora/fedora-system:def/relations-external#">
+          <rdf:Description rdf:about="info:fedora/a:1">
+            <fedora:isMemberOfCollection rdf:resource="info:fedora/a:col"/>
+          </rdf:Description>
+        </rdf:RDF>
+      </foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+  <foxml:datastream ID="RELS-INT" STATE="A" CONTROL_GROUP="X">
+    <foxml:datastreamVersion ID="RELS-INT.0" MIMETYPE="application/rdf+xml">
+      <foxml:xmlContent>
+        <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+          xmlns:islandora="http://islandora.ca/ontology/relsext#">
+          <rdf:Description rdf:about="info:fedora/a:1/OBJ">
+            <islandora:width>5</islandora:width>
+          </rdf:Description>
+        </rdf:RDF>
+      </foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+</foxml:digitalObject>
+'''
+
+
+class CopyFileTestCase(unittest.TestCase):
+    """
+    Tests feeding rows to COPY.
+    """
+
+    def test_escaping(self):
+        """
+        Test values are escaped for COPY's text format.
+        """
+        self.assertEqual(bulk._copy_value(None), '\\N')
+        self.assertEqual(bulk._copy_value(True), 'true')
+        self.assertEqual(bulk._copy_value(12), '12')
+        self.assertEqual(bulk._copy_value('a\tb\nc\\d\r'),
+                         'a\\tb\\nc\\\\d\\r')
+
+    def test_read(self):
+        """
+        Test reads of any size get all the rows, in order.
+        """
+        rows = [(1, 'one', None), (2, 'two', False)]
+        expected = '1\tone\t\\N\n2\ttwo\tfalse\n'
+        self.assertEqual(bulk._CopyFile(rows).read(), expected)
+
+        copy_file = bulk._CopyFile(rows)
+        chunks = iter(lambda: copy_file.read(5), '')
+        self.assertEqual(''.join(chunks), expected)
+
+
+class DeferredTestCase(unittest.TestCase):
+    """
+    Tests deferring trigger maintenance over a load.
+    """
+
+    def test_triggers(self):
+        """
+        Test the triggers found are disabled, then enabled and caught up on.
+        """
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [('objects', 'refresh_access')]
+        with patch('dgi_repo.fcrepo3.bulk._refresh_refcounts') as refcounts, \
+                patch('dgi_repo.fcrepo3.bulk._refresh_access') as access:
+            with bulk._deferred(connection, True, False):
+                refcounts.assert_not_called()
+            refcounts.assert_called_once_with(cursor)
+            access.assert_called_once_with(cursor)
+
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn('pg_trigger', statements[0])
+        self.assertEqual(cursor.execute.call_args_list[0][0][1][1],
+                         bulk.CHANGE_LOG_TRIGGERS)
+        self.assertEqual(statements[1:], [
+            'ALTER TABLE objects DISABLE TRIGGER refresh_access',
+            'ALTER TABLE objects ENABLE TRIGGER refresh_access',
+        ])
+
+
+class BulkFoxmlTargetTestCase(unittest.TestCase):
+    """
+    Tests reading FOXML into records for the loader.
+    """
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for patcher in (
+                patch.dict(filestore._URI_MAP, {
+                    filestore.DATASTREAM_SCHEME: {'dir': self.directory},
+                }),
+                patch.dict(bulk._config, {
+                    'filestore_durability': 'none',
+                    'default_hash_algorithm': 'SHA-256',
+                })):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _parse(self, foxml):
+        """
+        Parse the FOXML from a file, as a worker would.
+        """
+        path = os.path.join(self.directory, 'a_1.xml')
+        with open(path, 'w') as foxml_file:
+            foxml_file.write(foxml)
+        return bulk._parse(path)
+
+    def test_object(self):
+        """
+        Test object properties are mapped, and AUDIT skipped.
+        """
+        record = self._parse(FOXML)
+        self.assertEqual(
+            (record['pid'], record['label'], record['state'],
+             record['owner'], record['created']),
+            ('a:1', 'An object', 'I', None, 'now')
+        )
+        self.assertEqual([datastream['dsid']
+                          for datastream in record['datastreams']],
+                         ['OBJ', 'RELS-EXT', 'RELS-INT', 'DC'])
+
+    def test_content(self):
+        """
+        Test content lands in the filestore, with its checksums verified.
+        """
+        record = self._parse(FOXML)
+        version = record['datastreams'][0]['versions'][0]
+        self.assertEqual(version['checksums'], [{
+            'type': 'MD5',
+            'checksum': '5d41402abc4b2a76b9719d911017c592',
+        }])
+        self.assertEqual((version['mimetype'], version['created']),
+                         ('text/plain', '2016-01-01T00:00:00.000Z'))
+        path = filestore.resolve_uri(version['uri'])
+        self.assertIn(path, record['files'])
+        with open(path, 'rb') as content:
+            self.assertEqual(content.read(), b'hello')
+
+    def test_relations(self):
+        """
+        Test relations are gathered from DC, RELS-EXT and RELS-INT.
+        """
+        record = self._parse(FOXML)
+        self.assertEqual(record['relations']['RELS-EXT'], [(
+            relations.FEDORA_RELS_EXT_NAMESPACE, 'isMemberOfCollection', None,
+            'info:fedora/a:col'
+        )])
+        self.assertEqual(record['relations']['RELS-INT'], [(
+            'OBJ', relations.ISLANDORA_RELS_EXT_NAMESPACE, 'width', '5', None
+        )])
+        self.assertIn((relations.DC_NAMESPACE, 'identifier', 'a:1', None),
+                      record['relations']['DC'])
+
+    def test_checksum_mismatch(self):
+        """
+        Test a bad checksum fails the record, removing its files.
+        """
+        record = self._parse(FOXML.replace('5d41402a', '00000000'))
+        self.assertEqual(record['error'], 'ValueError: Checksum mismatch.')
+        self.assertEqual(os.listdir(self.directory), ['a_1.xml'])
+
+
+@patch('dgi_repo.fcrepo3.bulk._remove_files')
+@patch('dgi_repo.fcrepo3.bulk._datastream_ids', return_value={})
+@patch('dgi_repo.fcrepo3.bulk._object_ids', return_value={'a:col': 3})
+class ResolveRelationsTestCase(unittest.TestCase):
+    """
+    Tests resolving a batch's relations to rows.
+    """
+
+    def _record(self, pid, object_id, *rels_ext):
+        """
+        Get a parsed record with the given RELS-EXT relations.
+        """
+        return {
+            'pid': pid,
+            'id': object_id,
+            'path': '{}.xml'.format(pid),
+            'files': [],
+            'datastreams': [{'dsid': 'OBJ', 'id': object_id * 10}],
+            'relations': {
+                'DC': [],
+                'RELS-EXT': list(rels_ext),
+                'RELS-INT': [('OBJ', relations.ISLANDORA_RELS_EXT_NAMESPACE,
+                              'width', '5', None)],
+            },
+        }
+
+    def test_rows(self, object_ids, datastream_ids, remove_files):
+        """
+        Test references resolve within the batch, and to existing objects.
+        """
+        records = [
+            self._record('a:1', 1, (relations.FEDORA_RELS_EXT_NAMESPACE,
+                                    'isMemberOfCollection', None,
+                                    'info:fedora/a:col')),
+            self._record('a:2', 2, (relations.ISLANDORA_RELS_EXT_NAMESPACE,
+                                    'isSequenceNumberOfa_1', '4', None)),
+        ]
+        rows = bulk._resolve_relations(records, 5, MagicMock())
+        self.assertEqual(dict(rows), {
+            'is_member_of_collection': [(1, 3)],
+            'is_sequence_number_of': [(2, 1, '4')],
+            'image_width': [(10, '5'), (20, '5')],
+        })
+        self.assertEqual(object_ids.call_args[0][0], {'a:col', 'a:1'})
+        remove_files.assert_not_called()
+
+    def test_dropped(self, object_ids, datastream_ids, remove_files):
+        """
+        Test objects with unresolvable references drop out, with dependents.
+        """
+        records = [
+            self._record('a:1', 1, (relations.FEDORA_RELS_EXT_NAMESPACE,
+                                    'isMemberOfCollection', None,
+                                    'info:fedora/a:missing')),
+            self._record('a:2', 2, (relations.FEDORA_RELS_EXT_NAMESPACE,
+                                    'isMemberOfCollection', None,
+                                    'info:fedora/a:1')),
+            self._record('a:3', 3),
+        ]
+        rows = bulk._resolve_relations(records, 5, MagicMock())
+        self.assertEqual([record['pid'] for record in records], ['a:3'])
+        self.assertEqual(dict(rows), {'image_width': [(30, '5')]})
+        self.assertEqual(remove_files.call_count, 2)
+
+
+class RefreshRefcountsTestCase(unittest.TestCase):
+    """
+    Tests recomputing resource reference counts after a load.
+    """
+
+    def test_query(self):
+        """
+        Test counts come from both datastream tables, and only change rows.
+        """
+        cursor = MagicMock()
+        bulk._refresh_refcounts(cursor)
+        query = ' '.join(cursor.execute.call_args[0][0].split())
+        self.assertIn('INSERT INTO resource_refcounts (id, refcount)', query)
+        self.assertIn('LEFT JOIN ( SELECT resource FROM datastreams UNION ALL '
+                      'SELECT resource FROM old_datastreams )', query)
+        self.assertIn('ON CONFLICT (id) DO UPDATE', query)
+        self.assertIn('WHERE resource_refcounts.refcount IS DISTINCT FROM '
+                      'EXCLUDED.refcount', query)
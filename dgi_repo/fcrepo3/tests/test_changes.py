@@ -0,0 +1,79 @@
+"""
+Tests the change feed.
+"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+import falcon
+
+from dgi_repo.fcrepo3 import changes
+
+CHANGE = {'id': 7, 'transaction': 1234, 'pid': 'a:1', 'dsid': None,
+          'purged': False, 'changed': None}
+
+
+class TokenTestCase(unittest.TestCase):
+    """
+    Tests change feed tokens.
+    """
+
+    def test_round_trip(self):
+        """
+        Test tokens give back the position in the log.
+        """
+        self.assertEqual(changes.parse_token(changes.make_token(1234, 7)),
+                         (1234, 7))
+
+    def test_malformed(self):
+        """
+        Test malformed tokens are rejected.
+        """
+        for token in ('7', '1234.x', '1.2.3'):
+            with self.subTest(token=token):
+                with self.assertRaises(falcon.HTTPInvalidParam):
+                    changes.parse_token(token)
+
+
+@patch('dgi_repo.fcrepo3.changes._wait_for_notification')
+@patch('dgi_repo.database.read.changes.changes_since')
+class ReadChangesTestCase(unittest.TestCase):
+    """
+    Tests reading changes, waiting for them if need be.
+    """
+
+    def test_no_wait(self, changes_since, wait_for_notification):
+        """
+        Test the log is read once when not waiting.
+        """
+        changes_since.return_value.fetchall.return_value = []
+        cursor = MagicMock()
+        self.assertEqual(changes.read_changes(MagicMock(), cursor, (1, 2), 10,
+                                              0, 5), [])
+        changes_since.assert_called_once_with(1, 2, limit=10, cursor=cursor)
+        wait_for_notification.assert_not_called()
+        cursor.execute.assert_not_called()
+
+    def test_wait(self, changes_since, wait_for_notification):
+        """
+        Test the log is read again after waiting, until there are changes.
+        """
+        changes_since.return_value.fetchall.side_effect = [[], [], [CHANGE]]
+        cursor = MagicMock()
+        self.assertEqual(changes.read_changes(MagicMock(), cursor, (1, 2), 10,
+                                              30, 5), [CHANGE])
+        self.assertEqual(changes_since.call_count, 3)
+        self.assertEqual(wait_for_notification.call_count, 2)
+        cursor.execute.assert_called_once_with('LISTEN changes')
+
+    @patch('time.monotonic')
+    def test_timeout(self, monotonic, changes_since, wait_for_notification):
+        """
+        Test waiting stops at the deadline, waking in time for it.
+        """
+        changes_since.return_value.fetchall.return_value = []
+        monotonic.side_effect = [100, 100, 108, 110]
+        self.assertEqual(changes.read_changes(MagicMock(), MagicMock(),
+                                              (1, 2), 10, 10, 5), [])
+        self.assertEqual([call[0][1] for call in
+                          wait_for_notification.call_args_list], [5, 2])
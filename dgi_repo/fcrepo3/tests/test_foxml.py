@@ -0,0 +1,443 @@
+"""
+Tests FOXML ingest scheduling.
+"""
+
+import os
+import unittest
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, MagicMock
+
+from click.testing import CliRunner
+from lxml import etree
+
+from dgi_repo.fcrepo3 import foxml
+
+FOXML_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<foxml:digitalObject VERSION="1.1" PID="{pid}"
+  xmlns:foxml="info:fedora/fedora-system:def/foxml#">
+  <foxml:datastream ID="OBJ" STATE="A" CONTROL_GROUP="M">
+    <foxml:datastreamVersion ID="OBJ.0" MIMETYPE="text/plain">
+      <foxml:binaryContent>aGVsbG8=</foxml:binaryContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+  <foxml:datastream ID="RELS-EXT" STATE="A" CONTROL_GROUP="X">
+    <foxml:datastreamVersion ID="RELS-EXT.0" MIMETYPE="application/rdf+xml">
+      <foxml:xmlContent>
+        <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+          xmlns:fedora="info:fedora/fedora-system:def/relations-external#"
+          xmlns:fedora-model="info:fedora/fedora-system:def/model#"
+          xmlns:islandora="http://islandora.ca/ontology/relsext#">
+          <rdf:Description rdf:about="info:fedora/{pid}">
+            {relations}
+          </rdf:Description>
+        </rdf:RDF>
+      </foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+</foxml:digitalObject>
+'''
+
+
+class FoxmlHeaderTestCase(unittest.TestCase):
+    """
+    Tests pre-scanning FOXML for references.
+    """
+
+    def test_references(self):
+        """
+        Test resolvable references are found, and others ignored.
+        """
+        relations = '''
+            <fedora:isMemberOfCollection rdf:resource="info:fedora/a:col"/>
+            <fedora-model:hasModel rdf:resource="info:fedora/a:model"/>
+            <islandora:isSequenceNumberOfa_book>1</islandora:isSequenceNumberOfa_book>
+            <fedora:isMemberOf rdf:resource="info:fedora/a:1"/>
+        '''
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a_1.xml')
+            with open(path, 'w') as foxml_file:
+                foxml_file.write(FOXML_TEMPLATE.format(pid='a:1',
+                                                       relations=relations))
+            pid, references = foxml.foxml_header(path)
+
+        self.assertEqual(pid, 'a:1')
+        self.assertEqual(references, {'a:col', 'a:model', 'a:book'})
+
+
+class IngestWavesTestCase(unittest.TestCase):
+    """
+    Tests ordering FOXML by its dependencies.
+    """
+
+    def test_waves(self):
+        """
+        Test paths come after those they depend on, grouped in waves.
+        """
+        waves, cycles = foxml.ingest_waves({
+            'page': {'book', 'model'},
+            'book': {'collection', 'model'},
+            'collection': {'model'},
+            'model': set(),
+            'other': set(),
+        })
+        self.assertEqual(waves, [['model', 'other'], ['collection'], ['book'],
+                                 ['page']])
+        self.assertEqual(cycles, [])
+
+    def test_cycles(self):
+        """
+        Test cycles are reported, and what depends on them held back.
+        """
+        waves, cycles = foxml.ingest_waves({
+            'a': {'b'},
+            'b': {'a'},
+            'c': {'a'},
+            'd': set(),
+        })
+        self.assertEqual(waves, [['d']])
+        self.assertEqual(cycles, [['a', 'b', 'a']])
+
+
+FOXML_DATASTREAMS_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<foxml:digitalObject VERSION="1.1" PID="a:1"
+  xmlns:foxml="info:fedora/fedora-system:def/foxml#">{}</foxml:digitalObject>
+'''
+
+
+class _MemoryStash(BytesIO):
+    """
+    Stand-in for a StashWriter, keeping content in memory.
+    """
+
+    def close(self):
+        return None, self.getvalue()
+
+
+class _MemoryTarget(foxml.FoxmlTarget):
+    """
+    FoxmlTarget collecting datastreams instead of writing them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created = getattr(self, 'created', [])
+
+    def _stash_writer(self):
+        return _MemoryStash()
+
+    def _create_ds(self, ds, old=False):
+        self.created.append((self.dsid, ds))
+
+
+class FoxmlTargetTestCase(unittest.TestCase):
+    """
+    Tests reading datastreams out of FOXML.
+    """
+
+    def test_datastreams(self):
+        """
+        Test content is stashed, and inline XML is left alone.
+        """
+        target = _MemoryTarget(None, cursor=object())
+        etree.fromstring(b'''
+<foxml:digitalObject VERSION="1.1" PID="a:1"
+  xmlns:foxml="info:fedora/fedora-system:def/foxml#">
+  <foxml:datastream ID="MODS" STATE="A" CONTROL_GROUP="X"
+    VERSIONABLE="true">
+    <foxml:datastreamVersion ID="MODS.0" MIMETYPE="application/xml">
+      <foxml:contentDigest TYPE="MD5" DIGEST="abc"/>
+      <foxml:xmlContent><mods xmlns="http://www.loc.gov/mods/v3"
+        ><foxml:property NAME="a" VALUE="b"/></mods></foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+  <foxml:datastream ID="OBJ" STATE="A" CONTROL_GROUP="M"
+    VERSIONABLE="true">
+    <foxml:datastreamVersion ID="OBJ.0" MIMETYPE="text/plain">
+      <foxml:binaryContent>aGVs
+        bG8=</foxml:binaryContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+</foxml:digitalObject>
+''', etree.XMLParser(target=target))
+
+        (mods_dsid, mods), (obj_dsid, obj) = target.created
+        self.assertEqual(mods_dsid, 'MODS')
+        self.assertEqual(mods['checksums'],
+                         [{'type': 'MD5', 'checksum': 'abc'}])
+        content = etree.fromstring(mods['uri'])
+        self.assertEqual(content.tag, '{http://www.loc.gov/mods/v3}mods')
+        self.assertEqual(content[0].tag, foxml.PROPERTY_TAG)
+        self.assertEqual(obj_dsid, 'OBJ')
+        self.assertEqual(obj['uri'], b'hello')
+
+    def _parse(self, datastreams, chunk_size=None):
+        """
+        Read some datastreams' FOXML, fed in chunks of the given size.
+        """
+        target = _MemoryTarget(None, cursor=object())
+        parser = etree.XMLParser(target=target)
+        document = FOXML_DATASTREAMS_TEMPLATE.format(datastreams).encode()
+        chunk_size = chunk_size or len(document)
+        for start in range(0, len(document), chunk_size):
+            parser.feed(document[start:start + chunk_size])
+        parser.close()
+        return target.created
+
+    def test_split_base64(self):
+        """
+        Test base64 is decoded across data() calls, whitespace and all.
+        """
+        ((_, obj),) = self._parse('''
+  <foxml:datastream ID="OBJ" STATE="A" CONTROL_GROUP="M">
+    <foxml:datastreamVersion ID="OBJ.0" MIMETYPE="text/plain">
+      <foxml:binaryContent>
+        aGVsbG8g
+        d29y	bGQ =
+      </foxml:binaryContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+''', chunk_size=3)
+        self.assertEqual(obj['uri'], b'hello world')
+
+    def test_inline_xml_round_trip(self):
+        """
+        Test inline XML keeps its namespaces and comments.
+        """
+        ((_, mods),) = self._parse('''
+  <foxml:datastream ID="MODS" STATE="A" CONTROL_GROUP="X">
+    <foxml:datastreamVersion ID="MODS.0" MIMETYPE="application/xml">
+      <foxml:xmlContent><m:mods xmlns:m="urn:m" xmlns:x="urn:x"><!-- a -->
+<m:title x:lang="en">T</m:title><x:note/></m:mods></foxml:xmlContent>
+    </foxml:datastreamVersion>
+  </foxml:datastream>
+''', chunk_size=7)
+        content = etree.fromstring(mods['uri'])
+        self.assertEqual(content.tag, '{urn:m}mods')
+        self.assertEqual(content.nsmap, {'m': 'urn:m', 'x': 'urn:x'})
+        comment, title, note = content
+        self.assertEqual(comment.tag, etree.Comment)
+        self.assertEqual(comment.text, ' a ')
+        self.assertEqual(title.tag, '{urn:m}title')
+        self.assertEqual(title.get('{urn:x}lang'), 'en')
+        self.assertEqual(title.text, 'T')
+        self.assertEqual(note.tag, '{urn:x}note')
+        self.assertEqual(etree.fromstring(etree.tostring(content)).nsmap,
+                         content.nsmap)
+
+
+class WriteInlineXmlTestCase(unittest.TestCase):
+    """
+    Tests writing stored inline XML into FOXML.
+    """
+
+    def _export(self, content):
+        """
+        Write the given stored content into an xmlContent element.
+        """
+        foxml_file = BytesIO()
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'content.xml')
+            with open(path, 'wb') as content_file:
+                content_file.write(content)
+            with etree.xmlfile(foxml_file, buffered=False) as xf:
+                with xf.element(foxml.XML_CONTENT_TAG):
+                    foxml.write_inline_xml(xf, path, foxml_file)
+        return foxml_file.getvalue()
+
+    def test_copied(self):
+        """
+        Test UTF-8 content is copied as it is, less its declaration.
+        """
+        exported = self._export(
+            b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<m:mods  xmlns:m="urn:m">\xc3\xa9</m:mods>'
+        )
+        self.assertIn(b'>\n<m:mods  xmlns:m="urn:m">\xc3\xa9</m:mods></',
+                      exported)
+        self.assertEqual(etree.fromstring(exported)[0].text, '\xe9')
+
+    def test_reserialized(self):
+        """
+        Test content which can't be copied is parsed and re-serialized.
+        """
+        for content in (
+                b'<?xml version="1.0" encoding="ISO-8859-1"?>'
+                b'<mods>\xe9</mods>',
+                b'<!DOCTYPE mods [<!ENTITY e "\xc3\xa9">]><mods>&e;</mods>'):
+            exported = etree.fromstring(self._export(content))
+            self.assertEqual(exported[0].tag, 'mods')
+            self.assertEqual(exported[0].text, '\xe9')
+
+
+class SyncRelationsTestCase(unittest.TestCase):
+    """
+    Tests writing only the relations which changed.
+    """
+
+    @patch('dgi_repo.database.write.relations.write_relation_rows')
+    @patch('dgi_repo.database.delete.relations.delete_relation_rows')
+    @patch('dgi_repo.database.read.relations.relation_rows')
+    def test_difference(self, relation_rows, delete_rows, write_rows):
+        """
+        Test unchanged rows are left alone, including duplicates.
+        """
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [
+            {'relation_table': 'has_model', 'id': 1,
+             'relation_row': ['7', '3']},
+            {'relation_table': 'has_model', 'id': 2,
+             'relation_row': ['7', '4']},
+            {'relation_table': 'object_relationships', 'id': 3,
+             'relation_row': ['9', '7', 'a']},
+            {'relation_table': 'object_relationships', 'id': 4,
+             'relation_row': ['9', '7', 'a']},
+        ]
+        foxml._sync_relations(
+            ['has_model', 'object_relationships'],
+            [7],
+            [
+                ('has_model', (7, 3)),
+                ('has_model', (7, 5)),
+                ('object_relationships', (9, 7, 'a')),
+                ('object_relationships', (9, 7, None)),
+            ],
+            cursor
+        )
+
+        relation_rows.assert_called_once_with(
+            ['has_model', 'object_relationships'], [7], cursor=cursor
+        )
+        self.assertEqual(
+            sorted(call[0][:2] for call in delete_rows.call_args_list),
+            [('has_model', [2]), ('object_relationships', [4])]
+        )
+        self.assertEqual(
+            sorted(call[0][:2] for call in write_rows.call_args_list),
+            [('has_model', [(7, 5)]),
+             ('object_relationships', [(9, 7, None)])]
+        )
+
+
+RELS_EXT_TEMPLATE = '''
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+  xmlns:fedora="info:fedora/fedora-system:def/relations-external#"
+  xmlns:islandora="http://islandora.ca/ontology/relsext#">
+  <rdf:Description rdf:about="info:fedora/a:page">
+    {}
+  </rdf:Description>
+</rdf:RDF>
+'''
+
+
+@patch('dgi_repo.database.write.relations.write_pending_reference')
+class DeferReferenceTestCase(unittest.TestCase):
+    """
+    Tests staging references to objects which don't exist yet.
+    """
+
+    def _relation(self, relation):
+        """
+        Parse a relation in a RELS-EXT description.
+        """
+        return etree.fromstring(RELS_EXT_TEMPLATE.format(relation))[0][0]
+
+    def test_resource(self, write_pending_reference):
+        """
+        Test references to objects and datastreams are staged.
+        """
+        foxml._defer_reference(
+            self._relation('<fedora:isMemberOf '
+                           'rdf:resource="info:fedora/a:book/OBJ"/>'),
+            foxml.OBJECT_RELATION_MAP,
+            {'object': 7},
+            'cursor'
+        )
+        write_pending_reference.assert_called_once_with(
+            {'relation_table': 'is_member_of', 'pid': 'a:book',
+             'dsid': 'OBJ', 'object': 7},
+            cursor='cursor'
+        )
+
+    def test_sequence_number(self, write_pending_reference):
+        """
+        Test sequence numbers are staged against the paged object.
+        """
+        foxml._defer_reference(
+            self._relation('<islandora:isSequenceNumberOfa_book>3'
+                           '</islandora:isSequenceNumberOfa_book>'),
+            foxml.OBJECT_RELATION_MAP,
+            {'object': 7},
+            'cursor'
+        )
+        write_pending_reference.assert_called_once_with(
+            {'relation_table': 'is_sequence_number_of', 'pid': 'a:book',
+             'dsid': None, 'sequence_number': '3', 'object': 7},
+            cursor='cursor'
+        )
+
+    @patch('dgi_repo.database.read.repo_objects.object_id_from_raw')
+    def test_rels_ext_rows(self, object_id_from_raw, write_pending_reference):
+        """
+        Test sequence numbers of missing paged objects are deferred.
+        """
+        object_id_from_raw.return_value.fetchone.return_value = None
+        rels_ext = RELS_EXT_TEMPLATE.format(
+            '<islandora:isSequenceNumberOfa_book>3'
+            '</islandora:isSequenceNumberOfa_book>'
+        ).encode()
+
+        with self.assertRaises(foxml.ReferencedObjectDoesNotExistError):
+            list(foxml._rels_ext_rows(BytesIO(rels_ext), 7, 1, MagicMock(),
+                                      False))
+        write_pending_reference.assert_not_called()
+
+        self.assertEqual(list(foxml._rels_ext_rows(BytesIO(rels_ext), 7, 1,
+                                                   MagicMock(), True)), [])
+        self.assertEqual(write_pending_reference.call_args[0][0]['pid'],
+                         'a:book')
+
+
+class ResolvePendingReferencesTestCase(unittest.TestCase):
+    """
+    Tests deferred references are resolved once everything is ingested.
+    """
+
+    @patch('dgi_repo.database.read.relations.pending_reference_pids')
+    @patch('dgi_repo.database.write.relations.resolve_pending_references')
+    @patch('dgi_repo.fcrepo3.foxml._import_path')
+    @patch('dgi_repo.fcrepo3.foxml.get_connection')
+    @patch('dgi_repo.utilities.bootstrap')
+    def test_import_file(self, bootstrap, get_connection, import_path,
+                         resolve, pending_reference_pids):
+        """
+        Test the resolve pass follows every ingest, without any ordering.
+        """
+        imported = []
+
+        def import_path_effect(path, source, force, cursor, defer_references):
+            imported.append(defer_references)
+            return path
+        import_path.side_effect = import_path_effect
+
+        def resolve_effect(cursor):
+            self.assertEqual(imported, [True, True])
+            return MagicMock()
+        resolve.side_effect = resolve_effect
+        pending_reference_pids.return_value = [{'pid': 'a:missing'}]
+
+        with TemporaryDirectory() as directory:
+            for pid, relations in (('a:book', ''), ('a:page', (
+                    '<islandora:isSequenceNumberOfa_book>1'
+                    '</islandora:isSequenceNumberOfa_book>'))):
+                path = os.path.join(directory, pid.replace(':', '_'))
+                with open(path, 'w') as foxml_file:
+                    foxml_file.write(FOXML_TEMPLATE.format(
+                        pid=pid, relations=relations
+                    ))
+            result = CliRunner().invoke(foxml.import_file, [
+                directory, '--source', '1', '--defer-references'
+            ])
+
+        self.assertIsNone(result.exception)
+        resolve.assert_called_once()
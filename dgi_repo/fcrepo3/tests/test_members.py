@@ -0,0 +1,99 @@
+"""
+Tests listing the members and pages of objects.
+"""
+
+import unittest
+
+import simplejson as json
+from lxml import etree
+
+from dgi_repo.fcrepo3 import members
+
+ROWS = [
+    {'id': 4, 'pid': 'a:1', 'label': 'One', 'models': ['a:model'],
+     'depth': 1},
+    {'id': 9, 'pid': 'a:2', 'label': None, 'models': [], 'depth': 2},
+]
+
+
+class SerializeMembersTestCase(unittest.TestCase):
+    """
+    Tests serializing pages of members.
+    """
+
+    def test_json(self):
+        """
+        Test members are listed, with the token of the next page.
+        """
+        page = json.loads(''.join(members._json_members(iter([ROWS]), 2)))
+        self.assertEqual(page['members'], [
+            {'pid': 'a:1', 'label': 'One', 'models': ['a:model'], 'depth': 1},
+            {'pid': 'a:2', 'label': None, 'models': [], 'depth': 2},
+        ])
+        self.assertEqual(page['next'], '9')
+
+    def test_json_last_page(self):
+        """
+        Test a short page has no next page.
+        """
+        page = json.loads(''.join(members._json_members(iter([ROWS[:1]]), 2)))
+        self.assertIsNone(page['next'])
+        page = json.loads(''.join(members._json_members(iter([]), 2)))
+        self.assertEqual(page, {'members': [], 'next': None})
+
+    def test_xml(self):
+        """
+        Test members are listed, with the token of the next page.
+        """
+        page = etree.fromstring(b''.join(
+            members._xml_members(iter([ROWS[:1], ROWS[1:]]), 2)
+        ))
+        first, second = page.findall('member')
+        self.assertEqual(first.get('pid'), 'a:1')
+        self.assertEqual(first.findtext('label'), 'One')
+        self.assertEqual([model.text for model in first.findall('model')],
+                         ['a:model'])
+        self.assertEqual(second.get('depth'), '2')
+        self.assertIsNone(second.find('label'))
+        self.assertEqual(page.findtext('next'), '9')
+
+
+class SerializePagesTestCase(unittest.TestCase):
+    """
+    Tests serializing the pages of objects.
+    """
+
+    PAGES = [
+        {'id': 3, 'pid': 'a:2', 'label': 'Two', 'sequence_number': 1,
+         'dsids': ['JP2', 'OCR']},
+        {'id': 2, 'pid': 'a:1', 'label': None, 'sequence_number': None,
+         'dsids': []},
+    ]
+
+    def test_json(self):
+        """
+        Test pages are listed in the order given.
+        """
+        pages = json.loads(''.join(members._json_pages(iter([self.PAGES]))))
+        self.assertEqual(pages, {'pages': [
+            {'pid': 'a:2', 'label': 'Two', 'sequence_number': 1,
+             'dsids': ['JP2', 'OCR']},
+            {'pid': 'a:1', 'label': None, 'sequence_number': None,
+             'dsids': []},
+        ]})
+
+    def test_xml(self):
+        """
+        Test pages are listed in the order given, with their datastreams.
+        """
+        pages = etree.fromstring(b''.join(
+            members._xml_pages(iter([self.PAGES[:1], self.PAGES[1:]]))
+        )).findall('page')
+        self.assertEqual([page.get('pid') for page in pages], ['a:2', 'a:1'])
+        self.assertEqual(pages[0].get('sequence'), '1')
+        self.assertEqual(pages[0].findtext('label'), 'Two')
+        self.assertEqual(
+            [ds.get('dsid') for ds in pages[0].findall('datastream')],
+            ['JP2', 'OCR']
+        )
+        self.assertIsNone(pages[1].get('sequence'))
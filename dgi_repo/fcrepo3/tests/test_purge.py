@@ -0,0 +1,85 @@
+"""
+Tests bulk purging.
+"""
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+from click.testing import CliRunner
+
+from dgi_repo.fcrepo3 import purge
+
+
+class ReadPidFileTestCase(unittest.TestCase):
+    """
+    Tests reading lists of PIDs.
+    """
+
+    def test_read(self):
+        """
+        Test PIDs and URIs are read, and blanks and comments skipped.
+        """
+        self.assertEqual(purge.read_pid_file([
+            'a:1\n',
+            '\n',
+            '# Failed batch.\n',
+            '  info:fedora/a:2  \n',
+        ]), ['a:1', 'a:2'])
+
+    def test_invalid(self):
+        """
+        Test lines which aren't PIDs are rejected.
+        """
+        with self.assertRaises(ValueError):
+            purge.read_pid_file(['a:1\n', 'a\n'])
+
+
+class PurgeObjectsTestCase(unittest.TestCase):
+    """
+    Tests ordering the deletion of objects.
+    """
+
+    @patch('dgi_repo.database.delete.repo_objects.delete_objects')
+    @patch('dgi_repo.database.read.object_relations.referenced_objects')
+    def test_order(self, referenced_objects, delete_objects):
+        """
+        Test referenced objects go after those referencing them, or not at all.
+        """
+        # 1 is referenced by 2, 2 by 3, and 4 from outside the selection.
+        references = {1: {2}, 2: {3}, 4: {5}}
+        deleted = []
+
+        def referenced(batch, cursor):
+            return [{'id': object_id} for object_id in batch
+                    if references.get(object_id, set()) - set(deleted)]
+
+        referenced_objects.side_effect = referenced
+        delete_objects.side_effect = lambda ids, cursor: deleted.extend(ids)
+
+        purged, skipped = purge.purge_objects([1, 2, 3, 4], batch_size=2,
+                                              connection=MagicMock())
+
+        self.assertEqual(purged, 3)
+        self.assertEqual(skipped, [4])
+        self.assertEqual(
+            [call[0][0] for call in delete_objects.call_args_list],
+            [[3], [2], [1]]
+        )
+
+
+class PurgeCommandTestCase(unittest.TestCase):
+    """
+    Tests the purge command's options.
+    """
+
+    @patch('dgi_repo.fcrepo3.purge.purge_objects')
+    @patch('dgi_repo.utilities.bootstrap')
+    def test_batch_size(self, bootstrap, purge_objects):
+        """
+        Test an empty batch size is rejected up front.
+        """
+        result = CliRunner().invoke(purge.purge, ['--namespace', 'a',
+                                                  '--batch-size', '0'])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('--batch-size', result.output)
+        purge_objects.assert_not_called()
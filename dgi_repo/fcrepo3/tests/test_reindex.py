@@ -0,0 +1,208 @@
+"""
+Tests reindexing objects, against a stub GSearch.
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch, MagicMock
+from urllib.parse import urlparse, parse_qs
+
+from click.testing import CliRunner
+
+from dgi_repo.fcrepo3 import reindex
+
+
+class StubGSearchHandler(BaseHTTPRequestHandler):
+    """
+    Records updateIndex requests, failing as told by the server.
+    """
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in
+                  parse_qs(urlparse(self.path).query).items()}
+        with self.server.lock:
+            self.server.requests.append(params)
+            failures = self.server.failures.get(params['value'], 0)
+            if failures:
+                self.server.failures[params['value']] = failures - 1
+        if failures:
+            self.send_response(500)
+            body = b'Server error'
+        else:
+            self.send_response(200)
+            body = (b'exception' if params['value'] in self.server.broken
+                    else b'<resultPage/>')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GSearchIndexerTestCase(unittest.TestCase):
+    """
+    Tests dispatching to GSearch.
+    """
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubGSearchHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.broken = set()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.indexer = reindex.GSearchIndexer(
+            'http://127.0.0.1:{}/fedoragsearch/rest'.format(
+                self.server.server_port
+            ),
+            jobs=3,
+            retries=2,
+            backoff=0
+        )
+
+    def test_index_all(self):
+        """
+        Test each object is indexed or deleted, with retries.
+        """
+        self.server.failures['a:2'] = 1
+        self.server.broken.add('a:4')
+        indexed, failed = self.indexer.index_all([
+            ([('a:1', False), ('a:2', False)], None),
+            ([('a:3', True), ('a:4', False)], None),
+        ])
+
+        self.assertEqual(indexed, 3)
+        self.assertEqual(failed, ['a:4'])
+        requests = self.server.requests
+        self.assertEqual(
+            sorted(request['value'] for request in requests),
+            ['a:1', 'a:2', 'a:2', 'a:3', 'a:4', 'a:4', 'a:4']
+        )
+        self.assertTrue(all(request['operation'] == 'updateIndex'
+                            for request in requests))
+        self.assertEqual(
+            {request['value']: request['action'] for request in requests},
+            {'a:1': 'fromPid', 'a:2': 'fromPid', 'a:3': 'deletePid',
+             'a:4': 'fromPid'}
+        )
+
+    def test_checkpoint(self):
+        """
+        Test the position of each batch is saved once it is done.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            self.assertEqual(reindex.load_checkpoint(path), (0, 0))
+            self.indexer.index_all([([('a:1', False)], (12, 3)),
+                                    ([('a:2', False)], (12, 5)),
+                                    ([('a:3', False)], None)], path)
+            self.assertEqual(reindex.load_checkpoint(path), (12, 5))
+            self.assertEqual(os.listdir(directory), ['checkpoint.json'])
+
+    def test_checkpoint_failure(self):
+        """
+        Test the checkpoint isn't advanced past a failed object.
+        """
+        self.server.broken.add('a:2')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            indexed, failed = self.indexer.index_all([
+                ([('a:1', False)], (12, 3)),
+                ([('a:2', False)], (12, 5)),
+                ([('a:3', False)], (13, 1)),
+            ], path)
+            self.assertEqual((indexed, failed), (2, ['a:2']))
+            self.assertEqual(reindex.load_checkpoint(path), (12, 3))
+
+
+@patch('dgi_repo.fcrepo3.reindex.latest_position', return_value=(20, 4))
+@patch('dgi_repo.fcrepo3.reindex.pid_batches', return_value=[])
+@patch('dgi_repo.fcrepo3.reindex.GSearchIndexer')
+@patch('dgi_repo.utilities.bootstrap')
+class ReindexCommandTestCase(unittest.TestCase):
+    """
+    Tests the outcome of the reindex command.
+    """
+
+    def _reindex(self, *args):
+        """
+        Run the command; get its result and the position it saved.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint.json')
+            result = CliRunner().invoke(reindex.reindex,
+                                        ['--checkpoint', path] + list(args))
+            return result, reindex.load_checkpoint(path)
+
+    def test_success(self, bootstrap, indexer, pid_batches, latest_position):
+        """
+        Test a clean run saves the position from before it, and exits 0.
+        """
+        indexer.return_value.index_all.return_value = (3, [])
+        result, position = self._reindex()
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(position, (20, 4))
+
+    def test_failure(self, bootstrap, indexer, pid_batches, latest_position):
+        """
+        Test a run with failures saves no position, and exits non-zero.
+        """
+        indexer.return_value.index_all.return_value = (2, ['a:1'])
+        result, position = self._reindex()
+        self.assertEqual(result.exit_code, 1)
+        self.assertEqual(position, (0, 0))
+
+    def test_bounds(self, bootstrap, indexer, pid_batches, latest_position):
+        """
+        Test counts which would index nothing are rejected up front.
+        """
+        for args in (['--retries', '-1'], ['--jobs', '0'],
+                     ['--batch-size', '0']):
+            with self.subTest(args=args):
+                result, position = self._reindex(*args)
+                self.assertEqual(result.exit_code, 2)
+                self.assertEqual(position, (0, 0))
+        indexer.assert_not_called()
+
+
+class ChangeBatchesTestCase(unittest.TestCase):
+    """
+    Tests turning changes into indexing tasks.
+    """
+
+    @patch('dgi_repo.database.read.changes.changes_since')
+    def test_batches(self, changes_since):
+        """
+        Test objects are indexed once a batch, or deleted if last purged.
+        """
+        changes = [
+            {'transaction': 10, 'id': 1, 'pid': 'a:1', 'dsid': None,
+             'purged': False},
+            {'transaction': 10, 'id': 2, 'pid': 'a:1', 'dsid': 'OBJ',
+             'purged': False},
+            {'transaction': 11, 'id': 3, 'pid': 'a:2', 'dsid': 'OBJ',
+             'purged': True},
+            {'transaction': 12, 'id': 4, 'pid': 'a:3', 'dsid': None,
+             'purged': True},
+        ]
+        connection = MagicMock()
+        connection.cursor.return_value.fetchmany.side_effect = [
+            changes[:3], changes[3:], []
+        ]
+
+        self.assertEqual(
+            list(reindex.change_batches((9, 0), 3, connection=connection)),
+            [([('a:1', False), ('a:2', False)], (11, 3)),
+             ([('a:3', True)], (12, 4))]
+        )
+        changes_since.assert_called_once_with(
+            9, 0, cursor=connection.cursor.return_value
+        )
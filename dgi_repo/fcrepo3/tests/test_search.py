@@ -0,0 +1,116 @@
+"""
+Tests searching for objects.
+"""
+
+import datetime
+import unittest
+
+import falcon
+import pytz
+from lxml import etree
+
+from dgi_repo.exceptions import MalformedQueryError
+from dgi_repo.fcrepo3 import search
+from dgi_repo.fcrepo3.api import FEDORA_TYPES_URI
+
+ROWS = [
+    {'id': 4, 'pid': 'a:1', 'label': 'One', 'state': 'A', 'owner': 'admin',
+     'created': datetime.datetime(2016, 1, 2, tzinfo=pytz.utc),
+     'modified': None, 'title': ['One', 'Uno']},
+    {'id': 9, 'pid': 'a:2', 'label': None, 'state': 'I', 'owner': 'admin',
+     'created': datetime.datetime(2016, 1, 3, tzinfo=pytz.utc),
+     'modified': None, 'title': []},
+]
+
+
+class ParseQueryTestCase(unittest.TestCase):
+    """
+    Tests parsing findObjects queries.
+    """
+
+    def test_parse(self):
+        """
+        Test conditions are split, and quoted values unquoted.
+        """
+        self.assertEqual(
+            search.parse_query("pid~a:* cDate>=2016-01-01 "
+                               "title='It''s a title'"),
+            [('pid', '~', 'a:*'), ('cDate', '>=', '2016-01-01'),
+             ('title', '=', "It's a title")]
+        )
+
+    def test_malformed(self):
+        """
+        Test malformed and unsupported conditions are rejected.
+        """
+        for query in ('pid', 'nope=1', 'cDate~2016*', "title='a"):
+            with self.subTest(query=query):
+                with self.assertRaises(MalformedQueryError):
+                    search.parse_query(query)
+
+
+class TokenTestCase(unittest.TestCase):
+    """
+    Tests session tokens.
+    """
+
+    def test_round_trip(self):
+        """
+        Test tokens give back where the page starts.
+        """
+        token = search.encode_token(9, 50, 'abc')
+        self.assertEqual(search.decode_token(token, 'abc'), (9, 50))
+
+    def test_invalid(self):
+        """
+        Test malformed tokens, or those of other searches, are rejected.
+        """
+        token = search.encode_token(9, 50, 'abc')
+        for token, fingerprint in ((token, 'def'), ('!!', 'abc'),
+                                   (token[:-4], 'abc')):
+            with self.subTest(token=token):
+                with self.assertRaises(falcon.HTTPInvalidParam):
+                    search.decode_token(token, fingerprint)
+
+
+class SerializeResultsTestCase(unittest.TestCase):
+    """
+    Tests serializing search results.
+    """
+
+    NAMESPACES = {'t': FEDORA_TYPES_URI}
+
+    def _results(self, batches, limit):
+        return etree.fromstring(b''.join(
+            search._xml_results(iter(batches),
+                                ['pid', 'label', 'cDate', 'title'], limit,
+                                25, 'abc')
+        ))
+
+    def test_fields(self):
+        """
+        Test the requested fields are listed, with each DC value.
+        """
+        results = self._results([ROWS[:1], ROWS[1:]], 25)
+        first, second = results.findall('t:resultList/t:objectFields',
+                                        self.NAMESPACES)
+        self.assertEqual(first.findtext('t:pid', namespaces=self.NAMESPACES),
+                         'a:1')
+        self.assertEqual(first.findtext('t:cDate', namespaces=self.NAMESPACES),
+                         '2016-01-02T00:00:00.000000Z')
+        self.assertEqual([title.text for title in
+                          first.findall('t:title', self.NAMESPACES)],
+                         ['One', 'Uno'])
+        self.assertIsNone(second.find('t:label', self.NAMESPACES))
+        self.assertIsNone(results.find('t:listSession', self.NAMESPACES))
+
+    def test_session(self):
+        """
+        Test full pages give the token of the next.
+        """
+        results = self._results([ROWS], 2)
+        session = results.find('t:listSession', self.NAMESPACES)
+        self.assertEqual(session.findtext('t:cursor',
+                                          namespaces=self.NAMESPACES), '25')
+        token = session.findtext('t:token', namespaces=self.NAMESPACES)
+        self.assertEqual(search.decode_token(token, 'abc'), (9, 27))
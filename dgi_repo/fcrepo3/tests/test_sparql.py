@@ -0,0 +1,209 @@
+"""
+Tests compiling resource index queries, and serializing their results.
+"""
+
+import unittest
+
+from lxml import etree
+
+from dgi_repo.database.utilities import (OBJECT_RDF_OBJECT, RAW_RDF_OBJECT,
+                                         LITERAL_RDF_OBJECT)
+from dgi_repo.exceptions import MalformedQueryError
+from dgi_repo.fcrepo3 import risearch, sparql
+from dgi_repo.fcrepo3.relations import (FEDORA_MODEL_NAMESPACE,
+                                        FEDORA_RELS_EXT_NAMESPACE)
+
+COLLECTION_QUERY = '''
+PREFIX fre: <info:fedora/fedora-system:def/relations-external#>
+SELECT ?object ?title
+FROM <#ri>
+WHERE {
+    ?object fre:isMemberOfCollection <info:fedora/islandora:root> ;
+            <fedora-model:label> ?title ;
+            <fedora-model:hasModel> ?model .
+    OPTIONAL { ?object <http://example.com/ns#sort> ?sort }
+    FILTER(!sameTerm(?model, <info:fedora/fedora-system:FedoraObject-3.0>))
+}
+ORDER BY ?title
+LIMIT 20
+'''
+
+
+class ParseQueryTestCase(unittest.TestCase):
+    """
+    Tests parsing SPARQL.
+    """
+
+    def test_triples(self):
+        """
+        Test prefixes are expanded, and abbreviated triples are split.
+        """
+        query = sparql.parse_query(COLLECTION_QUERY)
+        self.assertEqual(query.variables, ['object', 'title'])
+        self.assertEqual(query.limit, 20)
+        triples = [element for element in query.where.elements
+                   if isinstance(element, sparql.Triple)]
+        self.assertEqual(triples, [
+            sparql.Triple(
+                sparql.Var('object'),
+                sparql.Iri(FEDORA_RELS_EXT_NAMESPACE + 'isMemberOfCollection'),
+                sparql.Iri('info:fedora/islandora:root')
+            ),
+            sparql.Triple(
+                sparql.Var('object'),
+                sparql.Iri(FEDORA_MODEL_NAMESPACE + 'label'),
+                sparql.Var('title')
+            ),
+            sparql.Triple(
+                sparql.Var('object'),
+                sparql.Iri(FEDORA_MODEL_NAMESPACE + 'hasModel'),
+                sparql.Var('model')
+            ),
+        ])
+
+    def test_malformed(self):
+        """
+        Test malformed and unsupported queries are rejected.
+        """
+        for query in ('SELECT WHERE { ?a ?b ?c }',
+                      'SELECT ?a WHERE { ?a <x:y> ?b',
+                      'SELECT ?a WHERE { ?a undeclared:y ?b }',
+                      'CONSTRUCT { ?a <x:y> ?b } WHERE { ?a <x:y> ?b }',
+                      'select $a from <#ri> where { $a <x:y> "b" } limit -1'):
+            with self.subTest(query=query):
+                with self.assertRaises(MalformedQueryError):
+                    sparql.parse_query(query)
+
+
+class CompileQueryTestCase(unittest.TestCase):
+    """
+    Tests compiling SPARQL to SQL.
+    """
+
+    def test_mapped_tables(self):
+        """
+        Test predicates with tables of their own are read from them.
+        """
+        compiled = sparql.compile_query(COLLECTION_QUERY)
+        self.assertIn('FROM is_member_of_collection t1', compiled.sql)
+        self.assertIn('CROSS JOIN objects t2', compiled.sql)
+        self.assertIn('CROSS JOIN has_model t3', compiled.sql)
+        self.assertIn('LEFT JOIN LATERAL', compiled.sql)
+        self.assertIn('t1.rdf_object = fedora_object_id(%(p0)s)',
+                      compiled.sql)
+        self.assertIn('ORDER BY "title" ASC NULLS FIRST LIMIT 20',
+                      compiled.sql)
+        self.assertEqual(compiled.params['p0'], 'info:fedora/islandora:root')
+        self.assertEqual(compiled.variables, [
+            ('object', OBJECT_RDF_OBJECT),
+            ('title', LITERAL_RDF_OBJECT),
+        ])
+
+    def test_general_table(self):
+        """
+        Test other predicates are read from the general relation table.
+        """
+        compiled = sparql.compile_query(COLLECTION_QUERY)
+        self.assertIn('object_relationships t4', compiled.sql)
+        self.assertIn('http://example.com/ns#', compiled.params.values())
+        self.assertIn('sort', compiled.params.values())
+
+    def test_union(self):
+        """
+        Test UNION branches are combined, padding missing variables.
+        """
+        compiled = sparql.compile_query('''
+            PREFIX isl: <http://islandora.ca/ontology/relsext#>
+            SELECT ?page ?number WHERE {
+                { ?page isl:isPageOf <info:fedora/a:1> }
+                UNION
+                { ?page isl:isSequenceNumberOfa_1 ?number }
+            }
+        ''')
+        self.assertIn('UNION ALL', compiled.sql)
+        self.assertIn('NULL::smallint AS "number"', compiled.sql)
+        self.assertIn('FROM is_sequence_number_of', compiled.sql)
+        self.assertEqual(list(compiled.params.values()),
+                         ['info:fedora/a:1', 'info:fedora/a:1'])
+
+    def test_request_limit(self):
+        """
+        Test the request's limit and distinctness override the query's.
+        """
+        compiled = sparql.compile_query(COLLECTION_QUERY, limit=5,
+                                        distinct=True)
+        self.assertTrue(compiled.sql.startswith('SELECT DISTINCT '))
+        self.assertTrue(compiled.sql.endswith(' LIMIT 5'))
+
+    def test_unsupported(self):
+        """
+        Test queries beyond the supported subset are rejected.
+        """
+        for query in ('SELECT ?p WHERE { <info:fedora/a:1> ?p ?o }',
+                      'SELECT ?o WHERE { ?o <x:y> ?z FILTER(lang(?z)) }',
+                      'SELECT DISTINCT ?o WHERE { ?o <x:y> ?z } ORDER BY ?z'):
+            with self.subTest(query=query):
+                with self.assertRaises(MalformedQueryError):
+                    sparql.compile_query(query)
+
+
+class SerializeResultsTestCase(unittest.TestCase):
+    """
+    Tests serializing query results.
+    """
+
+    VARIABLES = [('object', OBJECT_RDF_OBJECT), ('title', LITERAL_RDF_OBJECT),
+                 ('value', RAW_RDF_OBJECT)]
+    ROWS = [
+        ['info:fedora/a:1', 'One', 'http://example.com/x'],
+        ['info:fedora/a:2', None, 'a value'],
+    ]
+
+    def test_sparql(self):
+        """
+        Test results are given as Fedora's SPARQL XML.
+        """
+        results = etree.fromstring(b''.join(
+            risearch._sparql_chunks(self.VARIABLES, iter([self.ROWS]))
+        ))
+        namespaces = {'r': risearch.SPARQL_RESULT_NAMESPACE}
+        self.assertEqual(
+            [variable.get('name') for variable in
+             results.findall('r:head/r:variable', namespaces)],
+            ['object', 'title', 'value']
+        )
+        first, second = results.findall('r:results/r:result', namespaces)
+        self.assertEqual(first.find('r:object', namespaces).get('uri'),
+                         'info:fedora/a:1')
+        self.assertEqual(first.findtext('r:title', namespaces=namespaces),
+                         'One')
+        self.assertEqual(first.find('r:value', namespaces).get('uri'),
+                         'http://example.com/x')
+        self.assertEqual(second.find('r:title', namespaces).get('bound'),
+                         'false')
+        self.assertEqual(second.findtext('r:value', namespaces=namespaces),
+                         'a value')
+
+    def test_result_names(self):
+        """
+        Test variables which can't name XML elements are rejected.
+        """
+        risearch._check_result_names(self.VARIABLES)
+        for name in ('1st', '2'):
+            with self.subTest(name=name):
+                with self.assertRaises(MalformedQueryError):
+                    risearch._check_result_names([
+                        ('object', OBJECT_RDF_OBJECT),
+                        (name, LITERAL_RDF_OBJECT),
+                    ])
+
+    def test_csv(self):
+        """
+        Test results are given as CSV, with a header row.
+        """
+        self.assertEqual(
+            ''.join(risearch._csv_chunks(self.VARIABLES, iter([self.ROWS]))),
+            'object,title,value\r\n'
+            'info:fedora/a:1,One,http://example.com/x\r\n'
+            'info:fedora/a:2,,a value\r\n'
+        )
@@ -3,7 +3,12 @@ Tests FOXML functionality.
 """
 
 import unittest
+from io import BytesIO
+from unittest.mock import MagicMock
 
+from psycopg2 import DatabaseError
+
+from dgi_repo.exceptions import MalformedInlineXmlError
 from dgi_repo.fcrepo3 import utilities
 
 
@@ -47,3 +52,62 @@ class FedoraUriTestCase(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class CheckInlineXmlTestCase(unittest.TestCase):
+    """
+    Tests checking inline XML content.
+    """
+
+    def test_rewound(self):
+        """
+        Test well-formed content can be read again, streamed or not.
+        """
+        class Stream(BytesIO):
+            def seekable(self):
+                return False
+
+        content = b'<a><b/></a>'
+        for data in (BytesIO(content), Stream(content)):
+            self.assertEqual(utilities.check_inline_xml(data).read(), content)
+
+    def test_malformed(self):
+        """
+        Test malformed content is refused.
+        """
+        with self.assertRaises(MalformedInlineXmlError):
+            utilities.check_inline_xml(BytesIO(b'<a><b></a>'))
+
+
+class StreamResponseTestCase(unittest.TestCase):
+    """
+    Tests streaming response bodies from the database.
+    """
+
+    def test_stream(self):
+        """
+        Test text is encoded, and the connection released once done.
+        """
+        release = MagicMock()
+        stream = utilities.stream_response(iter(['a', b'b', '\xe9']), release,
+                                           'things')
+        self.assertEqual(next(stream), b'a')
+        release.assert_not_called()
+        self.assertEqual(list(stream), [b'b', b'\xc3\xa9'])
+        release.assert_called_once_with()
+
+    def test_failure(self):
+        """
+        Test the body stops short should the database fail.
+        """
+        def chunks():
+            yield 'a'
+            raise DatabaseError('gone')
+
+        release = MagicMock()
+        with self.assertLogs('dgi_repo.fcrepo3.utilities') as logs:
+            self.assertEqual(list(utilities.stream_response(
+                chunks(), release, 'things'
+            )), [b'a'])
+        self.assertIn('Failed while streaming things.', logs.output[0])
+        release.assert_called_once_with()
@@ -3,8 +3,12 @@ Utility functions to assist with the Fedora 3 spoofing.
 """
 import datetime
 import logging
+from shutil import copyfileobj
 
+import falcon
 import requests
+from lxml import etree
+from psycopg2 import DatabaseError
 from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
 import pytz
 
@@ -12,8 +16,10 @@ import dgi_repo.database.write.log as log_writer
 import dgi_repo.database.write.datastreams as ds_writer
 import dgi_repo.database.read.datastreams as ds_reader
 import dgi_repo.database.filestore as filestore
+from dgi_repo.database import cache
 from dgi_repo.database.utilities import check_cursor
 from dgi_repo.configuration import configuration as _config
+from dgi_repo.exceptions import MalformedInlineXmlError
 from dgi_repo import utilities as utils
 
 logger = logging.getLogger(__name__)
@@ -36,13 +42,69 @@ def resolve_log(req, cursor):
     return log
 
 
+class _DiscardingTarget(object):
+    """
+    Parser target discarding everything parsed.
+    """
+
+    def close(self):
+        return None
+
+
+def check_inline_xml(data):
+    """
+    Ensure content for an inline XML datastream is well-formed.
+
+    Exports splice inline XML into FOXML as it is stored, so it must be
+    checked on the way in.
+
+    Args:
+        data: A path, or a binary file-like object to read from its current
+            position.
+
+    Returns:
+        The path, or a file-like object positioned at the start of the same
+        content.
+
+    Raises:
+        MalformedInlineXmlError: The content isn't well-formed XML.
+    """
+    if isinstance(data, str):
+        start = None
+    elif getattr(data, 'seekable', lambda: False)():
+        start = data.tell()
+    else:
+        # Streams can't be rewound; keep a copy to be read again.
+        spooled_file = utils.SpooledTemporaryFile()
+        copyfileobj(data, spooled_file)
+        data = spooled_file
+        start = 0
+        data.seek(start)
+
+    try:
+        etree.parse(data, etree.XMLParser(target=_DiscardingTarget(),
+                                          huge_tree=True))
+    except etree.XMLSyntaxError as e:
+        raise MalformedInlineXmlError(str(e)) from e
+
+    if start is not None:
+        data.seek(start)
+    return data
+
+
 def write_ds(ds, old=False, cursor=None):
     """
     Create a datastream on the current object.
+
+    Raises:
+        MalformedInlineXmlError: Inline XML content isn't well-formed.
     """
     cursor = check_cursor(cursor, ISOLATION_LEVEL_READ_COMMITTED)
+    inline = ds['control_group'] == 'X'
 
     if ds['data'] is not None:
+        if inline:
+            ds['data'] = check_inline_xml(ds['data'])
         # We already have data.
         filestore.create_datastream_from_data(
             ds,
@@ -56,17 +118,18 @@ def write_ds(ds, old=False, cursor=None):
         # There is data but not in the request.
         if ds['control_group'] == 'R':
             # Data will remain external.
-            ds_writer.upsert_mime(ds['mimetype'], cursor=cursor)
             ds_writer.upsert_resource(
                 {
                     'uri': ds['data_ref']['REF'],
-                    'mime': cursor.fetchone()['id'],
+                    'mime': cache.mime_id(ds['mimetype'], cursor=cursor),
                 },
                 cursor=cursor)
             ds['resource'] = cursor.fetchone()['id']
             ds_writer.upsert_datastream(ds, cursor=cursor)
         elif ds['data_ref']['REF'].startswith(filestore.UPLOAD_SCHEME):
             # Data has been uploaded.
+            if inline:
+                check_inline_xml(filestore.resolve_uri(ds['data_ref']['REF']))
             filestore.create_datastream_from_upload(
                 ds,
                 ds['data_ref']['REF'],
@@ -87,6 +150,8 @@ def write_ds(ds, old=False, cursor=None):
                     _config['download_chunk_size']):
                 ds_file.write(chunk)
             ds_file.seek(0)
+            if inline:
+                check_inline_xml(ds_file)
 
             filestore.create_datastream_from_data(
                 ds,
@@ -98,8 +163,7 @@ def write_ds(ds, old=False, cursor=None):
             )
     else:
         # There is no data change.
-        mime = ds_writer.upsert_mime(ds['mimetype'], cursor=cursor
-                                     ).fetchone()['id']
+        mime = cache.mime_id(ds['mimetype'], cursor=cursor)
         uri = ds_reader.resource(ds['resource'], cursor=cursor
                                  ).fetchone()['uri']
         ds_writer.upsert_resource({'uri': uri, 'mime': mime}, cursor=cursor)
@@ -213,3 +277,44 @@ def dsid_from_fedora_uri(uri):
         return stripped_uri[stripped_uri.find('/') + 1:]
     else:
         return False
+
+
+def bounded_int_param(req, name, default, maximum=None, minimum=1):
+    """
+    Get an integer query parameter, within the bounds.
+
+    Raises:
+        falcon.HTTPInvalidParam: The parameter is out of bounds.
+    """
+    value = req.get_param_as_int(name)
+    if value is None:
+        return default
+    if value < minimum or (maximum is not None and value > maximum):
+        raise falcon.HTTPInvalidParam(
+            'Must be at least {}{}.'.format(
+                minimum,
+                '' if maximum is None else ' and at most {}'.format(maximum)
+            ),
+            name
+        )
+    return value
+
+
+def stream_response(chunks, release, description):
+    """
+    Generate a response body, releasing its resources once done.
+
+    Args:
+        chunks: An iterable of the text or bytes of the body, as read from
+            the database; text is encoded as UTF-8.
+        release: A callable to release the database connection with.
+        description: What is being streamed, for the log should it fail.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+    except DatabaseError:
+        # Headers are long gone; all we can do is stop short.
+        logger.exception('Failed while streaming %s.', description)
+    finally:
+        release()
@@ -9,4 +9,12 @@ def install():
     Run code to finish installing the application.
     """
     db_install.install_schema()
+    db_install.install_updates()
     db_install.install_base_data()
+
+
+def update():
+    """
+    Run code to bring an existing installation up to date.
+    """
+    db_install.install_updates()
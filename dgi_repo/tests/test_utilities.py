@@ -0,0 +1,53 @@
+"""
+Tests the general utility functions.
+"""
+
+import base64
+import os
+import unittest
+from io import BytesIO
+
+from dgi_repo import utilities as utils
+
+
+class Base64EncodeTestCase(unittest.TestCase):
+    """
+    Tests streaming base64 encoding.
+    """
+
+    def test_matches_stdlib(self):
+        """
+        Test output is as base64.encode(), whatever the chunk size.
+        """
+        for length in (0, 1, 56, 57, 58, 1000):
+            content = os.urandom(length)
+            expected = BytesIO()
+            base64.encode(BytesIO(content), expected)
+            for chunk_size in (1, 57, 100, utils.BASE64_CHUNK_SIZE):
+                out = BytesIO()
+                utils.base64_encode(BytesIO(content), out,
+                                    chunk_size=chunk_size)
+                self.assertEqual(out.getvalue(), expected.getvalue())
+
+    def test_single_line(self):
+        """
+        Test output can be left unbroken.
+        """
+        content = os.urandom(1000)
+        out = BytesIO()
+        utils.base64_encode(BytesIO(content), out, line_length=None,
+                            chunk_size=100)
+        self.assertEqual(out.getvalue(), base64.b64encode(content))
+
+    def test_short_reads(self):
+        """
+        Test content read back in pieces isn't padded mid-stream.
+        """
+        class Trickle(BytesIO):
+            def read(self, size=-1):
+                return super().read(min(size, 10))
+
+        content = os.urandom(1000)
+        out = BytesIO()
+        utils.base64_encode(Trickle(content), out, line_length=None)
+        self.assertEqual(out.getvalue(), base64.b64encode(content))
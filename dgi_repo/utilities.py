@@ -1,6 +1,7 @@
 """
 Utility functions.
 """
+import binascii
 import hashlib
 from tempfile import SpooledTemporaryFile as _SpooledTemporaryFile
 
@@ -12,6 +13,11 @@ from dgi_repo.configuration import configuration as _config
 
 PID_SEPARATOR = ':'
 
+# As base64.encode(), which MIME requires.
+BASE64_LINE_LENGTH = 76
+# Bytes of content to encode at a time, around 3.6MiB.
+BASE64_CHUNK_SIZE = 57 * 2 ** 16
+
 
 def bootstrap():
     """
@@ -112,3 +118,42 @@ def checksum_file(path, hash_type):
                           b''):
             hasher.update(chunk)
         return hasher.hexdigest()
+
+
+def base64_encode(in_file, out, line_length=BASE64_LINE_LENGTH,
+                  chunk_size=BASE64_CHUNK_SIZE):
+    """
+    Write the base64 encoding of a file out to another.
+
+    As base64.encode(), but encoding large chunks at a time, so the output's
+    write() (such as that of an lxml xmlfile) is called rarely.
+
+    Args:
+        in_file: A binary file-like object to encode.
+        out: An object with a write() method accepting bytes.
+        line_length: The length of the lines to output, a multiple of four;
+            None to output a single line without a line break.
+        chunk_size: About how many bytes to read and encode at a time.
+    """
+    # Chunks must encode to whole lines, or at least to whole quanta.
+    quantum = 3 if line_length is None else line_length // 4 * 3
+    chunk_size = max(chunk_size // quantum, 1) * quantum
+
+    while True:
+        chunk = in_file.read(chunk_size)
+        # Encoding a short chunk mid-stream would pad it; fill it up.
+        while chunk and len(chunk) < chunk_size:
+            more = in_file.read(chunk_size - len(chunk))
+            if not more:
+                break
+            chunk += more
+        if not chunk:
+            break
+
+        encoded = binascii.b2a_base64(chunk, newline=False)
+        if line_length is not None:
+            encoded = b'\n'.join([
+                encoded[start:start + line_length]
+                for start in range(0, len(encoded), line_length)
+            ]) + b'\n'
+        out.write(encoded)
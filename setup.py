@@ -48,5 +48,8 @@ setup(
         [console_scripts]
         dgi_repo_gc=dgi_repo.database.gc:collect
         dgi_repo_ingest=dgi_repo.fcrepo3.foxml:import_file
+        dgi_repo_bulk_ingest=dgi_repo.fcrepo3.bulk:bulk_import
+        dgi_repo_purge=dgi_repo.fcrepo3.purge:purge
+        dgi_repo_reindex=dgi_repo.fcrepo3.reindex:reindex
     '''
 )